@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from clients import async_openai_client, startup
+from embedding_batcher import estimate_tokens
+from query_batcher import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT, AsyncMicroBatcher
+from rate_limiter import INTERACTIVE, Scheduler
+
+# ---------------------------
+# Web アプリから外部 API を並行して呼び出す
+# プロセスに 1 つの asyncio イベントループ（バックグラウンドスレッド）で
+# OpenAI とベクトル検索の呼び出しをすべて実行し、リクエストのスレッドは結果を待つだけ
+# → 少数のプールされた接続で多くの質問を同時に処理できる
+# OpenAI:       AsyncOpenAI クライアント 1 つ（keep-alive の HTTP 接続を共有）
+# ベクトル検索: ブロックする SDK / ローカルインデックスの呼び出しは上限付きスレッドプールで実行
+# キーワード検索：ローカル索引（lexical_index.py）への BM25 検索、同じスレッドプール
+# チャンク本文: 検索ごとにローカルのチャンクストアを 1 回参照（chunk_store.py）、同じプール
+# ローカルキャッシュ: 埋め込み / 回答キャッシュの参照と保存（SQLite）、同じプール
+# 段階ごとに同時実行数の上限とタイムアウトを設定（config.py を参照）
+# 質問はマイクロバッチで埋め込む（embed_batch_wait 秒以内に届いた質問を
+# 1 回のリクエストにまとめる。query_batcher.py を参照）
+# metrics: 各上流呼び出しのレイテンシ（空き枠の待ち時間を除く）と
+# OpenAI が報告したトークン数、検索結果のサイズを受け取る Metrics
+# scheduler: OpenAI 呼び出しの Scheduler（モデルごとのレート制限、Retry-After に従う
+# バックオフ付きの再試行、サーキットブレーカー）。Pinecone 呼び出しのため
+# ベクトルストアにも同じものを渡す。既定では対話的な優先度で呼び出す
+# ---------------------------
+STAGES = ("embed", "search", "lexical", "chat")
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage} が {seconds} 秒以内に完了しませんでした")
+        self.stage = stage
+
+
+class AnswerService:
+    def __init__(
+        self,
+        api_key,
+        vector_store,
+        concurrency=None,
+        timeouts=None,
+        max_retries=2,
+        embed_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        embed_batch_wait=DEFAULT_MAX_WAIT,
+        metrics=None,
+        lexical_index=None,
+        chunk_store=None,
+        scheduler=None,
+    ):
+        concurrency = concurrency or {}
+        self.timeouts = timeouts or {}
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_wait = embed_batch_wait
+        self.embed_batchers = {}  # モデル → AsyncMicroBatcher（ループ上でのみ使用）
+        self.metrics = metrics
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.chunk_store = chunk_store
+        self.scheduler = scheduler or Scheduler(
+            priority=INTERACTIVE, max_retries=max_retries
+        )
+        self.api_key = api_key
+        self._client = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency.get("search", 16),
+            thread_name_prefix="vector-search",
+        )
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self.loop.run_forever, name="answer-service", daemon=True
+        ).start()
+        # セマフォはループに属するため、ループ上で作成する
+        self.limits = self.run(self._make_limits(concurrency))
+        self.counters = {stage: {"in_flight": 0, "timeouts": 0} for stage in STAGES}
+
+    async def _make_limits(self, concurrency):
+        return {
+            stage: asyncio.Semaphore(concurrency.get(stage, 32)) for stage in STAGES
+        }
+
+    # AsyncOpenAI クライアント（初回利用時に作成。SDK の import が起動時間の大半を
+    # 占めるため）。リトライはスケジューラーに任せる
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = async_openai_client(self.api_key)
+        return self._client
+
+    # ---------------------------
+    # 最初の質問の前に接続を開く: OpenAI へのリクエスト 1 回（モデル情報の取得）で
+    # keep-alive の接続を開き、ベクトルストアと BM25 インデックスは
+    # 提供する namespace を開く
+    # 失敗したものを {部分: エラー} で返す。それでも提供は開始する（最初の呼び出しが
+    # スケジューラーのリトライつきで接続する）
+    # ---------------------------
+    def warm_up(self, namespaces, model):
+        errors = {}
+        parts = {"openai": lambda: self.run(self.client.models.retrieve(model))}
+        for namespace in namespaces:
+            parts[f"vector store {namespace}"] = partial(
+                self.vector_store.warm_up, namespace
+            )
+            if self.lexical_index is not None:
+                parts[f"lexical index {namespace}"] = partial(
+                    self.lexical_index.namespace, namespace
+                )
+        for name, call in parts.items():
+            try:
+                with startup.phase("warm-up", name):
+                    call()
+            except Exception as e:
+                errors[name] = str(e)
+        return errors
+
+    # ---------------------------
+    # コルーチンをサービスのループで実行し、結果を待つ（どのスレッドからでも可）
+    # ---------------------------
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    # ---------------------------
+    # 1 つの段階を同時実行数の上限とタイムアウトの下で実行
+    # call() は空きができてから awaitable を作成する
+    # （空き待ちの時間もタイムアウトに含まれる）
+    # upstream: OpenAI 呼び出しのスケジューラのキー（モデル名）。指定すると
+    # レート制限を待ち、再試行する（再試行もタイムアウトに含まれる）
+    # ---------------------------
+    async def _stage(self, stage, call, upstream=None, tokens=0):
+        timeout = self.timeouts.get(stage)
+        counters = self.counters[stage]
+
+        async def limited():
+            async with self.limits[stage]:
+                counters["in_flight"] += 1
+                started = time.perf_counter()
+                try:
+                    if upstream is None:
+                        return await call()
+                    return await self.scheduler.acall(upstream, call, tokens)
+                finally:
+                    counters["in_flight"] -= 1
+                    if self.metrics is not None:
+                        self.metrics.observe(
+                            "upstream_seconds",
+                            time.perf_counter() - started,
+                            stage=stage,
+                        )
+
+        try:
+            return await asyncio.wait_for(limited(), timeout)
+        except asyncio.TimeoutError:
+            counters["timeouts"] += 1
+            raise StageTimeout(stage, timeout) from None
+
+    async def embed(self, text, model):
+        batcher = self.embed_batchers.get(model)
+        if batcher is None:
+            batcher = self.embed_batchers[model] = AsyncMicroBatcher(
+                partial(self._embed_many, model=model),
+                self.embed_batch_size,
+                self.embed_batch_wait,
+            )
+        return await batcher.embed(text)
+
+    # 質問のバッチを 1 回の埋め込みリクエストで処理（ベクトルは入力順）
+    async def _embed_many(self, texts, model):
+        response = await self._stage(
+            "embed",
+            lambda: self.client.embeddings.create(model=model, input=texts),
+            model,
+            sum(estimate_tokens(text) for text in texts),
+        )
+        self._count_tokens(response.usage, model)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    async def search(self, vector, **options):
+        loop = asyncio.get_running_loop()
+        call = partial(self.vector_store.query, vector, **options)
+        matches = await self._stage(
+            "search", lambda: loop.run_in_executor(self.executor, call)
+        )
+        if self.metrics is not None:
+            # 結果の JSON としてのサイズ（ID、スコア、メタデータ。ベクトル値は
+            # 含まない）→ メタデータの軽量化で 1 回の検索あたり何バイト減るかを示す
+            size = len(json.dumps(matches, ensure_ascii=False).encode("utf-8"))
+            self.metrics.inc("search_response_bytes_total", size)
+        return matches
+
+    async def lexical_search(self, text, **options):
+        loop = asyncio.get_running_loop()
+        call = partial(self.lexical_index.search, text, **options)
+        return await self._stage(
+            "lexical", lambda: loop.run_in_executor(self.executor, call)
+        )
+
+    # チャンクストアから本文を補ったマッチ（有効な場合）
+    async def resolve_texts(self, matches):
+        if self.chunk_store is None or not matches:
+            return matches
+        loop = asyncio.get_running_loop()
+        call = partial(self.chunk_store.resolve, matches)
+        return await self._stage(
+            "search", lambda: loop.run_in_executor(self.executor, call)
+        )
+
+    # ループ上からのローカルキャッシュ（SQLite）へのブロックする呼び出し:
+    # ループ上の他の質問を待たせないようスレッドプールで実行
+    async def offload(self, call, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(call, *args))
+
+    async def chat(self, **options):
+        completion = await self._stage(
+            "chat",
+            lambda: self.client.chat.completions.create(**options),
+            options.get("model"),
+            _chat_tokens(options),
+        )
+        self._count_tokens(completion.usage, options.get("model"))
+        return completion
+
+    # ---------------------------
+    # ストリーミングでの回答生成: 届いた差分のテキストを順に返す
+    # タイムアウトは最初の応答までの待ち時間に適用（回答全体ではない）
+    # トークン使用量は choices のない最後のチャンクで届く
+    # ---------------------------
+    async def chat_stream(self, **options):
+        stream = await self._stage(
+            "chat",
+            lambda: self.client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **options
+            ),
+            options.get("model"),
+            _chat_tokens(options),
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None):
+                self._count_tokens(chunk.usage, options.get("model"))
+
+    # レスポンスのプロンプト／生成トークン数（metrics が有効な場合）
+    def _count_tokens(self, usage, model):
+        if self.metrics is None or usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            tokens = getattr(usage, kind, None)
+            if tokens:
+                self.metrics.inc("openai_tokens_total", tokens, model=model, kind=kind)
+
+    # ---------------------------
+    # リクエストのスレッドから非同期ジェネレータを反復する（ストリーミング応答用）
+    # イテレータを閉じると（クライアント切断時）、ループ上のジェネレータも閉じる
+    # ---------------------------
+    def iterate(self, generator):
+        try:
+            while True:
+                try:
+                    yield self.run(generator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(generator.aclose())
+
+    # 段階ごとの実行中・タイムアウトした呼び出し、埋め込みバッチ、
+    # 宛先ごとの再試行・429・サーキットの状態
+    def stats(self):
+        stats = {stage: dict(counters) for stage, counters in self.counters.items()}
+        stats["embed_batching"] = {
+            model: batcher.stats.snapshot()
+            for model, batcher in self.embed_batchers.items()
+        }
+        stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+
+# チャット補完が 1 分あたりの上限に対して消費するトークン数（プロンプトの推定値
+# と補完の上限の合計）
+def _chat_tokens(options):
+    prompt = sum(
+        estimate_tokens(message.get("content") or "")
+        for message in options.get("messages", [])
+    )
+    return prompt + (options.get("max_tokens") or 0)
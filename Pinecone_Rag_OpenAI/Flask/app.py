@@ -1,13 +1,46 @@
+import sys  # コマンドライン引数を扱うための標準ライブラリ
+import os  # パス操作のための標準ライブラリ
+
+# プロジェクトルート（1つ上の階層）の共通モジュールをインポート可能にする
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# クライアントの遅延生成、起動時間の計測、事前 fork（計測を始めるため最初に import）
+from clients import Lazy, prefork, preload, preload_clients, startup
+
 from flask import (
     Flask,
+    Response,
     render_template,
     request,
     jsonify,
+    stream_with_context,
 )  # Flaskの主要機能をインポート
-import openai  # OpenAI APIを利用するためのライブラリ
-from pinecone import Pinecone  # PineconeのPython SDK
 import config  # APIキーなどを保持する自作モジュール
-import sys  # コマンドライン引数を扱うための標準ライブラリ
+import argparse  # コマンドライン引数の解析用標準ライブラリ
+import asyncio  # 複数の namespace を並行して検索するための標準ライブラリ
+import json  # ストリーミングするイベントをエンコードするための標準ライブラリ
+import socket  # 事前 fork したワーカーが共有する待ち受けソケット用の標準ライブラリ
+import time  # 回答にかかった時間を計測するための標準ライブラリ
+
+startup.mark("import", "flask")
+
+from embedding_cache import open_cache  # ディスク上のローカル埋め込みキャッシュ
+from answer_cache import open_answer_cache  # 繰り返される（ほぼ同じ）質問への回答
+from vector_store import open_vector_store  # Pinecone/ローカルのベクトル検索
+from lexical_index import SEARCH_MODES, fuse, open_lexical_index  # ローカル BM25 索引
+from chunk_store import open_chunk_store  # 軽量ベクトルのチャンク本文
+from answer_service import AnswerService, StageTimeout  # 外部 API の並行呼び出し
+from metrics import Metrics, Trace  # ステージのタイマーとカウンター（/metrics）
+from context_builder import ContextStats, build_context  # プロンプトのコンテキスト作成
+from chunking import tokenizer  # コンテキストのトークン数を数えるトークナイザー
+from rate_limiter import (
+    INTERACTIVE,
+    CircuitOpenError,
+    Scheduler,
+    parse_limits,
+)  # レート制限・再試行
+
+startup.mark("import", "project modules")
 
 # ---------------------------
 # Flask アプリケーションの初期化
@@ -15,27 +48,199 @@ import sys  # コマンドライン引数を扱うための標準ライブラリ
 app = Flask(__name__)
 
 # ---------------------------
-# OpenAI および Pinecone の初期設定
+# すべての OpenAI・Pinecone 呼び出しのクライアント側スケジューラ：モデルごとの
+# レート制限（RATE_LIMITS）、Retry-After に従うジッター付きバックオフでの再試行、
+# 宛先ごとのサーキットブレーカー。/query からの呼び出しは対話的な優先度
+# ---------------------------
+scheduler = Scheduler(
+    parse_limits(config.RATE_LIMITS),
+    priority=INTERACTIVE,
+    max_retries=config.OPENAI_MAX_RETRIES,
+    failure_threshold=config.CIRCUIT_BREAKER_FAILURES,
+    reset_seconds=config.CIRCUIT_BREAKER_RESET,
+)
+
+# ---------------------------
+# クライアント・インデックス・キャッシュは初回利用時に開く（Lazy。.get() で取得）
+# → app の import（WSGI サーバー、テスト、ベンチマーク）ではネットワーク接続や
+#   ディスクの準備を行わず、warm_up() が提供開始前にすべて開く
+# ---------------------------
+
+# ---------------------------
+# OpenAI およびベクトルストアの初期設定
 # config.py に定義された APIキーを使用
 # PineconeのホストURLは手動で指定している（self-hosted endpoint対応）
+# VECTOR_STORE=local の場合はローカルインデックスを検索（ネットワークを経由しない）
+# ---------------------------
+vector_store = Lazy(
+    "vector_store",
+    open_vector_store,
+    config.VECTOR_STORE,
+    local_dir=config.LOCAL_INDEX_DIR,
+    nprobe=config.LOCAL_ANN_NPROBE,
+    api_key=config.PINECONE_API_KEY,
+    url=config.PINECONE_URL,
+    index_name=config.PINECONE_INDEX_NAME,
+    scheduler=scheduler,
+)
+
+# ---------------------------
+# upload_embeddings.py が作成したローカル BM25 索引（キーワード検索、ネットワーク不要）
+# 検索モード "hybrid"・"lexical" で使用。無効なら None
+# ---------------------------
+lexical_index = Lazy("lexical_index", open_lexical_index, config.LEXICAL_INDEX_DIR)
+
+# ---------------------------
+# チャンク本文のローカルストア（CHUNK_STORE_DIR。無効なら None）
+# これを使って取り込んだベクトルは本文を持たないので、検索後に取得する
+# ---------------------------
+chunk_store = Lazy("chunk_store", open_chunk_store, config.CHUNK_STORE_DIR)
+
+# ---------------------------
+# ステージのレイテンシのヒストグラム、トークン数、キャッシュのヒット率（/metrics で公開）
+# ---------------------------
+metrics = Metrics()
+# コンテキスト作成で使用・削減したプロンプトのトークン数（/stats と /metrics）
+context_stats = ContextStats()
+
+# ---------------------------
+# OpenAI とベクトル検索の呼び出しは共有のイベントループで実行
+# （keep-alive 接続をプール、段階ごとに同時実行数の上限とタイムアウト）
+# 同時に届いた質問はマイクロバッチでまとめて埋め込む
+# ---------------------------
+EMBEDDING_MODEL = "text-embedding-3-small"  # 軽量・高精度な埋め込みモデル
+
+
+def open_service():
+    return AnswerService(
+        config.OPENAI_API_KEY,
+        vector_store.get(),
+        concurrency={
+            "embed": config.EMBED_CONCURRENCY,
+            "search": config.SEARCH_CONCURRENCY,
+            "lexical": config.SEARCH_CONCURRENCY,
+            "chat": config.CHAT_CONCURRENCY,
+        },
+        timeouts={
+            "embed": config.EMBED_TIMEOUT,
+            "search": config.SEARCH_TIMEOUT,
+            "lexical": config.SEARCH_TIMEOUT,
+            "chat": config.CHAT_TIMEOUT,
+        },
+        max_retries=config.OPENAI_MAX_RETRIES,
+        embed_batch_size=config.QUERY_EMBED_BATCH_SIZE,
+        embed_batch_wait=config.QUERY_EMBED_BATCH_WAIT_MS / 1000,
+        metrics=metrics,
+        lexical_index=lexical_index.get(),
+        chunk_store=chunk_store.get(),
+        scheduler=scheduler,
+    )
+
+
+service = Lazy("service", open_service)
+
+
 # ---------------------------
-openai.api_key = config.OPENAI_API_KEY
-pc = Pinecone(api_key=config.PINECONE_API_KEY)
-index = pc.Index(
-    name=config.PINECONE_INDEX_NAME,
-    host=config.PINECONE_URL,
+# 質問用のローカル埋め込みキャッシュ
+# 繰り返される質問は OpenAI API を呼ばずにベクトル化される
+# キャッシュのディレクトリに書き込むのは 1 プロセスだけ: 事前 fork したワーカーはそれぞれのサブディレクトリを使う
+# ---------------------------
+def open_query_cache():
+    directory = config.EMBEDDING_CACHE_DIR
+    if directory and startup.worker is not None:
+        directory = os.path.join(directory, f"worker-{startup.worker}")
+    return open_cache("query", directory, config.EMBEDDING_CACHE_CAPACITY)
+
+
+embedding_cache = Lazy("embedding_cache", open_query_cache)
+
+# ---------------------------
+# 回答キャッシュ: 以前に回答した質問に十分近い質問（埋め込みのコサイン類似度）には
+# 検索も回答生成も行わずに保存済みの回答を返す
+# ---------------------------
+answer_cache = Lazy(
+    "answer_cache",
+    open_answer_cache,
+    "app",
+    config.ANSWER_CACHE_DIR,
+    threshold=config.ANSWER_CACHE_THRESHOLD,
+    ttl=config.ANSWER_CACHE_TTL,
+    capacity=config.ANSWER_CACHE_CAPACITY,
 )
 
 # ---------------------------
-# 起動時に namespace をコマンドライン引数から取得
-# 指定がなければエラーメッセージを出して終了
-# ※ Flaskアプリ全体で固定のnamespaceを使用する構成
+# 提供する namespace: コマンドライン引数（python app.py ns1 ns2）、または
+# 別の WSGI サーバーが app を import する場合は環境変数 NAMESPACES
+# ※ 検索できるのはこれらの namespace のみ（許可リスト）。最初のものが既定
+#   1 つのプロセスが、クライアント・キャッシュ・同時実行数の上限を共有してすべてを提供する
+# ---------------------------
+NAMESPACES = []  # 許可リスト（指定順）
+
+
+def serve_namespaces(names):
+    NAMESPACES[:] = dict.fromkeys(names)
+
+
+serve_namespaces(config.NAMESPACES)
+
+
+# ---------------------------
+# リクエストの namespace
+#   {"namespace": "a"}             1 つの namespace（既定: 最初に指定したもの）
+#   {"namespaces": ["a", "b"]}     並行して検索し、スコア順に結果をまとめる
+# 提供していない namespace の場合は ValueError
+# ---------------------------
+def request_namespaces(data):
+    if not NAMESPACES:
+        raise ValueError(
+            "提供する namespace がありません（app.py に指定するか NAMESPACES を設定してください）"
+        )
+    requested = data.get("namespaces") or data.get("namespace") or NAMESPACES[0]
+    if isinstance(requested, str):
+        requested = [requested]
+    unknown = [ns for ns in requested if ns not in NAMESPACES]
+    if unknown:
+        raise ValueError(
+            f"提供していない namespace です: {', '.join(map(str, unknown))}"
+        )
+    return list(dict.fromkeys(requested))
+
+
+# ---------------------------
+# リクエストの検索モード：{"mode": "vector" | "hybrid" | "lexical"}
+# （既定: SEARCH_MODE）。不明または使えないモードなら ValueError
 # ---------------------------
-if len(sys.argv) < 2:
-    print("使用法: python app.py パラメータ<namespace>を指定して下さい！")
-    exit(1)
+def request_mode(data):
+    mode = data.get("mode") or config.SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(
+            f"不明な検索モードです: {mode}（{', '.join(SEARCH_MODES)} から選択）"
+        )
+    if mode != "vector" and lexical_index.get() is None:
+        raise ValueError(
+            f"検索モード {mode} にはキーワード索引（LEXICAL_INDEX_DIR）が必要です"
+        )
+    return mode
+
+
+# ---------------------------
+# リクエストごとのトレース: X-Request-ID ヘッダーの ID（なければ新しい ID）と
+# 各ステージ（embed / answer_cache / search / chat）にかかった時間
+# ID はレスポンスの X-Request-ID ヘッダーで返す。TRACE_LOG=1 のときは
+# リクエストごとにステージの時間を 1 行ログに出力する
+# ---------------------------
+def start_trace():
+    return Trace(metrics, "query_stage_seconds", request.headers.get("X-Request-ID"))
+
 
-NAMESPACE = sys.argv[1]  # グローバル変数として全体で使用するnamespaceを設定
+def finish_trace(trace, endpoint, status):
+    metrics.observe("query_seconds", trace.elapsed(), endpoint=endpoint)
+    metrics.inc("queries_total", endpoint=endpoint, status=status)
+    if config.TRACE_LOG:
+        print(
+            f"[トレース] {trace.trace_id} {endpoint} {status} {trace.summary()}",
+            flush=True,
+        )
 
 
 # ---------------------------
@@ -47,62 +252,475 @@ def index_page():
     return render_template("index.html")
 
 
+# このプロセスが提供する namespace（画面の namespace 選択用）
+@app.route("/namespaces")
+def namespaces():
+    return jsonify(
+        {"namespaces": NAMESPACES, "default": NAMESPACES[0] if NAMESPACES else None}
+    )
+
+
+# ---------------------------
+# ユーザー入力のベクトル化（同じテキストは前回の結果をローカルキャッシュから返す）
+# ---------------------------
+async def embed_query(user_input):
+    cache = embedding_cache.get()
+    if cache is not None:
+        embedding = await service.get().offload(cache.get, user_input)
+        if embedding is not None:
+            return embedding
+
+    embedding = await service.get().embed(user_input, model=EMBEDDING_MODEL)
+    if cache is not None:
+        await service.get().offload(cache.put, user_input, embedding)
+    return embedding
+
+
+# ---------------------------
+# 1 つの質問に対する検索（サービスのループ上で実行）
+# 複数の namespace は並行して検索し、全体で上位のマッチを残す
+# （埋め込みモデルが同じなのでスコアを比較できる）
+# mode "lexical" は代わりに BM25 索引を検索し（embedding は None）、"hybrid" は
+# 両方の検索を同時に実行して順位を Reciprocal Rank Fusion で統合する
+# ---------------------------
+async def retrieve(user_input, embedding, namespaces, mode="vector"):
+    searches = []
+    if mode != "lexical":
+        # ベクトルストアに対してベクトル検索を実行（namespace ごとに Top5件）
+        searches += [
+            service.get().search(
+                embedding,
+                top_k=5,
+                include_metadata=True,  # 元テキストなどのメタ情報を含めて返す
+                namespace=namespace,
+            )
+            for namespace in namespaces
+        ]
+    if mode != "vector":
+        searches += [
+            service.get().lexical_search(user_input, top_k=5, namespace=namespace)
+            for namespace in namespaces
+        ]
+    results = await asyncio.gather(*searches)
+    # 検索ごとに1つの順位リスト（ベクトル検索が先、キーワード検索が後）
+    rankings = [
+        [dict(match, namespace=namespace) for match in found]
+        for namespace, found in zip(namespaces * 2, results)
+    ]
+    if mode == "hybrid":
+        matches = fuse(rankings, top_k=5, k=config.HYBRID_RRF_K)
+    else:
+        matches = [match for found in rankings for match in found]
+        matches = sorted(matches, key=lambda m: m["score"], reverse=True)[:5]
+    # 軽量ベクトルの本文: 残したマッチについてチャンクストアを 1 回参照
+    return await service.get().resolve_texts(matches)
+
+
+# ---------------------------
+# マッチしたテキストに対する ChatGPT へのリクエスト（/query と /query/stream で共通）
+# ---------------------------
+def chat_options(user_input, matches, trace):
+    # マッチしたテキストをコンテキストに：重なるチャンクをまとめ、ほぼ重複を除き、
+    # 最大 CONTEXT_MAX_TOKENS トークン（context_builder.py を参照）
+    context, report = build_context(
+        matches,
+        max_tokens=config.CONTEXT_MAX_TOKENS,
+        duplicate_threshold=config.CONTEXT_DUPLICATE_THRESHOLD,
+    )
+    context_stats.add(report)
+    trace.note("context_tokens", report["tokens"])
+    trace.note("tokens_saved", report["tokens_saved"])
+
+    # ChatGPT APIを使って自然言語で応答を生成（制約付き）
+    return {
+        "model": "gpt-4o",  # 高速・高精度モデル
+        "messages": [
+            {
+                "role": "system",
+                "content": "ユーザーの質問に対して、日本語で簡潔に50字以内で返答してください。",
+            },
+            {"role": "user", "content": f"質問: {user_input}\n情報:\n{context}"},
+        ],
+    }
+
+
+# ---------------------------
+# マッチした参照元の文書（テキストを除いたメタ情報）
+# ---------------------------
+def sources(matches):
+    return [
+        {
+            "id": m["id"],
+            "score": m["score"],
+            "namespace": m["namespace"],
+            **{k: v for k, v in m["metadata"].items() if k != "text"},
+        }
+        for m in matches
+    ]
+
+
+# ---------------------------
+# 回答キャッシュの検索/保存（キャッシュ無効時は何もしない）
+# started: 埋め込み後の time.perf_counter()。検索と回答生成にかかった時間が
+# 以降のヒットで節約できる時間になる
+# lexical モードは embedding がない（None）ため、キャッシュを読みも書きもしない
+# どちらも SQLite でブロックするため、サービスのループ上では AnswerService.offload() 経由で呼ぶ
+# ---------------------------
+def cached_answer(embedding, namespaces):
+    cache = answer_cache.get()
+    if cache is None or embedding is None:
+        return None
+    return cache.get(namespaces, embedding)
+
+
+def store_answer(user_input, embedding, namespaces, answer_text, matches, started):
+    cache = answer_cache.get()
+    if cache is not None and embedding is not None and answer_text:
+        cache.put(
+            namespaces,
+            user_input,
+            embedding,
+            answer_text,
+            sources(matches),
+            cost=time.perf_counter() - started,
+        )
+
+
+# ---------------------------
+# 1 つの質問に対するベクトル検索＋回答生成（サービスのループ上で実行）
+# 該当がなければ None を返す
+# ---------------------------
+async def answer_question(user_input, namespaces, trace, mode="vector"):
+    # OpenAI API でベクトル化（またはローカルキャッシュ。lexical モードでは不要）
+    embedding = None
+    if mode != "lexical":
+        with trace.stage("embed"):
+            embedding = await embed_query(user_input)
+    with trace.stage("answer_cache"):
+        cached = await service.get().offload(cached_answer, embedding, namespaces)
+    if cached is not None:
+        return cached["answer"]
+
+    started = time.perf_counter()
+    with trace.stage("search"):
+        matches = await retrieve(user_input, embedding, namespaces, mode)
+    if not matches:
+        return None
+
+    with trace.stage("chat"):
+        completion = await service.get().chat(
+            **chat_options(user_input, matches, trace)
+        )
+
+    # 生成された回答を取り出す
+    answer_text = completion.choices[0].message.content.strip()
+    await service.get().offload(
+        store_answer, user_input, embedding, namespaces, answer_text, matches, started
+    )
+    return answer_text
+
+
 # ---------------------------
 # POSTリクエスト "/query" を処理するAPIエンドポイント
 # ユーザーから送信された質問文をもとに、ベクトル検索＋生成応答を行う
+# {"query": ..., "namespace": ...} または {"query": ..., "namespaces": [...]}
+# 任意で "mode": "vector" / "hybrid" / "lexical"（request_mode を参照）
+# I/O はサービスのループが行い、リクエストのスレッドは待つだけ
 # ---------------------------
 @app.route("/query", methods=["POST"])
 def query():
+    trace = start_trace()
+    response, status = answer_response(trace)
+    finish_trace(trace, "/query", status)
+    response.headers["X-Request-ID"] = trace.trace_id
+    return response, status
+
+
+def answer_response(trace):
     data = request.json  # フロントエンドから送信されたJSONを取得
     user_input = data.get("query")  # ユーザーの質問テキストを抽出
+    try:
+        namespaces = request_namespaces(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        return jsonify({"answer": str(e), "error": str(e)}), 400
 
-    # OpenAI APIで埋め込み（ベクトル化）を実行
-    embedding = (
-        openai.embeddings.create(
-            model="text-embedding-3-small",  # 軽量かつ精度の高い埋め込み専用モデル
-            input=user_input,
+    try:
+        answer_text = service.get().run(
+            answer_question(user_input, namespaces, trace, mode)
+        )
+    except StageTimeout as e:
+        return (
+            jsonify(
+                {
+                    "answer": "混み合っています。しばらくしてから再度お試しください。",
+                    "error": str(e),
+                }
+            ),
+            504,
+        )
+    except CircuitOpenError as e:
+        # 上流が失敗し続けている：再試行を待たずにすぐ応答する
+        return (
+            jsonify(
+                {
+                    "answer": "ただいまサービスを利用できません。しばらくしてから再度お試しください。",
+                    "error": str(e),
+                }
+            ),
+            503,
         )
-        .data[0]
-        .embedding
-    )
 
-    # Pinecone に対してベクトル検索を実行（Top5件）
-    result = index.query(
-        vector=embedding,
-        top_k=5,
-        include_metadata=True,  # 元テキストなどのメタ情報を含めて返す
-        namespace=NAMESPACE,  # 起動時に指定されたnamespaceを使用（固定）
-    )
+    if answer_text is None:
+        # マッチがない場合のエラーメッセージ
+        return jsonify({"answer": "該当する回答が見つかりませんでした"}), 200
+    return jsonify({"answer": answer_text}), 200
+
 
-    # 検索結果からマッチ部分を取得（Pineconeの返却形式に柔軟対応）
-    matches = result["matches"] if isinstance(result, dict) else result.matches
+# Server-Sent Events のメッセージ 1 件
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# ---------------------------
+# "/query" のストリーミング版（Server-Sent Events）
+# 検索が終わるとすぐに参照元を送り、続いて回答テキストを生成された順に送る
+# → 回答の生成が終わるずっと前から画面に表示できる
+# キャッシュ済みの回答は参照元の直後に 1 つの token として送る
+#   event: sources  [{"id", "score", "namespace", "source", "page", ...}, ...]
+#   event: token    回答テキストの断片
+#   event: error    回答に失敗した場合（段階のタイムアウト、上流のサーキットが開いている、
+#                   その他のエラー）の {"answer", "error"}
+#   event: done     回答の終わり
+# 最初のトークンまでの時間は "first_token" ステージとして記録する
+# ---------------------------
+@app.route("/query/stream", methods=["POST"])
+def query_stream():
+    trace = start_trace()
+    data = request.json
+    user_input = data.get("query")
+    try:
+        namespaces = request_namespaces(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        finish_trace(trace, "/query/stream", 400)
+        response = jsonify({"answer": str(e), "error": str(e)})
+        response.headers["X-Request-ID"] = trace.trace_id
+        return response, 400
 
-    if matches:
-        # 複数マッチ結果のテキストを文脈として連結
-        context = "\n\n".join([m["metadata"]["text"] for m in matches])
+    def events():
+        status = 200
+        try:
+            embedding = None
+            if mode != "lexical":
+                with trace.stage("embed"):
+                    embedding = service.get().run(embed_query(user_input))
+            with trace.stage("answer_cache"):
+                cached = cached_answer(embedding, namespaces)
+            if cached is not None:
+                yield sse("sources", cached["sources"])
+                yield sse("token", cached["answer"])
+                yield sse("done", {})
+                return
 
-        # ChatGPT APIを使って自然言語で応答を生成（制約付き）
-        completion = openai.chat.completions.create(
-            model="gpt-4o",  # 高速・高精度モデル
-            messages=[
+            started = time.perf_counter()
+            with trace.stage("search"):
+                matches = service.get().run(
+                    retrieve(user_input, embedding, namespaces, mode)
+                )
+            yield sse("sources", sources(matches))
+            if not matches:
+                # マッチがない場合のエラーメッセージ
+                yield sse("token", "該当する回答が見つかりませんでした")
+            else:
+                stream = service.get().chat_stream(
+                    **chat_options(user_input, matches, trace)
+                )
+                pieces = []
+                chat_started = time.perf_counter()
+                for text in service.get().iterate(stream):
+                    if not pieces:
+                        trace.add("first_token", time.perf_counter() - chat_started)
+                    pieces.append(text)
+                    yield sse("token", text)
+                trace.add("chat", time.perf_counter() - chat_started)
+                answer_text = "".join(pieces).strip()
+                store_answer(
+                    user_input, embedding, namespaces, answer_text, matches, started
+                )
+        except StageTimeout as e:
+            status = 504
+            yield sse(
+                "error",
                 {
-                    "role": "system",
-                    "content": "ユーザーの質問に対して、日本語で簡潔に50字以内で返答してください。",
+                    "answer": "混み合っています。しばらくしてから再度お試しください。",
+                    "error": str(e),
                 },
-                {"role": "user", "content": f"質問: {user_input}\n情報:\n{context}"},
-            ],
+            )
+        except CircuitOpenError as e:
+            status = 503
+            yield sse(
+                "error",
+                {
+                    "answer": "ただいまサービスを利用できません。しばらくしてから再度お試しください。",
+                    "error": str(e),
+                },
+            )
+        except Exception as e:
+            # 応答は送信を始めているため、クライアントはこのイベントでしか失敗を知れない
+            status = 500
+            app.logger.exception("/query/stream の処理中に失敗しました")
+            yield sse(
+                "error",
+                {
+                    "answer": "エラーが発生しました。再度お試しください。",
+                    "error": str(e),
+                },
+            )
+        finally:
+            finish_trace(trace, "/query/stream", status)
+        yield sse("done", {})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # 各イベントをすぐに送る（キャッシュなし、リバースプロキシでのバッファリングなし）
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Request-ID": trace.trace_id,
+        },
+    )
+
+
+# ---------------------------
+# 埋め込みキャッシュのヒット/ミス数と、外部 API の実行中/タイムアウト件数
+# スケジューラ：宛先（モデル / pinecone）ごとの呼び出し・再試行・429・サーキットの状態
+# 回答キャッシュ: ヒット率と、節約できた検索＋回答生成の秒数
+# コンテキスト：送信したプロンプトのトークン数と、マッチの統合・重複除去で削減した数
+# ---------------------------
+@app.route("/stats")
+def stats():
+    return jsonify(
+        {
+            "embedding_cache": embedding_cache.get() and embedding_cache.get().stats(),
+            "answer_cache": answer_cache.get() and answer_cache.get().stats(),
+            "context": context_stats.stats(),
+            "upstream": service.get().stats(),
+            "startup": startup.snapshot(),
+        }
+    )
+
+
+# ---------------------------
+# Prometheus のテキスト形式のメトリクス（Prometheus で収集、または curl で確認）
+#   rag_query_stage_seconds{stage}      /query と /query/stream のステージごとの時間
+#   rag_query_seconds{endpoint}         リクエスト全体
+#   rag_upstream_seconds{stage}         OpenAI・ベクトル検索・BM25 の呼び出し
+#   rag_openai_tokens_total{model,kind} OpenAI が返したトークン数
+#   rag_search_response_bytes_total     ベクトル検索結果のサイズ（JSON）
+#   rag_upstream_*{upstream}            宛先（モデル / pinecone）ごとの呼び出し・再試行・
+#                                       429・サーキットブレーカーの拒否・レートの割合
+#   rag_*_cache_*                       埋め込み／回答キャッシュのヒット数とヒット率
+#   rag_context_tokens*_total           送信した・削減したコンテキストのトークン数
+#   rag_startup_seconds{phase,part}     各部分の import・生成・ウォームアップの秒数
+#   rag_startup_ready_seconds           起動（または fork）から提供開始までの秒数
+# ---------------------------
+@app.route("/metrics")
+def metrics_page():
+    caches = {"embedding_cache": embedding_cache, "answer_cache": answer_cache}
+    for name, cache in caches.items():
+        cache = cache.get()
+        if cache is not None:
+            cache_stats = cache.stats()
+            metrics.record(f"{name}_hits_total", cache_stats["hits"])
+            metrics.record(f"{name}_misses_total", cache_stats["misses"])
+            metrics.record(f"{name}_hit_rate", cache_stats["hit_rate"])
+            metrics.record(f"{name}_entries", cache_stats["entries"])
+    context = context_stats.stats()
+    metrics.record("context_tokens_total", context["tokens"])
+    metrics.record("context_tokens_saved_total", context["tokens_saved"])
+    metrics.record("context_chunks_merged_total", context["merged"])
+    metrics.record("context_duplicates_dropped_total", context["duplicates"])
+    upstream = service.get().stats()
+    for stage in ("embed", "search", "lexical", "chat"):
+        metrics.record("upstream_in_flight", upstream[stage]["in_flight"], stage=stage)
+        metrics.record(
+            "upstream_timeouts_total", upstream[stage]["timeouts"], stage=stage
+        )
+    for model, batching in upstream["embed_batching"].items():
+        metrics.record("embed_batches_total", batching["batches"], model=model)
+        metrics.record("embed_batch_inputs_total", batching["inputs"], model=model)
+    for name, counters in upstream["scheduler"].items():
+        metrics.record("upstream_calls_total", counters["calls"], upstream=name)
+        metrics.record("upstream_retries_total", counters["retries"], upstream=name)
+        metrics.record("upstream_throttled_total", counters["throttled"], upstream=name)
+        metrics.record("upstream_rejected_total", counters["rejected"], upstream=name)
+        metrics.record("upstream_rate_scale", counters["rate_scale"], upstream=name)
+        metrics.record(
+            "upstream_circuit_open", int(counters["circuit"] != "closed"), upstream=name
         )
+    started = startup.snapshot()
+    for kind, parts in started["phases"].items():
+        for part, seconds in parts.items():
+            metrics.record("startup_seconds", seconds, phase=kind, part=part)
+    if started["ready_seconds"] is not None:
+        metrics.record("startup_ready_seconds", started["ready_seconds"])
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-        # 応答文を抽出して返却
-        answer_text = completion.choices[0].message.content.strip()
-        return jsonify({"answer": answer_text})
-    else:
-        # マッチがない場合のエラーメッセージ
-        return jsonify({"answer": "該当する回答が見つかりませんでした"})
+
+# ---------------------------
+# 最初のリクエストに必要なものを提供開始前にすべて開く: キャッシュと
+# チャンクストア、トークナイザー、OpenAI のクライアントと接続、提供する各 namespace の
+# ベクトルストア（Pinecone の接続またはローカルインデックスのファイル）と BM25 インデックス
+# 失敗した部分は表示し、代わりに初回利用時に改めて開く
+# ---------------------------
+def warm_up():
+    for resource in (embedding_cache, answer_cache, chunk_store, tokenizer):
+        resource.get()
+    errors = service.get().warm_up(NAMESPACES, EMBEDDING_MODEL)
+    for name, error in errors.items():
+        print(f"[ウォームアップ] {name} に失敗しました: {error}")
+    startup.ready()
+    print(f"[起動] {startup.report()}")
 
 
 # ---------------------------
-# Flask アプリケーションの起動（デバッグモード有効）
+# アプリケーションを起動
+# waitress（本番用 WSGI サーバー）: 1 プロセスで SERVER_THREADS 件を同時処理
+# --workers N（SERVER_WORKERS）: 事前 fork した N 個のプロセスが待ち受けソケットを共有する。
+# 親プロセスが SDK を 1 回だけ import し、各ワーカーはクライアントとキャッシュを自分で開いて
+# 提供開始前にウォームアップする
+# FLASK_DEBUG=1 のときは Flask のデバッグサーバーで起動
 # ---------------------------
 if __name__ == "__main__":
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="指定した namespace で質問に回答する")
+    parser.add_argument(
+        "namespaces", nargs="+", help="提供する namespace（最初のものが既定）"
+    )
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS)
+    args = parser.parse_args()
+    serve_namespaces(args.namespaces)
+
+    if config.FLASK_DEBUG:
+        warm_up()
+        app.run(debug=True)
+    else:
+        preload_clients()
+        preload(["waitress"])
+        from waitress import serve
+
+        listen = {"host": config.SERVER_HOST, "port": config.SERVER_PORT}
+        if args.workers > 1:
+            sock = socket.create_server((config.SERVER_HOST, config.SERVER_PORT))
+            listen = {"sockets": [sock]}
+
+        def serve_worker(worker):
+            warm_up()
+            print(
+                f"http://{config.SERVER_HOST}:{config.SERVER_PORT} で待ち受け中"
+                f"（ワーカー {worker}）"
+            )
+            serve(app, threads=config.SERVER_THREADS, **listen)
+
+        prefork(args.workers, serve_worker)
@@ -7,3 +7,70 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+PINECONE_URL = os.getenv("PINECONE_URL")
+
+# ローカル埋め込みキャッシュ（空にすると無効）
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "50000"))
+
+# ベクトルストアのバックエンド: "pinecone" または "local"（LOCAL_INDEX_DIR 配下のインデックス）
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".vector_index")
+# ローカルインデックスで1クエリあたりに探索する IVF リスト数（大きいほど高精度・低速）
+LOCAL_ANN_NPROBE = int(os.getenv("LOCAL_ANN_NPROBE", "16"))
+
+# リクエストに "mode" がない場合の /query・/query/stream の検索モード：
+# "vector"（ベクトルのみ）、"hybrid"（ベクトル + BM25 を Reciprocal Rank Fusion で統合）、
+# "lexical"（BM25 のみ：型番・エラー文字列の完全一致、ベクトル化の呼び出しなし）
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+# upload_embeddings.py が作成する BM25 索引（空なら無効）
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", ".lexical_index")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# upload_embeddings.py がローカルに保持したチャンク本文（空の値で無効）。
+# これを使って書き込んだベクトルは本文を持たないので、検索後にここで取得する
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "")
+
+# プロンプトのコンテキスト：重なるチャンクをまとめ、ほぼ重複を除き、最大
+# CONTEXT_MAX_TOKENS トークン（0: 上限なし）。context_builder.py を参照
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+# 意味的な回答キャッシュ（空にすると無効）
+# キャッシュ済みの質問とのコサイン類似度が ANSWER_CACHE_THRESHOLD 以上なら、その回答を返す
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", ".answer_cache")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # 秒
+ANSWER_CACHE_CAPACITY = int(os.getenv("ANSWER_CACHE_CAPACITY", "2000"))
+
+# Web サーバー（python Flask/app.py）: FLASK_DEBUG=1 以外は waitress
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "5000"))
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "64"))  # 同時に処理するリクエスト数
+FLASK_DEBUG = os.getenv("FLASK_DEBUG") == "1"
+# 事前 fork するサーバープロセス数（python app.py --workers N が優先）
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+# 別の WSGI サーバーが app を import する場合に提供する namespace（例: "docs,faq"）
+# （python app.py では引数で指定する）
+NAMESPACES = [name for name in os.getenv("NAMESPACES", "").split(",") if name]
+# リクエストごとにトレース ID とステージの時間を 1 行ログに出力
+TRACE_LOG = os.getenv("TRACE_LOG") == "1"
+
+# 段階ごとの外部 API 呼び出し: 同時実行数とタイムアウト（秒）
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "32"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "16"))
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "32"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "10"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# 宛先（OpenAI のモデル名または "pinecone"）ごとのクライアント側レート制限、例：
+# "text-embedding-3-small=3000:1000000,gpt-4o=500:30000,pinecone=6000"
+# （1分あたりリクエスト数、任意で ":1分あたりトークン数"）。未設定：制限なし
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# サーキットブレーカー：この回数続けて失敗した宛先は CIRCUIT_BREAKER_RESET 秒間
+# 呼び出さない（リクエストにはすぐ 503 を返す）
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", "30"))
+# 質問の埋め込み: QUERY_EMBED_BATCH_WAIT_MS 以内に届いた質問は 1 回のリクエストにまとめる
+QUERY_EMBED_BATCH_SIZE = int(os.getenv("QUERY_EMBED_BATCH_SIZE", "64"))
+QUERY_EMBED_BATCH_WAIT_MS = float(os.getenv("QUERY_EMBED_BATCH_WAIT_MS", "5"))
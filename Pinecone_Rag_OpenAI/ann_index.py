@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+
+# ---------------------------
+# ローカルベクトルストア用の IVF-flat 近似最近傍インデックス
+# 学習: 保存済みベクトルのサンプルに球面 k-means → nlist 個のセントロイド
+# 各行は最も近いセントロイド（転置リスト）に割り当てる
+# 検索: セントロイドを採点し、上位 nprobe 個のリストの行だけを採点する
+# → nprobe で再現率と応答時間を調整（nprobe = nlist で完全検索と同じ）
+# namespace のベクトルと同じディレクトリのファイル:
+#   ivf_centroids.npy: セントロイド（nlist × dim、単位長）
+#   ivf_lists.i32:     行ごとのリスト番号 + 1（0 = 未割り当て）、メモリマップ
+# ---------------------------
+DEFAULT_NPROBE = 16
+DEFAULT_MIN_ROWS = 20000  # これ未満は全件検索で十分速い
+KMEANS_ITERATIONS = 10
+SAMPLE_PER_LIST = 64  # セントロイドあたりの学習サンプル数
+MAX_SAMPLE = 100000
+_BLOCK = 65536  # 全行を割り当てるときのブロックあたり行数
+
+
+# n 行に対する既定のリスト数
+def default_nlist(rows):
+    return max(1, int(np.sqrt(rows)))
+
+
+class IVFIndex:
+    def __init__(self, directory):
+        self.centroids_path = os.path.join(directory, "ivf_centroids.npy")
+        self.lists_path = os.path.join(directory, "ivf_lists.i32")
+        self.centroids = None
+        self.lists = None  # memmap (capacity,)、行ごとのリスト番号 + 1
+        self._csr = None  # (リスト順の行, オフセット)、最初の検索時に構築
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    # ---------------------------
+    # `capacity` 行のストア用にインデックスファイルを（再）読み込み
+    # ---------------------------
+    def load(self, capacity):
+        self._csr = None
+        if not os.path.exists(self.centroids_path):
+            self.centroids = None
+            self.lists = None
+            return
+        self.centroids = np.load(self.centroids_path)
+        self.resize(capacity)
+
+    # ベクトルファイルに合わせてリストファイルを拡張（新しい行は未割り当て）
+    def resize(self, capacity):
+        if not self.trained or not capacity:
+            return
+        self.lists = None
+        with open(self.lists_path, "ab") as f:
+            if f.tell() < capacity * 4:
+                f.truncate(capacity * 4)
+        self.lists = np.memmap(
+            self.lists_path, dtype=np.int32, mode="r+", shape=(capacity,)
+        )
+        self._csr = None
+
+    # ---------------------------
+    # 有効な行で学習し、すべての行を割り当てる
+    # vectors: ストアのベクトル（単位長）、rows: 使用する行番号
+    # ---------------------------
+    def train(self, vectors, rows, nlist=None, seed=0):
+        rows = np.asarray(rows)
+        nlist = min(nlist or default_nlist(len(rows)), len(rows))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(rows), max(nlist * SAMPLE_PER_LIST, nlist), MAX_SAMPLE)
+        sample = np.sort(rng.choice(rows, sample_size, replace=False))
+        centroids = kmeans(np.asarray(vectors[sample]), nlist, seed=seed)
+
+        # セントロイドはアトミックに書き込む（読み取り側は次のコミット後に再読み込み）
+        tmp_path = self.centroids_path + ".tmp.npy"
+        np.save(tmp_path, centroids)
+        os.replace(tmp_path, self.centroids_path)
+        self.centroids = centroids
+        self.resize(len(vectors))
+        self.lists[:] = 0
+        for start in range(0, len(rows), _BLOCK):
+            block = rows[start : start + _BLOCK]
+            self.assign(block, np.asarray(vectors[block]))
+        self.lists.flush()
+
+    # ---------------------------
+    # 行を最も近いセントロイドに割り当てる（差分追加）
+    # ---------------------------
+    def assign(self, rows, values):
+        if not self.trained:
+            return
+        self.lists[rows] = np.argmax(values @ self.centroids.T, axis=1) + 1
+        self._csr = None
+
+    def flush(self):
+        if self.lists is not None:
+            self.lists.flush()
+
+    # ---------------------------
+    # 検索の候補行: クエリに最も近い nprobe 個のリストの行
+    # 未割り当ての行（古いプロセスが書き込んだもの）は常に含める
+    # ---------------------------
+    def candidates(self, query, nprobe=DEFAULT_NPROBE):
+        if self._csr is None:
+            assigned = np.asarray(self.lists)
+            order = np.argsort(assigned, kind="stable")
+            counts = np.bincount(assigned, minlength=len(self.centroids) + 1)
+            self._csr = (order, np.concatenate([[0], np.cumsum(counts)]))
+        order, offsets = self._csr
+        nprobe = min(nprobe, len(self.centroids))
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe] + 1
+        # リスト 0 は未割り当ての行
+        return np.concatenate(
+            [order[offsets[0] : offsets[1]]]
+            + [order[offsets[l] : offsets[l + 1]] for l in probe]
+        )
+
+
+# ---------------------------
+# k-means（空のクラスタはランダムな点で初期化し直す）
+# spherical=True（コサイン）: セントロイドは単位長、割り当ては内積で行う
+# spherical=False（ユークリッド）: セントロイドは平均、割り当ては距離で行う
+# （直積量子化のコードブックで使用、quantization.py 参照）
+# ---------------------------
+def kmeans(data, k, iterations=KMEANS_ITERATIONS, seed=0, spherical=True):
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest(data, centroids, spherical)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[nonempty]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[nonempty] = sums if spherical else sums / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms > 0, norms, 1)
+    return centroids
+
+
+# 各行に最も近いセントロイドの番号（メモリを抑えるためブロック単位）
+def nearest(data, centroids, spherical=True):
+    # |x - c|² = |x|² - 2 x·c + |c|²、|x|² はどのセントロイドでも同じ
+    bias = 0 if spherical else (centroids**2).sum(axis=1) / 2
+    return np.concatenate(
+        [
+            np.argmax(data[start : start + _BLOCK] @ centroids.T - bias, axis=1)
+            for start in range(0, len(data), _BLOCK)
+        ]
+    )
@@ -0,0 +1,330 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ---------------------------
+# 意味的な回答キャッシュ（SQLite＋メモリ上のベクトル）
+# 回答は質問の埋め込みとともに (role, namespace) ごとに保存する
+# （複数の namespace を検索した回答は、そのすべてをキーにする）
+# 新しい質問の埋め込みが、キャッシュ済みの質問とコサイン類似度 `threshold` 以上なら
+# 保存された回答を返す → ベクトル検索も回答生成も行わない
+# エントリは `ttl` 秒で期限切れ。満杯になると最も長く使われていないものを削除
+# namespace を再取り込みすると世代番号が進み（invalidate_answers）、
+# 同じキャッシュディレクトリを使うすべてのプロセスがその namespace の回答を破棄する
+#   answers.sqlite3: エントリと namespace の世代番号（プロセス間で共有）
+# ---------------------------
+DEFAULT_ANSWER_CACHE_DIR = ".answer_cache"
+DEFAULT_THRESHOLD = 0.95  # ほぼ同じ質問とみなすコサイン類似度
+DEFAULT_TTL = 24 * 60 * 60  # 回答をキャッシュから返す秒数
+DEFAULT_CAPACITY = 2000  # role ごとに保持する回答数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    role TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    cost REAL NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_by_namespace ON answers (role, namespace);
+CREATE TABLE IF NOT EXISTS generations (
+    namespace TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# 1 つまたは複数（まとめて検索）の namespace のキャッシュキー
+def _key(namespace):
+    if isinstance(namespace, str):
+        return namespace
+    return "\n".join(sorted(set(namespace)))
+
+
+# キーの世代番号: 含まれる namespace の合計。どれか 1 つを再取り込みすると
+# 値が変わる
+def _generation(conn, key):
+    names = key.split("\n")
+    row = conn.execute(
+        "SELECT SUM(generation) FROM generations WHERE namespace IN "
+        f"({', '.join('?' * len(names))})",
+        names,
+    ).fetchone()
+    return row[0] or 0
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+# ---------------------------
+# 1 つの namespace のキャッシュ済み回答: 質問の単位ベクトルを行列にまとめ、
+# 検索 1 回を行列積 1 回で行う（変更後に必要になった時点で作り直す）
+# ---------------------------
+class _Namespace:
+    def __init__(self, generation):
+        self.generation = generation
+        self.entries = {}  # id → (vector, answer, sources, cost, created)
+        self._matrix = None
+
+    def add(self, entry_id, entry):
+        self.entries[entry_id] = entry
+        self._matrix = None
+
+    def remove(self, entry_id):
+        self.entries.pop(entry_id, None)
+        self._matrix = None
+
+    # 最も近いキャッシュ済みの質問の (id, 類似度)、なければ (None, 0)
+    def closest(self, vector):
+        if not self.entries:
+            return None, 0.0
+        if self._matrix is None:
+            ids = list(self.entries)
+            self._matrix = (ids, np.stack([self.entries[i][0] for i in ids]))
+        ids, matrix = self._matrix
+        if matrix.shape[1] != len(vector):
+            return None, 0.0
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path,
+        role,
+        threshold=DEFAULT_THRESHOLD,
+        ttl=DEFAULT_TTL,
+        capacity=DEFAULT_CAPACITY,
+    ):
+        self.path = path
+        self.role = role
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.conn = _connect(path)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.saved_seconds = 0.0
+        self.namespaces = {}  # namespace → _Namespace
+        self.lru = OrderedDict()  # id → namespace（使われていない順）
+        self._load()
+
+    # この role の有効なエントリを読み込む
+    def _load(self):
+        now = time.time()
+        self.conn.execute(
+            "DELETE FROM answers WHERE role = ? AND created < ?",
+            (self.role, now - self.ttl),
+        )
+        rows = self.conn.execute(
+            "SELECT id, namespace, generation, vector, answer, sources, cost, created "
+            "FROM answers WHERE role = ? ORDER BY used",
+            (self.role,),
+        ).fetchall()
+        generations = {}
+        stale = []
+        for row in rows:
+            entry_id, namespace, generation, vector = row[:4]
+            answer, sources, cost, created = row[4:]
+            if namespace not in generations:
+                generations[namespace] = _generation(self.conn, namespace)
+            if generation != generations[namespace]:
+                stale.append((entry_id,))  # 保存後に再取り込みされた
+                continue
+            space = self.namespaces.setdefault(namespace, _Namespace(generation))
+            vector = np.frombuffer(vector, dtype=np.float32)
+            space.add(entry_id, (vector, answer, json.loads(sources), cost, created))
+            self.lru[entry_id] = namespace
+        self.conn.executemany("DELETE FROM answers WHERE id = ?", stale)
+        self.conn.commit()
+
+    # ---------------------------
+    # namespace のエントリ（読み込み後に再取り込みされていれば破棄する）
+    # ---------------------------
+    def _namespace(self, namespace):
+        generation = _generation(self.conn, namespace)
+        space = self.namespaces.get(namespace)
+        if space is None or space.generation != generation:
+            if space is not None:
+                self.invalidated += len(space.entries)
+                for entry_id in space.entries:
+                    self.lru.pop(entry_id, None)
+            space = self.namespaces[namespace] = _Namespace(generation)
+        return space
+
+    def _remove(self, namespace, entry_id):
+        self.namespaces[namespace].remove(entry_id)
+        self.lru.pop(entry_id, None)
+        self.conn.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    # ---------------------------
+    # 質問を埋め込みで検索
+    # namespace: 1 つの namespace、またはまとめて検索した namespace のリスト
+    # 戻り値は {"answer", "sources", "similarity"}、なければ None
+    # ---------------------------
+    def get(self, namespace, embedding):
+        namespace = _key(namespace)
+        vector = _unit(embedding)
+        with self.lock:
+            space = self._namespace(namespace)
+            entry_id, similarity = space.closest(vector)
+            if entry_id is not None and similarity >= self.threshold:
+                _, answer, sources, cost, created = space.entries[entry_id]
+                if time.time() - created <= self.ttl:
+                    self.hits += 1
+                    self.saved_seconds += cost
+                    self.lru.move_to_end(entry_id)
+                    self.conn.execute(
+                        "UPDATE answers SET used = ? WHERE id = ?",
+                        (time.time(), entry_id),
+                    )
+                    self.conn.commit()
+                    return {
+                        "answer": answer,
+                        "sources": sources,
+                        "similarity": similarity,
+                    }
+                self.expired += 1
+                self._remove(namespace, entry_id)
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+    # ---------------------------
+    # 回答を保存
+    # question: 質問テキスト（確認用に保存）、embedding: そのベクトル
+    # sources: 回答と一緒に返す JSON 化可能なリスト
+    # cost: 回答の作成にかかった秒数（ヒット時に節約できた時間として集計）
+    # ---------------------------
+    def put(self, namespace, question, embedding, answer, sources=(), cost=0.0):
+        namespace = _key(namespace)
+        vector = _unit(embedding)
+        sources = list(sources)
+        now = time.time()
+        with self.lock:
+            space = self._namespace(namespace)
+            entry_id, similarity = space.closest(vector)
+            if entry_id is not None and similarity >= self.threshold:
+                # ほぼ同じ質問がキャッシュ済みなので、その回答を置き換える
+                self._remove(namespace, entry_id)
+            entry_id = self.conn.execute(
+                "INSERT INTO answers (role, namespace, generation, question, vector, "
+                "answer, sources, cost, created, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.role,
+                    namespace,
+                    space.generation,
+                    question,
+                    vector.tobytes(),
+                    answer,
+                    json.dumps(sources, ensure_ascii=False),
+                    cost,
+                    now,
+                    now,
+                ),
+            ).lastrowid
+            space.add(entry_id, (vector, answer, sources, cost, now))
+            self.lru[entry_id] = namespace
+            while len(self.lru) > self.capacity:
+                oldest, oldest_namespace = next(iter(self.lru.items()))
+                self._remove(oldest_namespace, oldest)
+            self.conn.commit()
+
+    # ---------------------------
+    # ヒット率、エントリ数、ヒットで節約できた時間
+    # ---------------------------
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "entries": len(self.lru),
+                "capacity": self.capacity,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+# ---------------------------
+# role（例: "app", "cli"）ごとの回答キャッシュを開く
+# role ごとにプロンプトが異なるため、回答は分けて保持する
+# base_dir: キャッシュディレクトリ（空または None でキャッシュ無効）
+# ---------------------------
+def open_answer_cache(
+    role,
+    base_dir=DEFAULT_ANSWER_CACHE_DIR,
+    threshold=DEFAULT_THRESHOLD,
+    ttl=DEFAULT_TTL,
+    capacity=DEFAULT_CAPACITY,
+):
+    if not base_dir:
+        return None
+    os.makedirs(base_dir, exist_ok=True)
+    return AnswerCache(
+        os.path.join(base_dir, "answers.sqlite3"),
+        role,
+        threshold=float(threshold),
+        ttl=float(ttl),
+        capacity=int(capacity),
+    )
+
+
+# ---------------------------
+# namespace のキャッシュ済み回答を無効化する（再取り込みの後）
+# 同じディレクトリを使う配信中のプロセスは、次の検索時に新しい世代番号に気付く
+# 戻り値は削除した回答数
+# ---------------------------
+def invalidate_answers(namespace, base_dir=DEFAULT_ANSWER_CACHE_DIR):
+    if not base_dir or not os.path.isdir(base_dir):
+        return 0
+    conn = _connect(os.path.join(base_dir, "answers.sqlite3"))
+    try:
+        conn.execute(
+            "INSERT INTO generations VALUES (?, 1) ON CONFLICT (namespace) "
+            "DO UPDATE SET generation = generation + 1",
+            (namespace,),
+        )
+        # その namespace を含めて検索した回答も削除する
+        removed = conn.execute(
+            "DELETE FROM answers WHERE instr(char(10) || namespace || char(10), "
+            "char(10) || ? || char(10)) > 0",
+            (namespace,),
+        ).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return removed
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import time
+
+from query_embeddings import (
+    ANSWER_WORKERS,
+    BATCH_SIZE,
+    BATCH_WORKERS,
+    SEARCH_MODE,
+    answer_question_batch,
+    context_stats,
+    scheduler,
+)
+from retrieval_eval import RetrievalScores
+
+# ---------------------------
+# 質問の一括実行: ファイルの質問の検索（と必要に応じて回答）
+# （夜間の評価用質問セット、大量の質問への回答）。結果は順次 JSONL に書き出す
+# 質問はまとめて埋め込み、まとめて検索し（Pinecone への並行クエリ、または
+# ローカルインデックスでの 1 回の行列演算による上位 k 件）、同時実行数を
+# 制限して回答する（query_embeddings.answer_question_batch を参照）
+# 正解つきの質問は同じ実行の中で採点する: 正解の文書に対する recall@k と MRR
+# （retrieval_eval.py を参照）
+# 入力:
+#   .txt:   1 行に 1 問
+#   .jsonl: {"question": "...", "sources": ["manual.pdf", ...], "id": "q1"}
+#           （"sources"・"source" と "id" は省略可）
+# 出力（1 問 1 行、入力順）:
+#   {"id", "question", "matches": [{"id", "score", "source", "page", ...}],
+#    "answer", "sources", "recall", "reciprocal_rank", "found"}
+# ---------------------------
+
+
+# ---------------------------
+# 質問を読み込む: [{"id", "question", "sources"}, ...]
+# ---------------------------
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                sources = item.get("sources") or item.get("source") or []
+                if isinstance(sources, str):
+                    sources = [sources]
+                question = {
+                    "id": item.get("id", number),
+                    "question": item["question"],
+                    "sources": sources,
+                }
+            else:
+                question = {"id": number, "question": line, "sources": []}
+            questions.append(question)
+    return questions
+
+
+# 出力に書く検索結果（指定がなければチャンクのテキストを除いたメタデータ）
+def output_match(match, include_text):
+    metadata = dict(match["metadata"])
+    if not include_text:
+        metadata.pop("text", None)
+    return {"id": match["id"], "score": match["score"], **metadata}
+
+
+# ---------------------------
+# 質問を実行し、結果が届くたびに 1 件 1 行の JSON を書き出す
+# 評価の集計（RetrievalScores）を返す
+# ---------------------------
+def run_batch(questions, namespace, output, args):
+    scores = RetrievalScores(args.top_k)
+    started = time.perf_counter()
+    results = answer_question_batch(
+        [item["question"] for item in questions],
+        namespace,
+        mode=args.mode,
+        top_k=args.top_k,
+        answer=args.answer,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        answer_workers=args.answer_workers,
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        for count, (item, result) in enumerate(zip(questions, results), 1):
+            record = {
+                "id": item["id"],
+                "question": item["question"],
+                "matches": [
+                    output_match(match, args.include_text)
+                    for match in result["matches"]
+                ],
+            }
+            if args.answer:
+                record["answer"] = result["answer"]
+            scored = scores.add(result["matches"], item["sources"])
+            if scored is not None:
+                record["sources"] = item["sources"]
+                record.update(scored)
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if count % args.batch_size == 0 or count == len(questions):
+                f.flush()
+                elapsed = time.perf_counter() - started
+                print(
+                    f"[進捗] {count}/{len(questions)}問、"
+                    f"{count / elapsed if elapsed else 0.0:.1f}問/秒"
+                )
+    return scores
+
+
+# ---------------------------
+# コマンドライン引数の読み取りと実行
+# ---------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="ファイルの質問を一括で検索・回答し、recall@k・MRR を計算する"
+    )
+    parser.add_argument("questions", help="質問ファイル（.txt または .jsonl）")
+    parser.add_argument(
+        "namespace", help="Pineconeのネームスペース（例: our-project-specs）"
+    )
+    parser.add_argument(
+        "--output",
+        default="batch_results.jsonl",
+        help="1 問 1 行の結果を書き出す JSONL ファイル",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=("vector", "hybrid", "lexical"),
+        default=SEARCH_MODE,
+        help="検索モード（既定: SEARCH_MODE または vector）",
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=5, help="質問あたりの検索件数（recall@k の k）"
+    )
+    parser.add_argument(
+        "--answer", action="store_true", help="質問ごとに回答も生成する"
+    )
+    parser.add_argument(
+        "--include-text",
+        action="store_true",
+        help="検索結果のチャンクのテキストも出力する",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="まとめて埋め込み・検索する質問数",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BATCH_WORKERS,
+        help="並行する埋め込みリクエスト・ベクトル検索・BM25 検索の数",
+    )
+    parser.add_argument(
+        "--answer-workers",
+        type=int,
+        default=ANSWER_WORKERS,
+        help="並行する回答生成の数",
+    )
+    parser.add_argument(
+        "--summary", default=None, help="評価スコアを書き出す JSON ファイル"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.questions):
+        print(f"[エラー] 質問ファイルが存在しません: {args.questions}")
+        exit(1)
+    questions = load_questions(args.questions)
+    if not questions:
+        print(f"[エラー] {args.questions} に質問がありません")
+        exit(1)
+
+    started = time.perf_counter()
+    scores = run_batch(questions, args.namespace, args.output, args)
+    elapsed = time.perf_counter() - started
+    print(
+        f"[一括実行] {len(questions)}問、{elapsed:.1f}秒 → "
+        f"{len(questions) / elapsed if elapsed else 0.0:.1f}問/秒、"
+        f"結果: {args.output}"
+    )
+    if scores.stats()["questions"]:
+        print(f"[評価] {scores.report()}")
+    if args.answer:
+        context = context_stats.stats()
+        print(
+            f"[コンテキスト] プロンプトのコンテキスト {context['tokens']}トークン、"
+            f"削減 {context['tokens_saved']}トークン（チャンクの統合・重複除去）"
+        )
+    if scheduler.report():
+        print(f"[上流API] {scheduler.report()}")
+    if args.summary:
+        summary = dict(scores.stats(), seconds=elapsed, total=len(questions))
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
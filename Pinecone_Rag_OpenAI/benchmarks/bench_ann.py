@@ -0,0 +1,136 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ann_index import default_nlist
+from vector_store import LocalNamespace
+
+# ---------------------------
+# ローカルベクトルストアの ANN ベンチマーク
+# クラスタ状の合成ベクトル（トピックごとにまとまる文書の埋め込みを模したもの）で
+# namespace を作成し、IVF インデックスを学習してから残りを差分追加する
+# nprobe ごとに完全検索に対する recall@k と1秒あたりのクエリ数を表示
+# 使い方（プロジェクトのルートで実行）:
+#   python benchmarks/bench_ann.py
+#   python benchmarks/bench_ann.py --rows 200000 --dim 1536 --nprobe 4,16,64
+# ---------------------------
+BATCH = 5000
+
+
+# `topics` 個のランダムな中心の周りのベクトル
+def synthetic_vectors(rows, dim, topics, spread, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    vectors = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, BATCH):
+        size = min(BATCH, rows - start)
+        noise = rng.standard_normal((size, dim)).astype(np.float32)
+        noise *= spread / np.sqrt(dim)
+        vectors[start : start + size] = centres[rng.integers(topics, size=size)] + noise
+    return vectors
+
+
+# 質問は回答となるチャンクの近くに来る: 保存済みベクトルにノイズを加える
+def synthetic_queries(vectors, count, noise, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(len(vectors), size=count)].copy()
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * (
+        noise / np.sqrt(vectors.shape[1])
+    )
+    return queries
+
+
+def upsert(namespace, vectors, offset):
+    for start in range(0, len(vectors), BATCH):
+        batch = vectors[start : start + BATCH]
+        namespace.upsert(
+            [
+                {"id": f"v{offset + start + i}", "values": values}
+                for i, values in enumerate(batch)
+            ]
+        )
+
+
+# 全クエリを実行し (IDリスト, 1秒あたりのクエリ数) を返す
+def run_queries(namespace, queries, top_k, nprobe):
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        matches = namespace.query(query, top_k, include_metadata=False, nprobe=nprobe)
+        results.append([match["id"] for match in matches])
+    elapsed = time.perf_counter() - started
+    return results, len(queries) / elapsed
+
+
+def recall(results, truth, top_k):
+    hits = sum(len(set(found) & set(exact)) for found, exact in zip(results, truth))
+    return hits / (len(truth) * top_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF インデックスの再現率と QPS")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=500, help="クラスタ数")
+    parser.add_argument(
+        "--spread", type=float, default=0.5, help="クラスタ中心の周りのノイズ"
+    )
+    parser.add_argument(
+        "--query-noise",
+        type=float,
+        default=0.5,
+        help="クエリに使う保存済みベクトルに加えるノイズ",
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32,64")
+    parser.add_argument(
+        "--incremental",
+        type=float,
+        default=0.2,
+        help="学習後に追加する行の割合",
+    )
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.rows, args.dim, args.topics, args.spread)
+    queries = synthetic_queries(vectors, args.queries, args.query_noise)
+    trained_rows = int(args.rows * (1 - args.incremental))
+
+    with tempfile.TemporaryDirectory() as directory:
+        namespace = LocalNamespace(directory)
+        started = time.perf_counter()
+        upsert(namespace, vectors[:trained_rows], 0)
+        print(f"[追加] {trained_rows}行 {time.perf_counter() - started:.1f}秒")
+
+        started = time.perf_counter()
+        nlist = args.nlist or default_nlist(trained_rows)
+        namespace.build_index(force=True, nlist=nlist)
+        print(f"[学習] nlist={nlist} {time.perf_counter() - started:.1f}秒")
+
+        started = time.perf_counter()
+        upsert(namespace, vectors[trained_rows:], trained_rows)
+        print(
+            f"[追加] 学習後に {args.rows - trained_rows}行 "
+            f"{time.perf_counter() - started:.1f}秒"
+        )
+
+        truth, exact_qps = run_queries(namespace, queries, args.top_k, 0)
+        header = f"{'nprobe':>8}{f'recall@{args.top_k}':>11}{'QPS':>10}{'speedup':>9}"
+        print(header)
+        print("-" * len(header))
+        print(f"{'exact':>8}{1.0:>11.3f}{exact_qps:>10.0f}{1.0:>9.1f}")
+        for nprobe in [int(n) for n in args.nprobe.split(",")]:
+            results, qps = run_queries(namespace, queries, args.top_k, nprobe)
+            print(
+                f"{nprobe:>8}{recall(results, truth, args.top_k):>11.3f}"
+                f"{qps:>10.0f}{qps / exact_qps:>9.1f}"
+            )
+        namespace.close()
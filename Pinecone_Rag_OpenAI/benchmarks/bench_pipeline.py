@@ -0,0 +1,402 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from chunking import CHUNKERS, DEFAULT_STRATEGY
+from fake_services import (
+    FakeServices,
+    ServiceProfile,
+    add_profile_arguments,
+    profiles_from_args,
+)
+from ingest_pipeline import STAGES
+
+try:
+    import resource  # ピークメモリ（Windows では使えない）
+except ImportError:
+    resource = None
+
+# ---------------------------
+# オフラインのエンドツーエンド・ベンチマーク（APIキー・ネットワーク不要）
+# 1. OpenAI と Pinecone のローカル代替サーバーを起動（fake_services.py）
+# 2. 合成コーパスを書き出す（PDF / DOCX / TXT、corpus.py）
+# 3. upload_embeddings.process_directory で取り込む → ファイル/秒、チャンク/秒
+# 4. Flask/app.py に質問を送る（プロセス内のテストクライアント、並行スレッド）
+#    → 質問/秒と p50/p95/p99 レイテンシ（--stream では最初のトークンまでの時間）
+# 5. ピークメモリを表示（このプロセスと抽出ワーカー）
+# --json で結果を保存。--baseline で保存済みの結果と比較し、
+# --tolerance を超えて悪化した指標があれば終了コード 1 で終了（性能低下の検出）
+# 使い方（プロジェクトのルートで実行）:
+#   python benchmarks/bench_pipeline.py
+#   python benchmarks/bench_pipeline.py --files 200 --pages 20 --store local
+#   python benchmarks/bench_pipeline.py --json base.json
+#   python benchmarks/bench_pipeline.py --baseline base.json --tolerance 0.2
+# ---------------------------
+NAMESPACE = "bench"
+DEFAULT_PROFILES = {
+    "embed": ServiceProfile(latency=0.1),
+    "chat": ServiceProfile(latency=0.8),
+    "upsert": ServiceProfile(latency=0.05),
+    "query": ServiceProfile(latency=0.03),
+}
+# --baseline で比較する指標: 名前 → 大きいほど良い場合は True
+COMPARED = {
+    "files_per_sec": True,
+    "chunks_per_sec": True,
+    "queries_per_sec": True,
+    "query_p50": False,
+    "query_p95": False,
+    "query_p99": False,
+    "peak_rss_mb": False,
+    "context_tokens_per_answer": False,
+    "upsert_bytes_per_vector": False,
+    "search_bytes_per_query": False,
+}
+
+
+# ---------------------------
+# プロジェクトの接続先を代替サーバーに向ける（upload_embeddings と Flask/app.py は
+# インポート時に設定を読むため、それらをインポートする前に実行する）
+# 毎回同じ処理量を計測するためキャッシュは無効にする
+# chunk_store: チャンク本文をベクトルのメタデータではなくローカルストアに保持
+# ---------------------------
+def configure_environment(services, store, work_dir, chunk_store=False):
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": services.openai_base_url,
+            "OPENAI_EMBEDDINGS_URL": services.embeddings_url,
+            "PINECONE_API_KEY": "bench",
+            "PINECONE_URL": services.pinecone_url,
+            "PINECONE_INDEX_NAME": NAMESPACE,
+            "VECTOR_STORE": store,
+            "LOCAL_INDEX_DIR": os.path.join(work_dir, "index"),
+            "LEXICAL_INDEX_DIR": os.path.join(work_dir, "lexical"),
+            "INGEST_JOB_DIR": os.path.join(work_dir, "jobs"),
+            "CHUNK_STORE_DIR": os.path.join(work_dir, "chunks") if chunk_store else "",
+            "EMBEDDING_CACHE_DIR": "",
+            "EXTRACT_CACHE_DIR": "",
+            "ANSWER_CACHE_DIR": "",
+            "TRACE_LOG": "",
+        }
+    )
+
+
+# ---------------------------
+# 取り込み: ファイル数・チャンク数・秒数・ベクトルあたりの upsert リクエストのバイト数
+# （Pinecone のみ。ローカルストアはリクエストを送らない）と、実行時メトリクスから
+# 求めた段階ごとの p95 を返す
+# ---------------------------
+def run_ingestion(corpus_dir, chunk_options, options, verbose):
+    import upload_embeddings
+
+    output = contextlib.nullcontext() if verbose else _quiet()
+    started = time.perf_counter()
+    with output:
+        metrics = upload_embeddings.process_directory(
+            corpus_dir,
+            NAMESPACE,
+            manifest_path=None,
+            chunk_options=chunk_options,
+            progress_interval=3600,
+            **options,
+        )
+    elapsed = time.perf_counter() - started
+    files = metrics.value("ingest_files_total")
+    chunks = metrics.value("ingest_chunks_total")
+    upserted = metrics.value("upserted_vectors_total")
+    stages = {}
+    for stage in STAGES:
+        histogram = metrics.histogram("ingest_stage_seconds", stage=stage)
+        if histogram is not None:
+            stages[stage] = histogram.quantile(0.95)
+    return {
+        "files": files,
+        "chunks": chunks,
+        "vectors_upserted": upserted,
+        "upsert_bytes_per_vector": (
+            metrics.value("upserted_bytes_total") / upserted if upserted else 0.0
+        ),
+        "ingest_seconds": elapsed,
+        "files_per_sec": files / elapsed if elapsed else 0.0,
+        "chunks_per_sec": chunks / elapsed if elapsed else 0.0,
+        "stage_p95": stages,
+    }
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# NAMESPACE を提供する Flask/app.py を import してウォームアップ（クライアント、キャッシュ、インデックス）
+def load_app():
+    flask_dir = os.path.join(ROOT, "Flask")
+    sys.path.insert(0, flask_dir)
+    spec = importlib.util.spec_from_file_location(
+        "bench_app", os.path.join(flask_dir, "app.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.serve_namespaces([NAMESPACE])
+    with _quiet():
+        module.warm_up()
+    return module.app
+
+
+# ---------------------------
+# 質問: `concurrency` 個のスレッド、スレッドごとにテストクライアント1つ
+# レイテンシはリクエストごとに計測（回答全体まで、または stream=True では
+# /query/stream の最初のトークンまで）
+# mode: 各質問と一緒に送る検索モード（"vector" / "hybrid" / "lexical"）
+# ---------------------------
+def run_queries(app, questions, concurrency, stream, mode="vector"):
+    from bench_chunking import percentile
+
+    clients = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def ask(question):
+        if not hasattr(clients, "client"):
+            clients.client = app.test_client()
+        started = time.perf_counter()
+        if stream:
+            response = clients.client.post(
+                "/query/stream", json={"query": question, "mode": mode}, buffered=False
+            )
+            latency = None
+            for part in response.response:
+                if latency is None and b"event: token" in part:
+                    latency = time.perf_counter() - started
+                if b"event: error" in part:
+                    response.status_code = 504
+            response.close()
+        else:
+            response = clients.client.post(
+                "/query", json={"query": question, "mode": mode}
+            )
+            latency = time.perf_counter() - started
+        with lock:
+            if response.status_code != 200 or latency is None:
+                errors.append(response.status_code)
+            else:
+                latencies.append(latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ask, questions))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    # 生成した回答あたりのコンテキストのトークン数（context_builder.py）
+    context = app.test_client().get("/stats").json["context"]
+    answers = context["contexts"] or 1
+    # 質問あたりのベクトル検索結果のサイズ（JSON）
+    exposition = app.test_client().get("/metrics").get_data(as_text=True)
+    search_bytes = sum(
+        float(line.split()[-1])
+        for line in exposition.splitlines()
+        if line.startswith("rag_search_response_bytes_total")
+    )
+    return {
+        "search_bytes_per_query": search_bytes / len(questions),
+        "context_tokens_per_answer": context["tokens"] / answers,
+        "context_tokens_saved_per_answer": context["tokens_saved"] / answers,
+        "queries": len(questions),
+        "query_errors": len(errors),
+        "query_seconds": elapsed,
+        "queries_per_sec": len(questions) / elapsed if elapsed else 0.0,
+        "query_p50": percentile(latencies, 0.50),
+        "query_p95": percentile(latencies, 0.95),
+        "query_p99": percentile(latencies, 0.99),
+    }
+
+
+# ピーク常駐メモリ（MB）: (このプロセス, 最大の抽出ワーカー)
+def peak_memory():
+    if resource is None:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss: bytes / kilobytes
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * unit / (1024 * 1024), children * unit / (1024 * 1024)
+
+
+def print_results(results):
+    print(
+        f"[取り込み] {results['files']}ファイル、{results['chunks']}チャンク"
+        f"（アップサート {results['vectors_upserted']}件）、{results['ingest_seconds']:.1f}秒 "
+        f"→ {results['files_per_sec']:.1f}ファイル/秒、"
+        f"{results['chunks_per_sec']:.1f}チャンク/秒"
+    )
+    stages = ", ".join(
+        f"{stage} {seconds:.3f}秒" for stage, seconds in results["stage_p95"].items()
+    )
+    print(f"[取り込み] ステージ別 p95: {stages}")
+    if results["queries"]:
+        label = "最初のトークン" if results["stream"] else "レイテンシ"
+        print(
+            f"[質問] {results['queries']}件、並行数 "
+            f"{results['concurrency']} → {results['queries_per_sec']:.1f}件/秒、"
+            f"{label} p50 {results['query_p50']:.3f}秒、"
+            f"p95 {results['query_p95']:.3f}秒、p99 {results['query_p99']:.3f}秒、"
+            f"エラー {results['query_errors']}件"
+        )
+        print(
+            f"[コンテキスト] 回答あたり {results['context_tokens_per_answer']:.0f}トークン、"
+            f"削減 {results['context_tokens_saved_per_answer']:.0f}トークン"
+            f"（チャンクの統合・重複除去）"
+        )
+        print(
+            f"[ペイロード] ベクトルあたり upsert {results['upsert_bytes_per_vector']:.0f} バイト、"
+            f"質問あたり検索結果 {results['search_bytes_per_query']:.0f} "
+            f"バイト"
+        )
+    if results["peak_rss_mb"] is not None:
+        print(
+            f"[メモリ] ピーク RSS {results['peak_rss_mb']:.1f} MB、"
+            f"抽出ワーカー {results['peak_rss_children_mb']:.1f} MB"
+        )
+    for name, stats in results["upstream"].items():
+        print(
+            f"[上流API] {name}: リクエスト {stats['requests']}件、"
+            f"制限 {stats['throttled']}件（429）、エラー {stats['errors']}件（500）"
+        )
+
+
+# ---------------------------
+# 保存済みの結果と比較し、悪化した指標を返す
+# ---------------------------
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'figure':<16}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, higher_is_better in COMPARED.items():
+        base, current = baseline.get(name), results.get(name)
+        if not base or current is None:
+            continue
+        change = current / base - 1
+        worse = -change if higher_is_better else change
+        flag = "  ← 性能低下" if worse > tolerance else ""
+        print(f"{name:<16}{base:>12.3f}{current:>12.3f}{change:>+9.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="オフラインの取り込み・質問ベンチマーク")
+    parser.add_argument("--files", type=int, default=30, help="生成する文書数")
+    parser.add_argument("--pages", type=int, default=10, help="文書あたりのページ数")
+    parser.add_argument(
+        "--formats", default="txt,docx,pdf", help="カンマ区切り: txt,docx,pdf"
+    )
+    parser.add_argument("--lang", choices=["en", "ja", "mixed"], default="mixed")
+    parser.add_argument("--chunker", choices=sorted(CHUNKERS), default=DEFAULT_STRATEGY)
+    parser.add_argument("--store", choices=["pinecone", "local"], default="pinecone")
+    parser.add_argument("--extract-workers", type=int, default=None)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200, help="0 で質問を省略")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--mode", choices=["vector", "hybrid", "lexical"], default="vector"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="/query/stream を使い、最初のトークンまでの時間を計測",
+    )
+    add_profile_arguments(parser, DEFAULT_PROFILES)
+    parser.add_argument("--json", help="結果をこのファイルに保存")
+    parser.add_argument("--baseline", help="以前の実行結果のファイル")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="性能低下とみなすまでに許容する相対変化",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="コーパスとインデックスのディレクトリを残す"
+    )
+    parser.add_argument(
+        "--chunk-store",
+        action="store_true",
+        help="チャンク本文をベクトルのメタデータではなくローカルストアに保持",
+    )
+    parser.add_argument("--verbose", action="store_true", help="取り込みのログを表示")
+    args = parser.parse_args()
+
+    # Pinecone ストアへの質問は SDK 経由
+    if args.store == "pinecone" and args.queries:
+        if importlib.util.find_spec("pinecone") is None:
+            parser.error(
+                "--store pinecone には pinecone パッケージが必要です（または --store local）"
+            )
+
+    services = FakeServices(profiles_from_args(args)).start()
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    configure_environment(services, args.store, work_dir, args.chunk_store)
+
+    from corpus import synthetic_questions, write_corpus
+
+    corpus_dir = os.path.join(work_dir, "corpus")
+    formats = tuple(args.formats.split(","))
+    paths = write_corpus(corpus_dir, args.files, args.pages, formats, args.lang)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(
+        f"[コーパス] {len(paths)} ファイル（{', '.join(formats)}）、各 {args.pages} ページ、"
+        f"{size / (1024 * 1024):.1f} MB in {corpus_dir}"
+    )
+
+    chunk_options = {"strategy": args.chunker}
+    results = run_ingestion(
+        corpus_dir,
+        chunk_options,
+        {
+            "backend": args.store,
+            "extract_workers": args.extract_workers,
+            "embed_workers": args.embed_workers,
+            "upsert_workers": args.upsert_workers,
+        },
+        args.verbose,
+    )
+    results["queries"] = 0
+    if args.queries:
+        app = load_app()
+        questions = synthetic_questions(args.queries, args.lang)
+        results.update(
+            run_queries(app, questions, args.concurrency, args.stream, args.mode)
+        )
+    results["stream"] = args.stream
+    results["concurrency"] = args.concurrency
+    results["peak_rss_mb"], results["peak_rss_children_mb"] = peak_memory()
+    results["upstream"] = services.stats()
+    services.stop()
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"[性能低下] {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,128 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_ann import synthetic_queries, synthetic_vectors
+from quantization import DEFAULT_RERANK, default_subspaces, encode_rows, train_quantizer
+from vector_store import DEFAULT_LOCAL_INDEX_DIR, LocalVectorStore
+
+# ---------------------------
+# 量子化のベンチマーク
+# int8 と直積量子化（float による再採点の有無）について、100万ベクトルあたりのメモリと
+# float32 の完全検索に対する top-k の再現率を並べて表示
+# 使い方（プロジェクトのルートで実行）:
+#   python benchmarks/bench_quantization.py --dim 1536
+#   python benchmarks/bench_quantization.py --namespace my-namespace   （ローカルインデックス）
+# ---------------------------
+MILLION = 1_000_000
+
+
+def load_namespace(index_dir, namespace):
+    store = LocalVectorStore(index_dir).namespace(namespace)
+    if store.vectors is None:
+        sys.exit(f"[エラー] {index_dir} の namespace {namespace} にベクトルがありません")
+    return np.asarray(store.vectors[np.flatnonzero(store.live)])
+
+
+def top_k(scores, k):
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+# ---------------------------
+# 1つの設定: コードから近似スコアを求め、（rerank > 0 なら）
+# 上位 top_k × rerank 件の候補を float のベクトルで再採点する
+# ---------------------------
+def run(quantizer, codes, vectors, queries, truth, k, rerank):
+    hits = 0
+    started = time.perf_counter()
+    for query, exact in zip(queries, truth):
+        scores = quantizer.score(codes, query)
+        if rerank:
+            candidates = np.sort(top_k(scores, min(len(scores), k * rerank)))
+            found = candidates[top_k(vectors[candidates] @ query, k)]
+        else:
+            found = top_k(scores, k)
+        hits += len(set(found.tolist()) & set(exact.tolist()))
+    elapsed = time.perf_counter() - started
+    return hits / (len(queries) * k), len(queries) / elapsed
+
+
+def print_row(name, bytes_per_vector, fixed_bytes, recall, qps, train_seconds):
+    per_million = (bytes_per_vector * MILLION + fixed_bytes) / (1024 * 1024)
+    print(
+        f"{name:<18}{bytes_per_vector:>8}{per_million:>12.0f}"
+        f"{recall:>11.3f}{qps:>8.0f}{train_seconds:>10.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="量子化のメモリ使用量と再現率")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank", type=int, default=DEFAULT_RERANK)
+    parser.add_argument(
+        "--subspaces",
+        default=None,
+        help="PQ の分割数（カンマ区切り、既定: dim/32, dim/16, dim/8）",
+    )
+    parser.add_argument("--namespace", help="ローカル namespace のベクトルを使う")
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR),
+    )
+    args = parser.parse_args()
+
+    if args.namespace:
+        vectors = load_namespace(args.index_dir, args.namespace)
+    else:
+        vectors = synthetic_vectors(args.rows, args.dim, args.topics, 0.5)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = synthetic_queries(vectors, args.queries, 1.0)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    rows, dim = vectors.shape
+    k = args.top_k
+    print(f"[データ] {rows}件 × {dim}次元、クエリ {len(queries)}件、上位 {k}件")
+
+    started = time.perf_counter()
+    truth = [top_k(vectors @ query, k) for query in queries]
+    exact_qps = len(queries) / (time.perf_counter() - started)
+
+    header = (
+        f"{'method':<18}{'B/vec':>8}{'MB/1M vec':>12}"
+        f"{f'recall@{k}':>11}{'QPS':>8}{'train(s)':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    print_row("float32", dim * 4, 0, 1.0, exact_qps, 0.0)
+
+    configs = [("int8", None)]
+    subspaces = (
+        [int(s) for s in args.subspaces.split(",")]
+        if args.subspaces
+        else sorted({default_subspaces(dim) // 2, default_subspaces(dim), dim // 8})
+    )
+    configs += [("pq", s) for s in subspaces if s and dim % s == 0]
+    for kind, size in configs:
+        started = time.perf_counter()
+        quantizer = train_quantizer(kind, vectors, subspaces=size)
+        codes = encode_rows(quantizer, vectors, np.arange(rows))
+        train_seconds = time.perf_counter() - started
+        fixed = sum(array.nbytes for array in quantizer.state().values())
+        name = kind if kind == "int8" else f"pq{size}"
+        for rerank in (0, args.rerank):
+            recall, qps = run(quantizer, codes, vectors, queries, truth, k, rerank)
+            label = f"{name}+rerank{rerank}" if rerank else name
+            print_row(label, codes.shape[1], fixed, recall, qps, train_seconds)
+    print(
+        "B/vec と MB/1M vec はベクトル・コードのみ（とコードブック）の大きさ。"
+        "再採点では候補の float32 ベクトルもディスクから読み込みます"
+    )
@@ -0,0 +1,122 @@
+import os
+import sys
+import textwrap
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_chunking import synthetic_pages
+
+# ---------------------------
+# ベンチマーク用の合成文書（bench_chunking.py と同じページ生成）
+# txt:  ページを連結した UTF-8 テキスト
+# docx: "#"/"##" 行は Heading 1/2 の段落になる（python-docx が必要）
+# pdf:  1ページごとに1つのPDFページ、Helvetica のテキスト（PDFライブラリを使わず直接出力）
+#       → Helvetica には日本語のグリフがないため、PDF のページは常に英語
+# ---------------------------
+FORMATS = ("txt", "docx", "pdf")
+
+
+# ---------------------------
+# `pages` ページの文書を `files` 個、`formats` を順に使って書き出す
+# 書き出したパスを返す
+# ---------------------------
+def write_corpus(directory, files, pages, formats=FORMATS, lang="mixed", seed=0):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(files):
+        ext = formats[i % len(formats)]
+        page_lang = "en" if ext == "pdf" else lang
+        content = synthetic_pages(pages, page_lang, seed=seed + i)
+        path = os.path.join(directory, f"doc{i:05d}.{ext}")
+        WRITERS[ext](path, content)
+        paths.append(path)
+    return paths
+
+
+def write_txt(path, pages):
+    with open(path, "w", encoding="utf-8") as f:
+        for _, text in pages:
+            f.write(text)
+
+
+def write_docx(path, pages):
+    import docx
+
+    document = docx.Document()
+    for _, text in pages:
+        for line in text.splitlines():
+            if line.startswith("## "):
+                document.add_heading(line[3:], level=2)
+            elif line.startswith("# "):
+                document.add_heading(line[2:], level=1)
+            elif line:
+                document.add_paragraph(line)
+    document.save(path)
+
+
+# ---------------------------
+# 最小限の PDF 1.4: カタログ、ページツリー、フォント1つ、ページごとのコンテンツストリーム
+# 行はページ幅で折り返し、収まらないテキストは切り捨てる
+# ---------------------------
+_PDF_LINE_CHARS = 95
+_PDF_LINES_PER_PAGE = 62
+
+
+def write_pdf(path, pages):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None]
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for _, text in pages:
+        lines = []
+        for line in text.splitlines():
+            lines.extend(textwrap.wrap(line, _PDF_LINE_CHARS) or [""])
+        commands = ["BT", "/F1 9 Tf", "12 TL", "40 760 Td"]
+        for line in lines[:_PDF_LINES_PER_PAGE]:
+            commands.append(f"({_pdf_escape(line)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1", errors="replace")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(kids),
+        len(kids),
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+
+
+# 検索ベンチマーク用の質問: 各合成ページの最初の文
+def synthetic_questions(count, lang="mixed", seed=1):
+    questions = []
+    for _, text in synthetic_pages(count, lang, seed=seed):
+        paragraphs = [line for line in text.splitlines() if line and line[0] != "#"]
+        questions.append(paragraphs[0].split("。")[0].split(". ")[0])
+    return questions
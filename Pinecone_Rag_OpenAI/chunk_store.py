@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+import zlib
+
+# ---------------------------
+# チャンク本文のローカルストア（ベクトルのメタデータを軽量化）
+# チャンクストアを使うと、ベクトルは小さな属性（source、page、section）だけを
+# 持って書き込まれ、チャンク本文はここに zlib 圧縮して SQLite で保持する
+# → upsert リクエスト・ベクトルインデックスの容量・検索レスポンスが小さくなる
+# 検索時はすべてのマッチの本文を 1 回のまとめ読みで取得する（resolve）
+# metadata["text"] を既に持つマッチ（チャンクストアなしで書き込んだベクトル）は
+# そのまま残すので、両方のベクトルが混在してもよい
+#   chunks.sqlite3: (namespace, ベクトル ID) → 圧縮した本文
+# ---------------------------
+DEFAULT_CHUNK_STORE_DIR = ""  # 無効: 本文はベクトルのメタデータに残る
+COMPRESSION_LEVEL = 6
+_SQL_BATCH = 400  # "IN (...)" クエリ 1 回あたりの (namespace, id) の組
+_MMAP_BYTES = 256 * 1024 * 1024  # 読み込みはファイルのメモリマップ経由
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    id TEXT NOT NULL,
+    text BLOB NOT NULL,
+    PRIMARY KEY (namespace, id)
+) WITHOUT ROWID;
+"""
+
+
+class ChunkStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(directory, "chunks.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA mmap_size = {_MMAP_BYTES}")
+        self.lock = threading.Lock()
+
+    # チャンク本文を追加・置換: [(vector_id, text), ...]
+    def put(self, namespace, chunks):
+        rows = [
+            (
+                namespace,
+                vector_id,
+                zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL),
+            )
+            for vector_id, text in chunks
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, id, text) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    # 複数チャンクの本文: [(namespace, vector_id), ...] → {(namespace, vector_id): text}
+    # 保存されていないチャンクは結果に含まれない
+    def get(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start : start + _SQL_BATCH]
+                rows = self.conn.execute(
+                    "SELECT namespace, id, text FROM chunks WHERE (namespace, id) IN "
+                    f"(VALUES {', '.join(['(?, ?)'] * len(batch))})",
+                    [value for key in batch for value in key],
+                )
+                for namespace, vector_id, blob in rows:
+                    found[(namespace, vector_id)] = blob
+        return {
+            key: zlib.decompress(blob).decode("utf-8") for key, blob in found.items()
+        }
+
+    # ---------------------------
+    # metadata["text"] をストアから補ったマッチ（順序は同じ）
+    # マッチの名前空間は match["namespace"]、なければ `namespace`
+    # 本文が保存されていないマッチ（実行中の取り込みが書き込んだ直後、
+    # またはその後削除されたもの）は除外する
+    # ---------------------------
+    def resolve(self, matches, namespace=""):
+        keys = [
+            (match.get("namespace", namespace), match["id"])
+            for match in matches
+            if "text" not in match["metadata"]
+        ]
+        if not keys:
+            return matches
+        texts = self.get(keys)
+        resolved = []
+        for match in matches:
+            if "text" in match["metadata"]:
+                resolved.append(match)
+                continue
+            text = texts.get((match.get("namespace", namespace), match["id"]))
+            if text is not None:
+                resolved.append(
+                    dict(match, metadata=dict(match["metadata"], text=text))
+                )
+        return resolved
+
+    def delete(self, namespace, ids):
+        ids = list(ids)
+        with self.lock, self.conn:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                self.conn.execute(
+                    "DELETE FROM chunks WHERE namespace = ? AND id IN "
+                    f"({', '.join('?' * len(batch))})",
+                    [namespace, *batch],
+                )
+
+    # 名前空間のチャンク数と圧縮後のバイト数
+    def describe(self, namespace):
+        with self.lock:
+            count, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM chunks "
+                "WHERE namespace = ?",
+                (namespace,),
+            ).fetchone()
+        return {"chunks": count, "bytes": size}
+
+    # ベクトルストアの writer を包み、チャンク本文は代わりにここへ保存する
+    def writer(self, writer):
+        return ChunkStoreWriter(self, writer)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------
+# metadata["text"] をチャンクストアへ移すベクトルストアの writer
+# （包んだ writer と同じインターフェースとレポート。本文は max_batch_chunks ごと
+# と flush のたびに保存し、削除は両方に適用する）
+# ---------------------------
+class ChunkStoreWriter:
+    def __init__(self, store, writer, max_batch_chunks=100):
+        self.store = store
+        self.writer = writer
+        self.max_batch_chunks = max_batch_chunks
+        self.buffers = {}  # namespace → [(vector_id, text), ...]
+        self.reports = writer.reports
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        metadata = dict(metadata or {})
+        text = metadata.pop("text", None)
+        if text is not None:
+            self.buffers.setdefault(namespace, []).append((vector_id, text))
+            if len(self.buffers[namespace]) >= self.max_batch_chunks:
+                self._store(namespace)
+        self.writer.add(namespace, vector_id, values, metadata)
+
+    def flush(self, namespace=None):
+        self._store(namespace)
+        self.writer.flush(namespace)
+
+    def _store(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            chunks = self.buffers.pop(ns, [])
+            if chunks:
+                self.store.put(ns, chunks)
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        self.store.delete(namespace, ids)
+        return self.writer.delete(namespace, ids, batch_size)
+
+    def close(self):
+        self._store()
+        return self.writer.close()
+
+    def summary(self):
+        return self.writer.summary()
+
+
+# ---------------------------
+# チャンクストアを作成（ディレクトリが空なら無効 → None）
+# ---------------------------
+def open_chunk_store(directory=DEFAULT_CHUNK_STORE_DIR):
+    if not directory:
+        return None
+    return ChunkStore(directory)
@@ -0,0 +1,296 @@
+import re
+from functools import partial
+
+from clients import Lazy
+from embedding_batcher import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # 任意。未インストール時はトークン数を推定値で代用
+    tiktoken = None
+
+# ---------------------------
+# チャンク分割戦略（get_chunker で名前を指定して選択）
+# chars:    固定文字数の窓（従来の chunk_text と同じチャンク）
+# tokens:   単語境界で区切った最大 max_tokens トークンの窓
+# sentence: 文・段落を max_tokens まで詰める（日本語の 。！？ にも対応）
+# heading:  sentence と同様だが、Markdown/DOCX の見出しをまたがない。
+#           続きのチャンクにも見出しを付け、セクションの階層を保持する
+# どの戦略も pages = (ページ番号, テキスト) のイテラブルを受け取り、
+# (info, chunk) を返す。info には "page"（判明時）と "section"（heading のみ）が入る
+# ---------------------------
+DEFAULT_STRATEGY = "chars"
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+
+# 区切りのないテキストがこの長さを超えた場合は強制的に切る
+_MAX_UNIT_CHARS = 20000
+
+_WORD_END = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"[。．！？]+[」』）)]*\s*|[.!?]+[\"')\]]*\s+|\n[ \t]*\n\s*")
+_HEADING = re.compile(r"(#{1,6})[ \t]+(.*)")
+
+
+# ---------------------------
+# 埋め込みモデルのトークナイザー（cl100k_base）によるトークン数
+# エンコーディングは最初の count_tokens で読み込む（tiktoken は BPE ファイルを
+# ダウンロードするため import 時には行わない）。tiktoken が未インストール、
+# またはオフラインなどで読み込めない場合は estimate_tokens で代用
+# ---------------------------
+def _load_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[警告] tiktoken のエンコーディングを読み込めないため、トークン数は推定値を使います: {e}")
+        return None
+
+
+tokenizer = Lazy("tiktoken", _load_encoding)
+
+
+def count_tokens(text):
+    encoding = tokenizer.get()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# ---------------------------
+# 戦略: 固定文字数の窓
+# 全ページを連結して chunk_text した結果と同じチャンク。オーバーラップは
+# ページ境界をまたいで引き継ぎ、メモリには未確定の末尾だけを保持
+# ---------------------------
+def chunk_chars(pages, chunk_size=1000, overlap=200):
+    step = chunk_size - overlap
+    buffer = ""
+    starts = []  # 各ページの開始位置 [(buffer内のオフセット, ページ番号)]
+    for page, text in pages:
+        if not text:
+            continue
+        starts.append((len(buffer), page))
+        buffer += text
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            chunk = _chunk_with_page(buffer[start : start + chunk_size], start, starts)
+            if chunk:
+                yield chunk
+            start += step
+        if start:
+            buffer = buffer[start:]
+            starts = [(0, _page_at(starts, start))] + [
+                (offset - start, number) for offset, number in starts if offset > start
+            ]
+    start = 0
+    while start < len(buffer):
+        chunk = _chunk_with_page(buffer[start : start + chunk_size], start, starts)
+        if chunk:
+            yield chunk
+        start += step
+
+
+def _chunk_with_page(chunk, offset, starts):
+    stripped = chunk.strip()
+    if not stripped:
+        return None
+    offset += len(chunk) - len(chunk.lstrip())
+    return _info(_page_at(starts, offset)), stripped
+
+
+def _page_at(starts, offset):
+    page = starts[0][1]
+    for start, number in starts:
+        if start > offset:
+            break
+        page = number
+    return page
+
+
+# ---------------------------
+# 戦略: トークン予算（単語の間で区切る）
+# （空白のない日本語などの連続はトークン数で区切る）
+# ---------------------------
+def chunk_tokens(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    units = ((page, text, False) for page, text in _split_units(pages, _WORD_END))
+    return _pack(units, max_tokens, overlap_tokens)
+
+
+# ---------------------------
+# 戦略: トークン予算まで文・段落単位で詰める
+# ---------------------------
+def chunk_sentences(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    units = ((page, text, False) for page, text in _split_units(pages, _SENTENCE_END))
+    return _pack(units, max_tokens, overlap_tokens)
+
+
+# ---------------------------
+# 戦略: Markdown のセクション（"# 見出し" 行）内で文単位に詰める
+# DOCX の見出しは Markdown 行として渡される（extract_pages(markdown_headings=True) を参照）
+# ---------------------------
+def chunk_headings(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    return _pack(_heading_units(pages), max_tokens, overlap_tokens)
+
+
+def _heading_units(pages):
+    for page, text in _split_units(pages, _SENTENCE_END):
+        # 直前に文末がない場合、見出し行が単位の途中に含まれることがある
+        for part in re.split(r"(?m)^(?=#{1,6}[ \t])", text):
+            if not part:
+                continue
+            if _HEADING.match(part):
+                line, newline, rest = part.partition("\n")
+                yield page, line + newline, True
+                if rest:
+                    yield page, rest, False
+            else:
+                yield page, part, False
+
+
+# ---------------------------
+# ページのストリームを pattern の一致位置で終わる単位（単語・文）に分割
+# (単位の開始ページ番号, テキスト) を返す。単位はページをまたぐことがある
+# ---------------------------
+def _split_units(pages, pattern):
+    carry = ""
+    carry_page = None
+    for page, text in pages:
+        if not text:
+            continue
+        if not carry:
+            carry_page = page
+        page_start = len(carry)
+        carry += text
+        start = 0
+        for match in pattern.finditer(carry):
+            # 末尾ちょうどの区切りは次ページに続く可能性がある
+            if match.end() >= len(carry):
+                break
+            yield (carry_page if start < page_start else page), carry[
+                start : match.end()
+            ]
+            start = match.end()
+        while len(carry) - start > _MAX_UNIT_CHARS:
+            yield (carry_page if start < page_start else page), carry[
+                start : start + _MAX_UNIT_CHARS
+            ]
+            start += _MAX_UNIT_CHARS
+        if start:
+            carry_page = carry_page if start < page_start else page
+            carry = carry[start:]
+    if carry:
+        yield carry_page, carry
+
+
+# ---------------------------
+# 単位を最大 max_tokens のチャンクに先頭から詰める
+# units: (page, text, is_heading)
+# 各チャンクの末尾 overlap_tokens 以内の単位を次のチャンクの先頭に引き継ぐ
+# 見出しで新しいチャンクを開始し（オーバーラップなし）、続きのチャンクにも見出しを付ける
+# ---------------------------
+def _pack(units, max_tokens, overlap_tokens):
+    window = []  # [(page, text, tokens)]（見出し行を除く）
+    total = 0  # window 内のトークン数
+    header = None  # 現在の見出し行の (page, text, tokens)
+    headings = []  # 現在のセクションの [(level, title)]
+    for page, text, is_heading in units:
+        if is_heading:
+            if window:
+                yield from _emit(header, window, headings)
+            level, title = _HEADING.match(text).groups()
+            headings = [h for h in headings if h[0] < len(level)]
+            headings.append((len(level), title.strip()))
+            header = (page, text, count_tokens(text))
+            window = []
+            total = 0
+            continue
+        # 繰り返す見出しを除いた残り（最低でも max_tokens の半分）
+        budget = max(max_tokens - (header[2] if header else 0), max_tokens // 2)
+        tokens = count_tokens(text)
+        pieces = [(text, tokens)] if tokens <= budget else _split_long(text, budget)
+        for piece, tokens in pieces:
+            if window and total + tokens > budget:
+                yield from _emit(header, window, headings)
+                window = _overlap(window, overlap_tokens)
+                total = sum(unit[2] for unit in window)
+                while window and total + tokens > budget:
+                    total -= window.pop(0)[2]
+            window.append((page, piece, tokens))
+            total += tokens
+    # 本文のない見出しだけのチャンクは出力しない
+    if window:
+        yield from _emit(header, window, headings)
+
+
+# overlap_tokens に収まる末尾の単位（窓全体は引き継がない）
+def _overlap(window, overlap_tokens):
+    tail = []
+    size = 0
+    for unit in reversed(window[1:]):
+        if size + unit[2] > overlap_tokens:
+            break
+        tail.insert(0, unit)
+        size += unit[2]
+    return tail
+
+
+# 窓の (info, chunk) を返す（空白のみの場合は何も返さない）
+def _emit(header, window, headings):
+    text = "".join(unit[1] for unit in window)
+    if not text.strip():
+        return
+    info = _info(window[0][0])
+    if headings:
+        info["section"] = " > ".join(title for _, title in headings)
+    if header is not None:
+        text = header[1] + text
+    yield info, text.strip()
+
+
+def _info(page):
+    return {} if page is None else {"page": page}
+
+
+# ---------------------------
+# 長すぎる単位を最大 max_tokens の断片に文字位置で分割
+# ---------------------------
+def _split_long(text, max_tokens):
+    pieces = []
+    while text:
+        tokens = count_tokens(text)
+        if tokens <= max_tokens:
+            pieces.append((text, tokens))
+            break
+        size = max(1, len(text) * max_tokens // tokens)
+        while size > 1 and count_tokens(text[:size]) > max_tokens:
+            size = size * 9 // 10
+        pieces.append((text[:size], count_tokens(text[:size])))
+        text = text[size:]
+    return pieces
+
+
+CHUNKERS = {
+    "chars": chunk_chars,
+    "tokens": chunk_tokens,
+    "sentence": chunk_sentences,
+    "heading": chunk_headings,
+}
+
+
+# ---------------------------
+# 戦略名に対応するチャンク分割関数を返す（options は戦略に渡す）
+# (chars: chunk_size / overlap, others: max_tokens / overlap_tokens)
+# ---------------------------
+def get_chunker(strategy=DEFAULT_STRATEGY, **options):
+    if strategy not in CHUNKERS:
+        raise ValueError(
+            f"不明なチャンク分割戦略: {strategy}（選択肢: {', '.join(CHUNKERS)}）"
+        )
+    options = {key: value for key, value in options.items() if value is not None}
+    return partial(CHUNKERS[strategy], **options)
@@ -0,0 +1,212 @@
+import importlib
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from functools import partial
+
+# ---------------------------
+# SDK クライアントとローカルリソースの遅延生成、起動時間の計測、
+# 事前 fork するワーカー
+# Flask/app.py・query_embeddings.py の import では定義だけを行い、OpenAI・
+# Pinecone の SDK の import と、クライアント・キャッシュ・インデックスのオープンは
+# 初回利用時（または提供開始前の明示的なウォームアップ）に行う
+# → ワーカーは 1 秒未満で準備でき、モジュールを import するツールやテストは
+#   ネットワーク接続やディスクの準備を行わない
+# ---------------------------
+
+
+# ---------------------------
+# プロセスの起動時間（このモジュールを最初に import した時点から計測）
+# フェーズ: "import"（モジュール）、"init"（各リソースの生成）、"warm-up"
+# （提供開始前の接続）、それぞれ名前ごとの内訳つき
+# report(): 1 行（例: "import 0.62s (flask 0.18s, openai 0.41s), init ..."）
+# ---------------------------
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marked = self.started
+        self.forked = None  # 事前 fork したワーカーでの fork 時点の time.perf_counter()
+        self.worker = None  # 事前 fork したワーカーの番号（None: fork していない）
+        self.ready_seconds = None
+        self.phases = {}  # kind → {name: seconds}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, kind, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(kind, name, time.perf_counter() - started)
+
+    # 前回の mark・フェーズからの時間（例: モジュール冒頭の import）
+    def mark(self, kind, name):
+        self._add(kind, name, time.perf_counter() - self.marked)
+
+    def _add(self, kind, name, seconds):
+        with self.lock:
+            names = self.phases.setdefault(kind, {})
+            names[name] = names.get(name, 0.0) + seconds
+            self.marked = time.perf_counter()
+
+    # プロセス（またはワーカー）が提供を開始した
+    def ready(self):
+        self.ready_seconds = time.perf_counter() - (self.forked or self.started)
+
+    def snapshot(self):
+        with self.lock:
+            phases = {kind: dict(names) for kind, names in self.phases.items()}
+        return {
+            "phases": phases,
+            "ready_seconds": self.ready_seconds,
+            "worker": self.worker,
+        }
+
+    def report(self):
+        parts = []
+        for kind, names in self.snapshot()["phases"].items():
+            detail = ", ".join(
+                f"{name} {seconds:.2f}s"
+                for name, seconds in sorted(names.items(), key=lambda item: -item[1])
+            )
+            parts.append(f"{kind} {sum(names.values()):.2f}s ({detail})")
+        if self.ready_seconds is not None:
+            since = "after fork" if self.forked is not None else "after start"
+            parts.append(f"ready {self.ready_seconds:.2f}s {since}")
+        return ", ".join(parts)
+
+
+startup = StartupTimer()
+
+
+# ---------------------------
+# 初回利用時にモジュールを import（"import" フェーズとして計測）
+# ---------------------------
+def import_module(name):
+    module = sys.modules.get(name)
+    if module is None:
+        with startup.phase("import", name):
+            module = importlib.import_module(name)
+    return module
+
+
+# モジュールを事前に import（例: ワーカーの fork 前に読み込み、共有させる）
+def preload(names):
+    for name in names:
+        import_module(name)
+
+
+_UNSET = object()
+
+
+# ---------------------------
+# 初回利用時に生成する値: Lazy(name, factory, *args, **kwargs).get()
+# 同時に呼ばれても生成は 1 回だけ。factory は None を返してもよい（open_xxx 関数と
+# 同じく無効な機能）。生成にかかった時間は "init" フェーズの `name` として
+# 記録する
+# ---------------------------
+class Lazy:
+    def __init__(self, name, factory, *args, **kwargs):
+        self.name = name
+        self.factory = partial(factory, *args, **kwargs)
+        self.value = _UNSET
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.value is _UNSET:
+            with self.lock:
+                if self.value is _UNSET:
+                    with startup.phase("init", self.name):
+                        self.value = self.factory()
+        return self.value
+
+    @property
+    def built(self):
+        return self.value is not _UNSET
+
+
+# ---------------------------
+# SDK クライアント（openai パッケージはプロジェクトで最も import が遅いため、
+# 最初のクライアントを作成するときにここで import する）
+# リトライは既定でスケジューラー（rate_limiter.py）に任せる
+# ---------------------------
+def openai_client(api_key=None, max_retries=0, **options):
+    openai = import_module("openai")
+    return openai.OpenAI(api_key=api_key, max_retries=max_retries, **options)
+
+
+def async_openai_client(api_key=None, max_retries=0, **options):
+    openai = import_module("openai")
+    return openai.AsyncOpenAI(api_key=api_key, max_retries=max_retries, **options)
+
+
+# Pinecone のインデックスクライアント（host: インデックスの URL。未指定なら SDK が検索）
+def pinecone_index(api_key, index_name, host=None):
+    pinecone = import_module("pinecone")
+    client = pinecone.Pinecone(api_key=api_key)
+    if host:
+        return client.Index(name=index_name, host=host)
+    return client.Index(index_name)
+
+
+# 各 SDK のクライアントを 1 つ作成して破棄する。どちらもクライアント作成時に
+# モジュールの大半（HTTP 関連、データ操作 API）を import し、接続は開かない
+# → fork 前に実行しても安全で、ワーカーは読み込み済みのモジュールを使える
+def preload_clients():
+    preload(["openai", "pinecone"])
+    with startup.phase("import", "sdk clients"):
+        openai_client(api_key="preload")
+        async_openai_client(api_key="preload")
+        pinecone_index("preload", "preload", host="http://127.0.0.1")
+
+
+# ---------------------------
+# 事前 fork するワーカー
+# 親プロセスはワーカーで共有するモジュールを import し（preload）、待ち受けソケットを
+# bind してから `workers` 個の子プロセスを fork する。各子プロセスはクライアント・
+# キャッシュ・接続を自分で開き（fork 前には何も開かないため、SQLite の接続・
+# メモリマップ・ソケットは共有されない）、同じソケットで待ち受ける
+# → import は 1 回だけで、新しいワーカーは import を繰り返さずに準備できる
+# serve(worker): 各子プロセスで実行（worker = 0 … workers - 1）
+# 親プロセスは SIGINT・SIGTERM を子プロセスに転送し、終了を待つ
+# os.fork がない（Windows）かワーカーが 1 つなら、serve(0) をこのプロセスで実行
+# ---------------------------
+def prefork(workers, serve):
+    if workers <= 1 or not hasattr(os, "fork"):
+        serve(0)
+        return
+    children = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            startup.forked = time.perf_counter()
+            startup.worker = worker
+            status = 0
+            try:
+                serve(worker)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
@@ -0,0 +1,232 @@
+import re
+import threading
+
+import numpy as np
+
+from chunking import count_tokens
+
+# ---------------------------
+# マッチしたチャンクから作るプロンプトのコンテキスト（アプリと query_embeddings.py で使用）
+# 1. 同じ文書で重なる（各チャンクは前のチャンクの末尾を繰り返す）チャンクや
+#    隣り合うチャンクを1つの文章にまとめる
+# 2. ほぼ重複する文章は、順位の高い方を残して除く
+#    （文字 shingle の Jaccard 類似度を MinHash で推定）
+# 3. 文章を順位の順に max_tokens まで詰める。収まらない最初の文章は
+#    残りの予算に合わせて切り詰める
+# report には、すべてのマッチをそのまま連結した場合と比べて削減できたトークン数が入る
+# ---------------------------
+DEFAULT_MAX_TOKENS = 3000  # コンテキストのトークン予算（0: 上限なし）
+DEFAULT_DUPLICATE_THRESHOLD = 0.8  # ほぼ重複とみなす推定 Jaccard 類似度
+SHINGLE_CHARS = 5  # 文字 shingle は日本語にも英語にも使える
+MINHASH_PERMUTATIONS = 64
+MIN_OVERLAP_CHARS = 20  # これより短い共通部分は重なりとみなさない
+MIN_CUT_TOKENS = 50  # 切り詰めるとこれより短くなる文章 → 代わりに除く
+
+# ベクトルIDは "<取り込みルートからの相対パス>-chunk-<n>"（upload_embeddings.chunk_file）
+_CHUNK_NUMBER = re.compile(r"-chunk-(\d+)$")
+
+# MinHash の置換：各 shingle のハッシュに対する multiply-shift ハッシュ
+_SHINGLE_BASE = np.uint64(1000003)
+_rng = np.random.default_rng(0)
+_MULTIPLIERS = _rng.integers(1, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64) | 1
+_OFFSETS = _rng.integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+# ---------------------------
+# 順位順のマッチ（[{"id", "metadata": {"text", "source"}, ...}]）のコンテキスト
+# (context, report) を返す：
+#   chunks / passages   渡されたマッチの数 / コンテキストの文章の数
+#   merged              隣のチャンクにまとめたチャンクの数
+#   duplicates          ほぼ重複として除いた文章の数
+#   over_budget         max_tokens のために切り詰めた・除いた文章の数
+#   tokens              コンテキストのトークン数
+#   tokens_saved        全マッチをそのまま連結した場合のトークン数 − tokens
+# ---------------------------
+def build_context(
+    matches,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD,
+    separator="\n\n",
+):
+    passages = _merge_chunks(matches)
+    kept = _drop_duplicates(passages, duplicate_threshold)
+    packed, over_budget = _pack(kept, int(max_tokens or 0), separator)
+    context = separator.join(packed)
+    tokens = count_tokens(context) if packed else 0
+    report = {
+        "chunks": len(matches),
+        "passages": len(packed),
+        "merged": len(matches) - len(passages),
+        "duplicates": len(passages) - len(kept),
+        "over_budget": over_budget,
+        "tokens": tokens,
+        "tokens_saved": _joined_tokens(matches, separator) - tokens,
+    }
+    return context, report
+
+
+# 全マッチをそのまま連結した場合のトークン数（このモジュール以前のプロンプト）
+def _joined_tokens(matches, separator):
+    if not matches:
+        return 0
+    tokens = sum(count_tokens(match["metadata"]["text"]) for match in matches)
+    return tokens + count_tokens(separator) * (len(matches) - 1)
+
+
+def _chunk_number(vector_id):
+    found = _CHUNK_NUMBER.search(vector_id or "")
+    return int(found.group(1)) if found else None
+
+
+# ---------------------------
+# 同じ (namespace, source) で重なる・隣り合うチャンクをまとめる
+# 含まれるチャンクの最上位の順位で並べた文章を返す
+# ---------------------------
+def _merge_chunks(matches):
+    groups = {}
+    for rank, match in enumerate(matches):
+        metadata = match["metadata"]
+        number = _chunk_number(match.get("id"))
+        if number is None or not metadata.get("source"):
+            key = (None, rank)  # 位置が不明：単独で残す
+        else:
+            key = (match.get("namespace"), metadata["source"])
+        groups.setdefault(key, []).append((number or 0, rank, metadata["text"]))
+
+    passages = []
+    for members in groups.values():
+        members.sort()
+        number, rank, text = members[0]
+        for next_number, next_rank, next_text in members[1:]:
+            joined = _join(text, next_text, adjacent=next_number == number + 1)
+            if joined is None:
+                passages.append((rank, text))
+                rank, text = next_rank, next_text
+            else:
+                rank, text = min(rank, next_rank), joined
+            number = next_number
+        passages.append((rank, text))
+    return [text for _, text in sorted(passages)]
+
+
+# 文書順の2つのチャンクを1つの文章に（None: 隣り合っていない）
+def _join(first, second, adjacent):
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = _overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    if adjacent:
+        return first + "\n" + second
+    return None
+
+
+# `second` の先頭と一致する `first` の末尾の最大の長さ（0: なし）
+def _overlap(first, second):
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    position = first.find(probe, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+# ---------------------------
+# 順位の高い文章に含まれる、またはほぼ重複する文章を除く
+# ---------------------------
+def _drop_duplicates(passages, threshold):
+    kept = []
+    signatures = []
+    for text in passages:
+        if any(text in other for other in kept):
+            continue
+        signature = _minhash(text)
+        if signatures and _similarity(signatures, signature).max() >= threshold:
+            continue
+        kept.append(text)
+        signatures.append(signature)
+    return kept
+
+
+# 文字 shingle の MinHash シグネチャ（空白をまとめ、小文字化）
+# shingle はコードポイントの多項式としてハッシュし、numpy で一度に計算する
+def _minhash(text):
+    text = " ".join(text.split()).lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < SHINGLE_CHARS:
+        codes = np.pad(codes, (0, SHINGLE_CHARS - len(codes)))
+    count = len(codes) - SHINGLE_CHARS + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(SHINGLE_CHARS):
+        hashes = hashes * _SHINGLE_BASE + codes[i : i + count]
+    hashes = np.unique(hashes)
+    return ((hashes[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).min(axis=0)
+
+
+# シグネチャと `signatures` の各要素との推定 Jaccard 類似度
+def _similarity(signatures, signature):
+    return (np.stack(signatures) == signature).mean(axis=1)
+
+
+# ---------------------------
+# 収まる間は文章を順位の順にそのまま入れ、収まらない最初の文章は
+# 残りの予算に合わせて切り詰める（残りが MIN_CUT_TOKENS 未満なら除く）
+# (文章, 切り詰めた・除いた文章の数) を返す
+# ---------------------------
+def _pack(passages, max_tokens, separator):
+    if not max_tokens:
+        return list(passages), 0
+    packed = []
+    used = 0
+    gap = count_tokens(separator)
+    for i, text in enumerate(passages):
+        budget = max_tokens - used - (gap if packed else 0)
+        tokens = count_tokens(text)
+        if tokens <= budget:
+            packed.append(text)
+            used += tokens + (gap if len(packed) > 1 else 0)
+        elif budget >= MIN_CUT_TOKENS:
+            packed.append(_cut(text, tokens, budget))
+            return packed, len(passages) - i
+    return packed, len(passages) - len(packed)
+
+
+# max_tokens 以内のテキストの先頭（近くに文末・改行があればそこで切る）
+def _cut(text, tokens, max_tokens):
+    size = max(1, len(text) * max_tokens // tokens)
+    while size > 1 and count_tokens(text[:size]) > max_tokens:
+        size = size * 9 // 10
+    head = text[:size]
+    end = max(head.rfind(mark) for mark in ("。", ". ", "\n"))
+    if end > size * 3 // 4:
+        head = head[: end + 1]
+    return head.rstrip()
+
+
+# ---------------------------
+# 作成したすべてのコンテキストの合計（スレッドセーフ。/stats と /metrics で公開）
+# ---------------------------
+class ContextStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        keys = ("contexts", "chunks", "merged", "duplicates", "over_budget")
+        self.totals = dict.fromkeys(keys + ("tokens", "tokens_saved"), 0)
+
+    def add(self, report):
+        with self.lock:
+            self.totals["contexts"] += 1
+            for key in report:
+                if key in self.totals:
+                    self.totals[key] += report[key]
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+        sent = totals["tokens"] + totals["tokens_saved"]
+        totals["saved_rate"] = totals["tokens_saved"] / sent if sent else 0.0
+        return totals
@@ -0,0 +1,235 @@
+import threading
+import time
+import requests
+
+from rate_limiter import Scheduler
+
+# ---------------------------
+# 埋め込みのバッチ生成（OpenAI embeddings エンドポイント）
+# エンドポイントは配列の "input" を受け付けるため、複数チャンクを1リクエストでベクトル化
+# → 300ページのPDFでもチャンク数ぶんではなく数回の往復で済む
+# ---------------------------
+DEFAULT_EMBEDDING_URL = "https://api.openai.com/v1/embeddings"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# APIの上限：1リクエストあたり最大2048入力・300,000トークン
+# 推定値は概算のため、既定のトークン予算は上限より十分小さくしている
+MAX_INPUTS_PER_REQUEST = 2048
+DEFAULT_MAX_BATCH_TOKENS = 100000
+
+
+# ---------------------------
+# トークン数の概算（トークナイザー非依存）
+# ASCII文字：約4文字で1トークン
+# 日本語などの非ASCII文字：1文字1トークンとして保守的に見積もる
+# ---------------------------
+def estimate_tokens(text):
+    ascii_chars = len(text.encode("ascii", errors="ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+# ---------------------------
+# 単一入力でも大きすぎて埋め込みできない場合の例外
+# ---------------------------
+class BatchTooLargeError(Exception):
+    pass
+
+
+# ---------------------------
+# 埋め込みバッチャー
+# items: (chunk_id, text) の組（複数ファイル由来でも可）
+# トークン予算内でバッチにまとめて1バッチ1リクエストで送信し、
+# 返却ベクトルを "index" フィールドでチャンクIDに対応付ける
+# url: テスト時はローカルの代替サーバーを指定できる
+# cache: EmbeddingCache（キャッシュ済みのテキストはリクエストせずに返す）
+# scheduler: プロセス内の他の OpenAI / Pinecone 呼び出しと共有する Scheduler
+#   （モデルごとのレート制限、バックオフ付きの再試行、サーキットブレーカー）
+# ---------------------------
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        api_key,
+        url=DEFAULT_EMBEDDING_URL,
+        model=DEFAULT_EMBEDDING_MODEL,
+        max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+        max_batch_size=MAX_INPUTS_PER_REQUEST,
+        session=None,
+        timeout=60,
+        cache=None,
+        scheduler=None,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = min(max_batch_size, MAX_INPUTS_PER_REQUEST)
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler = scheduler or Scheduler()
+        self.lock = threading.Lock()
+        self.failed = {}  # chunk_id → エラーメッセージ
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "inputs": 0,
+            "tokens": 0,
+            "splits": 0,
+            "cached": 0,
+            "seconds": 0.0,
+        }
+
+    # ---------------------------
+    # トークン予算と入力数上限の範囲でバッチに分割
+    # ---------------------------
+    def iter_batches(self, items):
+        batch = []
+        batch_tokens = 0
+        for chunk_id, text in items:
+            tokens = estimate_tokens(text)
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append((chunk_id, text))
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    # ---------------------------
+    # 配列入力で1リクエスト送信し、入力順のベクトルを返す
+    # limiter: 並行する呼び出し元で共有する RateLimiter（送信前に待機。
+    #   スケジューラのモデルごとの上限に加えて適用）
+    # 429 / 5xx はスケジューラが再試行する（「大きすぎる」は再試行しない）
+    # ---------------------------
+    def _post(self, texts, limiter=None):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        data = {"input": texts, "model": self.model}
+
+        def send():
+            with self.lock:
+                self.stats["requests"] += 1
+            response = self.session.post(
+                self.url, headers=headers, json=data, timeout=self.timeout
+            )
+            if response.status_code in (400, 413) and _is_too_large(response):
+                raise BatchTooLargeError(response.text)
+            response.raise_for_status()
+            return response.json()
+
+        tokens = sum(estimate_tokens(text) for text in texts)
+        body = self.scheduler.call(self.model, send, tokens, limiter=limiter)
+        with self.lock:
+            self.stats["tokens"] += body.get("usage", {}).get("prompt_tokens", 0)
+        vectors = [None] * len(texts)
+        for item in body["data"]:
+            vectors[item["index"]] = item["embedding"]
+        return vectors
+
+    # ---------------------------
+    # 1バッチを埋め込み、大きすぎると拒否された場合は半分に分割して再試行
+    # 1件でも大きすぎる入力は self.failed に記録
+    # ---------------------------
+    def _embed_batch(self, batch, limiter=None):
+        try:
+            vectors = self._post([text for _, text in batch], limiter)
+        except BatchTooLargeError as e:
+            with self.lock:
+                if len(batch) == 1:
+                    self.failed[batch[0][0]] = str(e)
+                    return []
+                self.stats["splits"] += 1
+            middle = len(batch) // 2
+            return self._embed_batch(batch[:middle], limiter) + self._embed_batch(
+                batch[middle:], limiter
+            )
+        return [(chunk_id, vector) for (chunk_id, _), vector in zip(batch, vectors)]
+
+    # ---------------------------
+    # 1バッチを埋め込んで統計を更新（複数スレッドから呼び出し可能）
+    # 失敗したバッチは self.failed に記録し、空リストを返す
+    # キャッシュヒット分はバッチから除き、ミスしたものだけを送信
+    # ---------------------------
+    def embed_batch(self, batch, limiter=None):
+        start = time.perf_counter()
+        cached = []
+        if self.cache:
+            vectors = self.cache.get_many([text for _, text in batch])
+            cached = [
+                (chunk_id, vector)
+                for (chunk_id, _), vector in zip(batch, vectors)
+                if vector is not None
+            ]
+            batch = [item for item, vector in zip(batch, vectors) if vector is None]
+        try:
+            results = self._embed_batch(batch, limiter) if batch else []
+        except Exception as e:
+            with self.lock:
+                for chunk_id, _ in batch:
+                    self.failed[chunk_id] = str(e)
+            results = []
+        if self.cache and results:
+            texts = dict(batch)
+            self.cache.put_many(
+                [(texts[chunk_id], vector) for chunk_id, vector in results]
+            )
+        with self.lock:
+            self.stats["seconds"] += time.perf_counter() - start
+            self.stats["batches"] += 1
+            self.stats["inputs"] += len(results) + len(cached)
+            self.stats["cached"] += len(cached)
+        return cached + results
+
+    # ---------------------------
+    # 全件を埋め込み、バッチ完了ごとに (chunk_id, embedding) を返す
+    # ---------------------------
+    def embed(self, items):
+        for batch in self.iter_batches(items):
+            yield from self.embed_batch(batch)
+
+    # ---------------------------
+    # 全件を埋め込み {chunk_id: embedding} を返す
+    # ---------------------------
+    def embed_all(self, items):
+        return dict(self.embed(items))
+
+    # ---------------------------
+    # バッチサイズとスループットのレポート
+    # ---------------------------
+    def report(self):
+        batches = self.stats["batches"]
+        inputs = self.stats["inputs"]
+        seconds = self.stats["seconds"]
+        avg_size = inputs / batches if batches else 0.0
+        rate = inputs / seconds if seconds else 0.0
+        return (
+            f"{inputs}チャンク / {batches}バッチ "
+            f"（リクエスト{self.stats['requests']}回、分割{self.stats['splits']}回、"
+            f"キャッシュ{self.stats['cached']}件）、"
+            f"平均バッチサイズ {avg_size:.1f}、{rate:.1f} チャンク/秒、"
+            f"{self.stats['tokens']}トークン、失敗 {len(self.failed)}件"
+        )
+
+
+# ---------------------------
+# エラー応答が「リクエストが大きすぎる」ことを示すか判定
+# ---------------------------
+def _is_too_large(response):
+    if response.status_code == 413:
+        return True
+    message = response.text.lower()
+    return any(
+        phrase in message
+        for phrase in (
+            "maximum context length",
+            "too many tokens",
+            "max_tokens_per_request",
+            "too large",
+        )
+    )
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ---------------------------
+# (モデル, テキストハッシュ) をキーとするディスク上の永続埋め込みキャッシュ
+# vectors.f32: メモリマップした float32 配列（capacity × dim、1エントリ1スロット）
+# slots.bin:   メモリマップしたインデックス（スロットごとの SHA-256 キー＋最終使用カウンタ）
+# → 以前に埋め込んだテキスト（再チャンク化での重複、繰り返しの質問、別namespaceへの再取り込み）は
+#   ネットワーク呼び出しなしでディスクから返す
+# 満杯時は最も長く使われていないエントリを追い出し、そのスロットを再利用
+# 1つのキャッシュディレクトリに書き込むのは同時に1プロセスまでとする
+# （取り込みと検索応答は既定で別ディレクトリを使用）
+# ---------------------------
+DEFAULT_CACHE_DIR = ".embedding_cache"
+DEFAULT_DIMENSION = 1536  # text-embedding-3-small
+DEFAULT_CAPACITY = 50000  # 1536次元で約300MBのベクトル
+
+# tick 0 は未使用スロット。キーは32バイトの SHA-256 ダイジェスト
+_SLOT_DTYPE = np.dtype([("key", "u1", (32,)), ("tick", "<u8")])
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIR,
+        model="text-embedding-3-small",
+        dim=DEFAULT_DIMENSION,
+        capacity=DEFAULT_CAPACITY,
+    ):
+        self.directory = directory
+        self.model = model
+        self.dim = dim
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+
+        mode = "r+" if os.path.exists(self._path("slots.bin")) else "w+"
+        self.slots = np.memmap(
+            self._path("slots.bin"), dtype=_SLOT_DTYPE, mode=mode, shape=(capacity,)
+        )
+        self.vectors = np.memmap(
+            self._path("vectors.f32"),
+            dtype=np.float32,
+            mode=mode,
+            shape=(capacity, dim),
+        )
+
+        # key → slot（使用が古い順に並ぶ）
+        self.lru = OrderedDict()
+        used = np.nonzero(self.slots["tick"] > 0)[0]
+        for slot in used[np.argsort(self.slots["tick"][used], kind="stable")]:
+            self.lru[self.slots["key"][slot].tobytes()] = int(slot)
+        used_set = set(used.tolist())
+        self.free = [
+            slot for slot in range(capacity - 1, -1, -1) if slot not in used_set
+        ]
+        self.tick = int(self.slots["tick"].max()) if len(used) else 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # 次元数と容量はキャッシュディレクトリ作成時に固定される
+    def _check_meta(self):
+        meta_path = self._path("meta.json")
+        meta = {"dim": self.dim, "capacity": self.capacity}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(
+                    f"埋め込みキャッシュ {self.directory} は {stored} で作成されています"
+                    f"（指定値: {meta}）"
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).digest()
+
+    # ---------------------------
+    # テキスト1件を検索し、ベクトル（float のリスト）または None を返す
+    # ---------------------------
+    def get(self, text):
+        return self.get_many([text])[0]
+
+    # ---------------------------
+    # 複数テキストをまとめて検索（ミスは None）
+    # ---------------------------
+    def get_many(self, texts):
+        results = []
+        with self.lock:
+            for text in texts:
+                key = self.key(text)
+                slot = self.lru.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._touch(key, slot)
+                results.append(self.vectors[slot].tolist())
+        return results
+
+    # ---------------------------
+    # ベクトルを保存（満杯時は最も長く使われていないエントリを追い出す）
+    # ---------------------------
+    def put(self, text, vector):
+        self.put_many([(text, vector)])
+
+    def put_many(self, items):
+        with self.lock:
+            for text, vector in items:
+                if len(vector) != self.dim:
+                    continue
+                key = self.key(text)
+                slot = self.lru.get(key)
+                if slot is None:
+                    if self.free:
+                        slot = self.free.pop()
+                    else:
+                        _, slot = self.lru.popitem(last=False)
+                    self.slots["key"][slot] = np.frombuffer(key, dtype=np.uint8)
+                self.vectors[slot] = vector
+                self._touch(key, slot)
+
+    def _touch(self, key, slot):
+        self.tick += 1
+        self.slots["tick"][slot] = self.tick
+        self.lru[key] = slot
+        self.lru.move_to_end(key)
+
+    # ---------------------------
+    # ヒット/ミス数
+    # ---------------------------
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.lru),
+                "capacity": self.capacity,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"ヒット {stats['hits']}件、ミス {stats['misses']}件"
+            f"（ヒット率 {stats['hit_rate']:.1%}）、"
+            f"エントリ {stats['entries']}/{stats['capacity']}"
+        )
+
+    def flush(self):
+        with self.lock:
+            self.slots.flush()
+            self.vectors.flush()
+
+    def close(self):
+        self.flush()
+
+
+# ---------------------------
+# 用途（"ingest"・"query" など）ごとのキャッシュを開く
+# base_dir: 基準ディレクトリ（空または None でキャッシュ無効）
+# role: サブディレクトリ名（取り込みと検索応答で書き込み先を共有しないため）
+# ---------------------------
+def open_cache(
+    role,
+    base_dir=DEFAULT_CACHE_DIR,
+    capacity=DEFAULT_CAPACITY,
+    model="text-embedding-3-small",
+):
+    if not base_dir:
+        return None
+    return EmbeddingCache(
+        os.path.join(base_dir, role), model=model, capacity=int(capacity)
+    )
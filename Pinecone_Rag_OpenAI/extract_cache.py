@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import zlib
+
+from ingest_manifest import file_sha256
+
+# ---------------------------
+# 抽出したテキストのキャッシュ。キーはファイル内容の SHA-256（と抽出処理・
+# そのオプション）
+# 同じ文書のチャンク分割のやり直し（別の戦略やサイズ）や別の namespace への取り込みでは、
+# PDF を再度解析せずにここからページを読み込む
+# 文書ごとに zlib 圧縮した JSON ファイル 1 つを、アトミックに書き込む（os.replace）
+# → 抽出ワーカープロセス間で安全に共有できる
+# max_mb を超えると、最も長く使われていないエントリから削除する（prune）
+#   <dir>/<先頭2桁の16進数>/<key>.json.z: [[page, text], ...]
+# ---------------------------
+DEFAULT_EXTRACT_CACHE_DIR = ".extract_cache"
+DEFAULT_MAX_MB = 1024
+EXTRACTION_VERSION = 1  # 抽出結果が変わるときに上げる → 古いエントリは使われない
+COMPRESSION_LEVEL = 6
+
+
+class ExtractCache:
+    def __init__(self, directory, max_mb=DEFAULT_MAX_MB):
+        self.directory = directory
+        self.max_bytes = float(max_mb) * 1024 * 1024
+
+    # `kind` と指定のオプションで抽出したファイルのページのキー
+    def key(self, file_path, kind, **options):
+        digest = hashlib.sha256(file_sha256(file_path).encode("ascii"))
+        digest.update(
+            f"{EXTRACTION_VERSION}\n{kind}\n{sorted(options.items())}".encode()
+        )
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.z")
+
+    # [(page, text), ...]。キャッシュにない（または読めない）場合は None
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pages = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            os.utime(path)  # 最近使用した印（prune は古いものから削除）
+        except (OSError, ValueError, zlib.error):
+            return None
+        return [tuple(page) for page in pages]
+
+    def put(self, key, pages):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(list(pages), ensure_ascii=False).encode("utf-8")
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(zlib.compress(data, COMPRESSION_LEVEL))
+        os.replace(temp, path)
+
+    # ---------------------------
+    # キャッシュが max_mb を超えている間、最も長く使われていないエントリを削除
+    # 残った {"files", "bytes"} と削除したファイル数を返す
+    # ---------------------------
+    def prune(self):
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return {"files": len(entries) - removed, "bytes": total, "removed": removed}
+
+
+# ---------------------------
+# 抽出キャッシュを作成（ディレクトリが空なら無効 → None）
+# ---------------------------
+def open_extract_cache(directory=DEFAULT_EXTRACT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+    if not directory:
+        return None
+    return ExtractCache(directory, max_mb)
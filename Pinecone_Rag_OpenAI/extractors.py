@@ -0,0 +1,381 @@
+import codecs
+import csv
+import os
+import re
+import zipfile
+from html.parser import HTMLParser
+
+import docx
+import pdfplumber
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+# ---------------------------
+# ファイル種別に応じたテキスト抽出（抽出処理のレジストリ、1ページずつ）
+# 種別はファイル先頭のバイト列から判定し、拡張子はテキスト形式の中での選択にだけ使う
+# → 画像・アーカイブなどのバイナリファイルは、文字化けしたテキストとして
+# 埋め込まれることなくスキップされる
+# どの抽出処理も (ページ番号または None, テキスト) を1つずつ返すため、
+# 文書全体を1つの文字列として組み立てない
+#   pdf       pdfplumber でページごと（ページ番号あり）
+#   docx      段落と表を文書の順に。ページヘッダーは先頭に1回だけ
+#   html      表示されるテキスト（スクリプト・スタイルを除く）、ブロック要素ごとに1行
+#   csv       1行につき "列: 値; 列: 値" の1行（.csv / .tsv）
+#   markdown  テキストとして。YAML フロントマターは除く（.md / .markdown）
+#   text      その他のテキスト。UTF-8 でブロック単位に読み込み（例: .txt, .py）
+# markdown_headings=True の場合、見出しを "# 見出し" 行として出力（docx / html）
+# ---------------------------
+TEXT_BLOCK_SIZE = 64 * 1024
+SNIFF_BYTES = 8192  # 種別の判定に読むバイト数
+DEFAULT_MAX_FILE_MB = 200  # これより大きいファイルはスキップ（0: 上限なし）
+MAX_INVALID_RATE = 0.01  # 復号できないバイトがこれより多い → UTF-8 テキストではない
+
+EXTRACTORS = {}  # 種別 → 抽出処理(file_path, markdown_headings)
+EXTENSIONS = {}  # 拡張子 → テキスト形式の種別
+_SNIFFERS = []  # バイナリ形式の (種別, sniff(file_path, head))。最初に確認する
+
+# 抽出処理のないバイナリファイル（先頭のバイト列で判定）
+_BINARY_SIGNATURES = (
+    (b"\x89PNG", "PNG 画像"),
+    (b"\xff\xd8\xff", "JPEG 画像"),
+    (b"GIF8", "GIF 画像"),
+    (b"II*\x00", "TIFF 画像"),
+    (b"MM\x00*", "TIFF 画像"),
+    (b"RIFF", "音声・動画・画像（RIFF）"),
+    (b"PK\x03\x04", "ZIP アーカイブ"),
+    (b"\x1f\x8b", "gzip アーカイブ"),
+    (b"7z\xbc\xaf", "7z アーカイブ"),
+    (b"Rar!", "RAR アーカイブ"),
+    (b"\xd0\xcf\x11\xe0", "旧形式の Office 文書"),
+    (b"\x7fELF", "実行ファイル"),
+    (b"SQLite format 3", "SQLite データベース"),
+)
+_UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+
+# 抽出できないファイル種別（メッセージが理由）
+class UnsupportedFile(Exception):
+    pass
+
+
+# ---------------------------
+# 抽出処理を登録（デコレーター）
+# extensions: 担当するテキスト形式（例: ".csv"）
+# sniff: (file_path, 先頭のバイト列) → 内容で判定するバイナリ形式なら True
+# ---------------------------
+def register(kind, *extensions, sniff=None):
+    def decorate(extractor):
+        EXTRACTORS[kind] = extractor
+        for extension in extensions:
+            EXTENSIONS[extension] = kind
+        if sniff is not None:
+            _SNIFFERS.append((kind, sniff))
+        return extractor
+
+    return decorate
+
+
+# ---------------------------
+# ファイルの抽出処理の種別 → (種別, None)、スキップする場合は (None, 理由)
+# スキップ規則: 隠しファイルと Office のロックファイル（"~$..."）、空のファイル、
+# max_file_mb より大きいファイル、どの抽出処理も扱わないバイナリ、UTF-8 でないテキスト
+# ---------------------------
+def detect_kind(file_path, max_file_mb=DEFAULT_MAX_FILE_MB):
+    if os.path.basename(file_path).startswith((".", "~$")):
+        return None, "隠しファイルまたは一時ファイル"
+    size = os.path.getsize(file_path)
+    if not size:
+        return None, "空のファイル"
+    if max_file_mb and size > float(max_file_mb) * 1024 * 1024:
+        return None, f"{max_file_mb} MB を超えるファイル"
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    for kind, sniff in _SNIFFERS:
+        if sniff(file_path, head):
+            return kind, None
+    for signature, description in _BINARY_SIGNATURES:
+        if head.startswith(signature):
+            return None, description
+    if not head.startswith(_UTF16_BOMS):
+        if b"\x00" in head:
+            return None, "バイナリファイル"
+        text = head.decode("utf-8", errors="replace")
+        if text.count("\ufffd") > len(text) * MAX_INVALID_RATE:
+            return None, "UTF-8 でないテキスト"
+    extension = os.path.splitext(file_path)[1].lower()
+    return EXTENSIONS.get(extension, "text"), None
+
+
+# ---------------------------
+# ファイルの (ページ番号, テキスト) を1ページ（またはブロック）ずつ返す
+# kind: detect_kind の結果（省略時はここで判定）
+# スキップするファイルには UnsupportedFile を送出
+# ---------------------------
+def extract_pages(
+    file_path, markdown_headings=False, kind=None, max_file_mb=DEFAULT_MAX_FILE_MB
+):
+    if kind is None:
+        kind, reason = detect_kind(file_path, max_file_mb)
+        if kind is None:
+            raise UnsupportedFile(reason)
+    return EXTRACTORS[kind](file_path, markdown_headings)
+
+
+# テキストファイルを UTF-8（BOM は除去）で開く。UTF-16 の BOM で始まる場合は UTF-16
+def _open_text(file_path, newline=None):
+    with open(file_path, "rb") as f:
+        head = f.read(2)
+    encoding = "utf-16" if head in _UTF16_BOMS else "utf-8-sig"
+    return open(file_path, "r", encoding=encoding, errors="ignore", newline=newline)
+
+
+# ---------------------------
+# PDF: pdfplumber（ページごとに (ページ番号, テキスト) を返す）
+# ---------------------------
+def _is_pdf(file_path, head):
+    return b"%PDF-" in head[:1024]
+
+
+@register("pdf", sniff=_is_pdf)
+def extract_pdf(file_path, markdown_headings=False):
+    with pdfplumber.open(file_path) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            # テキスト層のないページ（スキャン・白紙）では extract_text() が None を返す
+            text = page.extract_text() or ""
+            # 解析済みレイアウトを破棄し、ページ数に応じてメモリが増えないようにする
+            page.flush_cache()
+            yield number, text + "\n"
+
+
+# ---------------------------
+# Word: python-docx（段落ごと。.docx は固定ページを持たないためページ番号は None）
+# 先頭にページヘッダー（同じテキストは1回）、続いて段落と表を文書の順に返す
+# 表の1行は "セル | セル | セル" の1行になる
+# ---------------------------
+def _is_docx(file_path, head):
+    if not head.startswith(b"PK\x03\x04"):
+        return False
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            return "word/document.xml" in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+@register("docx", sniff=_is_docx)
+def extract_docx(file_path, markdown_headings=False):
+    doc = docx.Document(file_path)
+    for idx, text in enumerate(_docx_lines(doc, markdown_headings)):
+        yield None, ("\n" if idx else "") + text
+
+
+def _docx_lines(doc, markdown_headings):
+    yield from _docx_headers(doc)
+    for child in doc.element.body.iterchildren():
+        if child.tag == qn("w:p"):
+            para = Paragraph(child, doc)
+            text = para.text
+            if markdown_headings:
+                text = _heading_prefix(para) + text
+            yield text
+        elif child.tag == qn("w:tbl"):
+            yield from _table_lines(Table(child, doc))
+
+
+# 全セクションのヘッダーのテキスト（前のセクションにリンクしたヘッダーは同じもの）
+def _docx_headers(doc):
+    seen = set()
+    for section in doc.sections:
+        for header in (section.first_page_header, section.header):
+            if header.is_linked_to_previous:
+                continue
+            for para in header.paragraphs:
+                text = para.text.strip()
+                if text and text not in seen:
+                    seen.add(text)
+                    yield text
+
+
+# 行ごとに1行。結合セルは python-docx が繰り返して返すので1回だけ残す
+def _table_lines(table):
+    for row in table.rows:
+        cells = []
+        previous = None
+        for cell in row.cells:
+            if cell._tc is previous:
+                continue
+            previous = cell._tc
+            cells.append(" ".join(cell.text.split()))
+        if any(cells):
+            yield " | ".join(cells)
+
+
+# "Heading 2" の段落なら "## "（"Title" はレベル1扱い）、見出し以外は ""
+def _heading_prefix(para):
+    style = para.style.name if para.style is not None else ""
+    if style == "Title":
+        return "# "
+    if style.startswith("Heading") or style.startswith("見出し"):
+        level = style.split()[-1]
+        return "#" * min(int(level), 6) + " " if level.isdigit() else "# "
+    return ""
+
+
+# ---------------------------
+# HTML: 表示されるテキスト。ブロック単位で解析（標準ライブラリの html.parser）
+# ブロック要素は改行し、リスト項目は "- " 行、表のセルは " | " で区切る。
+# スクリプト・スタイル・テンプレートは除く
+# ---------------------------
+_HTML_HIDDEN = {"script", "style", "noscript", "template", "svg"}
+_HTML_BLOCKS = {
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "br",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "figcaption",
+    "footer",
+    "form",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "hr",
+    "li",
+    "main",
+    "nav",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "title",
+    "tr",
+    "ul",
+}
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _HTMLText(HTMLParser):
+    def __init__(self, markdown_headings):
+        super().__init__(convert_charrefs=True)
+        self.markdown_headings = markdown_headings
+        self.hidden = 0  # 非表示要素の中の深さ
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_HIDDEN:
+            self.hidden += 1
+        elif tag in _HTML_BLOCKS:
+            self.parts.append("\n")
+            if tag == "li":
+                self.parts.append("- ")
+            elif self.markdown_headings and re.fullmatch(r"h[1-6]", tag):
+                self.parts.append("#" * int(tag[1]) + " ")
+        elif tag in ("td", "th"):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in _HTML_HIDDEN:
+            self.hidden = max(0, self.hidden - 1)
+        elif tag in _HTML_BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.parts.append(_WHITESPACE.sub(" ", data))
+
+    # ここまでに解析した完結した行（空行は除く）。最後の行はまだ続く可能性がある
+    def take_lines(self, final=False):
+        text = "".join(self.parts)
+        end = len(text) if final else text.rfind("\n") + 1
+        self.parts = [text[end:]]
+        lines = [line.strip(" |") for line in text[:end].split("\n")]
+        return [line for line in lines if line]
+
+
+@register("html", ".html", ".htm", ".xhtml")
+def extract_html(file_path, markdown_headings=False):
+    parser = _HTMLText(markdown_headings)
+    with _open_text(file_path) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+            parser.feed(block)
+            lines = parser.take_lines()
+            if lines:
+                yield None, "\n".join(lines) + "\n"
+    parser.close()
+    lines = parser.take_lines(final=True)
+    if lines:
+        yield None, "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# CSV / TSV: 1行目を列名とし、以降の各行を "列: 値; 列: 値" の1行にする
+# （空の値は除く）。どのチャンクでも、値がどの列のものか
+# 分かるようにする
+# 区切り文字はファイル先頭から判定（判定できなければ拡張子から）
+# ---------------------------
+@register("csv", ".csv", ".tsv")
+def extract_csv(file_path, markdown_headings=False):
+    with _open_text(file_path, newline="") as f:
+        sample = f.read(SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            tsv = file_path.lower().endswith(".tsv")
+            dialect = csv.excel_tab if tsv else csv.excel
+        rows = csv.reader(f, dialect)
+        header = [name.strip() for name in next(rows, [])]
+        lines = []
+        size = 0
+        for row in rows:
+            fields = [
+                f"{header[i]}: {value}" if i < len(header) and header[i] else value
+                for i, value in enumerate(value.strip() for value in row)
+                if value
+            ]
+            if not fields:
+                continue
+            line = "; ".join(fields)
+            lines.append(line)
+            size += len(line) + 1
+            if size >= TEXT_BLOCK_SIZE:
+                yield None, "\n".join(lines) + "\n"
+                lines = []
+                size = 0
+        if lines:
+            yield None, "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# Markdown: テキストとして読み込む（見出しは既に "#" 行）。先頭の YAML
+# フロントマター（"---" ... "---"）は除く
+# ---------------------------
+@register("markdown", ".md", ".markdown")
+def extract_markdown(file_path, markdown_headings=False):
+    with _open_text(file_path) as f:
+        for idx, block in enumerate(iter(lambda: f.read(TEXT_BLOCK_SIZE), "")):
+            if idx == 0 and block.startswith("---\n"):
+                end = block.find("\n---\n", 3)
+                if end != -1:
+                    block = block[end + 5 :]
+            yield None, block
+
+
+# ---------------------------
+# その他のテキスト: UTF-8でブロック単位に読み込み（例: .txt, .py。ページ番号は None）
+# ---------------------------
+@register("text")
+def extract_plain_text(file_path, markdown_headings=False):
+    with _open_text(file_path) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+            yield None, block
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# ---------------------------
+# ローカルの取り込みマニフェスト（SQLite）
+# files:  namespace ごとに、取り込み済みファイルの mtime / サイズ / SHA-256 と
+#         チャンク分割オプション（オプションを変えるとファイルは変更扱い）
+# chunks: namespace・ファイルごとに、各ベクトルIDのチャンク内容ハッシュ
+# → 再実行時は新規・変更チャンクのみ埋め込み、存在しなくなったベクトルは削除する
+# ---------------------------
+DEFAULT_MANIFEST_PATH = "ingest_manifest.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    namespace TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    options TEXT NOT NULL,
+    PRIMARY KEY (namespace, path)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (namespace, path, vector_id)
+);
+"""
+
+
+# ---------------------------
+# ハッシュ計算（ファイルはブロック単位で読み、大きなファイルでもメモリを使わない）
+# ---------------------------
+def file_sha256(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    # ---------------------------
+    # 前回記録時からファイルが変更されたかを判定
+    # mtime とサイズが同じ → ファイルを開かずに未変更と判定
+    # それ以外は SHA-256 で判定（更新日時だけ変わった同一内容のファイルは未変更扱い）
+    # options: チャンク分割オプションのフィンガープリント（記録時と異なれば変更扱い）
+    # 戻り値: (unchanged, state)。state = (mtime, size, sha256) は record_file に渡す
+    # ---------------------------
+    def check_file(self, namespace, file_path, options=""):
+        stat = os.stat(file_path)
+        row = self.conn.execute(
+            "SELECT mtime, size, sha256 FROM files "
+            "WHERE namespace = ? AND path = ? AND options = ?",
+            (namespace, file_path, options),
+        ).fetchone()
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return True, None
+        sha256 = file_sha256(file_path)
+        if row and row[1] == stat.st_size and row[2] == sha256:
+            self.conn.execute(
+                "UPDATE files SET mtime = ? WHERE namespace = ? AND path = ?",
+                (stat.st_mtime, namespace, file_path),
+            )
+            return True, None
+        return False, (stat.st_mtime, stat.st_size, sha256)
+
+    # ファイルについて記録済みの {vector_id: content_hash}
+    def chunk_hashes(self, namespace, file_path):
+        rows = self.conn.execute(
+            "SELECT vector_id, content_hash FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        return dict(rows)
+
+    # ---------------------------
+    # ファイルのチャンクハッシュを記録
+    # state: (mtime, size, sha256)。None の場合はファイル行を更新しない
+    # （一部チャンクが失敗した場合に使用し、次回の実行でファイルを再確認させる）
+    # options: ファイル行に記録するチャンク分割オプションのフィンガープリント
+    # ---------------------------
+    def record_file(self, namespace, file_path, state, hashes, options=""):
+        self.conn.execute(
+            "DELETE FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+            [(namespace, vid, file_path, h) for vid, h in hashes.items()],
+        )
+        if state is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, file_path) + tuple(state) + (options,),
+            )
+        self.conn.commit()
+
+    # ファイルとそのチャンクをマニフェストから削除
+    def forget_file(self, namespace, file_path):
+        self.conn.execute(
+            "DELETE FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.execute(
+            "DELETE FROM files WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.commit()
+
+    # namespace に記録されているパスの一覧
+    def files(self, namespace):
+        rows = self.conn.execute(
+            "SELECT DISTINCT path FROM chunks WHERE namespace = ? "
+            "UNION SELECT path FROM files WHERE namespace = ?",
+            (namespace, namespace),
+        )
+        return [row[0] for row in rows]
+
+
+# ---------------------------
+# 1回の取り込み実行における差分同期（IngestPipeline から使用）
+# should_skip(): 未変更ファイルを抽出前にスキップ
+# select_chunks(): 新規・変更チャンクのみを埋め込み対象に残す
+# restore(): 取り込みジョブの中断した実行で完了したファイルを引き継ぐ
+# take_over(): その実行が upsert 済みのチャンクを引き継ぐ
+# finish(): 成功したファイルを記録し、不要になったベクトルを削除
+#           （ファイルから消えたチャンク、ディレクトリから削除されたファイル）
+# full=True: 全チャンクを再埋め込み（マニフェスト更新と不要ベクトル削除は行う）
+# options: チャンク分割オプション。前回と異なるファイルは未変更でも再処理する
+# 呼び出しはすべてパイプラインのメインスレッドから（SQLite 接続は 1 つ）。ただし
+# マニフェストに触れない file_record() は upsert ワーカーから呼ばれる
+# ---------------------------
+class IncrementalSync:
+    def __init__(self, manifest, namespace, root, full=False, options=None):
+        self.manifest = manifest
+        self.namespace = namespace
+        self.root = root
+        self.full = full
+        self.options = options_fingerprint(options)
+        self.seen = set()
+        # file_path → (state, {vector_id: hash}, {変更された vector_id})
+        self.pending = {}
+        self.old_hashes = {}  # file_path → 今回の実行前の {vector_id: hash}
+        self.stats = {
+            "files_skipped": 0,
+            "files_changed": 0,
+            "chunks_embedded": 0,
+            "chunks_unchanged": 0,
+            "chunks_resumed": 0,
+            "vectors_deleted": 0,
+        }
+
+    def should_skip(self, file_path):
+        self.seen.add(file_path)
+        if self.full:
+            return False
+        unchanged, state = self.manifest.check_file(
+            self.namespace, file_path, self.options
+        )
+        if unchanged:
+            self.stats["files_skipped"] += 1
+            return True
+        self.pending[file_path] = (state, {}, set())
+        return False
+
+    def select_chunks(self, file_path, chunks):
+        if file_path not in self.pending:
+            # full モード（または事前確認していないファイル）: ここでハッシュを計算
+            stat = os.stat(file_path)
+            state = (stat.st_mtime, stat.st_size, file_sha256(file_path))
+            self.pending[file_path] = (state, {}, set())
+        state, hashes, changed = self.pending[file_path]
+        old = self.manifest.chunk_hashes(self.namespace, file_path)
+        self.old_hashes[file_path] = old
+        selected = []
+        for vector_id, chunk, metadata in chunks:
+            hashes[vector_id] = text_sha256(chunk)
+            if self.full or old.get(vector_id) != hashes[vector_id]:
+                changed.add(vector_id)
+                selected.append((vector_id, chunk, metadata))
+        self.stats["files_changed"] += 1
+        self.stats["chunks_unchanged"] += len(chunks) - len(selected)
+        return selected
+
+    # ---------------------------
+    # 同じジョブの以前の（中断した）実行で完了したファイル（ingest_job.py を参照）:
+    # 再抽出はしないが、その実行で確定した state と hashes で、
+    # 今回の実行のファイルと同様に finish() が記録する
+    # ---------------------------
+    def restore(self, file_path, state, hashes):
+        self.seen.add(file_path)
+        self.pending[file_path] = (state, hashes, set())
+        old = self.manifest.chunk_hashes(self.namespace, file_path)
+        self.old_hashes[file_path] = old
+        self.stats["files_changed"] += 1
+        self.stats["chunks_resumed"] += sum(
+            old.get(vid) != h for vid, h in hashes.items()
+        )
+
+    # ---------------------------
+    # 同じジョブの中断した実行が upsert 済みのチャンク（IngestJob.pending_chunks が
+    # 除外したもの）: 再埋め込みはせず、今回の実行で upsert したチャンクと同様に
+    # 新しいハッシュで記録する
+    # ---------------------------
+    def take_over(self, file_path, vector_ids):
+        self.pending[file_path][2].difference_update(vector_ids)
+        self.stats["chunks_resumed"] += len(vector_ids)
+
+    # チャンクの埋め込みと upsert を終えたファイルについて記録する (state, hashes)
+    # failed_ids: 埋め込みまたはアップサートに失敗したベクトルID
+    def file_record(self, file_path, failed_ids):
+        state, hashes, changed = self.pending[file_path]
+        old = self.old_hashes[file_path]
+        failed = changed & failed_ids
+        if failed:
+            # 失敗したチャンクは以前のハッシュを残し、次回再試行させる
+            hashes = {
+                vid: (old[vid] if vid in failed else h)
+                for vid, h in hashes.items()
+                if vid not in failed or vid in old
+            }
+            state = None
+        return state, hashes
+
+    # ---------------------------
+    # upserted_ids: upsert の成功がレポートされたベクトルID。埋め込み・upsert した
+    #               チャンクのうちここにないものは失敗扱い（ファイルは次回再処理）
+    #               → stats["chunks_embedded"] はこのうち今回の実行のチャンク数
+    # writer: 不要ベクトルの削除に使用
+    # ---------------------------
+    def finish(self, upserted_ids, writer):
+        for file_path in self.pending:
+            if file_path not in self.old_hashes:
+                continue  # 抽出が完了していないため次回あらためて処理
+            old = self.old_hashes[file_path]
+            changed = self.pending[file_path][2]
+            self.stats["chunks_embedded"] += len(changed & upserted_ids)
+            state, hashes = self.file_record(file_path, changed - upserted_ids)
+            orphans = set(old) - set(hashes)
+            if orphans:
+                if self._delete(writer, orphans):
+                    self.stats["vectors_deleted"] += len(orphans)
+                else:
+                    # 削除を次回再試行できるよう、不要ベクトルの記録を残す
+                    hashes.update({vid: old[vid] for vid in orphans})
+                    state = None
+            self.manifest.record_file(
+                self.namespace, file_path, state, hashes, self.options
+            )
+
+        for file_path in self.manifest.files(self.namespace):
+            if file_path in self.seen or not _is_under(file_path, self.root):
+                continue
+            if os.path.exists(file_path):
+                continue
+            ids = set(self.manifest.chunk_hashes(self.namespace, file_path))
+            if not ids or self._delete(writer, ids):
+                self.manifest.forget_file(self.namespace, file_path)
+                self.stats["vectors_deleted"] += len(ids)
+        return self.stats
+
+    def _delete(self, writer, ids):
+        reports = writer.delete(self.namespace, sorted(ids))
+        for report in reports:
+            if not report["ok"]:
+                print(f"[エラー] 削除失敗: {len(report['ids'])}件 → {report['error']}")
+        return all(report["ok"] for report in reports)
+
+
+# マニフェストに記録するチャンク分割オプション（未指定の値は除く）
+def options_fingerprint(options):
+    options = {k: v for k, v in (options or {}).items() if v is not None}
+    return json.dumps(options, sort_keys=True)
+
+
+def _is_under(path, root):
+    path = os.path.abspath(path)
+    root = os.path.abspath(root)
+    return os.path.commonpath([path, root]) == root
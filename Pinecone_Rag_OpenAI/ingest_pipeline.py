@@ -0,0 +1,446 @@
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from metrics import Metrics
+from rate_limiter import RateLimiter
+
+# ---------------------------
+# 並行取り込みパイプライン（抽出 → チャンク化 → 埋め込み → アップサート）
+# 抽出/チャンク化: プロセスプール（CPU負荷の高いPDF/DOCX解析）
+# 埋め込み/アップサート: ワーカースレッド（ネットワーク待ちのAPI呼び出し）
+# 各段は上限付きキューで接続 → 下流が遅いと上流が待機し（バックプレッシャー）、
+# チャンクがメモリに溜まり続けない
+# ---------------------------
+_STOP = object()  # ワーカースレッドに終了を伝える番兵
+
+# `metrics` で時間を計測するステージ（ヒストグラム "ingest_stage_seconds"、ラベル "stage"）
+# extract / chunk: ファイルごと（ワーカープロセス内）、embed: バッチごと（レート制限の
+# 待ち時間を含む）、upsert: バッチのリクエストごと（再試行を含む）
+STAGES = ("extract", "chunk", "embed", "upsert")
+
+# 1 つのファイルの抽出・チャンク分割に許す秒数（None / 0: 上限なし）
+DEFAULT_EXTRACT_TIMEOUT = 300
+
+
+# ファイルの抽出・チャンク分割が制限時間内に終わらなかった
+class ExtractionTimeout(Exception):
+    pass
+
+
+# タスク内でアラームにより送出。解析ライブラリの広い "except Exception" に
+# 握りつぶされないよう BaseException とする
+class _Interrupted(BaseException):
+    pass
+
+
+def _interrupt(signum, frame):
+    raise _Interrupted()
+
+
+# ---------------------------
+# ワーカープロセスで実行: chunk_fn は専用の Metrics に記録し、それをチャンクと
+# 一緒に返してパイプラインの Metrics に加算する
+# timeout: この秒数を過ぎるとタスクを SIGALRM で中断し、問題のある 1 つのファイルが
+# 実行の終わりまでワーカーを占有しないようにする
+# （POSIX のみ。setitimer のない環境、例えば Windows では制限なし）
+# ---------------------------
+def _chunk_with_metrics(chunk_fn, file_path, timeout=None):
+    metrics = Metrics()
+    limited = bool(timeout) and hasattr(signal, "setitimer")
+    if limited:
+        signal.signal(signal.SIGALRM, _interrupt)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        chunks = chunk_fn(file_path, metrics=metrics)
+    except _Interrupted:
+        raise ExtractionTimeout(f"{timeout} 秒以内に結果が出ませんでした") from None
+    finally:
+        if limited:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return chunks, metrics.snapshot()
+
+
+class IngestPipeline:
+    # ---------------------------
+    # chunk_fn: (file_path, metrics) → [(vector_id, chunk, metadata), ...]
+    #           （プロセスプールに渡せるようトップレベル関数にする。
+    #           抽出／チャンク分割の時間を metrics に記録する）
+    # batcher: EmbeddingBatcher（埋め込みワーカー間で共有）
+    # writer_factory: アップサートワーカーごとに PineconeUpsertWriter を1つ生成
+    # requests_per_minute / tokens_per_minute: 埋め込み呼び出しのグローバル制限
+    # sync: IncrementalSync（未変更のファイル・チャンクをスキップし、不要ベクトルを削除）
+    # extract_timeout: プロセスプールで 1 つのファイルに許す秒数（None / 0: 上限なし）
+    # job: IngestJob。完了したファイルと upsert したチャンクをその都度記録し、
+    #      失敗したチャンクをデッドレターとして残し、再開時は完了済みの作業を飛ばす
+    # metrics: ステージの時間とカウンターを記録する Metrics（STAGES を参照）
+    # ---------------------------
+    def __init__(
+        self,
+        chunk_fn,
+        batcher,
+        writer_factory,
+        namespace,
+        extract_workers=None,
+        embed_workers=4,
+        upsert_workers=2,
+        queue_size=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        progress_interval=5.0,
+        sync=None,
+        metrics=None,
+        extract_timeout=DEFAULT_EXTRACT_TIMEOUT,
+        job=None,
+    ):
+        self.chunk_fn = chunk_fn
+        self.batcher = batcher
+        self.writer_factory = writer_factory
+        self.namespace = namespace
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # 埋め込み待ちのバッチ / アップサート待ちのベクトル
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.upsert_queue = queue.Queue(maxsize=queue_size * 64)
+        # 取り込みルートからの相対パスを含むため、同名のファイルがあっても一意
+        self.sources = {}  # アップサートまで保持する vector_id → (chunk, metadata)
+        self.writers = []
+        self.progress_interval = progress_interval
+        self.sync = sync
+        self.sync_stats = None
+        self.metrics = metrics or Metrics()
+        self.extract_timeout = extract_timeout
+        self.job = job
+        self.outstanding = {}  # file_path → 未決着のベクトルID（_settle を参照）
+        self.file_failures = {}  # file_path → デッドレター化したベクトルID
+        self.counts = {
+            "files": 0,
+            "files_done": 0,
+            "chunks": 0,
+            "embedded": 0,
+            "files_resumed": 0,
+            "chunks_resumed": 0,
+            "dead_letters": 0,
+        }
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    # ---------------------------
+    # 指定ファイル群でパイプラインを実行し、アップサートライターを返す
+    # （バッチごとのレポートは呼び出し側で参照する）
+    # ---------------------------
+    def run(self, file_paths):
+        self.started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._embed_worker, daemon=True)
+            for _ in range(self.embed_workers)
+        ]
+        upsert_threads = []
+        for _ in range(self.upsert_workers):
+            writer = self.writer_factory()
+            self.writers.append(writer)
+            upsert_threads.append(
+                threading.Thread(
+                    target=self._upsert_worker, args=(writer,), daemon=True
+                )
+            )
+        progress = threading.Thread(target=self._progress_worker, daemon=True)
+        for thread in threads + upsert_threads + [progress]:
+            thread.start()
+
+        try:
+            for batch in self.batcher.iter_batches(self._extracted_items(file_paths)):
+                self.embed_queue.put(batch)  # 埋め込みワーカーが追いつくまで待機
+        finally:
+            for _ in threads:
+                self.embed_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+            for _ in upsert_threads:
+                self.upsert_queue.put(_STOP)
+            for thread in upsert_threads:
+                thread.join()
+            self.done.set()
+            progress.join()
+        if self.sync and self.writers:
+            self.sync_stats = self.sync.finish(self._upserted_ids(), self.writers[0])
+        self._record_totals()
+        return self.writers
+
+    # アップサートのリクエスト時間と実行全体のカウンター（全ワーカーの終了後）
+    def _record_totals(self):
+        for writer in self.writers:
+            for report in writer.reports:
+                self.metrics.observe(
+                    "ingest_stage_seconds", report["seconds"], stage="upsert"
+                )
+                if report["ok"]:
+                    self.metrics.inc("upserted_vectors_total", len(report["ids"]))
+                    self.metrics.inc("upserted_bytes_total", report["bytes"])
+        self.metrics.inc("ingest_files_total", self.counts["files_done"])
+        self.metrics.inc("ingest_chunks_total", self.counts["chunks"])
+        self.metrics.inc("ingest_files_resumed_total", self.counts["files_resumed"])
+        self.metrics.inc("ingest_chunks_resumed_total", self.counts["chunks_resumed"])
+        self.metrics.inc("dead_letters_total", self.counts["dead_letters"])
+        stats = self.batcher.stats
+        self.metrics.inc("embedding_requests_total", stats["requests"])
+        self.metrics.inc("embedding_tokens_total", stats["tokens"])
+        self.metrics.inc("embedding_cache_hits_total", stats["cached"])
+        self.metrics.inc("embedding_inputs_total", stats["inputs"])
+        self.metrics.inc("rate_limit_wait_seconds_total", self.limiter.waited_seconds)
+
+    # 今回の実行で upsert の成功がレポートされたベクトルID
+    def _upserted_ids(self):
+        return {
+            vector_id
+            for writer in self.writers
+            for report in writer.reports
+            if report["ok"]
+            for vector_id in report["ids"]
+        }
+
+    # ---------------------------
+    # プロセスプールで抽出・チャンク化し、完了順に (vector_id, chunk) を返す
+    # 同時処理は最大 2 × extract_workers ファイルまでとし、抽出が先行しすぎないようにする
+    # ---------------------------
+    def _extracted_items(self, file_paths):
+        file_paths = iter(file_paths)
+        max_in_flight = self.extract_workers * 2
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+            in_flight = set()
+            submitted = {}  # future → file_path
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    file_path = next(file_paths, None)
+                    if file_path is None:
+                        exhausted = True
+                        break
+                    if self.job and self._resume_file(file_path):
+                        continue
+                    if self.sync and self.sync.should_skip(file_path):
+                        continue
+                    print(f"[処理開始] {file_path}")
+                    future = pool.submit(
+                        _chunk_with_metrics,
+                        self.chunk_fn,
+                        file_path,
+                        self.extract_timeout,
+                    )
+                    submitted[future] = file_path
+                    in_flight.add(future)
+                    with self.lock:
+                        self.counts["files"] += 1
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    file_path = submitted.pop(future)
+                    try:
+                        chunks, snapshot = future.result()
+                    except ExtractionTimeout as e:
+                        # マニフェストに記録しない → 次回の実行で再試行
+                        print(f"[エラー] 抽出がタイムアウト: {file_path} → {e}")
+                        self.metrics.inc("extract_timeouts_total")
+                        self._fail_file(file_path, e)
+                        chunks = []
+                    except Exception as e:
+                        print(f"[エラー] テキスト抽出失敗: {file_path} → {e}")
+                        self._fail_file(file_path, e)
+                        chunks = []
+                    else:
+                        self.metrics.merge(snapshot)
+                        if self.sync:
+                            chunks = self.sync.select_chunks(file_path, chunks)
+                        chunks = self._track_file(file_path, chunks)
+                    with self.lock:
+                        self.counts["files_done"] += 1
+                        self.counts["chunks"] += len(chunks)
+                    for vector_id, chunk, metadata in chunks:
+                        self.sources[vector_id] = (chunk, metadata)
+                        yield vector_id, chunk
+
+    # ---------------------------
+    # 埋め込みワーカー: バッチ取得 → 埋め込み（レート制限待ちを含む） → アップサート待ちへ
+    # ---------------------------
+    def _embed_worker(self):
+        while True:
+            batch = self.embed_queue.get()
+            if batch is _STOP:
+                return
+            try:
+                self._embed(batch)
+            except Exception as e:
+                # ワーカーを止めない（止まるとキューが詰まり実行が終わらない）
+                print(f"[エラー] 埋め込みバッチ（{len(batch)}件）の処理中に失敗: {e}")
+                with self.batcher.lock:
+                    for vector_id, _ in batch:
+                        self.batcher.failed.setdefault(vector_id, str(e))
+                self._dead_letter_failed(batch)
+
+    # アップサート待ちへの投入は最後に行う: それより前で失敗してもバッチ全体が
+    # 未送信のままなので、ワーカーがまとめてデッドレターにする
+    def _embed(self, batch):
+        with self.metrics.timer("ingest_stage_seconds", stage="embed"):
+            results = self.batcher.embed_batch(batch, self.limiter)
+        with self.lock:
+            self.counts["embedded"] += len(results)
+        self._dead_letter_failed(batch)
+        for vector_id, embedding in results:
+            self.upsert_queue.put((vector_id, embedding))
+
+    # batcher.failed に記録されたバッチ内のチャンクをデッドレターにする
+    def _dead_letter_failed(self, batch):
+        for vector_id, _ in batch:
+            if vector_id in self.batcher.failed:
+                source = self.sources.pop(vector_id, None)
+                if source:
+                    self._dead_letter(
+                        vector_id, *source, "embed", self.batcher.failed[vector_id]
+                    )
+
+    # ---------------------------
+    # アップサートワーカー: 自身のライターにベクトルをバッファ（バッチ送信）
+    # ジョブがある場合、各バッチのレポートは writer が送信した時点で処理する
+    # ---------------------------
+    def _upsert_worker(self, writer):
+        inflight = {}  # vector_id → (chunk, metadata)（バッチがレポートされるまで）
+        reported = 0  # 処理済みの writer.reports の数
+        while True:
+            item = self.upsert_queue.get()
+            if item is _STOP:
+                writer.close()
+                self._settle_reports(writer.reports[reported:], inflight)
+                return
+            vector_id, embedding = item
+            # 失敗してもワーカーを止めない（止まるとキューが詰まり実行が終わらない）
+            source = None
+            try:
+                source = chunk, metadata = self.sources.pop(vector_id)
+                if self.job:
+                    inflight[vector_id] = source
+                writer.add(
+                    self.namespace, vector_id, embedding, dict(metadata, text=chunk)
+                )
+                if len(writer.reports) > reported:
+                    self._settle_reports(writer.reports[reported:], inflight)
+                    reported = len(writer.reports)
+            except Exception as e:
+                print(f"[エラー] {vector_id} の処理中に失敗: {e}")
+                if source and inflight.pop(vector_id, None):
+                    self._dead_letter(vector_id, *source, "upsert", e)
+
+    # ---------------------------
+    # ジョブのチェックポイント
+    # 各ファイルは全チャンクが upsert またはデッドレター化されるまで追跡し、
+    # その後ジョブが完了として記録する（sync が書くはずのマニフェスト記録も残し、
+    # 再開した実行が sync.restore() に引き継げるようにする）
+    # ---------------------------
+    def _resume_file(self, file_path):
+        record = self.job.finished_file(file_path)
+        if record is None or (self.sync and record[1] is None):
+            return False  # 未完了、その後に変更、またはマニフェストなしで完了
+        if self.sync:
+            self.sync.restore(file_path, *record)
+        with self.lock:
+            self.counts["files_resumed"] += 1
+        return True
+
+    # 抽出したファイルのうちまだ埋め込むチャンク（再開したジョブは upsert 済みの
+    # チャンクを除き、sync はそれらを引き継いだものとして記録する）
+    def _track_file(self, file_path, chunks):
+        if self.job is None:
+            return chunks
+        selected = self.job.pending_chunks(file_path, chunks)
+        pending = {vector_id for vector_id, _, _ in selected}
+        if self.sync:
+            self.sync.take_over(
+                file_path,
+                {vector_id for vector_id, _, _ in chunks if vector_id not in pending},
+            )
+        with self.lock:
+            self.counts["chunks_resumed"] += len(chunks) - len(selected)
+            self.outstanding[file_path] = pending
+        if not selected:
+            self._complete_file(file_path)
+        return selected
+
+    def _fail_file(self, file_path, error):
+        if self.job:
+            self.job.fail_file(file_path, error)
+
+    def _settle(self, vector_id, file_path, failed=False):
+        with self.lock:
+            waiting = self.outstanding.get(file_path)
+            if waiting is None:
+                return
+            waiting.discard(vector_id)
+            if failed:
+                self.file_failures.setdefault(file_path, set()).add(vector_id)
+            if waiting:
+                return
+            del self.outstanding[file_path]
+            failures = self.file_failures.pop(file_path, set())
+        self._complete_file(file_path, failures)
+
+    def _complete_file(self, file_path, failures=frozenset()):
+        state = hashes = None
+        if self.sync:
+            state, hashes = self.sync.file_record(file_path, failures)
+        self.job.complete_file(file_path, state, hashes)
+
+    # 1 つの writer の upsert レポート: 送信したベクトルはチェックポイントに記録し、
+    # 失敗したリクエストのベクトルはデッドレターにする（IngestJob.settle_reports を参照）
+    def _settle_reports(self, reports, inflight):
+        if self.job is None:
+            return
+        for vector_id, metadata, ok in self.job.settle_reports(reports, inflight):
+            if not ok:
+                with self.lock:
+                    self.counts["dead_letters"] += 1
+            self._settle(vector_id, metadata["source"], failed=not ok)
+
+    # 埋め込みまたは upsert に失敗したチャンク: ジョブのデッドレターキューに残す
+    def _dead_letter(self, vector_id, chunk, metadata, stage, error):
+        if self.job is None:
+            return
+        with self.lock:
+            self.counts["dead_letters"] += 1
+        self.job.dead_letter(
+            vector_id, metadata["source"], chunk, metadata, stage, error
+        )
+        self._settle(vector_id, metadata["source"], failed=True)
+
+    # ---------------------------
+    # 定期的な進捗表示
+    # キューが上限に張り付いている段やレート制限の待機時間からバックプレッシャーの発生箇所がわかる
+    # ---------------------------
+    def _progress_worker(self):
+        while not self.done.wait(self.progress_interval):
+            print(f"[進捗] {self.progress()}")
+        print(f"[進捗] {self.progress()}")
+
+    def progress(self):
+        with self.lock:
+            counts = dict(self.counts)
+        upserted = sum(
+            len(report["ids"])
+            for writer in self.writers
+            for report in list(writer.reports)
+            if report["ok"]
+        )
+        elapsed = time.perf_counter() - self.started
+        rate = counts["embedded"] / elapsed if elapsed else 0.0
+        return (
+            f"ファイル {counts['files_done']}/{counts['files']}、"
+            f"チャンク {counts['chunks']}、埋め込み {counts['embedded']}（{rate:.1f}/秒）、"
+            f"アップサート {upserted}、"
+            f"埋め込みキュー {self.embed_queue.qsize()}/{self.embed_queue.maxsize}、"
+            f"アップサートキュー {self.upsert_queue.qsize()}/{self.upsert_queue.maxsize}、"
+            f"レート制限待ち {self.limiter.waited_seconds:.1f}秒"
+        )
@@ -0,0 +1,488 @@
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from urllib.parse import quote
+
+import numpy as np
+
+# ---------------------------
+# ローカル BM25 転置索引（ベクトルストアと並ぶキーワード検索）
+# 取り込み時に、ベクトル化するのと同じチャンク（と同じベクトルID）から作成する
+# → 型番・部品番号・エラーメッセージのような完全一致の文字列も、
+#   ベクトル類似度で拾えない場合に見つかる（キーワード検索はベクトル化の呼び出し不要）
+# `directory` 配下に Namespace ごとに SQLite ファイル1つ：
+#   docs:     文書番号 → ベクトルID、トークン数、メタデータ（JSON、本文を含む）
+#   postings: 語 → セグメントごとの圧縮ポスティングリスト
+#             （文書番号は差分を収まる最小の符号なし整数型で、
+#             出現頻度は uint8 で保存）
+# 書き込みごとにセグメントが1つ増える。置き換え・削除された文書は、
+# セグメントのマージ時にポスティングから除かれる（compact、取り込みの最後に実行）
+# ---------------------------
+DEFAULT_LEXICAL_INDEX_DIR = ".lexical_index"
+DEFAULT_RRF_K = 60  # Reciprocal Rank Fusion の定数
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    docs BLOB NOT NULL,
+    tfs BLOB NOT NULL,
+    PRIMARY KEY (term, segment)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+_SQL_BATCH = 500  # "IN (...)" 1回あたりのパラメーター数
+
+# ---------------------------
+# トークナイザー（先に NFKC 正規化と小文字化を行うため、
+# 全角英数字も ASCII と一致する）
+# 英数字: 英数字の連続。"-"・"_"・"."・"/"・":" でつながる場合は
+#        全体も1トークンにする（"xj-200a" → "xj-200a", "xj", "200a"）
+#        → 型番が完全一致でも部分でも一致する
+# 日本語・中国語: かな・漢字の連続を文字 bigram に分割
+#        （"圧力センサー" → "圧力", "力セ", "セン", "ンサ", "サー"。1文字だけの場合はそのまま）
+# ---------------------------
+_CJK = "\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN = re.compile(rf"([{_CJK}]+)|([^\W_{_CJK}]+(?:[-_./:][^\W_{_CJK}]+)*)")
+_JOINERS = re.compile(r"[-_./:]")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for cjk, word in _TOKEN.findall(text):
+        if word:
+            tokens.append(word)
+            if not word.isalnum():
+                tokens.extend(_JOINERS.split(word))
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i : i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+# ---------------------------
+# ポスティングリストの符号化：（先頭の文書、整数幅、差分、出現頻度）
+# ---------------------------
+def _encode(docs, tfs):
+    deltas = np.diff(docs)
+    top = int(deltas.max()) if len(deltas) else 0
+    width = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4
+    return (
+        int(docs[0]),
+        width,
+        deltas.astype(f"<u{width}").tobytes(),
+        np.minimum(tfs, 255).astype(np.uint8).tobytes(),
+    )
+
+
+def _decode(first, width, docs, tfs):
+    deltas = np.frombuffer(docs, dtype=f"<u{width}")
+    decoded = np.empty(len(deltas) + 1, dtype=np.int64)
+    decoded[0] = first
+    np.cumsum(deltas, out=decoded[1:])
+    decoded[1:] += first
+    return decoded, np.frombuffer(tfs, dtype=np.uint8)
+
+
+class LexicalIndex:
+    def __init__(self, directory=DEFAULT_LEXICAL_INDEX_DIR):
+        self.directory = directory
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def namespace(self, namespace):
+        with self.lock:
+            if namespace not in self.namespaces:
+                # 既定の Namespace "" は "_" として保存（ローカルストアと同じ）
+                path = os.path.join(self.directory, quote(namespace or "_", safe=""))
+                self.namespaces[namespace] = LexicalNamespace(path)
+            return self.namespaces[namespace]
+
+    def search(self, text, top_k=5, namespace="", include_metadata=True):
+        return self.namespace(namespace).search(text, top_k, include_metadata)
+
+    def upsert(self, namespace, docs):
+        self.namespace(namespace).upsert(docs)
+
+    def delete(self, namespace, ids):
+        self.namespace(namespace).delete(ids)
+
+    def compact(self, namespace):
+        return self.namespace(namespace).compact()
+
+    def clear(self, namespace):
+        self.namespace(namespace).clear()
+
+    def count(self, namespace):
+        return self.namespace(namespace).count()
+
+    # ベクトルストアの writer を包み、書き込まれたベクトルをすべて索引にも追加する
+    def writer(self, writer):
+        return LexicalIndexWriter(self, writer)
+
+    def close(self):
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.close()
+            self.namespaces.clear()
+
+
+class LexicalNamespace:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(path, "lexical.sqlite3"), timeout=30, check_same_thread=False
+        )
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.version = None
+        self.lengths = np.zeros(0, dtype=np.int32)  # document → tokens (-1: none)
+        self.live = 0
+        self.avgdl = 0.0
+        self._refresh()
+
+    # ---------------------------
+    # 別の接続が変更をコミットした後に文書長を読み直す
+    # （例：アプリの稼働中に取り込みを実行した場合。LocalNamespace._refresh を参照）
+    # ---------------------------
+    def _refresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return
+        self.version = version
+        row = self.conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'docs'"
+        ).fetchone()
+        lengths = np.full((row[0] if row else 0) + 1, -1, dtype=np.int32)
+        found = np.asarray(
+            self.conn.execute("SELECT doc, length FROM docs").fetchall(), dtype=np.int64
+        ).reshape(-1, 2)
+        lengths[found[:, 0]] = found[:, 1]
+        self.lengths = lengths
+        self.live = len(found)
+        self.avgdl = float(found[:, 1].mean()) if len(found) else 0.0
+
+    # まだ存在する文書（前回の読み直し以降に書かれた番号は存在しない扱い）
+    def _live(self, docs):
+        live = docs < len(self.lengths)
+        live[live] = self.lengths[docs[live]] >= 0
+        return live
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return self.live
+
+    # ---------------------------
+    # 文書を追加または置き換え：[(vector_id, metadata), ...]
+    # 索引に入るのは metadata["text"]。検索結果には metadata 全体を返す
+    # 置き換えた文書には新しい番号を振り、古いポスティングは以後無視する
+    # ---------------------------
+    def upsert(self, docs):
+        latest = dict(docs)  # 1バッチ内で同じIDが複数ある場合は最後のものを採用
+        if not latest:
+            return
+        with self.lock:
+            self._delete(list(latest))
+            row = self.conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'docs'"
+            ).fetchone()
+            first = (row[0] if row else 0) + 1
+            rows = []
+            postings = {}  # term → ([doc, ...], [tf, ...])
+            for doc, (vector_id, metadata) in enumerate(latest.items(), start=first):
+                tokens = tokenize(metadata.get("text") or "")
+                rows.append(
+                    (
+                        doc,
+                        vector_id,
+                        len(tokens),
+                        json.dumps(metadata, ensure_ascii=False),
+                    )
+                )
+                for term, tf in Counter(tokens).items():
+                    entry = postings.setdefault(term, ([], []))
+                    entry[0].append(doc)
+                    entry[1].append(tf)
+            self.conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+            segment = self._next_segment()
+            self.conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (term, segment) + _encode(np.asarray(docs), np.asarray(tfs))
+                    for term, (docs, tfs) in postings.items()
+                ],
+            )
+            self.conn.commit()
+            self.version = None  # 自身のコミットでは data_version が変わらない
+
+    def delete(self, ids):
+        with self.lock:
+            self._delete(list(ids))
+            self.conn.commit()
+            self.version = None
+
+    def _delete(self, ids):
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start : start + _SQL_BATCH]
+            self.conn.execute(
+                f"DELETE FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch
+            )
+
+    # 前回のマージ以降に書かれたセグメント（マージ済みのものはセグメント0）
+    def _next_segment(self):
+        row = self.conn.execute(
+            "SELECT value FROM info WHERE key = 'segments'"
+        ).fetchone()
+        segment = (row[0] if row else 0) + 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO info VALUES ('segments', ?)", (segment,)
+        )
+        return segment
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM docs")
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM info")
+            self.conn.commit()
+            self.version = None
+
+    # ---------------------------
+    # 各語のセグメントを1つにマージし、置き換え・削除された文書を除く
+    # 残った語の数を返す
+    # ---------------------------
+    def compact(self):
+        with self.lock:
+            return self._compact()
+
+    def _compact(self):
+        self._refresh()
+        terms = [
+            term for (term,) in self.conn.execute("SELECT DISTINCT term FROM postings")
+        ]
+        kept = 0
+        for term in terms:
+            docs, tfs = self._postings(term)
+            live = self._live(docs)
+            self.conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+            if live.any():
+                self.conn.execute(
+                    "INSERT INTO postings VALUES (?, 0, ?, ?, ?, ?)",
+                    (term,) + _encode(docs[live], tfs[live]),
+                )
+                kept += 1
+        self.conn.execute("INSERT OR REPLACE INTO info VALUES ('segments', 0)")
+        self.conn.commit()
+        self.version = None
+        return kept
+
+    # 全セグメントを通した語のポスティングリスト（文書番号の昇順）
+    def _postings(self, term):
+        rows = self.conn.execute(
+            "SELECT first, width, docs, tfs FROM postings WHERE term = ? "
+            "ORDER BY segment",
+            (term,),
+        ).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        decoded = [_decode(*row) for row in rows]
+        return (
+            np.concatenate([docs for docs, _ in decoded]),
+            np.concatenate([tfs for _, tfs in decoded]),
+        )
+
+    # ---------------------------
+    # BM25 で上位 k 件の文書 → [{"id", "score", "metadata"}]（ベクトル検索と同じ形）
+    # ポスティングリストは numpy で復号するため、1回の検索は数ミリ秒
+    # ---------------------------
+    def search(self, text, top_k=5, include_metadata=True):
+        terms = Counter(tokenize(text))
+        with self.lock:
+            self._refresh()
+            if not terms or not self.live:
+                return []
+            found_docs = []
+            found_scores = []
+            for term, query_tf in terms.items():
+                docs, tfs = self._postings(term)
+                live = self._live(docs)
+                if not live.any():
+                    continue
+                docs, tfs = docs[live], tfs[live].astype(np.float32)
+                lengths = self.lengths[docs]
+                df = len(docs)
+                idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self.avgdl or 1))
+                found_docs.append(docs)
+                found_scores.append(query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+            if not found_docs:
+                return []
+            docs, inverse = np.unique(np.concatenate(found_docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(found_scores))
+            k = min(top_k, len(docs))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            found = {}
+            numbers = docs[top].tolist()
+            for start in range(0, len(numbers), _SQL_BATCH):
+                batch = numbers[start : start + _SQL_BATCH]
+                found.update(
+                    (doc, (vector_id, metadata))
+                    for doc, vector_id, metadata in self.conn.execute(
+                        "SELECT doc, id, metadata FROM docs "
+                        f"WHERE doc IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+        # 読み直し以降に別プロセスが削除した文書は除く
+        return [
+            {
+                "id": found[doc][0],
+                "score": float(score),
+                "metadata": json.loads(found[doc][1]) if include_metadata else {},
+            }
+            for doc, score in zip(numbers, scores[top].tolist())
+            if doc in found
+        ]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------
+# 各ベクトルの metadata["text"] を索引にも追加するベクトルストア writer
+# （包んだ writer と同じインターフェースと reports。文書は max_batch_docs 件ずつ
+# 索引に追加し、削除は両方に適用する）
+# ---------------------------
+class LexicalIndexWriter:
+    def __init__(self, index, writer, max_batch_docs=1000):
+        self.index = index
+        self.writer = writer
+        self.max_batch_docs = max_batch_docs
+        self.buffers = {}  # namespace → [(vector_id, metadata), ...]
+        self.reports = writer.reports
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        self.writer.add(namespace, vector_id, values, metadata)
+        self.buffers.setdefault(namespace, []).append((vector_id, metadata or {}))
+        if len(self.buffers[namespace]) >= self.max_batch_docs:
+            self._index(namespace)
+
+    def flush(self, namespace=None):
+        self._index(namespace)
+        self.writer.flush(namespace)
+
+    def _index(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            docs = self.buffers.pop(ns, [])
+            if docs:
+                self.index.upsert(ns, docs)
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        self.index.delete(namespace, ids)
+        return self.writer.delete(namespace, ids, batch_size)
+
+    def close(self):
+        self._index()
+        return self.writer.close()
+
+    def summary(self):
+        return self.writer.summary()
+
+
+# ---------------------------
+# 複数の検索結果の Reciprocal Rank Fusion（例：ベクトルとキーワード）
+# score = 結果が現れるリストでの Σ 1 / (k + 順位)（順位は1から）
+# 結果は (namespace, id) で識別し、最初のリストの内容を残す
+# ---------------------------
+def fuse(result_lists, top_k=5, k=DEFAULT_RRF_K):
+    fused = {}
+    for matches in result_lists:
+        for rank, match in enumerate(matches, start=1):
+            key = (match.get("namespace"), match["id"])
+            if key not in fused:
+                fused[key] = dict(match, score=0.0)
+            fused[key]["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda m: m["score"], reverse=True)[:top_k]
+
+
+# ---------------------------
+# キーワード索引を作成（ディレクトリが空なら無効 → None）
+# ---------------------------
+def open_lexical_index(directory=DEFAULT_LEXICAL_INDEX_DIR):
+    if not directory:
+        return None
+    return LexicalIndex(directory)
+
+
+# ---------------------------
+# コマンドラインからの完全一致検索（ベクトル化の呼び出しなし、ネットワーク不要）
+# 使い方: python lexical_index.py <namespace> "<query>" [--top-k 5]
+#         python lexical_index.py <namespace> --compact
+# ---------------------------
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="ローカル BM25 索引を検索")
+    parser.add_argument("namespace", help="検索する Namespace")
+    parser.add_argument("query", nargs="?", help="検索文字列（例：部品番号）")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="ポスティングリストのセグメントをマージする",
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR),
+        help="キーワード索引のディレクトリ（既定: LEXICAL_INDEX_DIR）",
+    )
+    args = parser.parse_args()
+
+    index = LexicalIndex(args.index_dir)
+    if args.compact:
+        terms = index.compact(args.namespace)
+        print(f"[キーワード索引] {args.namespace}: マージ後 {terms} 語")
+    if args.query:
+        started = time.perf_counter()
+        matches = index.search(args.query, args.top_k, args.namespace)
+        elapsed = time.perf_counter() - started
+        for match in matches:
+            text = " ".join(match["metadata"].get("text", "").split())
+            print(f"{match['score']:.3f}  {match['id']}  {text[:100]}")
+        print(f"[キーワード索引] {len(matches)} 件（{elapsed * 1000:.1f} ms）")
+    index.close()
@@ -0,0 +1,200 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import PINECONE, Scheduler
+
+# ---------------------------
+# Pinecone への一括アップサート（REST /vectors/upsert）
+# ベクトルを namespace ごとにバッファし、接続プール付きの Session でバッチ送信
+# → ベクトルごとに接続を張らず、keep-alive 接続を再利用する
+# ---------------------------
+DEFAULT_MAX_BATCH_VECTORS = 100  # 1回のアップサートで推奨されるベクトル数の上限
+DEFAULT_MAX_BATCH_BYTES = 2 * 1024 * 1024  # Pinecone のリクエストサイズ上限（2MB）
+
+# リクエスト本文のうちベクトル以外の固定JSONオーバーヘッド
+# ({"vectors": [...], "namespace": "..."})
+_REQUEST_OVERHEAD_BYTES = 64
+
+
+# ---------------------------
+# 接続プール付き Session の生成（keep-alive 接続を共有）
+# ---------------------------
+def build_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ---------------------------
+# アップサートライター
+# add(): ベクトルを1件バッファ（件数またはバイト数の上限に達すると自動送信）
+# close(): 残りをすべて送信し、バッチごとのレポート一覧を返す
+# 各レポート: namespace / ベクトル数 / バイト数 / 試行回数 / 成否 / エラー /
+# 秒数（再試行を含む）
+# scheduler: プロセス内の他の OpenAI / Pinecone 呼び出しと共有する Scheduler
+#   （レート制限、バックオフ付きの再試行、サーキットブレーカー）。既定では
+#   max_retries / backoff を使う専用のスケジューラ
+# ---------------------------
+class PineconeUpsertWriter:
+    def __init__(
+        self,
+        api_key,
+        url,
+        max_batch_vectors=DEFAULT_MAX_BATCH_VECTORS,
+        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+        max_retries=5,
+        backoff=0.5,
+        timeout=30,
+        session=None,
+        scheduler=None,
+    ):
+        self.api_key = api_key
+        self.url = f"{url}/vectors/upsert"
+        self.delete_url = f"{url}/vectors/delete"
+        self.max_batch_vectors = max_batch_vectors
+        self.max_batch_bytes = max_batch_bytes
+        self.scheduler = scheduler or Scheduler(
+            max_retries=max_retries, backoff=backoff
+        )
+        self.timeout = timeout
+        self.session = session or build_session()
+        self.buffers = {}  # namespace → [(ベクトル, エンコード後サイズ), ...]
+        self.buffer_bytes = {}  # namespace → バッファ中の合計バイト数
+        self.reports = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------------------
+    # namespace のバッファにベクトルを1件追加
+    # ---------------------------
+    def add(self, namespace, vector_id, values, metadata=None):
+        vector = {"id": vector_id, "values": values}
+        if metadata:
+            vector["metadata"] = metadata
+        size = len(json.dumps(vector, ensure_ascii=False).encode("utf-8")) + 1
+        limit = self.max_batch_bytes - _REQUEST_OVERHEAD_BYTES - len(namespace)
+        if self.buffer_bytes.get(namespace, 0) + size > limit:
+            self.flush(namespace)
+        self.buffers.setdefault(namespace, []).append((vector, size))
+        self.buffer_bytes[namespace] = self.buffer_bytes.get(namespace, 0) + size
+        if len(self.buffers[namespace]) >= self.max_batch_vectors:
+            self.flush(namespace)
+
+    # ---------------------------
+    # バッファ中のベクトルを送信（namespace 省略時は全namespace）
+    # ---------------------------
+    def flush(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            entries = self.buffers.pop(ns, [])
+            batch_bytes = self.buffer_bytes.pop(ns, 0)
+            if entries:
+                vectors = [vector for vector, _ in entries]
+                self.reports.append(self._send(ns, vectors, batch_bytes))
+
+    # ---------------------------
+    # 1バッチを送信（429/5xx・接続エラーは指数バックオフで再試行）
+    # サーバーの Retry-After ヘッダーがあれば計算した待機時間より優先する
+    # ---------------------------
+    def _send(self, namespace, vectors, batch_bytes):
+        data = {"vectors": vectors, "namespace": namespace}
+        report = {
+            "namespace": namespace,
+            "ids": [vector["id"] for vector in vectors],
+            "bytes": batch_bytes,
+            "attempts": 0,
+            "ok": False,
+            "error": None,
+        }
+        return self._post(self.url, data, report)
+
+    # ---------------------------
+    # IDを指定してベクトルを削除（batch_size 件ずつ送信）
+    # アップサートと同じ形式のレポートを返す（self.reports には含めない）
+    # ---------------------------
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        reports = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            report = {
+                "namespace": namespace,
+                "ids": batch,
+                "bytes": 0,
+                "attempts": 0,
+                "ok": False,
+                "error": None,
+            }
+            data = {"ids": batch, "namespace": namespace}
+            reports.append(self._post(self.delete_url, data, report))
+        return reports
+
+    # ---------------------------
+    # 再試行付きで POST し、レポート（試行回数 / 成否 / エラー / 秒数）を埋める
+    # 再試行後も失敗したバッチ（または開いたサーキットで拒否されたバッチ）は
+    # 例外を送出せず失敗として報告する
+    # ---------------------------
+    def _post(self, url, data, report):
+        started = time.perf_counter()
+        try:
+            return self._post_attempts(url, data, report)
+        finally:
+            report["seconds"] = time.perf_counter() - started
+
+    def _post_attempts(self, url, data, report):
+        headers = {"Api-Key": self.api_key, "Content-Type": "application/json"}
+
+        def send():
+            report["attempts"] += 1
+            response = self.session.post(
+                url, headers=headers, json=data, timeout=self.timeout
+            )
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                raise requests.HTTPError(error, response=response)
+
+        try:
+            self.scheduler.call(PINECONE, send)
+        except Exception as e:
+            report["error"] = str(e)
+            return report
+        report["ok"] = True
+        report["error"] = None
+        return report
+
+    # ---------------------------
+    # 残りのベクトルを送信し、全バッチのレポートを返す
+    # ---------------------------
+    def close(self):
+        self.flush()
+        return self.reports
+
+    # ---------------------------
+    # バッチレポートの集計（成功・失敗したベクトル数とバッチ数）
+    # ---------------------------
+    def summary(self):
+        return summarize_reports(self.reports)
+
+
+# ---------------------------
+# バッチレポートのリストを集計（ローカルベクトルストアのライターと共用）
+# ---------------------------
+def summarize_reports(reports):
+    ok = [r for r in reports if r["ok"]]
+    failed = [r for r in reports if not r["ok"]]
+    return {
+        "batches_ok": len(ok),
+        "batches_failed": len(failed),
+        "vectors_ok": sum(len(r["ids"]) for r in ok),
+        "vectors_failed": sum(len(r["ids"]) for r in failed),
+        "bytes": sum(r["bytes"] for r in reports),
+        "retries": sum(max(r["attempts"] - 1, 0) for r in reports),
+    }
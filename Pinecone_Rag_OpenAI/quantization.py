@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from ann_index import MAX_SAMPLE, kmeans, nearest
+
+# ---------------------------
+# ベクトル量子化: 保存する埋め込みの圧縮コード
+# int8: 次元ごとに符号付き1バイト、次元ごとにスケール（float32 の 1/4）
+# pq:   直積量子化。ベクトルを `subspaces` 個に分割し、各部分を
+#       256個のセントロイドのうち最も近いものの番号に置き換える（1部分1バイト）
+#       → text-embedding-3-small（1536次元）を96分割: 6KB の代わりに 96バイト
+# コードからのスコアは近似値。ローカルストアは上位 top_k × rerank 件の候補を
+# float のベクトルで再採点する（LocalNamespace.query 参照）
+# ---------------------------
+KINDS = ("int8", "pq")
+DEFAULT_RERANK = 10  # 結果1件あたり float のベクトルで再採点する候補数
+PQ_CENTROIDS = 256
+PQ_SAMPLE = 20000  # コードブックの学習ベクトル数（セントロイドあたり約80）
+_BLOCK = 65536  # ブロックあたりの符号化行数（一時配列の大きさを抑える）
+_SCORE_BLOCK = 2048  # ブロックあたりの採点行数（一時配列が CPU キャッシュに収まる）
+
+
+def _blocks(codes, score, size=_SCORE_BLOCK):
+    if not len(codes):
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(
+        [score(codes[start : start + size]) for start in range(0, len(codes), size)]
+    )
+
+
+# ---------------------------
+# int8: コード = round(値 / scale)、scale = その次元の |値| の最大 / 127
+# ---------------------------
+class Int8Quantizer:
+    kind = "int8"
+    dtype = np.int8
+
+    def __init__(self, scale=None):
+        self.scale = scale
+
+    def train(self, vectors):
+        high = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0)
+        self.scale = np.where(high > 0, high / 127, 1).astype(np.float32)
+        return self
+
+    @property
+    def code_size(self):
+        return len(self.scale)
+
+    def encode(self, vectors):
+        # 学習時の範囲を超える値（後から追加したベクトル）は切り詰める
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    # クエリとの近似内積: コード · (クエリ × scale)
+    def score(self, codes, query):
+        weights = (np.asarray(query, dtype=np.float32) * self.scale).astype(np.float32)
+        return _blocks(codes, lambda block: block.astype(np.float32) @ weights)
+
+    def state(self):
+        return {"scale": self.scale}
+
+
+# ---------------------------
+# 直積量子化
+# スコアは部分ごとに表から引く: table[部分, コード] = セントロイド · クエリの部分
+# ---------------------------
+class PQQuantizer:
+    kind = "pq"
+    dtype = np.uint8
+
+    def __init__(self, subspaces=None, codebooks=None):
+        self.codebooks = codebooks  # (subspaces, 256, dim / subspaces)
+        self.subspaces = len(codebooks) if codebooks is not None else subspaces
+
+    def train(self, vectors, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        self.subspaces = self.subspaces or default_subspaces(dim)
+        if dim % self.subspaces:
+            raise ValueError(
+                f"次元数 {dim} は {self.subspaces} 分割で割り切れません"
+            )
+        k = min(PQ_CENTROIDS, len(vectors))
+        self.codebooks = np.stack(
+            [
+                kmeans(part, k, seed=seed, spherical=False)
+                for part in self._parts(vectors)
+            ]
+        )
+        return self
+
+    @property
+    def code_size(self):
+        return self.subspaces
+
+    def _parts(self, vectors):
+        return np.split(vectors, self.subspaces, axis=1)
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return np.stack(
+            [
+                nearest(part, book, spherical=False)
+                for part, book in zip(self._parts(vectors), self.codebooks)
+            ],
+            axis=1,
+        ).astype(np.uint8)
+
+    def score(self, codes, query):
+        query = np.asarray(query, dtype=np.float32)
+        table = np.einsum(
+            "pcd,pd->pc", self.codebooks, query.reshape(self.subspaces, -1)
+        )
+        return _blocks(codes, lambda block: _lookup(table, block))
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+
+# 各行について全部分の table[部分, コード] を合計
+# （部分ごとに連続した列を引く方が2次元のファンシーインデックスよりはるかに速い）
+def _lookup(table, codes):
+    scores = np.zeros(len(codes), dtype=np.float32)
+    for part, column in zip(table, np.ascontiguousarray(codes.T)):
+        scores += part.take(column)
+    return scores
+
+
+# 次元数に対する分割数: 可能なら1部分16次元（1536 → 96）
+def default_subspaces(dim):
+    return next(m for m in range(max(1, dim // 16), 0, -1) if dim % m == 0)
+
+
+def make_quantizer(kind, subspaces=None):
+    if kind == "int8":
+        return Int8Quantizer()
+    if kind == "pq":
+        return PQQuantizer(subspaces)
+    raise ValueError(f"不明な量子化: {kind}（選択肢: {', '.join(KINDS)}）")
+
+
+# ベクトル（のサンプル）で学習
+def train_quantizer(kind, vectors, rows=None, subspaces=None, seed=0):
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    sample = PQ_SAMPLE if kind == "pq" else MAX_SAMPLE
+    if len(rows) > sample:
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(rows, sample, replace=False))
+    return make_quantizer(kind, subspaces).train(np.asarray(vectors[rows]))
+
+
+# 行をブロック単位で符号化（vectors はメモリより大きい memmap の場合がある）
+def encode_rows(quantizer, vectors, rows):
+    codes = np.empty((len(rows), quantizer.code_size), dtype=quantizer.dtype)
+    for start in range(0, len(rows), _BLOCK):
+        block = rows[start : start + _BLOCK]
+        codes[start : start + len(block)] = quantizer.encode(vectors[block])
+    return codes
+
+
+# ---------------------------
+# 量子化器の保存・読み込み（.npz、アトミックに書き込む）
+# ---------------------------
+def save_quantizer(quantizer, path, **arrays):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, kind=quantizer.kind, **quantizer.state(), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_quantizer(data):
+    if isinstance(data, str):
+        data = np.load(data)
+    kind = str(data["kind"])
+    if kind == "int8":
+        return Int8Quantizer(data["scale"])
+    if kind == "pq":
+        return PQQuantizer(codebooks=data["codebooks"])
+    raise ValueError(f"不明な量子化: {kind}（選択肢: {', '.join(KINDS)}）")
+
+
+# ---------------------------
+# ローカル namespace のコード（float のベクトルと同じディレクトリ）
+#   quantizer.npz: 学習済みの量子化器
+#   codes.q:       メモリマップしたコード（capacity × コードサイズ）
+# 検索は float のベクトルの代わりにコードを走査する（データ量は 1/4〜1/64）
+# ---------------------------
+class QuantizedVectors:
+    def __init__(self, directory):
+        self.quantizer_path = os.path.join(directory, "quantizer.npz")
+        self.codes_path = os.path.join(directory, "codes.q")
+        self.quantizer = None
+        self.codes = None
+
+    @property
+    def kind(self):
+        return self.quantizer.kind if self.quantizer is not None else None
+
+    # `capacity` 行のストア用に（再）読み込み
+    def load(self, capacity):
+        self.quantizer = None
+        self.codes = None
+        if os.path.exists(self.quantizer_path):
+            self.quantizer = load_quantizer(self.quantizer_path)
+            self.resize(capacity)
+
+    # ベクトルファイルに合わせてコードファイルを拡張
+    def resize(self, capacity):
+        if self.quantizer is None or not capacity:
+            return
+        self.codes = None
+        size = self.quantizer.code_size * np.dtype(self.quantizer.dtype).itemsize
+        with open(self.codes_path, "ab") as f:
+            if f.tell() < capacity * size:
+                f.truncate(capacity * size)
+        self.codes = np.memmap(
+            self.codes_path,
+            dtype=self.quantizer.dtype,
+            mode="r+",
+            shape=(capacity, self.quantizer.code_size),
+        )
+
+    # ---------------------------
+    # 有効な行で `kind` の量子化器を学習し、すべての行を符号化
+    # コードは新しいファイルに書いて古いファイルと置き換えるため、読み取り側は
+    # 次のコミット後に再読み込みするまで一貫した（古い）マッピングを使い続ける
+    # ---------------------------
+    def train(self, kind, vectors, rows, subspaces=None):
+        quantizer = train_quantizer(kind, vectors, rows, subspaces)
+        tmp_path = self.codes_path + ".tmp"
+        codes = np.memmap(
+            tmp_path,
+            dtype=quantizer.dtype,
+            mode="w+",
+            shape=(len(vectors), quantizer.code_size),
+        )
+        for start in range(0, len(rows), _BLOCK):
+            block = rows[start : start + _BLOCK]
+            codes[block] = quantizer.encode(vectors[block])
+        codes.flush()
+        del codes
+        os.replace(tmp_path, self.codes_path)
+        save_quantizer(quantizer, self.quantizer_path)
+        self.quantizer = quantizer
+        self.resize(len(vectors))
+
+    # 追加・置換した行を符号化（量子化器の学習前は何もしない）
+    def assign(self, rows, values):
+        if self.quantizer is not None:
+            self.codes[rows] = self.quantizer.encode(values)
+
+    def flush(self):
+        if self.codes is not None:
+            self.codes.flush()
+
+    # 指定した行の近似スコア
+    def score(self, query, rows):
+        if len(rows) > len(self.codes) // 2:
+            return self.quantizer.score(self.codes, query)[rows]
+        return self.quantizer.score(self.codes[rows], query)
+
+
+# ---------------------------
+# namespace の圧縮エクスポート: 量子化器・コード・ID・メタデータを1つの .npz に保存
+# 単体で検索できる（近似スコア、float のベクトルは不要）
+# ---------------------------
+def write_compact(path, quantizer, codes, ids, metadata):
+    save_quantizer(
+        quantizer,
+        path,
+        codes=codes,
+        ids=_json_bytes(ids),
+        metadata=_json_bytes(metadata),
+    )
+
+
+def _json_bytes(value):
+    return np.frombuffer(
+        json.dumps(value, ensure_ascii=False).encode("utf-8"), np.uint8
+    )
+
+
+class CompactIndex:
+    def __init__(self, path):
+        data = np.load(path)
+        self.quantizer = load_quantizer(data)
+        self.codes = data["codes"]
+        self.ids = json.loads(data["ids"].tobytes().decode("utf-8"))
+        self.metadata = json.loads(data["metadata"].tobytes().decode("utf-8"))
+
+    def query(self, vector, top_k=5, include_metadata=True):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.quantizer.score(self.codes, query)
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "id": self.ids[row],
+                "score": float(scores[row]),
+                "metadata": self.metadata[row] if include_metadata else {},
+            }
+            for row in top.tolist()
+        ]
+
+
+# ---------------------------
+# ローカルインデックス（LOCAL_INDEX_DIR）の namespace を圧縮ファイルに書き出す
+# 使用法: python quantization.py <namespace> <output.npz> [--kind pq|int8]
+# ---------------------------
+if __name__ == "__main__":
+    from vector_store import DEFAULT_LOCAL_INDEX_DIR, LocalVectorStore
+
+    parser = argparse.ArgumentParser(description="namespace のインデックスを圧縮して書き出す")
+    parser.add_argument("namespace", help="ローカルインデックスの namespace")
+    parser.add_argument("output", help="出力ファイル（.npz）")
+    parser.add_argument("--kind", choices=KINDS, default="pq")
+    parser.add_argument(
+        "--subspaces", type=int, default=None, help="PQ のベクトルあたりバイト数"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR),
+        help="ローカルインデックスのディレクトリ（既定: LOCAL_INDEX_DIR）",
+    )
+    args = parser.parse_args()
+
+    store = LocalVectorStore(args.index_dir)
+    count = store.namespace(args.namespace).export(
+        args.output, args.kind, args.subspaces
+    )
+    store.close()
+    print(
+        f"[エクスポート] {count}件 → {args.output} "
+        f"({os.path.getsize(args.output) / (1024 * 1024):.1f} MB)"
+    )
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# ---------------------------
+# 質問の埋め込みのマイクロバッチ化
+# max_wait 秒以内に届いた質問は 1 回のリクエストでまとめて埋め込み
+# （embeddings エンドポイントは配列の "input" を受け付ける）、
+# 呼び出し元にはそれぞれのベクトルを返す
+# → 負荷時: 質問ごとに 1 回ではなく毎秒数回のリクエストになり、
+#   レート制限エラーが減る。単独の質問の待ち時間は最大 max_wait
+# max_batch_size: 満杯になったバッチは待たずにすぐ送信する
+# embed_many: テキスト → 同じ順序のベクトル（API リクエスト 1 回）
+# MicroBatcher: スレッド用（query_embeddings.py）
+# AsyncMicroBatcher: asyncio のイベントループ用（Flask/answer_service.py）
+# ---------------------------
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT = 0.005  # バッチの最初の質問が他の質問を待つ秒数
+
+
+# ---------------------------
+# バッチの集計: バッチサイズと、リクエスト送信までキューで待った時間
+# ---------------------------
+class BatchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.inputs = 0
+        self.queued_seconds = 0.0
+        self.max_queued_seconds = 0.0
+
+    def record(self, enqueued, sent):
+        with self.lock:
+            self.batches += 1
+            self.inputs += len(enqueued)
+            for started in enqueued:
+                self.queued_seconds += sent - started
+                self.max_queued_seconds = max(self.max_queued_seconds, sent - started)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "inputs": self.inputs,
+                "avg_batch_size": self.inputs / self.batches if self.batches else 0.0,
+                "avg_queue_ms": (
+                    1000 * self.queued_seconds / self.inputs if self.inputs else 0.0
+                ),
+                "max_queue_ms": 1000 * self.max_queued_seconds,
+            }
+
+
+# バッチ内の同じテキストは 1 回だけ埋め込む（同じ質問が同時に来た場合）
+def _unique(texts):
+    order = list(dict.fromkeys(texts))
+    position = {text: i for i, text in enumerate(order)}
+    return order, [position[text] for text in texts]
+
+
+# ---------------------------
+# スレッド版: 呼び出し元は embed() で待機し、バックグラウンドのスレッドが
+# キューをバッチにまとめて小さなプールから送信する（バッチは並行して送れる）
+# ---------------------------
+class MicroBatcher:
+    def __init__(
+        self,
+        embed_many,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_wait=DEFAULT_MAX_WAIT,
+        workers=4,
+    ):
+        self.embed_many = embed_many
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = float(max_wait)
+        self.stats = BatchStats()
+        self.condition = threading.Condition()
+        self.pending = []  # (text, Future, enqueued)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="query-embed"
+        )
+        threading.Thread(
+            target=self._collect, name="query-embed-batcher", daemon=True
+        ).start()
+
+    def embed(self, text):
+        future = Future()
+        with self.condition:
+            self.pending.append((text, future, time.perf_counter()))
+            self.condition.notify()
+        return future.result()
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                deadline = self.pending[0][2] + self.max_wait
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.max_batch_size,
+                    timeout=max(0.0, deadline - time.perf_counter()),
+                )
+                batch = self.pending[: self.max_batch_size]
+                del self.pending[: self.max_batch_size]
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        self.stats.record([enqueued for _, _, enqueued in batch], time.perf_counter())
+        texts, positions = _unique([text for text, _, _ in batch])
+        try:
+            vectors = self.embed_many(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), i in zip(batch, positions):
+            future.set_result(vectors[i])
+
+
+# ---------------------------
+# asyncio 版: 1 つのイベントループからのみ使う
+# バッチの最初の質問が max_wait 後の送信を予約し、満杯のバッチは
+# すぐに送信する。諦めた呼び出し元（タイムアウト）は待つのをやめるだけ
+# ---------------------------
+class AsyncMicroBatcher:
+    def __init__(
+        self,
+        embed_many,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.embed_many = embed_many  # async: texts → vectors
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = float(max_wait)
+        self.stats = BatchStats()
+        self.pending = []  # (text, asyncio.Future, enqueued)
+        self._timer = None
+        self._tasks = set()  # 送信中のバッチのタスク（ループは弱参照しか持たない）
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self.pending
+        self.pending = []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        self.stats.record([enqueued for _, _, enqueued in batch], time.perf_counter())
+        texts, positions = _unique([text for text, _, _ in batch])
+        try:
+            vectors = await self.embed_many(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), i in zip(batch, positions):
+            if not future.done():
+                future.set_result(vectors[i])
@@ -1,6 +1,35 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from clients import Lazy, openai_client, startup
 from dotenv import dotenv_values
-import openai
-from pinecone import Pinecone
+from answer_cache import (
+    DEFAULT_ANSWER_CACHE_DIR,
+    DEFAULT_CAPACITY as DEFAULT_ANSWER_CAPACITY,
+    DEFAULT_THRESHOLD,
+    DEFAULT_TTL,
+    open_answer_cache,
+)
+from embedding_batcher import estimate_tokens
+from embedding_cache import DEFAULT_CACHE_DIR, DEFAULT_CAPACITY, open_cache
+from chunk_store import DEFAULT_CHUNK_STORE_DIR, open_chunk_store
+from context_builder import (
+    DEFAULT_DUPLICATE_THRESHOLD as DEFAULT_CONTEXT_THRESHOLD,
+    DEFAULT_MAX_TOKENS as DEFAULT_CONTEXT_TOKENS,
+    ContextStats,
+    build_context,
+)
+from query_batcher import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT, MicroBatcher
+from ann_index import DEFAULT_NPROBE
+from lexical_index import (
+    DEFAULT_LEXICAL_INDEX_DIR,
+    DEFAULT_RRF_K,
+    fuse,
+    open_lexical_index,
+)
+from rate_limiter import INTERACTIVE, Scheduler, parse_limits
+from vector_store import DEFAULT_BACKEND, DEFAULT_LOCAL_INDEX_DIR, open_vector_store
+
+startup.mark("import", "project modules")
 
 # ---------------------------
 # 環境変数読み込み（config.env.template から直接取得）
@@ -9,54 +38,235 @@ from pinecone import Pinecone
 # ---------------------------
 config = dotenv_values("config.env.template")
 
-# OpenAI APIキーを直接設定（環境変数経由ではない）
-openai.api_key = config.get("OPENAI_API_KEY")
+# ---------------------------
+# 以下のクライアント・インデックス・キャッシュは初回利用時に開く（Lazy。.get() で
+# 取得）→ このモジュールの import ではネットワーク接続やディスクの準備を行わない。
+# warm_up() で最初の質問の前に開ける
+# ---------------------------
 
-# Pinecone初期化（APIキーを直接取得）
-pc = Pinecone(api_key=config.get("PINECONE_API_KEY"))
+# OpenAI クライアント（APIキーを直接設定、環境変数経由ではない）
+# 再試行は下のスケジューラに任せる（Retry-After に従うバックオフ）
+openai_api = Lazy("openai", openai_client, config.get("OPENAI_API_KEY"))
 
-# Pineconeのインデックス名も外部設定から取得
+# OpenAI・Pinecone 呼び出しのスケジューラ（対話的な優先度）：モデルごとの
+# レート制限（RATE_LIMITS、アプリと同じ形式）、再試行、サーキットブレーカー
+scheduler = Scheduler(
+    parse_limits(config.get("RATE_LIMITS")),
+    priority=INTERACTIVE,
+    failure_threshold=int(config.get("CIRCUIT_BREAKER_FAILURES", 5)),
+    reset_seconds=float(config.get("CIRCUIT_BREAKER_RESET", 30)),
+)
+
+# ベクトルストア: Pinecone（既定）またはローカルインデックス（VECTOR_STORE=local）
+# Pineconeのインデックス名は外部設定から取得
 # → 複数プロジェクト・データセットに対応できる柔軟な構造
-index = pc.Index(config.get("PINECONE_INDEX_NAME"))
+vector_store = Lazy(
+    "vector_store",
+    open_vector_store,
+    config.get("VECTOR_STORE", DEFAULT_BACKEND),
+    local_dir=config.get("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR),
+    nprobe=config.get("LOCAL_ANN_NPROBE", DEFAULT_NPROBE),
+    api_key=config.get("PINECONE_API_KEY"),
+    index_name=config.get("PINECONE_INDEX_NAME"),
+    scheduler=scheduler,
+)
+
+# 取り込み時に作成したローカル BM25 索引（LEXICAL_INDEX_DIR が空なら無効）
+# SEARCH_MODE: "vector"（既定）、"hybrid"（ベクトル + BM25 を順位で統合）、
+# "lexical"（BM25 のみ：型番・エラー文字列の完全一致、ベクトル化の呼び出しなし）
+lexical_index = Lazy(
+    "lexical_index",
+    open_lexical_index,
+    config.get("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR),
+)
+SEARCH_MODE = config.get("SEARCH_MODE", "vector")
+
+# upload_embeddings.py がローカルに保持したチャンク本文（CHUNK_STORE_DIR。空: 無効）
+# → これを使って書き込んだベクトルは本文を持たないので、ここで取得する
+chunk_store = Lazy(
+    "chunk_store",
+    open_chunk_store,
+    config.get("CHUNK_STORE_DIR", DEFAULT_CHUNK_STORE_DIR),
+)
+RRF_K = int(config.get("HYBRID_RRF_K", DEFAULT_RRF_K))
+
+# ask_direct_answer のプロンプトのコンテキスト：重なるチャンクをまとめ、ほぼ重複を除き、
+# 最大 CONTEXT_MAX_TOKENS トークン（context_builder.py を参照）
+# → context_stats.stats(): これまでに使用・削減したプロンプトのトークン数
+CONTEXT_MAX_TOKENS = int(config.get("CONTEXT_MAX_TOKENS", DEFAULT_CONTEXT_TOKENS))
+CONTEXT_DUPLICATE_THRESHOLD = float(
+    config.get("CONTEXT_DUPLICATE_THRESHOLD", DEFAULT_CONTEXT_THRESHOLD)
+)
+context_stats = ContextStats()
+
+# 質問用のローカル埋め込みキャッシュ（EMBEDDING_CACHE_DIR を空にすると無効）
+# → 繰り返される質問は OpenAI API を呼ばずにベクトル化される
+embedding_cache = Lazy(
+    "embedding_cache",
+    open_cache,
+    "query",
+    config.get("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR),
+    config.get("EMBEDDING_CACHE_CAPACITY", DEFAULT_CAPACITY),
+)
+
+# 回答キャッシュ（ANSWER_CACHE_DIR を空にすると無効）
+# → 以前に回答した質問（同じ namespace）に近い質問は検索と gpt-4o を省略
+answer_cache = Lazy(
+    "answer_cache",
+    open_answer_cache,
+    "cli",
+    config.get("ANSWER_CACHE_DIR", DEFAULT_ANSWER_CACHE_DIR),
+    threshold=config.get("ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD),
+    ttl=config.get("ANSWER_CACHE_TTL", DEFAULT_TTL),
+    capacity=config.get("ANSWER_CACHE_CAPACITY", DEFAULT_ANSWER_CAPACITY),
+)
 
 
 # ---------------------------
-# 類似文書検索（Pinecone + OpenAI埋め込み）
-# 入力: 質問文（自然言語）, namespace（データセット識別子）
-# 出力: 検索されたメタ情報（text）のリスト
+# 複数の質問を 1 回の埋め込みリクエストで処理（ベクトルは入力順）
 # ---------------------------
-def get_similar_chunks(question, ns):
-    # OpenAI APIで質問をベクトル化（埋め込みモデルを使用）
-    embedding = (
-        openai.embeddings.create(
-            input=question,
-            model="text-embedding-3-small",  # 軽量・高精度の最新埋め込みモデル
-        )
-        .data[0]
-        .embedding
+def embed_questions(questions):
+    model = "text-embedding-3-small"  # 軽量で高精度な埋め込みモデル
+    response = scheduler.call(
+        model,
+        lambda: openai_api.get().embeddings.create(input=questions, model=model),
+        sum(estimate_tokens(question) for question in questions),
     )
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+# （複数のスレッドから）同時に来た質問は 1 回のリクエストにまとめる
+# → QUERY_EMBED_BATCH_WAIT_MS: 最初の質問が他の質問を待つ時間
+batch_wait_ms = config.get("QUERY_EMBED_BATCH_WAIT_MS", DEFAULT_MAX_WAIT * 1000)
+# （ワーカースレッドは最初の質問で開始する）
+embedding_batcher = Lazy(
+    "embedding_batcher",
+    MicroBatcher,
+    embed_questions,
+    max_batch_size=config.get("QUERY_EMBED_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE),
+    max_wait=float(batch_wait_ms) / 1000,
+)
+
+
+# ---------------------------
+# 質問のベクトル化（OpenAI埋め込み。可能ならローカルキャッシュから返す）
+# ---------------------------
+def embed_question(question):
+    cache = embedding_cache.get()
+    if cache is not None:
+        embedding = cache.get(question)
+        if embedding is not None:
+            return embedding
 
-    # PineconeベクトルDBから類似検索を実行
-    results = index.query(
-        vector=embedding,
+    embedding = embedding_batcher.get().embed(question)
+    if cache is not None:
+        cache.put(question, embedding)
+    return embedding
+
+
+# ---------------------------
+# ベクトル化した質問の類似検索（Pinecone またはローカル）
+# ---------------------------
+def search_similar(embedding, ns):
+    return vector_store.get().query(
+        embedding,
         top_k=5,  # 上位5件の類似文書を取得
         include_metadata=True,  # 元テキストを含むメタ情報を含めて返す
         namespace=ns,  # プロジェクトや用途で論理分離するための識別子
     )
 
+
+# ---------------------------
+# ローカル BM25 索引でのキーワード検索（ベクトル化の呼び出しなし）
+# ---------------------------
+def search_lexical(question, ns, top_k=5):
+    index = lexical_index.get()
+    if index is None:
+        raise RuntimeError("キーワード索引は無効です（LEXICAL_INDEX_DIR が空）")
+    return index.search(question, top_k=top_k, namespace=ns)
+
+
+# ---------------------------
+# ハイブリッド検索：BM25 検索をベクトル検索と並行して実行し、
+# 両方の順位を Reciprocal Rank Fusion で統合する
+# ---------------------------
+def search_hybrid(question, embedding, ns, top_k=5):
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        lexical = pool.submit(search_lexical, question, ns, top_k)
+        vector = search_similar(embedding, ns)
+        return fuse([vector, lexical.result()], top_k=top_k, k=RRF_K)
+
+
+# 指定したモードで検索（lexical モードでは embedding は None）
+# マッチのメタデータにない本文はチャンクストアから取得（1 回の検索）
+def search_chunks(question, embedding, ns, mode):
+    if mode == "lexical":
+        matches = search_lexical(question, ns)
+    elif mode == "hybrid":
+        matches = search_hybrid(question, embedding, ns)
+    else:
+        matches = search_similar(embedding, ns)
+    store = chunk_store.get()
+    if store is not None:
+        matches = store.resolve(matches, ns)
+    return matches
+
+
+# ---------------------------
+# 類似文書検索（ベクトルストア + OpenAI埋め込み）
+# 入力: 質問文（自然言語）, namespace（データセット識別子）
+#        mode: "vector" / "hybrid" / "lexical"（既定: SEARCH_MODE）
+# 出力: 検索されたメタ情報（text）のリスト
+# ---------------------------
+def get_similar_chunks(question, ns, mode=None):
+    mode = mode or SEARCH_MODE
+    # 質問を OpenAI API でベクトル化（埋め込みモデル。lexical では不要）
+    embedding = None if mode == "lexical" else embed_question(question)
+
+    # 検索を実行（ベクトルストア：Pinecone またはローカル、BM25：ローカル索引）
+    matches = search_chunks(question, embedding, ns, mode)
+
     # メタ情報からテキスト本文のみ抽出して返却
-    return [match["metadata"]["text"] for match in results["matches"]]
+    return [match["metadata"]["text"] for match in matches]
 
 
 # ---------------------------
 # 応答生成（OpenAI Chatモデル）
 # 入力: ユーザーの質問, namespace（検索対象）
 # 出力: gpt-4o による自然言語の回答文（str）
+# 以前に回答した質問とほぼ同じ質問には回答キャッシュから返す
+# （質問をベクトル化しない lexical モードでは使わない）
 # ---------------------------
-def ask_direct_answer(question, ns):
+def ask_direct_answer(question, ns, mode=None):
+    mode = mode or SEARCH_MODE
+    embedding = None if mode == "lexical" else embed_question(question)
+    cache = answer_cache.get()
+    if cache is not None and embedding is not None:
+        cached = cache.get(ns, embedding)
+        if cached is not None:
+            return cached["answer"]
+
     # 類似文書を取得し、回答のコンテキスト（文脈）として利用
-    chunks = get_similar_chunks(question, ns)
-    context = "\n".join(chunks)
+    started = time.perf_counter()
+    matches = search_chunks(question, embedding, ns, mode)
+    answer = generate_answer(question, matches)
+    if cache is not None and embedding is not None:
+        cache.put(ns, question, embedding, answer, cost=time.perf_counter() - started)
+    return answer
+
+
+# ---------------------------
+# 検索結果から質問に回答（チャンクのテキストからプロンプトのコンテキストを構成）
+# 出力: gpt-4o が生成した回答文字列
+# ---------------------------
+def generate_answer(question, matches):
+    context, report = build_context(
+        matches,
+        max_tokens=CONTEXT_MAX_TOKENS,
+        duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+        separator="\n",
+    )
+    context_stats.add(report)
 
     # プロンプト設計：FAQ文書を前提にした回答生成を指示
     prompt = (
@@ -64,9 +274,163 @@ def ask_direct_answer(question, ns):
     )
 
     # gpt-4o（2024年最新）を使用して応答生成
-    response = openai.chat.completions.create(
-        model="gpt-4o", messages=[{"role": "user", "content": prompt}]
+    messages = [{"role": "user", "content": prompt}]
+    response = scheduler.call(
+        "gpt-4o",
+        lambda: openai_api.get().chat.completions.create(
+            model="gpt-4o", messages=messages
+        ),
+        estimate_tokens(prompt),
     )
 
     # 応答から生成テキストのみ抽出して返す
     return response.choices[0].message.content.strip()
+
+
+# ---------------------------
+# 質問の一括処理（評価用の質問セット、大量の質問への回答。batch_questions.py を参照）
+# ---------------------------
+BATCH_SIZE = 256  # まとめて埋め込み・検索する質問数
+BATCH_WORKERS = 8  # 並行する埋め込みリクエスト・ベクトル検索・BM25 検索の数
+ANSWER_WORKERS = 4  # 並行する gpt-4o の呼び出し数
+
+
+# ---------------------------
+# 多数の質問をベクトル化: キャッシュ済みの質問はローカルキャッシュから取得し、
+# それ以外は 1 リクエストあたり batch_size 件、最大 `workers` 件を並行して埋め込む
+# 出力: 入力順のベクトル
+# ---------------------------
+def embed_question_batch(questions, batch_size=BATCH_SIZE, workers=BATCH_WORKERS):
+    cache = embedding_cache.get()
+    vectors = (
+        cache.get_many(questions) if cache is not None else [None] * len(questions)
+    )
+    missing = list(dict.fromkeys(q for q, v in zip(questions, vectors) if v is None))
+    batches = [
+        missing[start : start + batch_size]
+        for start in range(0, len(missing), batch_size)
+    ]
+    embedded = {}
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            for batch, batch_vectors in zip(
+                batches, pool.map(embed_questions, batches)
+            ):
+                embedded.update(zip(batch, batch_vectors))
+        if cache is not None:
+            cache.put_many(list(embedded.items()))
+    return [
+        vector if vector is not None else embedded[question]
+        for question, vector in zip(questions, vectors)
+    ]
+
+
+# ---------------------------
+# 多数の質問をまとめて検索（embeddings: lexical モードでは None）
+# ベクトル検索はまとめてベクトルストアに送り（query_many: Pinecone への並行クエリ、
+# またはローカルインデックスでの 1 回の行列演算）、BM25 検索は `workers` 個の
+# スレッドで実行する。hybrid では質問ごとに両方の順位を統合する
+# 出力: 質問ごとの検索結果（テキストはチャンクストアから補完）
+# ---------------------------
+def search_chunks_batch(
+    questions, embeddings, ns, mode, top_k=5, workers=BATCH_WORKERS
+):
+    if mode != "lexical":
+        vector = vector_store.get().query_many(
+            embeddings, top_k=top_k, namespace=ns, workers=workers
+        )
+    if mode != "vector":
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            lexical = list(
+                pool.map(
+                    lambda question: search_lexical(question, ns, top_k), questions
+                )
+            )
+    if mode == "hybrid":
+        results = [fuse(pair, top_k=top_k, k=RRF_K) for pair in zip(vector, lexical)]
+    else:
+        results = lexical if mode == "lexical" else vector
+    store = chunk_store.get()
+    if store is not None:
+        results = [store.resolve(matches, ns) for matches in results]
+    return results
+
+
+# 一括処理の 1 問の回答（回答キャッシュは ask_direct_answer と同じ）
+def _batch_answer(question, ns, embedding, matches):
+    cache = answer_cache.get() if embedding is not None else None
+    if cache is not None:
+        cached = cache.get(ns, embedding)
+        if cached is not None:
+            return cached["answer"]
+    started = time.perf_counter()
+    answer = generate_answer(question, matches)
+    if cache is not None:
+        cache.put(ns, question, embedding, answer, cost=time.perf_counter() - started)
+    return answer
+
+
+# ---------------------------
+# 多数の質問の検索（と必要に応じて回答）
+# 入力: 質問（文字列のリスト）、namespace、mode（既定: SEARCH_MODE）、top_k
+#        answer: 回答も生成（gpt-4o の呼び出しは最大 answer_workers 件を並行）
+#        batch_size: まとめて埋め込み・検索する質問数。各バッチの結果は次のバッチを
+#        始める前に返すため、結果を順次書き出せる
+# 出力: 入力順に {"question", "matches", "answer"} を返す
+#         （answer=True でなければ answer は None）
+# ---------------------------
+def answer_question_batch(
+    questions,
+    ns,
+    mode=None,
+    top_k=5,
+    answer=False,
+    batch_size=BATCH_SIZE,
+    workers=BATCH_WORKERS,
+    answer_workers=ANSWER_WORKERS,
+):
+    mode = mode or SEARCH_MODE
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start : start + batch_size]
+        if mode == "lexical":
+            embeddings = [None] * len(batch)
+        else:
+            embeddings = embed_question_batch(batch, batch_size, workers)
+        results = search_chunks_batch(batch, embeddings, ns, mode, top_k, workers)
+        if not answer:
+            for question, matches in zip(batch, results):
+                yield {"question": question, "matches": matches, "answer": None}
+            continue
+        with ThreadPoolExecutor(max_workers=answer_workers) as pool:
+            answers = pool.map(
+                lambda item: _batch_answer(item[0], ns, item[1], item[2]),
+                zip(batch, embeddings, results),
+            )
+            for question, matches, text in zip(batch, results, answers):
+                yield {"question": question, "matches": matches, "answer": text}
+
+
+# ---------------------------
+# 最初の質問の前にクライアント・キャッシュ・インデックスを開く（任意。
+# 呼ばなければ初回利用時に開く）。OpenAI・Pinecone の接続と、namespace `ns` の
+# ベクトルストア・BM25 インデックスも開く
+# 出力: 失敗した部分の {部分: エラー}（初回利用時に再試行される）
+# ---------------------------
+def warm_up(ns=""):
+    for resource in (embedding_cache, answer_cache, chunk_store, embedding_batcher):
+        resource.get()
+    parts = {
+        "openai": lambda: openai_api.get().models.retrieve("text-embedding-3-small"),
+        "vector store": lambda: vector_store.get().warm_up(ns),
+    }
+    if lexical_index.get() is not None:
+        parts["lexical index"] = lambda: lexical_index.get().namespace(ns)
+    errors = {}
+    for name, call in parts.items():
+        try:
+            with startup.phase("warm-up", name):
+                call()
+        except Exception as e:
+            errors[name] = str(e)
+    startup.ready()
+    return errors
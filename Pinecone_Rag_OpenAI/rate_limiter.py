@@ -0,0 +1,482 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+
+import requests
+
+# 再試行する HTTP ステータス：レート制限（429）と一時的なサーバーエラー
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# ステータスなしで再試行するエラー（接続リセット、タイムアウトなど）
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# 優先度：同じリミッターで待機している場合、対話的な呼び出し（/query の質問）を
+# バックグラウンドの呼び出し（取り込み）より先に通す
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# 適応レート：429 を受けるとリミッターのレートを半分にし（設定上限の MIN_RATE_SCALE まで）、
+# 呼び出しが成功するたびに RATE_RECOVERY_STEP ずつ戻す
+MIN_RATE_SCALE = 0.1
+RATE_RECOVERY_STEP = 0.05
+# 対話的な呼び出しが待機している間、バックグラウンドの呼び出しが待つ秒数
+BACKGROUND_YIELD_SECONDS = 0.05
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # 最初の再試行までの秒数（再試行ごとに倍）
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_FAILURE_THRESHOLD = 5  # サーキットを開く連続失敗回数
+DEFAULT_RESET_SECONDS = 30.0  # 開いたサーキットが呼び出しを拒否する秒数
+
+
+# ---------------------------
+# トークンバケット（容量＝1分あたりの許容量、連続的に補充）
+# take(): 取得できれば 0、できなければ待機すべき秒数を返す
+# wait() / consume(): 同じ処理を 2 段階で行う（複数のバケットからまとめて取得するため）
+# scale: 現在許可しているレートの割合（429 を受けると下げる）
+# ---------------------------
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount):
+        wait = self.wait(amount)
+        if wait == 0.0:
+            self.consume(amount)
+        return wait
+
+    def wait(self, amount):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # バケット容量を超える要求は、バケットが満タンになった時点で許可する
+        amount = min(float(amount), self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(float(amount), self.capacity)
+
+    def set_scale(self, scale):
+        self.wait(0)  # 現在までは元のレートで補充
+        self.rate = self.capacity / 60.0 * scale
+
+
+def _bucket(per_minute, share=1.0):
+    return TokenBucket(per_minute * share) if per_minute else None
+
+
+# ---------------------------
+# ワーカースレッド（と 1 つのイベントループのコルーチン）で共有するレート制限
+# requests_per_minute / tokens_per_minute: None は無制限
+# background_share: バックグラウンドの呼び出しが使える上限の割合。残りは
+#   対話的な呼び出しに残す（別プロセスからの呼び出しでも有効。
+#   取り込みと Web アプリは同じ API の上限を共有するため）
+# acquire(tokens): リクエスト1回分とトークンの両方が確保できるまで待機
+# acquire_async(tokens): 同じ処理をイベントループをブロックせずに行う
+# throttled(retry_after) / succeeded(): 429 に応じてレートを調整
+# waited_seconds: 待機時間の合計（進捗表示でバックプレッシャーとして表示）
+# ---------------------------
+class RateLimiter:
+    def __init__(
+        self, requests_per_minute=None, tokens_per_minute=None, background_share=1.0
+    ):
+        self.request_bucket = _bucket(requests_per_minute)
+        self.token_bucket = _bucket(tokens_per_minute)
+        # バックグラウンドの呼び出しは、この小さいバケットからも取得する
+        self.background_buckets = (None, None)
+        if background_share < 1.0:
+            self.background_buckets = (
+                _bucket(requests_per_minute, background_share),
+                _bucket(tokens_per_minute, background_share),
+            )
+        self.lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.scale = 1.0
+        self.paused_until = 0.0  # 直近の 429 の Retry-After（time.monotonic）
+        self.interactive_waiting = 0
+
+    def acquire(self, tokens=0, priority=BACKGROUND):
+        for wait in self._waits(tokens, priority):
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0, priority=BACKGROUND):
+        for wait in self._waits(tokens, priority):
+            await asyncio.sleep(wait)
+
+    # リクエストを送信できるまでの待機（その間、対話的な呼び出しは待機中として数え、
+    # バックグラウンドの呼び出しが先に通す）
+    def _waits(self, tokens, priority):
+        waiting = False
+        try:
+            while True:
+                with self.lock:
+                    wait = self._try_take(tokens, priority)
+                    if wait == 0.0:
+                        return
+                    if priority == INTERACTIVE and not waiting:
+                        self.interactive_waiting += 1
+                        waiting = True
+                    self.waited_seconds += wait
+                yield wait
+        finally:
+            if waiting:
+                with self.lock:
+                    self.interactive_waiting -= 1
+
+    # すべてのバケットから確保できる場合のみ消費する
+    def _try_take(self, tokens, priority):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if priority != INTERACTIVE and self.interactive_waiting:
+            return BACKGROUND_YIELD_SECONDS
+        demands = [(self.request_bucket, 1), (self.token_bucket, tokens)]
+        if priority != INTERACTIVE:
+            request_bucket, token_bucket = self.background_buckets
+            demands += [(request_bucket, 1), (token_bucket, tokens)]
+        demands = [(bucket, amount) for bucket, amount in demands if bucket and amount]
+        wait = max((bucket.wait(amount) for bucket, amount in demands), default=0.0)
+        if wait == 0.0:
+            for bucket, amount in demands:
+                bucket.consume(amount)
+        return wait
+
+    # ---------------------------
+    # 適応レート（AIMD）：429 を受けるとレートを半分にし、全呼び出しを retry_after 秒
+    # 停止する。成功するたびにレートを少しずつ戻す
+    # → バーストと 429 の繰り返しではなく、上限の少し下で安定したスループット
+    # ---------------------------
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self._set_scale(max(MIN_RATE_SCALE, self.scale / 2))
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+    def succeeded(self):
+        if self.scale < 1.0:
+            with self.lock:
+                self._set_scale(min(1.0, self.scale + RATE_RECOVERY_STEP))
+
+    def _set_scale(self, scale):
+        self.scale = scale
+        buckets = (self.request_bucket, self.token_bucket) + self.background_buckets
+        for bucket in buckets:
+            if bucket:
+                bucket.set_scale(scale)
+
+
+# ---------------------------
+# サーキットブレーカー：`threshold` 回続けて失敗するとサーキットが開き、
+# reset_seconds 秒間は呼び出しをすぐに失敗させる（CircuitOpenError）。その後 1 回だけ
+# 試行の呼び出しを通し（half-open）、成功すればサーキットを閉じる
+# → 上流の障害時、すべての呼び出しが再試行を繰り返す代わりに
+# 呼び出しごとに即座にエラーを返す
+# 失敗は 5xx の応答・接続エラー・タイムアウト。429 は上流が応答しているため、
+# スロットリングでサーキットは開かない
+# ---------------------------
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self, threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS
+    ):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened = None  # サーキットが開いた時刻（time.monotonic()）
+        self.trial = False  # half-open の試行の呼び出しが実行中
+        self.lock = threading.Lock()
+
+    # 呼び出し元が half-open の試行の呼び出しなら True を返す
+    def check(self, name):
+        with self.lock:
+            if self.opened is None:
+                return False
+            remaining = self.opened + self.reset_seconds - time.monotonic()
+            if remaining <= 0 and not self.trial:
+                self.trial = True
+                return True
+            raise CircuitOpenError(
+                f"{name}: {self.failures} 回続けて失敗したためサーキットが開いています"
+                f"（次の試行まで {max(remaining, 0.0):.1f} 秒）"
+            )
+
+    # サーキットが開いているかを返す（失敗後）
+    def record(self, ok):
+        with self.lock:
+            self.trial = False
+            if ok:
+                self.failures = 0
+                self.opened = None
+                return False
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            return self.opened is not None
+
+    # 試行の呼び出しが結果なしで終わった（例：キャンセル）：次の呼び出しを
+    # 代わりに試行として通す
+    def cancel_trial(self):
+        with self.lock:
+            self.trial = False
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        return "half-open" if self.trial else "open"
+
+
+# ---------------------------
+# エラーを再試行すべきか：(retryable, status, retry_after 秒)
+# requests、OpenAI SDK（status_code / response）、Pinecone SDK（status / headers）の
+# いずれにも、例外クラスに依存せずに対応
+# ---------------------------
+def retry_info(error):
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+        return status in RETRY_STATUS_CODES, status, parse_retry_after(headers)
+    return isinstance(error, RETRY_ERRORS + _sdk_retry_errors()), None, None
+
+
+# SDK が読み込まれていれば openai.APIConnectionError（APITimeoutError も含む）
+# （プロジェクトで最も import が遅いため、ここでは import しない。clients.py を参照）
+def _sdk_retry_errors():
+    openai = sys.modules.get("openai")
+    error = getattr(openai, "APIConnectionError", None)
+    return (error,) if isinstance(error, type) else ()
+
+
+# ---------------------------
+# Retry-After ヘッダー（秒、または OpenAI の retry-after-ms）→ float。
+# ない場合・数値でない場合は None
+# ---------------------------
+def parse_retry_after(headers):
+    if not headers:
+        return None
+    try:
+        milliseconds = headers.get("retry-after-ms")
+        if milliseconds is not None:
+            return max(0.0, float(milliseconds) / 1000)
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+# フルジッター付きの指数バックオフ。サーバーの Retry-After を優先
+def retry_delay(
+    attempt, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, retry_after=None
+):
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(max_backoff, backoff * (2**attempt)))
+
+
+# ---------------------------
+# 宛先ごとの上限を次のような設定から取得
+#   "text-embedding-3-small=3000:1000000,gpt-4o=500:30000,pinecone=6000"
+# → {name: (requests_per_minute, tokens_per_minute)}。トークン数が
+#   ない・0 の場合はトークン数の制限なし
+# ---------------------------
+def parse_limits(spec):
+    limits = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, values = item.partition("=")
+        requests_per_minute, _, tokens_per_minute = values.partition(":")
+        limits[name.strip()] = (
+            float(requests_per_minute) or None,
+            float(tokens_per_minute or 0) or None,
+        )
+    return limits
+
+
+# ---------------------------
+# プロセス内のすべての OpenAI・Pinecone 呼び出しで共有するクライアント側スケジューラ
+# 宛先ごとにレートリミッターとサーキットブレーカーを 1 つずつ持つ：
+# OpenAI はモデル名（上限はモデルごと）、ベクトルストアは PINECONE
+# call(name, send, tokens): レート制限を待って send() を呼び出し、429 / 5xx / 接続エラーは
+#   バックオフして再試行する。それ以外のエラーはすぐに送出し、
+#   再試行を使い切るかサーキットが開いた場合も最後のエラーを送出する
+# acall(name, send, tokens): コルーチン用の同じ処理（send() は awaitable を返す）
+# limits: {name: (requests_per_minute, tokens_per_minute)}（parse_limits を参照）
+# priority: 呼び出しの既定の優先度（Web アプリと質問 CLI は INTERACTIVE、
+#   取り込みは BACKGROUND）
+# background_share: バックグラウンドの呼び出しが使える各上限の割合
+# ---------------------------
+PINECONE = "pinecone"
+
+
+class Scheduler:
+    def __init__(
+        self,
+        limits=None,
+        priority=BACKGROUND,
+        background_share=1.0,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_seconds=DEFAULT_RESET_SECONDS,
+    ):
+        self.limits = limits or {}
+        self.priority = priority
+        self.background_share = background_share
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.limiters = {}
+        self.breakers = {}
+        self.counters = {}  # name → {"calls", "retries", "throttled", "rejected"}
+        self.lock = threading.Lock()
+
+    def limiter(self, name):
+        with self.lock:
+            if name not in self.limiters:
+                self.limiters[name] = RateLimiter(
+                    *self.limits.get(name, (None, None)),
+                    background_share=self.background_share,
+                )
+                self.breakers[name] = CircuitBreaker(
+                    self.failure_threshold, self.reset_seconds
+                )
+                self.counters[name] = dict.fromkeys(
+                    ("calls", "retries", "throttled", "rejected"), 0
+                )
+            return self.limiters[name]
+
+    # ---------------------------
+    # limiter: 追加で待機する RateLimiter（例：1 回の実行の --rpm / --tpm）
+    # ---------------------------
+    def call(self, name, send, tokens=0, priority=None, limiter=None):
+        priority = self.priority if priority is None else priority
+        limiters = [self.limiter(name)] + ([limiter] if limiter else [])
+        trial = self._admit(name)
+        attempt = 0
+        try:
+            while True:
+                for each in limiters:
+                    each.acquire(tokens, priority)
+                try:
+                    result = send()
+                except Exception as e:
+                    delay = self._failed(name, e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(name)
+                return result
+        except BaseException:
+            if trial:
+                self.breakers[name].cancel_trial()
+            raise
+
+    async def acall(self, name, send, tokens=0, priority=None):
+        priority = self.priority if priority is None else priority
+        limiter = self.limiter(name)
+        trial = self._admit(name)
+        attempt = 0
+        try:
+            while True:
+                await limiter.acquire_async(tokens, priority)
+                try:
+                    result = await send()
+                except Exception as e:
+                    delay = self._failed(name, e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(name)
+                return result
+        except BaseException:
+            # 例：ステージのタイムアウトでキャンセル → 次の呼び出しを試行にする
+            if trial:
+                self.breakers[name].cancel_trial()
+            raise
+
+    # 呼び出しが half-open の試行かを返す
+    def _admit(self, name):
+        try:
+            trial = self.breakers[name].check(name)
+        except CircuitOpenError:
+            self._count(name, "rejected")
+            raise
+        self._count(name, "calls")
+        return trial
+
+    def _count(self, name, counter):
+        with self.lock:
+            self.counters[name][counter] += 1
+
+    def _succeeded(self, name):
+        self.breakers[name].record(True)
+        self.limiters[name].succeeded()
+
+    # 再試行までの待機秒数。エラーを送出する場合は None
+    def _failed(self, name, error, attempt):
+        retryable, status, retry_after = retry_info(error)
+        if not retryable:
+            # 上流は応答した（例：400）：障害ではなく呼び出し側のエラー
+            self.breakers[name].record(True)
+            return None
+        if status == 429:
+            # スロットリングは障害ではない：適応レート制限と Retry-After に任せる
+            self._count(name, "throttled")
+            self.limiters[name].throttled(retry_after)
+            opened = self.breakers[name].record(True)
+        else:
+            opened = self.breakers[name].record(False)
+        if attempt >= self.max_retries or opened:
+            return None  # 以降の呼び出しはサーキットが戻るまで拒否される
+        self._count(name, "retries")
+        return retry_delay(attempt, self.backoff, self.max_backoff, retry_after)
+
+    # {name: {"calls", "retries", "throttled", "rejected", "rate_scale", "circuit",
+    #         "waited_seconds"}}
+    def stats(self):
+        with self.lock:
+            names = list(self.limiters)
+            counters = {name: dict(self.counters[name]) for name in names}
+        return {
+            name: dict(
+                counters[name],
+                rate_scale=self.limiters[name].scale,
+                circuit=self.breakers[name].state,
+                waited_seconds=self.limiters[name].waited_seconds,
+            )
+            for name in names
+        }
+
+    def report(self):
+        return ", ".join(
+            f"{name}: 呼び出し {stats['calls']}件、再試行 {stats['retries']}件、"
+            f"レート制限（429）{stats['throttled']}件、"
+            f"サーキットブレーカーによる拒否 {stats['rejected']}件、レート制限の待機 {stats['waited_seconds']:.1f}秒"
+            for name, stats in self.stats().items()
+        )
@@ -0,0 +1,77 @@
+import os
+import threading
+
+# ---------------------------
+# 正解の文書に対する検索精度（評価用の質問セット）
+# 質問には回答の根拠となる文書を "sources" として付ける（取り込み時に
+# metadata["source"] に記録されたファイルパスまたはファイル名）
+# recall@k: 正解の文書のうち上位 k 件の検索結果で見つかった割合
+# MRR:      最初に正解の文書が現れた順位の逆数（上位 k 件になければ 0）
+# どちらも正解つきの質問で平均する（正解のない質問は対象外）
+# ---------------------------
+
+
+# 正解として文書を指定できる名前: パスまたはファイル名
+def _source_keys(source):
+    source = os.path.normpath(source)
+    return {source, os.path.basename(source)}
+
+
+# ---------------------------
+# 1 問のスコア: {"recall", "reciprocal_rank", "found": [見つかった正解]}
+# matches: metadata["source"] を持つ順位つきの検索結果（スコアの高い順）
+# ---------------------------
+def score_matches(matches, sources, k):
+    labels = {os.path.normpath(source) for source in sources}
+    found = set()
+    rank = None
+    for position, match in enumerate(matches[:k], 1):
+        source = match["metadata"].get("source")
+        hits = _source_keys(source) & labels if source else set()
+        if hits:
+            found |= hits
+            rank = rank or position
+    return {
+        "recall": len(found) / len(labels) if labels else 0.0,
+        "reciprocal_rank": 1 / rank if rank else 0.0,
+        "found": sorted(found),
+    }
+
+
+# ---------------------------
+# 採点したすべての質問の平均（スレッドセーフ）
+# ---------------------------
+class RetrievalScores:
+    def __init__(self, k):
+        self.k = k
+        self.lock = threading.Lock()
+        self.totals = {"questions": 0, "recall": 0.0, "reciprocal_rank": 0.0}
+
+    # 1 問を採点して平均に加える（正解がなければ None）
+    def add(self, matches, sources):
+        if not sources:
+            return None
+        scores = score_matches(matches, sources, self.k)
+        with self.lock:
+            self.totals["questions"] += 1
+            self.totals["recall"] += scores["recall"]
+            self.totals["reciprocal_rank"] += scores["reciprocal_rank"]
+        return scores
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+        questions = totals["questions"]
+        return {
+            "questions": questions,
+            "k": self.k,
+            f"recall@{self.k}": totals["recall"] / questions if questions else 0.0,
+            "mrr": totals["reciprocal_rank"] / questions if questions else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"recall@{self.k} {stats[f'recall@{self.k}']:.3f}、"
+            f"MRR {stats['mrr']:.3f}（正解つきの質問 {stats['questions']}件）"
+        )
@@ -1,9 +1,34 @@
 import os
+import time
 import requests
-import pdfplumber
-import docx
 import argparse
+from functools import partial
 from dotenv import load_dotenv
+from ann_index import DEFAULT_MIN_ROWS
+from answer_cache import DEFAULT_ANSWER_CACHE_DIR, invalidate_answers
+from chunk_store import DEFAULT_CHUNK_STORE_DIR, open_chunk_store
+from chunking import CHUNKERS, DEFAULT_STRATEGY, get_chunker
+from embedding_batcher import DEFAULT_EMBEDDING_URL, EmbeddingBatcher, estimate_tokens
+from embedding_cache import DEFAULT_CACHE_DIR, DEFAULT_CAPACITY, open_cache
+from extract_cache import DEFAULT_EXTRACT_CACHE_DIR, DEFAULT_MAX_MB, open_extract_cache
+from extractors import DEFAULT_MAX_FILE_MB, detect_kind, extract_pages
+from ingest_job import DEFAULT_JOB_DIR, job_id, open_ingest_job
+from ingest_manifest import (
+    DEFAULT_MANIFEST_PATH,
+    IncrementalSync,
+    IngestManifest,
+    text_sha256,
+)
+from ingest_pipeline import DEFAULT_EXTRACT_TIMEOUT, STAGES, IngestPipeline
+from lexical_index import DEFAULT_LEXICAL_INDEX_DIR, open_lexical_index
+from metrics import Metrics
+from rate_limiter import Scheduler, parse_limits
+from vector_store import (
+    BACKENDS,
+    DEFAULT_BACKEND,
+    DEFAULT_LOCAL_INDEX_DIR,
+    open_vector_store,
+)
 
 # ---------------------------
 # 環境変数読み込み（APIキー・接続先URLを外部ファイルから安全に取得）
@@ -12,29 +37,63 @@ load_dotenv("config.env.template")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_URL = os.getenv("PINECONE_URL")  # 末尾に /query を含まないこと
+# 埋め込みエンドポイント（テスト時はローカルの代替サーバーに切り替え可能）
+OPENAI_EMBEDDINGS_URL = os.getenv("OPENAI_EMBEDDINGS_URL", DEFAULT_EMBEDDING_URL)
+# ローカル埋め込みキャッシュ（EMBEDDING_CACHE_DIR を空にすると無効）
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR)
+EMBEDDING_CACHE_CAPACITY = os.getenv("EMBEDDING_CACHE_CAPACITY", DEFAULT_CAPACITY)
+# アプリと query_embeddings.py の回答キャッシュ（再取り込みした namespace の回答は破棄）
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", DEFAULT_ANSWER_CACHE_DIR)
+# ベクトルの書き込み先: "pinecone" または "local"（LOCAL_INDEX_DIR 配下のインデックス）
+VECTOR_STORE = os.getenv("VECTOR_STORE", DEFAULT_BACKEND)
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR)
+# ローカルインデックス: 取り込み後に IVF インデックスを学習する namespace のベクトル数
+LOCAL_ANN_MIN_ROWS = os.getenv("LOCAL_ANN_MIN_ROWS", DEFAULT_MIN_ROWS)
+# ローカルインデックス: IVF インデックスと同時にベクトルを圧縮（"int8" / "pq"、空: なし）
+LOCAL_QUANTIZATION = os.getenv("LOCAL_QUANTIZATION")
+# キーワード検索・ハイブリッド検索用の取り込み済みチャンクの BM25 索引（空なら作成しない）
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR)
+# チャンク本文のローカルストア。ベクトルは小さな属性だけを持つ（空: 無効）
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", DEFAULT_CHUNK_STORE_DIR)
+# ファイル内容ごとに抽出テキストをキャッシュし、チャンク分割のやり直しで再解析しない（空: 無効）
+EXTRACT_CACHE_DIR = os.getenv("EXTRACT_CACHE_DIR", DEFAULT_EXTRACT_CACHE_DIR)
+EXTRACT_CACHE_MAX_MB = os.getenv("EXTRACT_CACHE_MAX_MB", DEFAULT_MAX_MB)
+# これより大きいファイルは読まずにスキップ（0: 上限なし）
+EXTRACT_MAX_FILE_MB = os.getenv("EXTRACT_MAX_FILE_MB", DEFAULT_MAX_FILE_MB)
+# 取り込みジョブのチェックポイントとデッドレターキュー。--resume 用（空: 無効）
+INGEST_JOB_DIR = os.getenv("INGEST_JOB_DIR", DEFAULT_JOB_DIR)
+# モデル / "pinecone" ごとのクライアント側レート制限（アプリの RATE_LIMITS と同じ形式、
+# 例："text-embedding-3-small=3000:1000000,pinecone=6000"。未設定：制限なし）
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# 取り込みが使える各上限の割合（残りはアプリの質問に残す）
+INGEST_RATE_SHARE = float(os.getenv("INGEST_RATE_SHARE", "0.8"))
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", "30"))
+
+# ---------------------------
+# 取り込みのすべての OpenAI・Pinecone 呼び出しのスケジューラ（バックグラウンド優先度）：
+# モデルごとのレート制限、Retry-After に従うジッター付きバックオフでの再試行、
+# 宛先ごとのサーキットブレーカー
+# ---------------------------
+scheduler = Scheduler(
+    parse_limits(RATE_LIMITS),
+    background_share=INGEST_RATE_SHARE,
+    failure_threshold=CIRCUIT_BREAKER_FAILURES,
+    reset_seconds=CIRCUIT_BREAKER_RESET,
+)
+
+# 抽出ワーカープロセスで共有（エントリはアトミックに書き込まれる）
+extract_cache = open_extract_cache(EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_MB)
 
 
 # ---------------------------
-# ファイル種別に応じたテキスト抽出処理
-# PDF → pdfplumber
-# Word → python-docx
-# その他 → UTF-8でそのまま読み取り（例: .txt, .md, .py）
+# ファイル全文（小さいファイル向け。取り込みは extract_pages を直接使う）
+# ファイル種別ごとの抽出は extractors.py を参照（PDF・Word・HTML・CSV・Markdown・
+# テキストの抽出処理のレジストリ。バイナリファイルはスキップ）
 # ---------------------------
 def extract_text(file_path):
-    ext = os.path.splitext(file_path)[1].lower()
     try:
-        if ext == ".pdf":
-            text = ""
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() + "\n"
-            return text
-        elif ext == ".docx":
-            doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
-        else:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+        return "".join(text for _, text in extract_pages(file_path))
     except Exception as e:
         print(f"[警告] テキスト抽出失敗: {file_path} → {e}")
         return ""
@@ -60,6 +119,7 @@ def chunk_text(text, chunk_size=1000, overlap=200):
 # OpenAI API による埋め込み生成
 # モデル：text-embedding-3-small（2024年以降の高精度版）
 # 各チャンクをベクトル化し、Pineconeで意味検索に利用
+# 429 / 5xx はスケジューラが再試行する
 # ---------------------------
 def get_embedding(text):
     headers = {
@@ -67,63 +127,591 @@ def get_embedding(text):
         "Content-Type": "application/json",
     }
     data = {"input": text, "model": "text-embedding-3-small"}
-    response = requests.post(
-        "https://api.openai.com/v1/embeddings", headers=headers, json=data
+
+    def send():
+        response = requests.post(OPENAI_EMBEDDINGS_URL, headers=headers, json=data)
+        response.raise_for_status()
+        return response.json()
+
+    body = scheduler.call(data["model"], send, estimate_tokens(text))
+    return body["data"][0]["embedding"]
+
+
+# ---------------------------
+# 取り込み時の一括埋め込みに使うバッチャーを生成
+# チャンクはトークン予算ごとのバッチにまとめて配列入力で送信
+# 以前に埋め込んだチャンクは API ではなくローカルキャッシュから読み込む
+# ---------------------------
+def build_embedding_batcher():
+    cache = open_cache("ingest", EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_CAPACITY)
+    return EmbeddingBatcher(
+        OPENAI_API_KEY, url=OPENAI_EMBEDDINGS_URL, cache=cache, scheduler=scheduler
     )
-    response.raise_for_status()
-    return response.json()["data"][0]["embedding"]
+
+
+# ---------------------------
+# 埋め込みレポート（とキャッシュのヒット/ミス数）を表示し、キャッシュを書き出す
+# スケジューラの宛先（モデル / pinecone）ごとの再試行・429 も表示
+# ---------------------------
+def print_embedding_report(batcher):
+    print(f"[埋め込み] {batcher.report()}")
+    if scheduler.stats():
+        print(f"[上流API] {scheduler.report()}")
+    if batcher.cache:
+        print(f"[埋め込みキャッシュ] {batcher.cache.report()}")
+        batcher.cache.close()
+
+
+# ---------------------------
+# ベクトルの書き込み先となるベクトルストアを生成（Pinecone またはローカルインデックス）
+# backend: "pinecone" / "local"（省略時は VECTOR_STORE）
+# ---------------------------
+def build_vector_store(backend=None):
+    return open_vector_store(
+        backend or VECTOR_STORE,
+        local_dir=LOCAL_INDEX_DIR,
+        api_key=PINECONE_API_KEY,
+        url=PINECONE_URL,
+        ann_min_rows=LOCAL_ANN_MIN_ROWS,
+        quantization=LOCAL_QUANTIZATION,
+        scheduler=scheduler,
+    )
+
+
+# バックエンドごとのマニフェスト（ローカルインデックスはそのファイルと同じ場所に持つ）
+def default_manifest_path(backend=None):
+    if (backend or VECTOR_STORE) == "local":
+        return os.path.join(LOCAL_INDEX_DIR, DEFAULT_MANIFEST_PATH)
+    return DEFAULT_MANIFEST_PATH
+
+
+# ---------------------------
+# 一括アップサートに使うライターを生成
+# Pinecone: ベクトルは namespace ごとにバッファし、接続プール付き Session でバッチ送信
+# ローカル: メモリマップしたインデックスへバッチ単位で書き込む
+# lexical: 書き込む各ベクトルの本文を索引にも追加する LexicalIndex（任意）
+# chunks: 本文を保持する ChunkStore。ベクトルは本文なしで書き込まれる（任意）
+# ---------------------------
+def build_upsert_writer(store=None, lexical=None, chunks=None):
+    writer = (store or build_vector_store()).writer()
+    if chunks:
+        writer = chunks.writer(writer)
+    return lexical.writer(writer) if lexical else writer
 
 
 # ---------------------------
 # Pinecone へのアップロード処理
-# ID: ファイル名＋チャンク番号で一意に生成
+# ID: 取り込みルートからの相対パス＋チャンク番号で一意に生成（vector_id_base）
 # namespace: ユーザー指定の論理グループ（用途別に切り替え可能）
 # metadata: 検索時に返す元テキストやファイル情報を保持
+#           （CHUNK_STORE_DIR を設定すると本文は代わりにチャンクストアへ）
+# → ここではバッファに積むだけで、送信はライターが次のバッチでまとめて行う
 # ---------------------------
-def upload_to_pinecone(vector_id, embedding, metadata, namespace):
-    headers = {"Api-Key": PINECONE_API_KEY, "Content-Type": "application/json"}
-    url = f"{PINECONE_URL}/vectors/upsert"
-    data = {
-        "vectors": [{"id": vector_id, "values": embedding, "metadata": metadata}],
-        "namespace": namespace,
-    }
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code != 200:
-        print(f"[エラー] アップロード失敗: {vector_id} → {response.text}")
-    else:
-        print(f"[成功] アップロード: {vector_id}")
+def upload_to_pinecone(vector_id, embedding, metadata, namespace, writer):
+    writer.add(namespace, vector_id, embedding, metadata)
 
 
 # ---------------------------
-# 単一ファイルの全文をチャンク分割 → ベクトル化 → Pinecone登録
-# 各チャンクごとにアップロードとログ出力
+# バッチごとのアップロード結果を表示（複数ライターの結果をまとめて集計）
+# 失敗したバッチのみ個別に表示し、最後に集計を1行出力
 # ---------------------------
-def process_file(file_path, namespace):
-    text = extract_text(file_path)
-    if not text.strip():
+def print_upload_report(*writers):
+    summary = {}
+    for writer in writers:
+        for report in writer.reports:
+            if not report["ok"]:
+                print(
+                    f"[エラー] アップロード失敗: {len(report['ids'])}件 "
+                    f"（{report['ids'][0]} … {report['ids'][-1]}） → {report['error']}"
+                )
+        for key, value in writer.summary().items():
+            summary[key] = summary.get(key, 0) + value
+    print(
+        f"[アップロード] 成功 {summary['vectors_ok']}件（{summary['batches_ok']}バッチ）、"
+        f"失敗 {summary['vectors_failed']}件（{summary['batches_failed']}バッチ）"
+        f"（再試行 {summary['retries']}回、{summary['bytes']}バイト）"
+    )
+
+
+# ---------------------------
+# 実行時間の内訳（ステージごと）とトークン数／バイト数を表示
+# ---------------------------
+def print_metrics_report(metrics):
+    for stage in STAGES:
+        histogram = metrics.histogram("ingest_stage_seconds", stage=stage)
+        if histogram is not None:
+            print(f"[メトリクス] {stage}: {histogram.describe()}")
+    inputs = metrics.value("embedding_inputs_total")
+    cached = metrics.value("embedding_cache_hits_total")
+    print(
+        f"[メトリクス] 抽出 {metrics.value('extracted_bytes_total')}バイト、"
+        f"埋め込み {metrics.value('embedding_tokens_total')}トークン"
+        f"（リクエスト{metrics.value('embedding_requests_total')}回）、"
+        f"埋め込みキャッシュのヒット率 {cached / inputs if inputs else 0.0:.1%}、"
+        f"アップサート {metrics.value('upserted_bytes_total')}バイト、"
+        f"レート制限待ち {metrics.value('rate_limit_wait_seconds_total'):.1f}秒"
+    )
+    print(
+        f"[メトリクス] 抽出キャッシュから {metrics.value('extract_cache_hits_total')}ファイル、"
+        f"スキップ {metrics.value('extract_skipped_files_total')}ファイル、"
+        f"タイムアウト {metrics.value('extract_timeouts_total')}ファイル"
+    )
+
+
+# ---------------------------
+# 単一ファイルをページ単位でチャンク分割
+# (vector_id, chunk, metadata) を返す。metadata にはソースパスと、
+# PDFの場合はチャンク開始位置のページ番号を含む（heading 戦略では "section" も）
+# strategy / options: チャンク分割戦略（chunking.get_chunker を参照）
+# root: 取り込みルート。ベクトルIDは root からの相対パス（省略時はファイル名）で、
+#       サブフォルダにある同名のファイルも別のIDになる
+# 抽出エラーは例外として送出（パイプラインは次回実行時にそのファイルを再処理）
+# 抽出処理が扱わないファイル（バイナリ、大きすぎる など）はメッセージを出してスキップ
+# timing: ページの抽出にかかった秒数（"extract"）、抽出したテキストのサイズ（"bytes"）、
+#         ページを抽出キャッシュから読んだか（"cached"）、ファイルをスキップしたか
+#         （"skipped"）を受け取る dict。
+#         残りの時間はチャンク分割
+# ---------------------------
+def chunk_file(file_path, strategy=DEFAULT_STRATEGY, timing=None, root=None, **options):
+    kind, reason = detect_kind(file_path, EXTRACT_MAX_FILE_MB)
+    if kind is None:
+        print(f"[スキップ] {file_path} → {reason}")
+        if timing is not None:
+            timing["skipped"] = True
+        return
+    chunker = get_chunker(strategy, **options)
+    pages = load_pages(file_path, kind, strategy == "heading", timing)
+    if timing is not None:
+        pages = timed_pages(pages, timing)
+    base = vector_id_base(file_path, root)
+    count = 0
+    for info, chunk in chunker(pages):
+        count += 1
+        vector_id = f"{base}-chunk-{count}"
+        metadata = dict(info, source=file_path)
+        yield vector_id, chunk, metadata
+    if not count:
         print(f"[スキップ] 空または抽出不可: {file_path}")
+
+
+# ベクトルIDの前半（"<ルートからの相対パス>-chunk-<n>"、区切りは OS によらず "/"）
+def vector_id_base(file_path, root=None):
+    if root is None:
+        return os.path.basename(file_path)
+    return os.path.relpath(file_path, root).replace(os.sep, "/")
+
+
+# ---------------------------
+# ファイルのページ: 同じ内容を以前に抽出していれば抽出キャッシュから、
+# なければ抽出する（ファイル全体を読み終えた時点でキャッシュに保存）
+# kind: extractors.detect_kind が返した抽出処理の種別
+# ---------------------------
+def load_pages(file_path, kind, markdown_headings=False, timing=None):
+    if extract_cache is None:
+        yield from extract_pages(file_path, markdown_headings, kind)
         return
-    chunks = chunk_text(text)
-    for idx, chunk in enumerate(chunks):
-        vector_id = f"{os.path.basename(file_path)}-chunk-{idx+1}"
+    key = extract_cache.key(file_path, kind, markdown_headings=markdown_headings)
+    pages = extract_cache.get(key)
+    if timing is not None:
+        timing["cached"] = pages is not None
+    if pages is not None:
+        yield from pages
+        return
+    pages = []
+    for page in extract_pages(file_path, markdown_headings, kind):
+        pages.append(page)
+        yield page
+    extract_cache.put(key, pages)
+
+
+# 抽出にかかった時間とテキストのサイズを timing に加えるページのイテレーター
+def timed_pages(pages, timing):
+    timing.setdefault("extract", 0.0)
+    timing.setdefault("bytes", 0)
+    while True:
+        started = time.perf_counter()
+        page = next(pages, None)
+        timing["extract"] += time.perf_counter() - started
+        if page is None:
+            return
+        timing["bytes"] += len(page[1].encode("utf-8"))
+        yield page
+
+
+# chunk_file と同じだが、抽出エラー時は警告を表示するだけ
+def iter_file_chunks(file_path, **chunk_options):
+    try:
+        yield from chunk_file(file_path, **chunk_options)
+    except Exception as e:
+        print(f"[警告] テキスト抽出失敗: {file_path} → {e}")
+
+
+# ---------------------------
+# パイプラインのプロセスプールで実行する抽出＋チャンク化タスク
+# ワーカープロセスからジェネレーターは返せないためリストで返す
+# metrics: ファイルの抽出／チャンク分割の時間とテキストのサイズを記録する
+# ---------------------------
+def extract_and_chunk(file_path, metrics=None, **chunk_options):
+    if metrics is None:
+        return list(chunk_file(file_path, **chunk_options))
+    timing = {}
+    started = time.perf_counter()
+    chunks = list(chunk_file(file_path, timing=timing, **chunk_options))
+    total = time.perf_counter() - started
+    if timing.get("skipped"):
+        metrics.inc("extract_skipped_files_total")
+        return chunks
+    if timing.get("cached"):
+        metrics.inc("extract_cache_hits_total")
+    metrics.observe("ingest_stage_seconds", timing["extract"], stage="extract")
+    metrics.observe("ingest_stage_seconds", total - timing["extract"], stage="chunk")
+    metrics.inc("extracted_bytes_total", timing["bytes"])
+    return chunks
+
+
+# ---------------------------
+# チャンクをバッチでベクトル化 → Pinecone登録
+# 複数ファイルのチャンクが同じバッチに入っても (ソースパス, vector_id) で結果を対応付ける
+# （別々のファイルに同じ vector_id があっても取り違えない）
+# job: upsert したチャンクを記録し、失敗したチャンクをデッドレターとして残す
+#      IngestJob（None: 失敗は表示のみ）
+# ---------------------------
+def embed_and_upload(chunk_iter, namespace, batcher, writer, job=None):
+    pending = {}  # (source, vector_id) → (chunk, metadata)
+    sent = {}  # vector_id → (chunk, metadata)（writer がレポートするまで）
+    reported = len(writer.reports)
+
+    def items():
+        for vector_id, chunk, metadata in chunk_iter:
+            key = (metadata["source"], vector_id)
+            pending[key] = (chunk, metadata)
+            yield key, chunk
+
+    for key, embedding in batcher.embed(items()):
+        vector_id = key[1]
+        chunk, metadata = pending.pop(key)
         try:
-            embedding = get_embedding(chunk)
-            metadata = {"source": file_path, "text": chunk}
-            upload_to_pinecone(vector_id, embedding, metadata, namespace)
+            upload_to_pinecone(
+                vector_id, embedding, dict(metadata, text=chunk), namespace, writer
+            )
+            sent[vector_id] = (chunk, metadata)
         except Exception as e:
             print(f"[エラー] {vector_id} の処理中に失敗: {e}")
+            if job:
+                job.dead_letter(
+                    vector_id, metadata["source"], chunk, metadata, "upsert", e
+                )
+
+    for key, error in batcher.failed.items():
+        vector_id = key[1]
+        print(f"[エラー] 埋め込み失敗: {vector_id} → {error}")
+        if job and key in pending:
+            chunk, metadata = pending.pop(key)
+            job.dead_letter(
+                vector_id, metadata["source"], chunk, metadata, "embed", error
+            )
+    batcher.failed.clear()
+    writer.flush()
+    if job:
+        job.settle_reports(writer.reports[reported:], sent)
 
 
 # ---------------------------
-# ディレクトリ内の全ファイルを走査して順次処理
-# サブディレクトリも含め再帰的に処理
+# 単一ファイルの全文をチャンク分割 → ベクトル化 → Pinecone登録
+# job: 失敗したチャンクをデッドレターとして受け取る IngestJob（embed_and_upload を参照）
 # ---------------------------
-def process_directory(directory_path, namespace):
+def process_file(
+    file_path, namespace, batcher=None, writer=None, chunk_options=None, job=None
+):
+    if batcher is None:
+        batcher = build_embedding_batcher()
+        process_file(file_path, namespace, batcher, writer, chunk_options, job)
+        print_embedding_report(batcher)
+    elif writer is None:
+        chunk_store = open_chunk_store(CHUNK_STORE_DIR)
+        try:
+            with build_upsert_writer(chunks=chunk_store) as writer:
+                process_file(file_path, namespace, batcher, writer, chunk_options, job)
+        finally:
+            if chunk_store:
+                chunk_store.close()
+        print_upload_report(writer)
+    else:
+        chunks = iter_file_chunks(file_path, **(chunk_options or {}))
+        embed_and_upload(chunks, namespace, batcher, writer, job)
+
+
+# ディレクトリ内の全ファイルのパス（サブディレクトリも再帰的に含む）
+def iter_directory_files(directory_path):
     for root, _, files in os.walk(directory_path):
         for file in files:
-            file_path = os.path.join(root, file)
+            yield os.path.join(root, file)
+
+
+# ---------------------------
+# ディレクトリ内の全ファイルを走査し、並行パイプラインで処理
+# サブディレクトリも含め再帰的に処理
+# 抽出（プロセスプール）と埋め込み・アップサート（ワーカースレッド）を並行実行
+# options: 段ごとのワーカー数、キューサイズ、レート制限（IngestPipeline 参照）
+# manifest_path: 差分実行用のローカルマニフェスト（None の場合は全件処理）
+# full: 未変更のチャンクも再埋め込み（マニフェストは更新する）
+# chunk_options: チャンク分割の戦略とサイズ（例: {"strategy": "sentence", "max_tokens": 512}）
+# backend: 書き込み先のベクトルストア（"pinecone" / "local"、省略時は VECTOR_STORE）
+# resume: ディレクトリの取り込みジョブを前回の実行が止まったところから続ける
+#         （完了済みファイルと upsert 済みチャンクは再処理しない）
+# 実行の Metrics（ステージ時間とカウンター）を返す
+# ---------------------------
+def process_directory(
+    directory_path,
+    namespace,
+    manifest_path=DEFAULT_MANIFEST_PATH,
+    full=False,
+    chunk_options=None,
+    backend=None,
+    resume=False,
+    **options,
+):
+    job = open_ingest_job(
+        INGEST_JOB_DIR, job_id(backend or VECTOR_STORE, namespace, directory_path)
+    )
+    if job:
+        start_job(job, chunk_options or {}, resume)
+    batcher = build_embedding_batcher()
+    store = build_vector_store(backend)
+    manifest = IngestManifest(manifest_path) if manifest_path else None
+    sync = (
+        IncrementalSync(
+            manifest, namespace, directory_path, full=full, options=chunk_options
+        )
+        if manifest
+        else None
+    )
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    chunks = open_chunk_store(CHUNK_STORE_DIR)
+    metrics = Metrics()
+    pipeline = IngestPipeline(
+        partial(extract_and_chunk, root=directory_path, **(chunk_options or {})),
+        batcher,
+        partial(build_upsert_writer, store, lexical, chunks),
+        namespace,
+        sync=sync,
+        metrics=metrics,
+        job=job,
+        **options,
+    )
+    try:
+        writers = pipeline.run(iter_directory_files(directory_path))
+        if job:
+            job.finish()
+            job_summary = job.summary()
+        # ローカルインデックス: namespace が十分大きければ ANN インデックスを（再）学習
+        index = store.build_index(namespace)
+        if lexical:
+            # 今回の実行で書いた BM25 ポスティングリストをマージ
+            lexical.compact(namespace)
+            print(f"[キーワード索引] {namespace}: {lexical.count(namespace)} チャンク")
+        if extract_cache:
+            cached = extract_cache.prune()
+            print(
+                f"[抽出キャッシュ] {cached['files']}ファイル、"
+                f"{cached['bytes'] / (1024 * 1024):.1f} MB "
+                f"（古いものから {cached['removed']}ファイルを削除）"
+            )
+        if chunks:
+            stored = chunks.describe(namespace)
+            print(
+                f"[チャンクストア] {namespace}: {stored['chunks']} チャンクの本文、"
+                f"圧縮後 {stored['bytes'] / (1024 * 1024):.1f} MB"
+            )
+    finally:
+        if manifest:
+            manifest.close()
+        if lexical:
+            lexical.close()
+        if chunks:
+            chunks.close()
+        if job:
+            job.close()
+        store.close()
+
+    for vector_id, error in batcher.failed.items():
+        print(f"[エラー] 埋め込み失敗: {vector_id} → {error}")
+    print_embedding_report(batcher)
+    print_upload_report(*writers)
+    print_metrics_report(metrics)
+    if pipeline.sync_stats:
+        stats = pipeline.sync_stats
+        print(
+            f"[差分同期] 未変更ファイル {stats['files_skipped']}件、"
+            f"処理ファイル {stats['files_changed']}件、"
+            f"埋め込みチャンク {stats['chunks_embedded']}件、"
+            f"未変更チャンク {stats['chunks_unchanged']}件、"
+            f"削除した不要ベクトル {stats['vectors_deleted']}件"
+        )
+    if job:
+        print(
+            f"[ジョブ] 完了ファイル {job_summary['files_done']}件"
+            f"（止まった実行から引き継いだファイル {metrics.value('ingest_files_resumed_total')}件、"
+            f"チャンク {metrics.value('ingest_chunks_resumed_total')}件）、"
+            f"失敗ファイル {job_summary['files_failed']}件、"
+            f"デッドレターキューのチャンク {job_summary['dead_letters']}件"
+        )
+        if job_summary["dead_letters"]:
+            print("[ジョブ] --replay-dead-letters で再度埋め込み・upsert できます")
+    if index:
+        print(
+            f"[インデックス] IVFインデックスを学習しました: ベクトル {index['rows']}件、"
+            f"リスト {index['nlist']}件、量子化: {index['quantization'] or 'なし'}"
+        )
+
+    # キャッシュ済みの回答は変更・削除されたチャンクに基づいている可能性がある
+    stats = pipeline.sync_stats
+    if (
+        not stats
+        or stats["chunks_embedded"]
+        or stats["chunks_resumed"]
+        or stats["vectors_deleted"]
+    ):
+        removed = invalidate_answers(namespace, ANSWER_CACHE_DIR)
+        print(
+            f"[回答キャッシュ] {namespace} の回答キャッシュを無効化しました（{removed} 件）"
+        )
+    return metrics
+
+
+# ---------------------------
+# 取り込みジョブ（ingest_job.py を参照）の実行を開始し、何を引き継ぐかを表示
+# ---------------------------
+def start_job(job, chunk_options, resume):
+    job.start({"chunk_options": chunk_options}, resume)
+    stopped = job.previous_status == "running"
+    if job.resumed:
+        print(f"[ジョブ] 再開: 止まった実行で完了したファイル {len(job.done)}件")
+    elif resume and stopped:
+        print(
+            "[ジョブ] 止まった実行からチャンク分割オプションが変わったため、最初からやり直します"
+        )
+    elif resume:
+        print("[ジョブ] 再開できる実行がないため、新しいジョブを開始します")
+    elif stopped:
+        print(
+            "[ジョブ] 前回の実行は完了前に止まっています。最初からやり直します"
+            "（--resume で続きから再開できます）"
+        )
+
+
+# ---------------------------
+# ディレクトリの取り込みジョブのデッドレター（障害などで埋め込みまたは upsert に
+# 失敗したチャンク）を再度埋め込み・upsert する
+# 再実行できたチャンクはキューから除き、マニフェストに記録する → 次回の実行で
+# 再び埋め込まない。再び失敗したチャンクは残る（試行回数 + 1）
+# ---------------------------
+def replay_dead_letters(
+    directory_path, namespace, manifest_path=DEFAULT_MANIFEST_PATH, backend=None
+):
+    job = open_ingest_job(
+        INGEST_JOB_DIR, job_id(backend or VECTOR_STORE, namespace, directory_path)
+    )
+    if job is None:
+        print("[エラー] INGEST_JOB_DIR が空のため、取り込みジョブは無効です")
+        return
+    letters = job.dead_letters()
+    if not letters:
+        print(f"[ジョブ] {namespace} の {directory_path} にデッドレターはありません")
+        job.close()
+        return
+    print(f"[ジョブ] デッドレター {len(letters)}件を再実行します")
+    batcher = build_embedding_batcher()
+    store = build_vector_store(backend)
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    chunks = open_chunk_store(CHUNK_STORE_DIR)
+    try:
+        with build_upsert_writer(store, lexical, chunks) as writer:
+            embed_and_upload(
+                (
+                    (letter["vector_id"], letter["text"], letter["metadata"])
+                    for letter in letters
+                ),
+                namespace,
+                batcher,
+                writer,
+                job,
+            )
+        remaining = {letter["vector_id"] for letter in job.dead_letters()}
+        replayed = [
+            letter for letter in letters if letter["vector_id"] not in remaining
+        ]
+        if manifest_path and replayed:
+            record_replayed(manifest_path, namespace, replayed)
+        store.build_index(namespace)
+        if lexical:
+            lexical.compact(namespace)
+    finally:
+        if lexical:
+            lexical.close()
+        if chunks:
+            chunks.close()
+        job.close()
+        store.close()
+
+    print_embedding_report(batcher)
+    print_upload_report(writer)
+    print(
+        f"[ジョブ] デッドレター {len(replayed)}件を再実行、{len(remaining)}件は再び失敗"
+    )
+    if replayed:
+        removed = invalidate_answers(namespace, ANSWER_CACHE_DIR)
+        print(
+            f"[回答キャッシュ] {namespace} の回答キャッシュを無効化しました（{removed} 件）"
+        )
+
+
+# 再実行したチャンクのハッシュを記録。ファイルの行はそのままなので、次回の実行は
+# これらのファイルを確認するが、再実行したチャンクは変更なしと判定される
+def record_replayed(manifest_path, namespace, replayed):
+    manifest = IngestManifest(manifest_path)
+    try:
+        for path in {letter["path"] for letter in replayed}:
+            hashes = manifest.chunk_hashes(namespace, path)
+            hashes.update(
+                {
+                    letter["vector_id"]: text_sha256(letter["text"])
+                    for letter in replayed
+                    if letter["path"] == path
+                }
+            )
+            manifest.record_file(namespace, path, None, hashes)
+    finally:
+        manifest.close()
+
+
+# ---------------------------
+# 文書から Namespace の BM25 索引だけを（再）作成する（ベクトル化・
+# ベクトルストアへの書き込みなし）。例：索引の導入前に取り込んだ Namespace
+# 取り込みと同じチャンク分割・ベクトルIDを使うため、IDはベクトルと一致する
+# ---------------------------
+def build_lexical_index(directory_path, namespace, chunk_options=None):
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    if lexical is None:
+        print("[エラー] LEXICAL_INDEX_DIR が空のため、キーワード索引は無効です")
+        return
+    try:
+        lexical.clear(namespace)
+        for file_path in iter_directory_files(directory_path):
             print(f"[処理開始] {file_path}")
-            process_file(file_path, namespace)
+            lexical.upsert(
+                namespace,
+                [
+                    (vector_id, dict(metadata, text=chunk))
+                    for vector_id, chunk, metadata in iter_file_chunks(
+                        file_path, root=directory_path, **(chunk_options or {})
+                    )
+                ],
+            )
+        lexical.compact(namespace)
+        print(f"[キーワード索引] {namespace}: {lexical.count(namespace)} チャンク")
+    finally:
+        lexical.close()
 
 
 # ---------------------------
@@ -137,6 +725,102 @@ if __name__ == "__main__":
     parser.add_argument(
         "namespace", help="Pineconeのネームスペース（例: our-project-specs）"
     )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=None,
+        help="テキスト抽出・チャンク化のプロセス数（既定: CPU数）",
+    )
+    parser.add_argument(
+        "--embed-workers", type=int, default=4, help="埋め込み呼び出しのスレッド数"
+    )
+    parser.add_argument(
+        "--upsert-workers", type=int, default=2, help="Pineconeアップサートのスレッド数"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="段間でバッファする埋め込みバッチ数（バックプレッシャーの上限）",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=None, help="埋め込みの1分あたりリクエスト数上限"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=None, help="埋め込みの1分あたりトークン数上限"
+    )
+    parser.add_argument(
+        "--extract-timeout",
+        type=float,
+        default=DEFAULT_EXTRACT_TIMEOUT,
+        help="1 つのファイルの抽出・チャンク分割に許す秒数（0: 上限なし）",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5.0,
+        help="進捗表示の間隔（秒）",
+    )
+    parser.add_argument(
+        "--store",
+        choices=BACKENDS,
+        default=None,
+        help="書き込み先のベクトルストア（既定: VECTOR_STORE または pinecone）",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help=(
+            "未変更のファイル・チャンクをスキップするためのローカルマニフェスト"
+            f"（既定: {DEFAULT_MANIFEST_PATH}、--store local では LOCAL_INDEX_DIR 内）"
+        ),
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="マニフェストを読み書きせず全ファイルを処理",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="未変更のチャンクも再埋め込み（マニフェストは更新する）",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=sorted(CHUNKERS),
+        default=DEFAULT_STRATEGY,
+        help="チャンク分割戦略（chars: 従来どおり1000文字固定）",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=None,
+        help="1チャンクの最大トークン数（tokens/sentence/heading 戦略）",
+    )
+    parser.add_argument(
+        "--chunk-overlap-tokens",
+        type=int,
+        default=None,
+        help="チャンク間で引き継ぐトークン数（tokens/sentence/heading 戦略）",
+    )
+    parser.add_argument(
+        "--lexical-only",
+        action="store_true",
+        help="BM25 索引（LEXICAL_INDEX_DIR）だけを再作成する（ベクトル化・アップロードなし）",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "このディレクトリの取り込みジョブを前回止まったところから続ける"
+            f"（チェックポイントは INGEST_JOB_DIR、既定: {DEFAULT_JOB_DIR}）"
+        ),
+    )
+    parser.add_argument(
+        "--replay-dead-letters",
+        action="store_true",
+        help="このディレクトリのジョブで失敗したチャンクだけを再度埋め込み・upsert する",
+    )
     args = parser.parse_args()
 
     # フォルダ存在チェック
@@ -149,5 +833,40 @@ if __name__ == "__main__":
         print(f"[エラー] ディレクトリが空です: {args.directory}")
         exit(1)
 
+    chunk_options = {"strategy": args.chunker}
+    if args.chunker != "chars":
+        chunk_options.update(
+            max_tokens=args.chunk_tokens, overlap_tokens=args.chunk_overlap_tokens
+        )
+
+    if args.lexical_only:
+        build_lexical_index(args.directory, args.namespace, chunk_options)
+        exit(0)
+
+    manifest_path = (
+        None if args.no_manifest else args.manifest or default_manifest_path(args.store)
+    )
+    if args.replay_dead_letters:
+        replay_dead_letters(
+            args.directory, args.namespace, manifest_path, backend=args.store
+        )
+        exit(0)
+
     # 一括処理開始
-    process_directory(args.directory, args.namespace)
+    process_directory(
+        args.directory,
+        args.namespace,
+        extract_workers=args.extract_workers,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        progress_interval=args.progress_interval,
+        extract_timeout=args.extract_timeout,
+        manifest_path=manifest_path,
+        full=args.full,
+        chunk_options=chunk_options,
+        backend=args.store,
+        resume=args.resume,
+    )
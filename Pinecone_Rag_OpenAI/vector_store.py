@@ -0,0 +1,703 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from ann_index import DEFAULT_MIN_ROWS, DEFAULT_NPROBE, IVFIndex
+from clients import pinecone_index
+from pinecone_writer import PineconeUpsertWriter, summarize_reports
+from rate_limiter import PINECONE, Scheduler
+from quantization import (
+    DEFAULT_RERANK,
+    QuantizedVectors,
+    encode_rows,
+    train_quantizer,
+    write_compact,
+)
+
+# ---------------------------
+# ベクトルストアの抽象化（open_vector_store で名前を指定して選択）
+# pinecone: Pinecone インデックス（検索は SDK、書き込みは REST の一括ライター）
+# local:    ローカルディスク上のベクトル（ネットワークを経由せず、オフラインでも動作）
+# どちらのバックエンドも以下を提供:
+#   query(vector, top_k, namespace, include_metadata, filter) → [{"id", "score", "metadata"}]
+#   query_many(vectors, top_k, namespace, include_metadata, workers) → ベクトルごとの
+#              検索結果（pinecone: 並行クエリ、local: 1 回の行列演算）
+#   writer() → add / flush / delete / close / summary / reports を持つライター
+#              （PineconeUpsertWriter と同じインターフェースのため、取り込みはどちらでも動作）
+#   build_index(namespace) → 取り込み後に呼ぶ（local: ANN インデックスを学習）
+#   warm_up(namespace) → 最初の検索に必要なもの（クライアント・接続、ファイル）を開く
+# ---------------------------
+DEFAULT_BACKEND = "pinecone"
+DEFAULT_LOCAL_INDEX_DIR = ".vector_index"
+BACKENDS = ("pinecone", "local")
+
+
+# ---------------------------
+# Pinecone バックエンド
+# SDK クライアントは最初の検索時に生成（取り込みでは REST ライターのみ使用）
+# 検索と書き込みはスケジューラを通す（レート制限、再試行、サーキットブレーカー）
+# ---------------------------
+class PineconeStore:
+    def __init__(self, api_key, url=None, index_name=None, scheduler=None):
+        self.api_key = api_key
+        self.url = url
+        self.index_name = index_name
+        self.scheduler = scheduler or Scheduler()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = pinecone_index(self.api_key, self.index_name, self.url)
+        return self._index
+
+    # SDK クライアントを作成して接続を開く（インデックス統計のリクエスト 1 回）
+    def warm_up(self, namespace=""):
+        self.scheduler.call(PINECONE, self.index.describe_index_stats)
+
+    def query(self, vector, top_k=5, namespace="", include_metadata=True, filter=None):
+        options = {"filter": filter} if filter else {}
+        result = self.scheduler.call(
+            PINECONE,
+            lambda: self.index.query(
+                vector=vector,
+                top_k=top_k,
+                include_metadata=include_metadata,
+                namespace=namespace,
+                **options,
+            ),
+        )
+        # Pinecone の返却形式（dict / オブジェクト）の両方に対応
+        matches = result["matches"] if isinstance(result, dict) else result.matches
+        return [
+            {
+                "id": _field(match, "id"),
+                "score": _field(match, "score"),
+                "metadata": _field(match, "metadata") or {},
+            }
+            for match in matches
+        ]
+
+    # 複数のクエリをまとめて実行: 最大 `workers` 件を並行して送信（同じスケジューラー）
+    def query_many(
+        self, vectors, top_k=5, namespace="", include_metadata=True, workers=8
+    ):
+        vectors = list(vectors)
+        if not vectors:
+            return []
+        with ThreadPoolExecutor(max_workers=min(workers, len(vectors))) as pool:
+            return list(
+                pool.map(
+                    lambda vector: self.query(
+                        vector, top_k, namespace, include_metadata
+                    ),
+                    vectors,
+                )
+            )
+
+    def writer(self):
+        return PineconeUpsertWriter(self.api_key, self.url, scheduler=self.scheduler)
+
+    # Pinecone はインデックスを自身で管理する
+    def build_index(self, namespace, force=False, nlist=None):
+        return None
+
+    def close(self):
+        pass
+
+
+def _field(match, key):
+    return match[key] if isinstance(match, dict) else getattr(match, key, None)
+
+
+# ---------------------------
+# ローカルバックエンド: `directory` 配下に namespace ごとのディレクトリ
+# vectors.f32:  メモリマップした float32 配列（行数 × 次元数、長さ1に正規化）
+# rows.sqlite3: 行番号 → ベクトルIDとメタデータ（JSON）
+# 検索は全行のスコアを一度に計算し（行列×ベクトル）、argpartition で上位k件を選ぶ
+# → スコアは cosine 指標の Pinecone インデックスと同じコサイン類似度
+# namespace のベクトルが ann_min_rows 件以上になると build_index が IVF インデックス
+# （ann_index.py）を学習し、検索は最も近い nprobe 個のリストの行だけを採点する
+# quantization（"int8" / "pq"、quantization.py 参照）を指定するとベクトルも符号化し、
+# 検索はコードを走査して上位の候補を float のベクトルで再採点する
+# 返す行のメタデータだけを読むため、メモリ使用量はベクトル分にとどまる
+# ---------------------------
+class LocalVectorStore:
+    def __init__(
+        self,
+        directory=DEFAULT_LOCAL_INDEX_DIR,
+        nprobe=DEFAULT_NPROBE,
+        ann_min_rows=DEFAULT_MIN_ROWS,
+        quantization=None,
+    ):
+        self.directory = directory
+        self.nprobe = nprobe
+        self.ann_min_rows = ann_min_rows
+        self.quantization = quantization
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def namespace(self, namespace):
+        with self.lock:
+            if namespace not in self.namespaces:
+                # 既定の namespace "" は "_" として保存
+                path = os.path.join(self.directory, quote(namespace or "_", safe=""))
+                self.namespaces[namespace] = LocalNamespace(
+                    path, self.nprobe, self.quantization
+                )
+            return self.namespaces[namespace]
+
+    def query(self, vector, top_k=5, namespace="", include_metadata=True, filter=None):
+        return self.namespace(namespace).query(vector, top_k, include_metadata, filter)
+
+    # 複数のクエリをまとめて実行（workers は未使用。クエリは 1 回の行列演算を共有）
+    def query_many(
+        self, vectors, top_k=5, namespace="", include_metadata=True, workers=None
+    ):
+        return self.namespace(namespace).query_many(vectors, top_k, include_metadata)
+
+    # 最初の検索の前に namespace のファイル（メモリマップ、ANN インデックス）を開く
+    def warm_up(self, namespace=""):
+        self.namespace(namespace)
+
+    def upsert(self, namespace, vectors):
+        self.namespace(namespace).upsert(vectors)
+
+    def delete(self, namespace, ids):
+        self.namespace(namespace).delete(ids)
+
+    def writer(self):
+        return LocalStoreWriter(self)
+
+    def build_index(self, namespace, force=False, nlist=None):
+        return self.namespace(namespace).build_index(self.ann_min_rows, force, nlist)
+
+    # namespace ごとのベクトル数
+    def describe(self):
+        names = os.listdir(self.directory)
+        stats = {}
+        for name in sorted(names):
+            if os.path.isdir(os.path.join(self.directory, name)):
+                namespace = _unquote_namespace(name)
+                stats[namespace] = self.namespace(namespace).count()
+        return stats
+
+    def close(self):
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.close()
+            self.namespaces.clear()
+
+
+def _unquote_namespace(name):
+    return "" if name == "_" else unquote(name)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+_INITIAL_ROWS = 1024
+_SQL_BATCH = 500  # "IN (...)" 1回あたりのパラメーター数
+# query_many が一度に計算するスコア数（クエリ数 × 行数）
+_SCORE_BLOCK = 16 * 1024 * 1024
+
+
+class LocalNamespace:
+    def __init__(
+        self, path, nprobe=DEFAULT_NPROBE, quantization=None, rerank=DEFAULT_RERANK
+    ):
+        self.path = path
+        self.nprobe = nprobe
+        self.quantization = quantization  # build_index で学習する種類（None: なし）
+        self.rerank = rerank
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.conn = sqlite3.connect(
+            os.path.join(path, "rows.sqlite3"), check_same_thread=False
+        )
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.version = None
+        self.dim = None
+        self.vectors = None  # memmap（容量 × 次元数）、空の間は None
+        self.live = np.zeros(0, dtype=bool)  # ベクトルが入っている行
+        self.ann = IVFIndex(path)
+        self.quantized = QuantizedVectors(path)
+        self._refresh()
+
+    # ---------------------------
+    # 別プロセス（取り込み処理など）が変更をコミットした後に再読み込み
+    # PRAGMA data_version は他の接続からのコミットでのみ変化する
+    # ---------------------------
+    def _refresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return
+        self.version = version
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        if row is None:
+            return
+        self.dim = int(row[0])
+        self._open_vectors()
+        capacity = len(self.vectors) if self.vectors is not None else 0
+        self.ann.load(capacity)
+        self.quantized.load(capacity)
+        self.live = np.zeros(capacity, bool)
+        rows = [r for (r,) in self.conn.execute("SELECT row FROM rows")]
+        self.live[rows] = True
+
+    def _open_vectors(self):
+        size = (
+            os.path.getsize(self.vectors_path)
+            if os.path.exists(self.vectors_path)
+            else 0
+        )
+        capacity = size // (self.dim * 4)
+        self.vectors = (
+            np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dim),
+            )
+            if capacity
+            else None
+        )
+
+    # 少なくとも `capacity` 行が入るようにベクトルファイルを拡張
+    def _grow(self, capacity):
+        old = len(self.live)
+        capacity = max(capacity, old * 2, _INITIAL_ROWS)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._open_vectors()
+        self.ann.resize(capacity)
+        self.quantized.resize(capacity)
+        live = np.zeros(capacity, dtype=bool)
+        live[:old] = self.live
+        self.live = live
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return int(self.live.sum())
+
+    # ---------------------------
+    # ベクトルを追加または置換: [{"id", "values", "metadata"}, ...]
+    # 行をコミットする前にベクトルをディスクへ書き出すため、
+    # 読み取り側がベクトル未書き込みの行を見ることはない
+    # ---------------------------
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        # 1バッチ内で同じIDが複数ある場合は最後のものを採用
+        latest = {vector["id"]: vector for vector in vectors}
+        ids = list(latest)
+        values = np.asarray([latest[i]["values"] for i in ids], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms > 0, norms, 1)
+
+        with self.lock:
+            self._refresh()
+            if self.dim is None:
+                self.dim = values.shape[1]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO info VALUES ('dim', ?)", (self.dim,)
+                )
+            elif values.shape[1] != self.dim:
+                raise ValueError(
+                    f"ベクトルの次元数 {values.shape[1]} が "
+                    f"{self.path} の次元数 {self.dim} と一致しません"
+                )
+            existing = dict(self._select("SELECT id, row FROM rows WHERE id IN", ids))
+            new_count = sum(1 for i in ids if i not in existing)
+            free = np.flatnonzero(~self.live)
+            if len(free) < new_count:
+                self._grow(len(self.live) + new_count - len(free))
+                free = np.flatnonzero(~self.live)
+            free = iter(free.tolist())
+            rows = [existing[i] if i in existing else next(free) for i in ids]
+
+            self.vectors[rows] = values
+            self.vectors.flush()
+            # 新しい行は最も近い IVF リストに追加（インデックス学習前は何もしない）
+            self.ann.assign(rows, values)
+            self.ann.flush()
+            self.quantized.assign(rows, values)
+            self.quantized.flush()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                [
+                    (
+                        row,
+                        i,
+                        json.dumps(latest[i].get("metadata") or {}, ensure_ascii=False),
+                    )
+                    for row, i in zip(rows, ids)
+                ],
+            )
+            self.conn.commit()
+            self.live[rows] = True
+
+    def delete(self, ids):
+        with self.lock:
+            self._refresh()
+            rows = [
+                r for _, r in self._select("SELECT id, row FROM rows WHERE id IN", ids)
+            ]
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                self.conn.execute(
+                    f"DELETE FROM rows WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            self.conn.commit()
+            self.live[rows] = False
+
+    # ---------------------------
+    # コサイン類似度の上位 k 件
+    # IVF インデックスの学習後は最も近い nprobe 個のリストの行だけを採点し、
+    # nprobe=0 またはフィルタ指定時は全行を採点する
+    # rerank: _score 参照（None: namespace の設定）
+    # filter: メタデータ項目に対する {"key": value} または {"key": {"$eq": value}}
+    # ---------------------------
+    def query(
+        self,
+        vector,
+        top_k=5,
+        include_metadata=True,
+        filter=None,
+        nprobe=None,
+        rerank=None,
+    ):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        nprobe = self.nprobe if nprobe is None else nprobe
+        rerank = self.rerank if rerank is None else rerank
+        with self.lock:
+            self._refresh()
+            if self.vectors is None or not self.live.any():
+                return []
+            if self.ann.trained and nprobe and not filter:
+                rows = np.sort(self.ann.candidates(query, nprobe))
+                rows = rows[self.live[rows]]
+            else:
+                mask = self._filter_mask(filter) if filter else self.live
+                rows = np.flatnonzero(mask)
+            rows, scores = self._score(rows, query, top_k, rerank)
+            k = min(top_k, len(rows))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            scores = scores[top].tolist()
+            top = rows[top].tolist()
+            found = self._rows(top)
+        return _matches(top, scores, found, include_metadata)
+
+    # ---------------------------
+    # 複数のクエリの上位 k 件（ベクトルごとに検索結果のリスト）
+    # 厳密検索では、クエリのブロックと全行のスコアを 1 回の行列演算で計算する
+    # （スコア行列が約 64 MB に収まるブロックサイズ）。学習済みの IVF インデックスや
+    # 量子化コードがある場合は、クエリごとに query() を実行する
+    # ---------------------------
+    def query_many(self, vectors, top_k=5, include_metadata=True):
+        if not len(vectors):
+            return []
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+        with self.lock:
+            self._refresh()
+            if self.vectors is None or not self.live.any() or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            exact = self.quantized.quantizer is None and not (
+                self.ann.trained and self.nprobe
+            )
+            if exact:
+                rows = np.flatnonzero(self.live)
+                k = min(top_k, len(rows))
+                # _score と同様: 大半の行が有効なら全行を計算してから有効な行を取り出す
+                whole = len(rows) > len(self.live) // 2
+                matrix = self.vectors if whole else self.vectors[rows]
+                block = max(1, _SCORE_BLOCK // len(matrix))
+                tops, top_scores = [], []
+                for start in range(0, len(queries), block):
+                    scores = queries[start : start + block] @ matrix.T
+                    if whole:
+                        scores = scores[:, rows]
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    best = np.take_along_axis(scores, top, axis=1)
+                    order = np.argsort(-best, axis=1, kind="stable")
+                    tops += rows[np.take_along_axis(top, order, axis=1)].tolist()
+                    top_scores += np.take_along_axis(best, order, axis=1).tolist()
+                found = self._rows(sorted({row for top in tops for row in top}))
+        if not exact:
+            return [self.query(query, top_k, include_metadata) for query in queries]
+        return [
+            _matches(top, scores, found, include_metadata)
+            for top, scores in zip(tops, top_scores)
+        ]
+
+    # 指定した行の 行番号 → (ベクトルID, メタデータJSON)
+    def _rows(self, rows):
+        return {
+            row: (vector_id, metadata)
+            for vector_id, row, metadata in self._select(
+                "SELECT id, row, metadata FROM rows WHERE row IN", rows
+            )
+        }
+
+    # ---------------------------
+    # 候補行のスコア
+    # 量子化コードがあれば先にコードを採点し、上位 top_k × rerank 行だけを
+    # float のベクトルで再採点する
+    # （rerank=0 ではコードの近似スコアをそのまま返す）
+    # ---------------------------
+    def _score(self, rows, query, top_k, rerank):
+        if self.quantized.quantizer is not None:
+            scores = self.quantized.score(query, rows)
+            if not rerank:
+                return rows, scores
+            keep = min(len(rows), top_k * rerank)
+            if keep < len(rows):
+                rows = np.sort(rows[np.argpartition(-scores, keep - 1)[:keep]])
+        elif len(rows) > len(self.live) // 2:
+            return rows, (self.vectors @ query)[rows]
+        return rows, self.vectors[rows] @ query
+
+    # ---------------------------
+    # namespace のベクトルが min_rows 件以上になったら IVF インデックスを学習（再学習）
+    # 差分追加でリストの大きさが偏るため、前回の学習から
+    # namespace が2倍になったら再学習する
+    # 量子化器（設定時）も同時に学習する
+    # 学習した場合は {"rows", "nlist", "quantization"}、それ以外は None を返す
+    # ---------------------------
+    def build_index(self, min_rows=DEFAULT_MIN_ROWS, force=False, nlist=None):
+        with self.lock:
+            self._refresh()
+            rows = np.flatnonzero(self.live)
+            if not len(rows):
+                return None
+            trained = self.conn.execute(
+                "SELECT value FROM info WHERE key = 'ann_rows'"
+            ).fetchone()
+            stale = (
+                force
+                or not self.ann.trained
+                or not trained
+                or len(rows) >= int(trained[0]) * 2
+            )
+            quantize = self.quantization and (
+                stale or self.quantized.kind != self.quantization
+            )
+            if not force and (len(rows) < min_rows or not (stale or quantize)):
+                return None
+            if stale:
+                self.ann.train(self.vectors, rows, nlist)
+            if quantize:
+                self.quantized.train(self.quantization, self.vectors, rows)
+            # コミットにより他のプロセスがインデックスを再読み込みする（_refresh 参照）
+            self.conn.execute(
+                "INSERT OR REPLACE INTO info VALUES ('ann_rows', ?)", (len(rows),)
+            )
+            self.conn.commit()
+            return {
+                "rows": len(rows),
+                "nlist": len(self.ann.centroids),
+                "quantization": self.quantized.kind,
+            }
+
+    # ---------------------------
+    # namespace の検索可能な圧縮コピーを書き出す（quantization.CompactIndex 参照）
+    # namespace の量子化器が同じ種類ならそれを再利用する
+    # 書き出したベクトル数を返す
+    # ---------------------------
+    def export(self, path, kind="pq", subspaces=None):
+        with self.lock:
+            self._refresh()
+            found = self.conn.execute(
+                "SELECT row, id, metadata FROM rows ORDER BY row"
+            ).fetchall()
+            if not found:
+                raise ValueError(f"{self.path} にベクトルがありません")
+            rows = np.asarray([row for row, _, _ in found])
+            quantizer = self.quantized.quantizer
+            if quantizer is not None and quantizer.kind == kind and not subspaces:
+                codes = np.asarray(self.quantized.codes[rows])
+            else:
+                quantizer = train_quantizer(kind, self.vectors, rows, subspaces)
+                codes = encode_rows(quantizer, self.vectors, rows)
+        write_compact(
+            path,
+            quantizer,
+            codes,
+            [vector_id for _, vector_id, _ in found],
+            [json.loads(metadata) for _, _, metadata in found],
+        )
+        return len(found)
+
+    def _filter_mask(self, filter):
+        conditions = []
+        params = []
+        for key, value in filter.items():
+            if isinstance(value, dict):
+                if set(value) != {"$eq"}:
+                    raise ValueError(f"ローカルストアでは未対応のフィルター: {value}")
+                value = value["$eq"]
+            conditions.append("json_extract(metadata, ?) = ?")
+            params += [f"$.{key}", value]
+        mask = np.zeros(len(self.live), dtype=bool)
+        rows = [
+            r
+            for (r,) in self.conn.execute(
+                f"SELECT row FROM rows WHERE {' AND '.join(conditions)}", params
+            )
+        ]
+        mask[rows] = True
+        return mask & self.live
+
+    # "... IN (?, ...)" を分割して実行し、全行を返す
+    def _select(self, sql, values):
+        results = []
+        for start in range(0, len(values), _SQL_BATCH):
+            batch = values[start : start + _SQL_BATCH]
+            results += self.conn.execute(
+                f"{sql} ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+        return results
+
+    def close(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+            self.conn.close()
+
+
+# 指定した行とスコアの検索結果（スコアの高い順）
+def _matches(rows, scores, found, include_metadata):
+    matches = []
+    for row, score in zip(rows, scores):
+        vector_id, metadata = found[row]
+        matches.append(
+            {
+                "id": vector_id,
+                "score": score,
+                "metadata": json.loads(metadata) if include_metadata else {},
+            }
+        )
+    return matches
+
+
+# ---------------------------
+# ローカルストア用のライター（PineconeUpsertWriter と同じインターフェース・レポート）
+# ベクトルをバッファし、max_batch_vectors 件ずつ書き込む
+# ---------------------------
+class LocalStoreWriter:
+    def __init__(self, store, max_batch_vectors=1000):
+        self.store = store
+        self.max_batch_vectors = max_batch_vectors
+        self.buffers = {}  # namespace → [vector, ...]
+        self.reports = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        vector = {"id": vector_id, "values": values, "metadata": metadata}
+        self.buffers.setdefault(namespace, []).append(vector)
+        if len(self.buffers[namespace]) >= self.max_batch_vectors:
+            self.flush(namespace)
+
+    def flush(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            vectors = self.buffers.pop(ns, [])
+            if vectors:
+                ids = [vector["id"] for vector in vectors]
+                self.reports.append(
+                    self._run(ns, ids, lambda: self.store.upsert(ns, vectors))
+                )
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        return [self._run(namespace, ids, lambda: self.store.delete(namespace, ids))]
+
+    def _run(self, namespace, ids, operation):
+        report = {
+            "namespace": namespace,
+            "ids": ids,
+            "bytes": 0,
+            "attempts": 1,
+            "ok": False,
+            "error": None,
+        }
+        started = time.perf_counter()
+        try:
+            operation()
+            report["ok"] = True
+        except Exception as e:
+            report["error"] = str(e)
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    def close(self):
+        self.flush()
+        return self.reports
+
+    def summary(self):
+        return summarize_reports(self.reports)
+
+
+# ---------------------------
+# 設定されたバックエンドを生成
+# backend: "pinecone" or "local"
+# local_dir: ローカルバックエンドのディレクトリ
+# nprobe / ann_min_rows: ローカルバックエンドの IVF 検索幅と学習のしきい値
+# quantization: IVF インデックスと同時に作成するコード（"int8" / "pq"、None: なし）
+# api_key / url / index_name: Pinecone の設定
+# scheduler: Pinecone 呼び出しの Scheduler（OpenAI 呼び出しと共有）
+# ---------------------------
+def open_vector_store(
+    backend=DEFAULT_BACKEND,
+    local_dir=DEFAULT_LOCAL_INDEX_DIR,
+    api_key=None,
+    url=None,
+    index_name=None,
+    nprobe=DEFAULT_NPROBE,
+    ann_min_rows=DEFAULT_MIN_ROWS,
+    quantization=None,
+    scheduler=None,
+):
+    if backend == "local":
+        return LocalVectorStore(
+            local_dir, int(nprobe), int(ann_min_rows), quantization or None
+        )
+    if backend == "pinecone":
+        return PineconeStore(api_key, url, index_name, scheduler)
+    raise ValueError(
+        f"不明なベクトルストア: {backend}（選択肢: {', '.join(BACKENDS)}）"
+    )
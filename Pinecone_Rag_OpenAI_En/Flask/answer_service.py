@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from clients import async_openai_client, startup
+from embedding_batcher import estimate_tokens
+from query_batcher import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT, AsyncMicroBatcher
+from rate_limiter import INTERACTIVE, Scheduler
+
+# ---------------------------
+# Concurrent upstream calls for the web app
+# One asyncio event loop per process (in a background thread) runs every
+# OpenAI and vector search call, so a request thread only waits for its result
+# → many questions can be in flight at once over a few pooled connections
+# OpenAI:        one AsyncOpenAI client (HTTP connections with keep-alive, shared)
+# Vector search: blocking SDK / local index calls run in a bounded thread pool
+# Lexical search: BM25 queries on the local index (lexical_index.py), same pool
+# Chunk texts: one lookup in the local chunk store per search (chunk_store.py), same pool
+# Local caches: embedding / answer cache lookups and stores (SQLite), same pool
+# Each stage has its own concurrency limit and timeout (see config.py)
+# Questions are embedded in micro-batches (one request for the questions that
+# arrive within embed_batch_wait seconds, see query_batcher.py)
+# metrics: Metrics receiving the latency of each upstream call (without the wait
+# for a free slot), the tokens reported by OpenAI and the size of search results
+# scheduler: Scheduler of the OpenAI calls (per-model rate limits, retries with
+# backoff honouring Retry-After, circuit breaker); pass the vector store the same
+# one for the Pinecone calls. Its calls run with interactive priority by default
+# ---------------------------
+STAGES = ("embed", "search", "lexical", "chat")
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage} did not finish within {seconds} seconds")
+        self.stage = stage
+
+
+class AnswerService:
+    def __init__(
+        self,
+        api_key,
+        vector_store,
+        concurrency=None,
+        timeouts=None,
+        max_retries=2,
+        embed_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        embed_batch_wait=DEFAULT_MAX_WAIT,
+        metrics=None,
+        lexical_index=None,
+        chunk_store=None,
+        scheduler=None,
+    ):
+        concurrency = concurrency or {}
+        self.timeouts = timeouts or {}
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_wait = embed_batch_wait
+        self.embed_batchers = {}  # model → AsyncMicroBatcher (used on the loop only)
+        self.metrics = metrics
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.chunk_store = chunk_store
+        self.scheduler = scheduler or Scheduler(
+            priority=INTERACTIVE, max_retries=max_retries
+        )
+        self.api_key = api_key
+        self._client = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency.get("search", 16),
+            thread_name_prefix="vector-search",
+        )
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self.loop.run_forever, name="answer-service", daemon=True
+        ).start()
+        # Semaphores belong to the loop, so they are created on it
+        self.limits = self.run(self._make_limits(concurrency))
+        self.counters = {stage: {"in_flight": 0, "timeouts": 0} for stage in STAGES}
+
+    async def _make_limits(self, concurrency):
+        return {
+            stage: asyncio.Semaphore(concurrency.get(stage, 32)) for stage in STAGES
+        }
+
+    # AsyncOpenAI client, created on first use (importing the SDK takes most of
+    # the startup time); retries are left to the scheduler
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = async_openai_client(self.api_key)
+        return self._client
+
+    # ---------------------------
+    # Open the connections before the first question: one OpenAI request (a
+    # model lookup) opens a keep-alive connection, and the vector store and the BM25
+    # index open the served namespaces
+    # Returns {part: error} for what failed; serving starts anyway (the first
+    # calls then connect, with the scheduler's retries)
+    # ---------------------------
+    def warm_up(self, namespaces, model):
+        errors = {}
+        parts = {"openai": lambda: self.run(self.client.models.retrieve(model))}
+        for namespace in namespaces:
+            parts[f"vector store {namespace}"] = partial(
+                self.vector_store.warm_up, namespace
+            )
+            if self.lexical_index is not None:
+                parts[f"lexical index {namespace}"] = partial(
+                    self.lexical_index.namespace, namespace
+                )
+        for name, call in parts.items():
+            try:
+                with startup.phase("warm-up", name):
+                    call()
+            except Exception as e:
+                errors[name] = str(e)
+        return errors
+
+    # ---------------------------
+    # Run a coroutine on the service loop and wait for its result (from any thread)
+    # ---------------------------
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    # ---------------------------
+    # Run one stage under its concurrency limit and timeout
+    # call() creates the awaitable once a slot is free
+    # (the wait for a free slot counts towards the timeout)
+    # upstream: scheduler key (model name) of an OpenAI call; the call then waits
+    # for the rate limit and is retried (retries count towards the timeout too)
+    # ---------------------------
+    async def _stage(self, stage, call, upstream=None, tokens=0):
+        timeout = self.timeouts.get(stage)
+        counters = self.counters[stage]
+
+        async def limited():
+            async with self.limits[stage]:
+                counters["in_flight"] += 1
+                started = time.perf_counter()
+                try:
+                    if upstream is None:
+                        return await call()
+                    return await self.scheduler.acall(upstream, call, tokens)
+                finally:
+                    counters["in_flight"] -= 1
+                    if self.metrics is not None:
+                        self.metrics.observe(
+                            "upstream_seconds",
+                            time.perf_counter() - started,
+                            stage=stage,
+                        )
+
+        try:
+            return await asyncio.wait_for(limited(), timeout)
+        except asyncio.TimeoutError:
+            counters["timeouts"] += 1
+            raise StageTimeout(stage, timeout) from None
+
+    async def embed(self, text, model):
+        batcher = self.embed_batchers.get(model)
+        if batcher is None:
+            batcher = self.embed_batchers[model] = AsyncMicroBatcher(
+                partial(self._embed_many, model=model),
+                self.embed_batch_size,
+                self.embed_batch_wait,
+            )
+        return await batcher.embed(text)
+
+    # One embeddings request for a batch of questions (vectors in input order)
+    async def _embed_many(self, texts, model):
+        response = await self._stage(
+            "embed",
+            lambda: self.client.embeddings.create(model=model, input=texts),
+            model,
+            sum(estimate_tokens(text) for text in texts),
+        )
+        self._count_tokens(response.usage, model)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    async def search(self, vector, **options):
+        loop = asyncio.get_running_loop()
+        call = partial(self.vector_store.query, vector, **options)
+        matches = await self._stage(
+            "search", lambda: loop.run_in_executor(self.executor, call)
+        )
+        if self.metrics is not None:
+            # Size of the results as JSON (IDs, scores, metadata; without the
+            # vectors) → shows what slim metadata saves per query
+            size = len(json.dumps(matches, ensure_ascii=False).encode("utf-8"))
+            self.metrics.inc("search_response_bytes_total", size)
+        return matches
+
+    async def lexical_search(self, text, **options):
+        loop = asyncio.get_running_loop()
+        call = partial(self.lexical_index.search, text, **options)
+        return await self._stage(
+            "lexical", lambda: loop.run_in_executor(self.executor, call)
+        )
+
+    # Matches with their texts looked up in the chunk store (when enabled)
+    async def resolve_texts(self, matches):
+        if self.chunk_store is None or not matches:
+            return matches
+        loop = asyncio.get_running_loop()
+        call = partial(self.chunk_store.resolve, matches)
+        return await self._stage(
+            "search", lambda: loop.run_in_executor(self.executor, call)
+        )
+
+    # A blocking call on a local cache (SQLite) from the loop: run in the thread
+    # pool so that the other questions on the loop do not wait for it
+    async def offload(self, call, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(call, *args))
+
+    async def chat(self, **options):
+        completion = await self._stage(
+            "chat",
+            lambda: self.client.chat.completions.create(**options),
+            options.get("model"),
+            _chat_tokens(options),
+        )
+        self._count_tokens(completion.usage, options.get("model"))
+        return completion
+
+    # ---------------------------
+    # Streamed completion: yields the text of each delta as it arrives
+    # The timeout covers the wait for the first response, not the whole answer
+    # The token usage arrives in a last chunk without choices
+    # ---------------------------
+    async def chat_stream(self, **options):
+        stream = await self._stage(
+            "chat",
+            lambda: self.client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **options
+            ),
+            options.get("model"),
+            _chat_tokens(options),
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None):
+                self._count_tokens(chunk.usage, options.get("model"))
+
+    # Prompt / completion tokens of a response (when metrics are enabled)
+    def _count_tokens(self, usage, model):
+        if self.metrics is None or usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            tokens = getattr(usage, kind, None)
+            if tokens:
+                self.metrics.inc("openai_tokens_total", tokens, model=model, kind=kind)
+
+    # ---------------------------
+    # Iterate an async generator from a request thread (for streamed responses)
+    # Closing the iterator (client gone) also closes the generator on the loop
+    # ---------------------------
+    def iterate(self, generator):
+        try:
+            while True:
+                try:
+                    yield self.run(generator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(generator.aclose())
+
+    # In-flight / timed-out calls per stage, the embedding batches, and the
+    # retries / 429s / circuit state per upstream
+    def stats(self):
+        stats = {stage: dict(counters) for stage, counters in self.counters.items()}
+        stats["embed_batching"] = {
+            model: batcher.stats.snapshot()
+            for model, batcher in self.embed_batchers.items()
+        }
+        stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+
+# Tokens a chat completion counts against the per-minute limit (prompt estimate
+# plus the completion budget)
+def _chat_tokens(options):
+    prompt = sum(
+        estimate_tokens(message.get("content") or "")
+        for message in options.get("messages", [])
+    )
+    return prompt + (options.get("max_tokens") or 0)
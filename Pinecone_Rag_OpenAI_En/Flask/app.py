@@ -1,13 +1,41 @@
+import sys  # Standard library for handling command-line arguments
+import os  # Standard library for path handling
+
+# Make the shared modules in the project root (one level up) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Lazy clients, startup timing and pre-forked workers (imported first: it starts the clock)
+from clients import Lazy, prefork, preload, preload_clients, startup
+
 from flask import (
     Flask,
+    Response,
     render_template,
     request,
     jsonify,
+    stream_with_context,
 )  # Import core Flask modules
-import openai  # Library for using OpenAI API
-from pinecone import Pinecone  # Pinecone Python SDK
 import config  # Custom module containing API keys, etc.
-import sys  # Standard library for handling command-line arguments
+import argparse  # Standard library for the command-line options
+import asyncio  # Standard library for searching several namespaces in parallel
+import json  # Standard library for encoding streamed events
+import socket  # Standard library for the listening socket shared by pre-forked workers
+import time  # Standard library for measuring the time an answer took
+
+startup.mark("import", "flask")
+
+from embedding_cache import open_cache  # Local on-disk embedding cache
+from answer_cache import open_answer_cache  # Answers to (near-)repeated questions
+from vector_store import open_vector_store  # Pinecone or local vector index
+from lexical_index import SEARCH_MODES, fuse, open_lexical_index  # Local BM25 index
+from chunk_store import open_chunk_store  # Chunk texts of slim vectors
+from answer_service import AnswerService, StageTimeout  # Concurrent upstream calls
+from metrics import Metrics, Trace  # Stage timers and counters (/metrics)
+from context_builder import ContextStats, build_context  # Prompt context packing
+from chunking import tokenizer  # Tokenizer counting the context tokens
+from rate_limiter import INTERACTIVE, CircuitOpenError, Scheduler, parse_limits  # Rate limits / retries
+
+startup.mark("import", "project modules")
 
 # ---------------------------
 # Initialize Flask application
@@ -15,27 +43,178 @@ import sys  # Standard library for handling command-line arguments
 app = Flask(__name__)
 
 # ---------------------------
-# Initialize OpenAI and Pinecone settings
+# Client-side scheduler of every OpenAI and Pinecone call: per-model rate limits
+# (RATE_LIMITS), retries with jittered backoff honouring Retry-After, and a circuit
+# breaker per upstream. Calls from /query have interactive priority
+# ---------------------------
+scheduler = Scheduler(
+    parse_limits(config.RATE_LIMITS),
+    priority=INTERACTIVE,
+    max_retries=config.OPENAI_MAX_RETRIES,
+    failure_threshold=config.CIRCUIT_BREAKER_FAILURES,
+    reset_seconds=config.CIRCUIT_BREAKER_RESET,
+)
+
+# ---------------------------
+# Clients, indexes and caches are opened on first use (Lazy; .get() returns them)
+# → importing the app (WSGI server, tests, benchmarks) does no network or disk
+#   setup; warm_up() opens them all before serving
+# ---------------------------
+
+# ---------------------------
+# Initialize OpenAI and vector store settings
 # Use API keys defined in config.py
 # Pinecone host URL is manually specified (supports self-hosted endpoint)
+# VECTOR_STORE=local searches the local index instead (no network hop)
 # ---------------------------
-openai.api_key = config.OPENAI_API_KEY
-pc = Pinecone(api_key=config.PINECONE_API_KEY)
-index = pc.Index(
-    name=config.PINECONE_INDEX_NAME,
-    host=config.PINECONE_URL,
+vector_store = Lazy(
+    "vector_store",
+    open_vector_store,
+    config.VECTOR_STORE,
+    local_dir=config.LOCAL_INDEX_DIR,
+    nprobe=config.LOCAL_ANN_NPROBE,
+    api_key=config.PINECONE_API_KEY,
+    url=config.PINECONE_URL,
+    index_name=config.PINECONE_INDEX_NAME,
+    scheduler=scheduler,
 )
 
 # ---------------------------
-# Retrieve namespace from command-line argument at startup
-# Exit with error if not specified
-# ※ The Flask app uses a fixed namespace throughout
+# Local BM25 index built by upload_embeddings.py (keyword search, no network)
+# Used by the "hybrid" and "lexical" search modes; None when disabled
 # ---------------------------
-if len(sys.argv) < 2:
-    print("Usage: python app.py <namespace> is required!")
-    exit(1)
+lexical_index = Lazy("lexical_index", open_lexical_index, config.LEXICAL_INDEX_DIR)
 
-NAMESPACE = sys.argv[1]  # Set namespace as global variable used throughout the app
+# ---------------------------
+# Local chunk-text store (CHUNK_STORE_DIR; None when disabled)
+# Vectors ingested with it carry no text; it is looked up after the search
+# ---------------------------
+chunk_store = Lazy("chunk_store", open_chunk_store, config.CHUNK_STORE_DIR)
+
+# ---------------------------
+# Stage latency histograms, token counters and cache hit rates (served at /metrics)
+# ---------------------------
+metrics = Metrics()
+# Prompt tokens used and saved by context packing (/stats and /metrics)
+context_stats = ContextStats()
+
+# ---------------------------
+# OpenAI and vector search calls run on one shared event loop
+# (pooled keep-alive connections, concurrency limit and timeout per stage)
+# Concurrent questions are embedded together in micro-batches
+# ---------------------------
+EMBEDDING_MODEL = "text-embedding-3-small"  # Lightweight, high-accuracy embedding model
+
+def open_service():
+    return AnswerService(
+        config.OPENAI_API_KEY,
+        vector_store.get(),
+        concurrency={
+            "embed": config.EMBED_CONCURRENCY,
+            "search": config.SEARCH_CONCURRENCY,
+            "lexical": config.SEARCH_CONCURRENCY,
+            "chat": config.CHAT_CONCURRENCY,
+        },
+        timeouts={
+            "embed": config.EMBED_TIMEOUT,
+            "search": config.SEARCH_TIMEOUT,
+            "lexical": config.SEARCH_TIMEOUT,
+            "chat": config.CHAT_TIMEOUT,
+        },
+        max_retries=config.OPENAI_MAX_RETRIES,
+        embed_batch_size=config.QUERY_EMBED_BATCH_SIZE,
+        embed_batch_wait=config.QUERY_EMBED_BATCH_WAIT_MS / 1000,
+        metrics=metrics,
+        lexical_index=lexical_index.get(),
+        chunk_store=chunk_store.get(),
+        scheduler=scheduler,
+    )
+
+service = Lazy("service", open_service)
+
+# ---------------------------
+# Local embedding cache for questions
+# Repeated questions are vectorized without calling the OpenAI API
+# A cache directory has one writer: each pre-forked worker uses its own subdirectory
+# ---------------------------
+def open_query_cache():
+    directory = config.EMBEDDING_CACHE_DIR
+    if directory and startup.worker is not None:
+        directory = os.path.join(directory, f"worker-{startup.worker}")
+    return open_cache("query", directory, config.EMBEDDING_CACHE_CAPACITY)
+
+embedding_cache = Lazy("embedding_cache", open_query_cache)
+
+# ---------------------------
+# Answer cache: a question close enough to one answered before (cosine similarity
+# of the embeddings) gets the stored answer without search or answer generation
+# ---------------------------
+answer_cache = Lazy(
+    "answer_cache",
+    open_answer_cache,
+    "app",
+    config.ANSWER_CACHE_DIR,
+    threshold=config.ANSWER_CACHE_THRESHOLD,
+    ttl=config.ANSWER_CACHE_TTL,
+    capacity=config.ANSWER_CACHE_CAPACITY,
+)
+
+# ---------------------------
+# Served namespaces: from the command-line arguments (python app.py ns1 ns2), or
+# NAMESPACES in the environment when another WSGI server imports the app
+# ※ Only these namespaces can be searched (allow-list); the first is the default
+#   One process serves all of them with shared clients, caches and limits
+# ---------------------------
+NAMESPACES = []  # Allow-list, in the given order
+
+def serve_namespaces(names):
+    NAMESPACES[:] = dict.fromkeys(names)
+
+serve_namespaces(config.NAMESPACES)
+
+# ---------------------------
+# Namespaces of a request
+#   {"namespace": "a"}             one namespace (default: the first one served)
+#   {"namespaces": ["a", "b"]}     searched in parallel, results merged by score
+# Raises ValueError for a namespace that is not served
+# ---------------------------
+def request_namespaces(data):
+    if not NAMESPACES:
+        raise ValueError("No namespace is served (pass them to app.py or set NAMESPACES)")
+    requested = data.get("namespaces") or data.get("namespace") or NAMESPACES[0]
+    if isinstance(requested, str):
+        requested = [requested]
+    unknown = [ns for ns in requested if ns not in NAMESPACES]
+    if unknown:
+        raise ValueError(f"Namespace not served: {', '.join(map(str, unknown))}")
+    return list(dict.fromkeys(requested))
+
+# ---------------------------
+# Search mode of a request: {"mode": "vector" | "hybrid" | "lexical"}
+# (default: SEARCH_MODE); raises ValueError for an unknown or unavailable mode
+# ---------------------------
+def request_mode(data):
+    mode = data.get("mode") or config.SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode} (choose from {', '.join(SEARCH_MODES)})")
+    if mode != "vector" and lexical_index.get() is None:
+        raise ValueError(f"Search mode {mode} needs the lexical index (LEXICAL_INDEX_DIR)")
+    return mode
+
+# ---------------------------
+# Per-request trace: ID from the X-Request-ID header (or a new one) and the time
+# spent in each stage (embed / answer_cache / search / chat)
+# The ID is returned in the X-Request-ID response header; TRACE_LOG=1 also prints
+# one line per request with the stage times
+# ---------------------------
+def start_trace():
+    return Trace(metrics, "query_stage_seconds", request.headers.get("X-Request-ID"))
+
+def finish_trace(trace, endpoint, status):
+    metrics.observe("query_seconds", trace.elapsed(), endpoint=endpoint)
+    metrics.inc("queries_total", endpoint=endpoint, status=status)
+    if config.TRACE_LOG:
+        print(f"[Trace] {trace.trace_id} {endpoint} {status} {trace.summary()}", flush=True)
 
 # ---------------------------
 # Display index.html when root endpoint ("/") is accessed
@@ -45,61 +224,419 @@ NAMESPACE = sys.argv[1]  # Set namespace as global variable used throughout the
 def index_page():
     return render_template("index.html")
 
+# Namespaces served by this process (for the namespace selector of the page)
+@app.route("/namespaces")
+def namespaces():
+    return jsonify({"namespaces": NAMESPACES, "default": NAMESPACES[0] if NAMESPACES else None})
+
+# ---------------------------
+# Vectorize user input (served from the local cache when the same text was seen before)
+# ---------------------------
+async def embed_query(user_input):
+    cache = embedding_cache.get()
+    if cache is not None:
+        embedding = await service.get().offload(cache.get, user_input)
+        if embedding is not None:
+            return embedding
+
+    embedding = await service.get().embed(user_input, model=EMBEDDING_MODEL)
+    if cache is not None:
+        await service.get().offload(cache.put, user_input, embedding)
+    return embedding
+
+# ---------------------------
+# Search for one question (runs on the service loop)
+# Several namespaces are searched in parallel; the best matches of all of them
+# are kept (same embedding model, so the scores are comparable)
+# mode "lexical" searches the BM25 index instead (embedding is None), and "hybrid"
+# runs both searches at once and merges the rankings by reciprocal rank fusion
+# ---------------------------
+async def retrieve(user_input, embedding, namespaces, mode="vector"):
+    searches = []
+    if mode != "lexical":
+        # Perform vector search against the vector store (Top 5 results per namespace)
+        searches += [
+            service.get().search(
+                embedding,
+                top_k=5,
+                include_metadata=True,  # Return metadata including original text
+                namespace=namespace,
+            )
+            for namespace in namespaces
+        ]
+    if mode != "vector":
+        searches += [
+            service.get().lexical_search(user_input, top_k=5, namespace=namespace)
+            for namespace in namespaces
+        ]
+    results = await asyncio.gather(*searches)
+    # One ranked list per search (the vector searches first, then the lexical ones)
+    rankings = [
+        [dict(match, namespace=namespace) for match in found]
+        for namespace, found in zip(namespaces * 2, results)
+    ]
+    if mode == "hybrid":
+        matches = fuse(rankings, top_k=5, k=config.HYBRID_RRF_K)
+    else:
+        matches = [match for found in rankings for match in found]
+        matches = sorted(matches, key=lambda m: m["score"], reverse=True)[:5]
+    # Texts of slim vectors: one chunk store lookup for the matches kept
+    return await service.get().resolve_texts(matches)
+
+# ---------------------------
+# Chat request for the matched texts (shared by /query and /query/stream)
+# ---------------------------
+def chat_options(user_input, matches, trace):
+    # Matched texts as context: overlapping chunks merged, near-duplicates dropped,
+    # at most CONTEXT_MAX_TOKENS tokens (see context_builder.py)
+    context, report = build_context(
+        matches,
+        max_tokens=config.CONTEXT_MAX_TOKENS,
+        duplicate_threshold=config.CONTEXT_DUPLICATE_THRESHOLD,
+    )
+    context_stats.add(report)
+    trace.note("context_tokens", report["tokens"])
+    trace.note("tokens_saved", report["tokens_saved"])
+
+    # Generate natural language response using ChatGPT API (with constraints)
+    return {
+        "model": "gpt-4o",  # Fast, high-accuracy model
+        "messages": [
+            {
+                "role": "system",
+                "content": "Please answer the user's question in English in a concise and helpful manner, within 50 characters.",
+            },
+            {"role": "user", "content": f"Question: {user_input}\nInfo:\n{context}"},
+        ],
+    }
+
+# ---------------------------
+# Source documents of the matches (metadata without the text)
+# ---------------------------
+def sources(matches):
+    return [
+        {
+            "id": m["id"],
+            "score": m["score"],
+            "namespace": m["namespace"],
+            **{k: v for k, v in m["metadata"].items() if k != "text"},
+        }
+        for m in matches
+    ]
+
+# ---------------------------
+# Answer cache lookup / store (no-ops when the cache is disabled)
+# started: time.perf_counter() after embedding; the search and answer generation
+# time is what a later hit saves
+# Lexical mode has no embedding (None), so it neither reads nor fills the cache
+# Both block on SQLite: on the service loop they run through AnswerService.offload()
+# ---------------------------
+def cached_answer(embedding, namespaces):
+    cache = answer_cache.get()
+    if cache is None or embedding is None:
+        return None
+    return cache.get(namespaces, embedding)
+
+def store_answer(user_input, embedding, namespaces, answer_text, matches, started):
+    cache = answer_cache.get()
+    if cache is not None and embedding is not None and answer_text:
+        cache.put(
+            namespaces,
+            user_input,
+            embedding,
+            answer_text,
+            sources(matches),
+            cost=time.perf_counter() - started,
+        )
+
+# ---------------------------
+# Vector search + answer generation for one question (runs on the service loop)
+# Returns None when no matches are found
+# ---------------------------
+async def answer_question(user_input, namespaces, trace, mode="vector"):
+    # Generate embedding using OpenAI API (or the local cache; not for lexical mode)
+    embedding = None
+    if mode != "lexical":
+        with trace.stage("embed"):
+            embedding = await embed_query(user_input)
+    with trace.stage("answer_cache"):
+        cached = await service.get().offload(cached_answer, embedding, namespaces)
+    if cached is not None:
+        return cached["answer"]
+
+    started = time.perf_counter()
+    with trace.stage("search"):
+        matches = await retrieve(user_input, embedding, namespaces, mode)
+    if not matches:
+        return None
+
+    with trace.stage("chat"):
+        completion = await service.get().chat(**chat_options(user_input, matches, trace))
+
+    # Extract the generated answer
+    answer_text = completion.choices[0].message.content.strip()
+    await service.get().offload(
+        store_answer, user_input, embedding, namespaces, answer_text, matches, started
+    )
+    return answer_text
+
 # ---------------------------
 # API endpoint to handle POST request "/query"
 # Performs vector search + answer generation based on user input
+# {"query": ..., "namespace": ...} or {"query": ..., "namespaces": [...]}
+# optionally with "mode": "vector" / "hybrid" / "lexical" (see request_mode)
+# The request thread only waits while the service loop does the I/O
 # ---------------------------
 @app.route("/query", methods=["POST"])
 def query():
+    trace = start_trace()
+    response, status = answer_response(trace)
+    finish_trace(trace, "/query", status)
+    response.headers["X-Request-ID"] = trace.trace_id
+    return response, status
+
+def answer_response(trace):
     data = request.json  # Get JSON sent from frontend
     user_input = data.get("query")  # Extract user query text
+    try:
+        namespaces = request_namespaces(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        return jsonify({"answer": str(e), "error": str(e)}), 400
 
-    # Generate embedding using OpenAI API
-    embedding = (
-        openai.embeddings.create(
-            model="text-embedding-3-small",  # Lightweight, high-accuracy embedding model
-            input=user_input,
-        )
-        .data[0]
-        .embedding
-    )
+    try:
+        answer_text = service.get().run(answer_question(user_input, namespaces, trace, mode))
+    except StageTimeout as e:
+        return jsonify({"answer": "The server is busy. Please try again.", "error": str(e)}), 504
+    except CircuitOpenError as e:
+        # An upstream keeps failing: answer at once instead of waiting for retries
+        return jsonify({"answer": "The service is temporarily unavailable. Please try again later.", "error": str(e)}), 503
 
-    # Perform vector search against Pinecone (Top 5 results)
-    result = index.query(
-        vector=embedding,
-        top_k=5,
-        include_metadata=True,  # Return metadata including original text
-        namespace=NAMESPACE,  # Use the namespace specified at startup (fixed)
-    )
+    if answer_text is None:
+        # Error message when no matches are found
+        return jsonify({"answer": "No relevant answer found."}), 200
+    return jsonify({"answer": answer_text}), 200
 
-    # Extract match results (handle both dict and object formats from Pinecone)
-    matches = result["matches"] if isinstance(result, dict) else result.matches
+# One Server-Sent Events message
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# ---------------------------
+# Streaming version of "/query" (Server-Sent Events)
+# The sources are sent as soon as the search is done, then the answer text as
+# it is generated, so the page shows something long before the answer is complete
+# A cached answer is sent as a single token right after its sources
+#   event: sources  [{"id", "score", "namespace", "source", "page", ...}, ...]
+#   event: token    piece of the answer text
+#   event: error    {"answer", "error"} when the answer failed (a stage timed out,
+#                   an upstream's circuit is open, or any other error)
+#   event: done     end of the answer
+# The time to the first token is recorded as the "first_token" stage
+# ---------------------------
+@app.route("/query/stream", methods=["POST"])
+def query_stream():
+    trace = start_trace()
+    data = request.json
+    user_input = data.get("query")
+    try:
+        namespaces = request_namespaces(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        finish_trace(trace, "/query/stream", 400)
+        response = jsonify({"answer": str(e), "error": str(e)})
+        response.headers["X-Request-ID"] = trace.trace_id
+        return response, 400
 
-    if matches:
-        # Concatenate matched texts as context
-        context = "\n\n".join([m["metadata"]["text"] for m in matches])
+    def events():
+        status = 200
+        try:
+            embedding = None
+            if mode != "lexical":
+                with trace.stage("embed"):
+                    embedding = service.get().run(embed_query(user_input))
+            with trace.stage("answer_cache"):
+                cached = cached_answer(embedding, namespaces)
+            if cached is not None:
+                yield sse("sources", cached["sources"])
+                yield sse("token", cached["answer"])
+                yield sse("done", {})
+                return
 
-        # Generate natural language response using ChatGPT API (with constraints)
-        completion = openai.chat.completions.create(
-            model="gpt-4o",  # Fast, high-accuracy model
-            messages=[
+            started = time.perf_counter()
+            with trace.stage("search"):
+                matches = service.get().run(retrieve(user_input, embedding, namespaces, mode))
+            yield sse("sources", sources(matches))
+            if not matches:
+                # Error message when no matches are found
+                yield sse("token", "No relevant answer found.")
+            else:
+                stream = service.get().chat_stream(**chat_options(user_input, matches, trace))
+                pieces = []
+                chat_started = time.perf_counter()
+                for text in service.get().iterate(stream):
+                    if not pieces:
+                        trace.add("first_token", time.perf_counter() - chat_started)
+                    pieces.append(text)
+                    yield sse("token", text)
+                trace.add("chat", time.perf_counter() - chat_started)
+                answer_text = "".join(pieces).strip()
+                store_answer(
+                    user_input, embedding, namespaces, answer_text, matches, started
+                )
+        except StageTimeout as e:
+            status = 504
+            yield sse(
+                "error",
+                {"answer": "The server is busy. Please try again.", "error": str(e)},
+            )
+        except CircuitOpenError as e:
+            status = 503
+            yield sse(
+                "error",
                 {
-                    "role": "system",
-                    "content": "Please answer the user's question in English in a concise and helpful manner, within 50 characters.",
+                    "answer": "The service is temporarily unavailable. Please try again later.",
+                    "error": str(e),
                 },
-                {"role": "user", "content": f"Question: {user_input}\nInfo:\n{context}"},
-            ],
-        )
+            )
+        except Exception as e:
+            # The response has started, so the client only learns of it from this event
+            status = 500
+            app.logger.exception("/query/stream failed")
+            yield sse(
+                "error",
+                {"answer": "An error occurred. Please try again.", "error": str(e)},
+            )
+        finally:
+            finish_trace(trace, "/query/stream", status)
+        yield sse("done", {})
 
-        # Extract and return the generated answer
-        answer_text = completion.choices[0].message.content.strip()
-        return jsonify({"answer": answer_text})
-    else:
-        # Error message when no matches are found
-        return jsonify({"answer": "No relevant answer found."})
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Send each event immediately (no caching, no buffering in a reverse proxy)
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Request-ID": trace.trace_id,
+        },
+    )
+
+# ---------------------------
+# Embedding cache hit/miss counters and upstream calls in flight / timed out
+# Scheduler: calls, retries, 429s and circuit state per upstream (model / pinecone)
+# Answer cache: hit rate and seconds of search + answer generation saved
+# Context: prompt tokens sent and saved by merging / deduplicating the matches
+# ---------------------------
+@app.route("/stats")
+def stats():
+    return jsonify(
+        {
+            "embedding_cache": embedding_cache.get() and embedding_cache.get().stats(),
+            "answer_cache": answer_cache.get() and answer_cache.get().stats(),
+            "context": context_stats.stats(),
+            "upstream": service.get().stats(),
+            "startup": startup.snapshot(),
+        }
+    )
 
 # ---------------------------
-# Launch Flask application (debug mode enabled)
+# Metrics in the Prometheus text format (scraped by Prometheus or read with curl)
+#   rag_query_stage_seconds{stage}      time per stage of /query and /query/stream
+#   rag_query_seconds{endpoint}         whole request
+#   rag_upstream_seconds{stage}         OpenAI / vector search / BM25 calls
+#   rag_openai_tokens_total{model,kind} tokens reported by OpenAI
+#   rag_search_response_bytes_total     size of the vector search results (JSON)
+#   rag_upstream_*{upstream}            calls, retries, 429s, circuit breaker rejections
+#                                       and rate scale per model / pinecone
+#   rag_*_cache_*                       embedding / answer cache hits and hit rate
+#   rag_context_tokens*_total           prompt context tokens sent / saved by packing
+#   rag_startup_seconds{phase,part}     seconds to import / build / warm up each part
+#   rag_startup_ready_seconds           seconds from start (or fork) until serving
+# ---------------------------
+@app.route("/metrics")
+def metrics_page():
+    caches = {"embedding_cache": embedding_cache, "answer_cache": answer_cache}
+    for name, cache in caches.items():
+        cache = cache.get()
+        if cache is not None:
+            cache_stats = cache.stats()
+            metrics.record(f"{name}_hits_total", cache_stats["hits"])
+            metrics.record(f"{name}_misses_total", cache_stats["misses"])
+            metrics.record(f"{name}_hit_rate", cache_stats["hit_rate"])
+            metrics.record(f"{name}_entries", cache_stats["entries"])
+    context = context_stats.stats()
+    metrics.record("context_tokens_total", context["tokens"])
+    metrics.record("context_tokens_saved_total", context["tokens_saved"])
+    metrics.record("context_chunks_merged_total", context["merged"])
+    metrics.record("context_duplicates_dropped_total", context["duplicates"])
+    upstream = service.get().stats()
+    for stage in ("embed", "search", "lexical", "chat"):
+        metrics.record("upstream_in_flight", upstream[stage]["in_flight"], stage=stage)
+        metrics.record("upstream_timeouts_total", upstream[stage]["timeouts"], stage=stage)
+    for model, batching in upstream["embed_batching"].items():
+        metrics.record("embed_batches_total", batching["batches"], model=model)
+        metrics.record("embed_batch_inputs_total", batching["inputs"], model=model)
+    for name, counters in upstream["scheduler"].items():
+        metrics.record("upstream_calls_total", counters["calls"], upstream=name)
+        metrics.record("upstream_retries_total", counters["retries"], upstream=name)
+        metrics.record("upstream_throttled_total", counters["throttled"], upstream=name)
+        metrics.record("upstream_rejected_total", counters["rejected"], upstream=name)
+        metrics.record("upstream_rate_scale", counters["rate_scale"], upstream=name)
+        metrics.record("upstream_circuit_open", int(counters["circuit"] != "closed"), upstream=name)
+    started = startup.snapshot()
+    for kind, parts in started["phases"].items():
+        for part, seconds in parts.items():
+            metrics.record("startup_seconds", seconds, phase=kind, part=part)
+    if started["ready_seconds"] is not None:
+        metrics.record("startup_ready_seconds", started["ready_seconds"])
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# ---------------------------
+# Open everything the first request needs before serving: the caches, the chunk
+# store and the tokenizer, the OpenAI client and its connection, the vector store
+# (Pinecone connection or local index files) and BM25 index of every served namespace
+# A part that fails is reported and opened again on first use instead
+# ---------------------------
+def warm_up():
+    for resource in (embedding_cache, answer_cache, chunk_store, tokenizer):
+        resource.get()
+    errors = service.get().warm_up(NAMESPACES, EMBEDDING_MODEL)
+    for name, error in errors.items():
+        print(f"[Warm-up] {name} failed: {error}")
+    startup.ready()
+    print(f"[Startup] {startup.report()}")
+
+# ---------------------------
+# Launch the application
+# waitress (production WSGI server): SERVER_THREADS requests in flight per process
+# --workers N (SERVER_WORKERS): N pre-forked processes share the listening socket;
+# the parent imports the SDKs once, each worker opens its own clients and caches
+# and warms them up before serving
+# FLASK_DEBUG=1 starts the Flask debug server instead
 # ---------------------------
 if __name__ == "__main__":
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="Serve questions on the given namespaces")
+    parser.add_argument("namespaces", nargs="+", help="Served namespaces (the first is the default)")
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS)
+    args = parser.parse_args()
+    serve_namespaces(args.namespaces)
+
+    if config.FLASK_DEBUG:
+        warm_up()
+        app.run(debug=True)
+    else:
+        preload_clients()
+        preload(["waitress"])
+        from waitress import serve
+
+        listen = {"host": config.SERVER_HOST, "port": config.SERVER_PORT}
+        if args.workers > 1:
+            sock = socket.create_server((config.SERVER_HOST, config.SERVER_PORT))
+            listen = {"sockets": [sock]}
+
+        def serve_worker(worker):
+            warm_up()
+            print(f"Serving on http://{config.SERVER_HOST}:{config.SERVER_PORT} (worker {worker})")
+            serve(app, threads=config.SERVER_THREADS, **listen)
+
+        prefork(args.workers, serve_worker)
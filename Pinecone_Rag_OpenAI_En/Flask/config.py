@@ -7,3 +7,70 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+PINECONE_URL = os.getenv("PINECONE_URL")
+
+# Local embedding cache (an empty value disables it)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "50000"))
+
+# Vector store backend: "pinecone" or "local" (index files under LOCAL_INDEX_DIR)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".vector_index")
+# IVF lists searched per query on the local index (higher = better recall, slower)
+LOCAL_ANN_NPROBE = int(os.getenv("LOCAL_ANN_NPROBE", "16"))
+
+# Retrieval mode of /query and /query/stream when the request has no "mode":
+# "vector" (embeddings only), "hybrid" (vector + BM25 fused by reciprocal rank)
+# or "lexical" (BM25 only: exact codes and error strings, no embedding call)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+# BM25 index written by upload_embeddings.py (an empty value disables it)
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", ".lexical_index")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Chunk texts kept locally by upload_embeddings.py (an empty value disables it);
+# vectors written with it carry no text, so it is looked up here after the search
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "")
+
+# Prompt context: overlapping chunks merged, near-duplicates dropped, at most
+# CONTEXT_MAX_TOKENS tokens (0: no limit); see context_builder.py
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+# Semantic answer cache (an empty value disables it)
+# Questions at least ANSWER_CACHE_THRESHOLD cosine-similar to a cached one get its answer
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", ".answer_cache")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # Seconds
+ANSWER_CACHE_CAPACITY = int(os.getenv("ANSWER_CACHE_CAPACITY", "2000"))
+
+# Web server (python Flask/app.py): waitress unless FLASK_DEBUG=1
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "5000"))
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "64"))  # Requests in flight
+FLASK_DEBUG = os.getenv("FLASK_DEBUG") == "1"
+# Pre-forked server processes (python app.py --workers N overrides it)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+# Served namespaces when the app is imported by another WSGI server, e.g. "docs,faq"
+# (python app.py takes them as arguments instead)
+NAMESPACES = [name for name in os.getenv("NAMESPACES", "").split(",") if name]
+# One log line per request with its trace ID and stage times
+TRACE_LOG = os.getenv("TRACE_LOG") == "1"
+
+# Upstream calls per stage: concurrent calls and timeout (seconds)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "32"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "16"))
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "32"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "10"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Client-side rate limits per upstream (OpenAI model name or "pinecone"), e.g.
+# "text-embedding-3-small=3000:1000000,gpt-4o=500:30000,pinecone=6000"
+# (requests per minute, optionally ":tokens per minute"); unset: no limit
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Circuit breaker: an upstream failing this many times in a row is not called
+# for CIRCUIT_BREAKER_RESET seconds (requests get 503 at once)
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", "30"))
+# Question embeddings: questions arriving within QUERY_EMBED_BATCH_WAIT_MS share one request
+QUERY_EMBED_BATCH_SIZE = int(os.getenv("QUERY_EMBED_BATCH_SIZE", "64"))
+QUERY_EMBED_BATCH_WAIT_MS = float(os.getenv("QUERY_EMBED_BATCH_WAIT_MS", "5"))
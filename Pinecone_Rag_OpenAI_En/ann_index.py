@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+
+# ---------------------------
+# IVF-flat approximate nearest-neighbour index for the local vector store
+# Training: spherical k-means on a sample of the stored vectors → nlist centroids
+# Each row is assigned to its nearest centroid (its inverted list)
+# Query: score the centroids, then only the rows in the nprobe best lists
+# → nprobe is the recall/latency knob (nprobe = nlist is exact search)
+# Files next to the namespace's vectors:
+#   ivf_centroids.npy: centroids (nlist × dim, unit length)
+#   ivf_lists.i32:     list number + 1 per row (0 = not assigned), memory-mapped
+# ---------------------------
+DEFAULT_NPROBE = 16
+DEFAULT_MIN_ROWS = 20000  # Below this, brute force is fast enough
+KMEANS_ITERATIONS = 10
+SAMPLE_PER_LIST = 64  # Training sample size per centroid
+MAX_SAMPLE = 100000
+_BLOCK = 65536  # Rows per block when assigning all rows
+
+
+# Default number of lists for n rows
+def default_nlist(rows):
+    return max(1, int(np.sqrt(rows)))
+
+
+class IVFIndex:
+    def __init__(self, directory):
+        self.centroids_path = os.path.join(directory, "ivf_centroids.npy")
+        self.lists_path = os.path.join(directory, "ivf_lists.i32")
+        self.centroids = None
+        self.lists = None  # memmap (capacity,), list number + 1 per row
+        self._csr = None  # (rows ordered by list, offsets) built on first search
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    # ---------------------------
+    # (Re)load the index files for a store with `capacity` rows
+    # ---------------------------
+    def load(self, capacity):
+        self._csr = None
+        if not os.path.exists(self.centroids_path):
+            self.centroids = None
+            self.lists = None
+            return
+        self.centroids = np.load(self.centroids_path)
+        self.resize(capacity)
+
+    # Grow the list file with the vectors file (new rows read as unassigned)
+    def resize(self, capacity):
+        if not self.trained or not capacity:
+            return
+        self.lists = None
+        with open(self.lists_path, "ab") as f:
+            if f.tell() < capacity * 4:
+                f.truncate(capacity * 4)
+        self.lists = np.memmap(
+            self.lists_path, dtype=np.int32, mode="r+", shape=(capacity,)
+        )
+        self._csr = None
+
+    # ---------------------------
+    # Train on the live rows and assign every one of them
+    # vectors: store vectors (unit length); rows: row numbers to use
+    # ---------------------------
+    def train(self, vectors, rows, nlist=None, seed=0):
+        rows = np.asarray(rows)
+        nlist = min(nlist or default_nlist(len(rows)), len(rows))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(rows), max(nlist * SAMPLE_PER_LIST, nlist), MAX_SAMPLE)
+        sample = np.sort(rng.choice(rows, sample_size, replace=False))
+        centroids = kmeans(np.asarray(vectors[sample]), nlist, seed=seed)
+
+        # Write the centroids atomically; readers reload them after the next commit
+        tmp_path = self.centroids_path + ".tmp.npy"
+        np.save(tmp_path, centroids)
+        os.replace(tmp_path, self.centroids_path)
+        self.centroids = centroids
+        self.resize(len(vectors))
+        self.lists[:] = 0
+        for start in range(0, len(rows), _BLOCK):
+            block = rows[start : start + _BLOCK]
+            self.assign(block, np.asarray(vectors[block]))
+        self.lists.flush()
+
+    # ---------------------------
+    # Assign rows to their nearest centroid (incremental inserts)
+    # ---------------------------
+    def assign(self, rows, values):
+        if not self.trained:
+            return
+        self.lists[rows] = np.argmax(values @ self.centroids.T, axis=1) + 1
+        self._csr = None
+
+    def flush(self):
+        if self.lists is not None:
+            self.lists.flush()
+
+    # ---------------------------
+    # Candidate rows for a query: rows in the nprobe lists closest to it
+    # Rows not assigned yet (written by an older process) are always included
+    # ---------------------------
+    def candidates(self, query, nprobe=DEFAULT_NPROBE):
+        if self._csr is None:
+            assigned = np.asarray(self.lists)
+            order = np.argsort(assigned, kind="stable")
+            counts = np.bincount(assigned, minlength=len(self.centroids) + 1)
+            self._csr = (order, np.concatenate([[0], np.cumsum(counts)]))
+        order, offsets = self._csr
+        nprobe = min(nprobe, len(self.centroids))
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe] + 1
+        # List 0 holds the unassigned rows
+        return np.concatenate(
+            [order[offsets[0] : offsets[1]]]
+            + [order[offsets[l] : offsets[l + 1]] for l in probe]
+        )
+
+
+# ---------------------------
+# k-means; empty clusters are re-seeded with random points
+# spherical=True (cosine): unit-length centroids, assignment by dot product
+# spherical=False (Euclidean): mean centroids, assignment by distance
+# (used for the product quantization codebooks, see quantization.py)
+# ---------------------------
+def kmeans(data, k, iterations=KMEANS_ITERATIONS, seed=0, spherical=True):
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest(data, centroids, spherical)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[nonempty]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[nonempty] = sums if spherical else sums / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms > 0, norms, 1)
+    return centroids
+
+
+# Index of the nearest centroid for each row (in blocks to bound memory)
+def nearest(data, centroids, spherical=True):
+    # |x - c|² = |x|² - 2 x·c + |c|², and |x|² is the same for every centroid
+    bias = 0 if spherical else (centroids**2).sum(axis=1) / 2
+    return np.concatenate(
+        [
+            np.argmax(data[start : start + _BLOCK] @ centroids.T - bias, axis=1)
+            for start in range(0, len(data), _BLOCK)
+        ]
+    )
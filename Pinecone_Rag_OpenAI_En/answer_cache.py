@@ -0,0 +1,330 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ---------------------------
+# Semantic answer cache (SQLite + in-memory vectors)
+# An answer is stored with the embedding of its question, per (role, namespace)
+# (an answer searched in several namespaces is keyed by all of them)
+# A new question whose embedding is within `threshold` cosine similarity of a
+# cached question gets the stored answer → no vector search and no chat completion
+# Entries expire after `ttl` seconds; when full, the least recently used is evicted
+# Re-ingesting a namespace bumps its generation (invalidate_answers), and every
+# process using the same cache directory drops that namespace's answers
+#   answers.sqlite3: entries and namespace generations (shared between processes)
+# ---------------------------
+DEFAULT_ANSWER_CACHE_DIR = ".answer_cache"
+DEFAULT_THRESHOLD = 0.95  # Cosine similarity of near-duplicate questions
+DEFAULT_TTL = 24 * 60 * 60  # Seconds an answer is served from the cache
+DEFAULT_CAPACITY = 2000  # Answers kept per role
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    role TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    cost REAL NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_by_namespace ON answers (role, namespace);
+CREATE TABLE IF NOT EXISTS generations (
+    namespace TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# Cache key of one namespace or several (searched together)
+def _key(namespace):
+    if isinstance(namespace, str):
+        return namespace
+    return "\n".join(sorted(set(namespace)))
+
+
+# Generation of a key: the sum over its namespaces, so re-ingesting any of them
+# changes it
+def _generation(conn, key):
+    names = key.split("\n")
+    row = conn.execute(
+        "SELECT SUM(generation) FROM generations WHERE namespace IN "
+        f"({', '.join('?' * len(names))})",
+        names,
+    ).fetchone()
+    return row[0] or 0
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+# ---------------------------
+# Cached answers of one namespace: unit question vectors stacked for one
+# matrix product per lookup (rebuilt lazily after a change)
+# ---------------------------
+class _Namespace:
+    def __init__(self, generation):
+        self.generation = generation
+        self.entries = {}  # id → (vector, answer, sources, cost, created)
+        self._matrix = None
+
+    def add(self, entry_id, entry):
+        self.entries[entry_id] = entry
+        self._matrix = None
+
+    def remove(self, entry_id):
+        self.entries.pop(entry_id, None)
+        self._matrix = None
+
+    # (id, similarity) of the closest cached question, or (None, 0)
+    def closest(self, vector):
+        if not self.entries:
+            return None, 0.0
+        if self._matrix is None:
+            ids = list(self.entries)
+            self._matrix = (ids, np.stack([self.entries[i][0] for i in ids]))
+        ids, matrix = self._matrix
+        if matrix.shape[1] != len(vector):
+            return None, 0.0
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path,
+        role,
+        threshold=DEFAULT_THRESHOLD,
+        ttl=DEFAULT_TTL,
+        capacity=DEFAULT_CAPACITY,
+    ):
+        self.path = path
+        self.role = role
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.conn = _connect(path)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.saved_seconds = 0.0
+        self.namespaces = {}  # namespace → _Namespace
+        self.lru = OrderedDict()  # id → namespace, least recently used first
+        self._load()
+
+    # Load the entries of this role that are still valid
+    def _load(self):
+        now = time.time()
+        self.conn.execute(
+            "DELETE FROM answers WHERE role = ? AND created < ?",
+            (self.role, now - self.ttl),
+        )
+        rows = self.conn.execute(
+            "SELECT id, namespace, generation, vector, answer, sources, cost, created "
+            "FROM answers WHERE role = ? ORDER BY used",
+            (self.role,),
+        ).fetchall()
+        generations = {}
+        stale = []
+        for row in rows:
+            entry_id, namespace, generation, vector = row[:4]
+            answer, sources, cost, created = row[4:]
+            if namespace not in generations:
+                generations[namespace] = _generation(self.conn, namespace)
+            if generation != generations[namespace]:
+                stale.append((entry_id,))  # Re-ingested since it was stored
+                continue
+            space = self.namespaces.setdefault(namespace, _Namespace(generation))
+            vector = np.frombuffer(vector, dtype=np.float32)
+            space.add(entry_id, (vector, answer, json.loads(sources), cost, created))
+            self.lru[entry_id] = namespace
+        self.conn.executemany("DELETE FROM answers WHERE id = ?", stale)
+        self.conn.commit()
+
+    # ---------------------------
+    # The namespace's entries, dropped when it was re-ingested since they were loaded
+    # ---------------------------
+    def _namespace(self, namespace):
+        generation = _generation(self.conn, namespace)
+        space = self.namespaces.get(namespace)
+        if space is None or space.generation != generation:
+            if space is not None:
+                self.invalidated += len(space.entries)
+                for entry_id in space.entries:
+                    self.lru.pop(entry_id, None)
+            space = self.namespaces[namespace] = _Namespace(generation)
+        return space
+
+    def _remove(self, namespace, entry_id):
+        self.namespaces[namespace].remove(entry_id)
+        self.lru.pop(entry_id, None)
+        self.conn.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    # ---------------------------
+    # Look up a question by its embedding
+    # namespace: one namespace, or a list of the namespaces searched together
+    # Returns {"answer", "sources", "similarity"} or None
+    # ---------------------------
+    def get(self, namespace, embedding):
+        namespace = _key(namespace)
+        vector = _unit(embedding)
+        with self.lock:
+            space = self._namespace(namespace)
+            entry_id, similarity = space.closest(vector)
+            if entry_id is not None and similarity >= self.threshold:
+                _, answer, sources, cost, created = space.entries[entry_id]
+                if time.time() - created <= self.ttl:
+                    self.hits += 1
+                    self.saved_seconds += cost
+                    self.lru.move_to_end(entry_id)
+                    self.conn.execute(
+                        "UPDATE answers SET used = ? WHERE id = ?",
+                        (time.time(), entry_id),
+                    )
+                    self.conn.commit()
+                    return {
+                        "answer": answer,
+                        "sources": sources,
+                        "similarity": similarity,
+                    }
+                self.expired += 1
+                self._remove(namespace, entry_id)
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+    # ---------------------------
+    # Store an answer
+    # question: text (kept for inspection); embedding: its vector
+    # sources: JSON-serializable list returned with the answer
+    # cost: seconds it took to produce the answer (reported as time saved on hits)
+    # ---------------------------
+    def put(self, namespace, question, embedding, answer, sources=(), cost=0.0):
+        namespace = _key(namespace)
+        vector = _unit(embedding)
+        sources = list(sources)
+        now = time.time()
+        with self.lock:
+            space = self._namespace(namespace)
+            entry_id, similarity = space.closest(vector)
+            if entry_id is not None and similarity >= self.threshold:
+                # A near-duplicate question is cached already; replace its answer
+                self._remove(namespace, entry_id)
+            entry_id = self.conn.execute(
+                "INSERT INTO answers (role, namespace, generation, question, vector, "
+                "answer, sources, cost, created, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.role,
+                    namespace,
+                    space.generation,
+                    question,
+                    vector.tobytes(),
+                    answer,
+                    json.dumps(sources, ensure_ascii=False),
+                    cost,
+                    now,
+                    now,
+                ),
+            ).lastrowid
+            space.add(entry_id, (vector, answer, sources, cost, now))
+            self.lru[entry_id] = namespace
+            while len(self.lru) > self.capacity:
+                oldest, oldest_namespace = next(iter(self.lru.items()))
+                self._remove(oldest_namespace, oldest)
+            self.conn.commit()
+
+    # ---------------------------
+    # Hit rate, entries and the time saved by hits
+    # ---------------------------
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "entries": len(self.lru),
+                "capacity": self.capacity,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+# ---------------------------
+# Open the answer cache for one role (e.g. "app", "cli")
+# Roles use different prompts, so their answers are kept apart
+# base_dir: cache directory; empty or None disables the cache
+# ---------------------------
+def open_answer_cache(
+    role,
+    base_dir=DEFAULT_ANSWER_CACHE_DIR,
+    threshold=DEFAULT_THRESHOLD,
+    ttl=DEFAULT_TTL,
+    capacity=DEFAULT_CAPACITY,
+):
+    if not base_dir:
+        return None
+    os.makedirs(base_dir, exist_ok=True)
+    return AnswerCache(
+        os.path.join(base_dir, "answers.sqlite3"),
+        role,
+        threshold=float(threshold),
+        ttl=float(ttl),
+        capacity=int(capacity),
+    )
+
+
+# ---------------------------
+# Invalidate the cached answers of a namespace (after it was re-ingested)
+# Processes serving from the same directory notice the new generation on their
+# next lookup; returns the number of answers removed
+# ---------------------------
+def invalidate_answers(namespace, base_dir=DEFAULT_ANSWER_CACHE_DIR):
+    if not base_dir or not os.path.isdir(base_dir):
+        return 0
+    conn = _connect(os.path.join(base_dir, "answers.sqlite3"))
+    try:
+        conn.execute(
+            "INSERT INTO generations VALUES (?, 1) ON CONFLICT (namespace) "
+            "DO UPDATE SET generation = generation + 1",
+            (namespace,),
+        )
+        # Also the answers of searches that included the namespace
+        removed = conn.execute(
+            "DELETE FROM answers WHERE instr(char(10) || namespace || char(10), "
+            "char(10) || ? || char(10)) > 0",
+            (namespace,),
+        ).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return removed
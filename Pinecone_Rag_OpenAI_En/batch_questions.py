@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import time
+
+from query_embeddings import (
+    ANSWER_WORKERS,
+    BATCH_SIZE,
+    BATCH_WORKERS,
+    SEARCH_MODE,
+    answer_question_batch,
+    context_stats,
+    scheduler,
+)
+from retrieval_eval import RetrievalScores
+
+# ---------------------------
+# Batch questions: retrieval (and optionally answers) for a file of questions
+# (nightly evaluation sets, bulk question answering), results streamed to JSONL
+# Questions are embedded in bulk, searched together (concurrent Pinecone
+# queries or one matrix top-k on the local index) and answered with bounded
+# concurrency (see query_embeddings.answer_question_batch)
+# Labelled questions are scored in the same pass: recall@k and MRR against
+# their sources (see retrieval_eval.py)
+# Input:
+#   .txt:   one question per line
+#   .jsonl: {"question": "...", "sources": ["manual.pdf", ...], "id": "q1"}
+#           ("sources" / "source" and "id" are optional)
+# Output (one line per question, in input order):
+#   {"id", "question", "matches": [{"id", "score", "source", "page", ...}],
+#    "answer", "sources", "recall", "reciprocal_rank", "found"}
+# ---------------------------
+
+
+# ---------------------------
+# Read the questions: [{"id", "question", "sources"}, ...]
+# ---------------------------
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                sources = item.get("sources") or item.get("source") or []
+                if isinstance(sources, str):
+                    sources = [sources]
+                question = {
+                    "id": item.get("id", number),
+                    "question": item["question"],
+                    "sources": sources,
+                }
+            else:
+                question = {"id": number, "question": line, "sources": []}
+            questions.append(question)
+    return questions
+
+
+# Match as written to the output (metadata without the chunk text unless asked)
+def output_match(match, include_text):
+    metadata = dict(match["metadata"])
+    if not include_text:
+        metadata.pop("text", None)
+    return {"id": match["id"], "score": match["score"], **metadata}
+
+
+# ---------------------------
+# Run the questions and write one JSON line per result as it arrives
+# Returns the evaluation statistics (RetrievalScores.stats())
+# ---------------------------
+def run_batch(questions, namespace, output, args):
+    scores = RetrievalScores(args.top_k)
+    started = time.perf_counter()
+    results = answer_question_batch(
+        [item["question"] for item in questions],
+        namespace,
+        mode=args.mode,
+        top_k=args.top_k,
+        answer=args.answer,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        answer_workers=args.answer_workers,
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        for count, (item, result) in enumerate(zip(questions, results), 1):
+            record = {
+                "id": item["id"],
+                "question": item["question"],
+                "matches": [
+                    output_match(match, args.include_text)
+                    for match in result["matches"]
+                ],
+            }
+            if args.answer:
+                record["answer"] = result["answer"]
+            scored = scores.add(result["matches"], item["sources"])
+            if scored is not None:
+                record["sources"] = item["sources"]
+                record.update(scored)
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if count % args.batch_size == 0 or count == len(questions):
+                f.flush()
+                elapsed = time.perf_counter() - started
+                print(
+                    f"[Progress] {count}/{len(questions)} questions, "
+                    f"{count / elapsed if elapsed else 0.0:.1f} questions/s"
+                )
+    return scores
+
+
+# ---------------------------
+# Parse command-line arguments and execute
+# ---------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Retrieval (and answers) for a file of questions, with recall@k / MRR"
+    )
+    parser.add_argument("questions", help="Questions file (.txt or .jsonl)")
+    parser.add_argument(
+        "namespace", help="Pinecone namespace (e.g., our-project-specs)"
+    )
+    parser.add_argument(
+        "--output",
+        default="batch_results.jsonl",
+        help="JSONL file receiving one result per question",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=("vector", "hybrid", "lexical"),
+        default=SEARCH_MODE,
+        help="Search mode (default: SEARCH_MODE or vector)",
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=5, help="Matches per question (k of recall@k)"
+    )
+    parser.add_argument(
+        "--answer", action="store_true", help="Also generate an answer per question"
+    )
+    parser.add_argument(
+        "--include-text",
+        action="store_true",
+        help="Write the chunk texts of the matches to the output",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Questions embedded and searched together",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BATCH_WORKERS,
+        help="Embedding requests / vector queries / BM25 searches in flight",
+    )
+    parser.add_argument(
+        "--answer-workers",
+        type=int,
+        default=ANSWER_WORKERS,
+        help="Answer generation calls in flight",
+    )
+    parser.add_argument(
+        "--summary", default=None, help="JSON file receiving the evaluation scores"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.questions):
+        print(f"[Error] Questions file does not exist: {args.questions}")
+        exit(1)
+    questions = load_questions(args.questions)
+    if not questions:
+        print(f"[Error] No questions in {args.questions}")
+        exit(1)
+
+    started = time.perf_counter()
+    scores = run_batch(questions, args.namespace, args.output, args)
+    elapsed = time.perf_counter() - started
+    print(
+        f"[Batch] {len(questions)} questions in {elapsed:.1f}s → "
+        f"{len(questions) / elapsed if elapsed else 0.0:.1f} questions/s, "
+        f"results in {args.output}"
+    )
+    if scores.stats()["questions"]:
+        print(f"[Evaluation] {scores.report()}")
+    if args.answer:
+        context = context_stats.stats()
+        print(
+            f"[Context] {context['tokens']} prompt context tokens, "
+            f"{context['tokens_saved']} saved by merging / deduplication"
+        )
+    if scheduler.report():
+        print(f"[Upstream] {scheduler.report()}")
+    if args.summary:
+        summary = dict(scores.stats(), seconds=elapsed, total=len(questions))
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
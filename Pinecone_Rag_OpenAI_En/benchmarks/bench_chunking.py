@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chunking import CHUNKERS, count_tokens, get_chunker, tokenizer
+from upload_embeddings import extract_pages, iter_directory_files
+
+# ---------------------------
+# Chunking benchmark
+# Compares the strategies in chunking.py on the same corpus:
+# chunks/sec, token-size distribution, embedding cost and vector storage
+# Usage (from the project root):
+#   python benchmarks/bench_chunking.py PDF
+#   python benchmarks/bench_chunking.py --synthetic 2000 --lang ja
+# ---------------------------
+PRICE_PER_MILLION_TOKENS = 0.02  # text-embedding-3-small (USD)
+DIMENSION = 1536
+
+_EN_WORDS = (
+    "pump valve pressure sensor install check the manual before operating "
+    "maintenance interval filter replace system error code reset power supply "
+    "temperature limit warning safety cover motor speed flow rate"
+).split()
+_JA_PHRASES = [
+    "ポンプの圧力を確認してください",
+    "フィルターは定期的に交換します",
+    "電源を切ってから作業を行います",
+    "エラーコードが表示された場合はリセットします",
+    "温度が上限を超えると警告が出ます",
+    "安全カバーを取り外さないでください",
+]
+
+
+# ---------------------------
+# Synthetic corpus: Markdown-like pages with headings and paragraphs
+# ---------------------------
+def synthetic_pages(count, lang="mixed", seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for number in range(1, count + 1):
+        lines = []
+        if number % 3 == 1:
+            lines.append(f"# Chapter {number // 3 + 1}")
+        for _ in range(rng.randint(3, 8)):
+            if rng.random() < 0.2:
+                lines.append(f"## Section {rng.randint(1, 99)}")
+            use_ja = lang == "ja" or (lang == "mixed" and rng.random() < 0.5)
+            if use_ja:
+                sentences = [rng.choice(_JA_PHRASES) + "。" for _ in range(6)]
+                lines.append("".join(sentences))
+            else:
+                sentences = [
+                    " ".join(rng.choice(_EN_WORDS) for _ in range(12)).capitalize()
+                    + "."
+                    for _ in range(6)
+                ]
+                lines.append(" ".join(sentences))
+            lines.append("")
+        pages.append((number, "\n".join(lines) + "\n"))
+    return pages
+
+
+# ---------------------------
+# Load the corpus once: [(name, [(page, text), ...])]
+# Extraction is done up front so that only chunking is timed
+# ---------------------------
+def load_corpus(paths, markdown_headings):
+    corpus = []
+    for path in paths:
+        files = iter_directory_files(path) if os.path.isdir(path) else [path]
+        for file_path in files:
+            try:
+                pages = list(extract_pages(file_path, markdown_headings))
+            except Exception as e:
+                print(f"[Skip] {file_path} → {e}")
+                continue
+            corpus.append((file_path, pages))
+    return corpus
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+# ---------------------------
+# Run one strategy over the corpus and return its row of results
+# ---------------------------
+def run_strategy(strategy, corpus, options, price):
+    chunker = get_chunker(strategy, **options)
+    chunks = []
+    started = time.perf_counter()
+    for _, pages in corpus:
+        chunks.extend(chunker(pages))
+    elapsed = time.perf_counter() - started
+
+    tokens = sorted(count_tokens(chunk) for _, chunk in chunks)
+    total = sum(tokens)
+    # Vector values (float32) plus the metadata stored with each vector
+    metadata_bytes = sum(
+        len(json.dumps(dict(info, text=chunk), ensure_ascii=False).encode("utf-8"))
+        for info, chunk in chunks
+    )
+    storage = len(chunks) * DIMENSION * 4 + metadata_bytes
+    return {
+        "strategy": strategy,
+        "chunks": len(chunks),
+        "chunks_per_sec": len(chunks) / elapsed if elapsed else 0.0,
+        "tokens": total,
+        "min": tokens[0] if tokens else 0,
+        "p50": percentile(tokens, 0.5),
+        "p95": percentile(tokens, 0.95),
+        "max": tokens[-1] if tokens else 0,
+        "mean": total / len(tokens) if tokens else 0.0,
+        "cost": total / 1_000_000 * price,
+        "storage_mb": storage / (1024 * 1024),
+    }
+
+
+def print_table(rows):
+    header = (
+        f"{'strategy':<10}{'chunks':>8}{'chunks/s':>11}{'tokens':>10}"
+        f"{'min':>6}{'p50':>6}{'p95':>6}{'max':>6}{'mean':>8}"
+        f"{'cost($)':>11}{'storage(MB)':>13}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['strategy']:<10}{row['chunks']:>8}{row['chunks_per_sec']:>11.0f}"
+            f"{row['tokens']:>10}{row['min']:>6}{row['p50']:>6}{row['p95']:>6}"
+            f"{row['max']:>6}{row['mean']:>8.1f}{row['cost']:>11.5f}"
+            f"{row['storage_mb']:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking strategies")
+    parser.add_argument("paths", nargs="*", help="Files or directories to chunk")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="Add a synthetic document with this many pages",
+    )
+    parser.add_argument(
+        "--lang",
+        choices=["en", "ja", "mixed"],
+        default="mixed",
+        help="Language of the synthetic pages",
+    )
+    parser.add_argument(
+        "--strategies",
+        default=",".join(CHUNKERS),
+        help="Comma-separated strategies to compare",
+    )
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--overlap-tokens", type=int, default=None)
+    parser.add_argument(
+        "--price",
+        type=float,
+        default=PRICE_PER_MILLION_TOKENS,
+        help="Embedding price in USD per 1M tokens",
+    )
+    args = parser.parse_args()
+
+    if not args.paths and not args.synthetic:
+        parser.error("give files/directories or --synthetic N")
+
+    # Heading markers from DOCX are only needed by the heading strategy,
+    # but the corpus is shared, so they are always extracted here
+    corpus = load_corpus(args.paths, markdown_headings=True)
+    if args.synthetic:
+        corpus.append(("synthetic", synthetic_pages(args.synthetic, args.lang)))
+    pages = sum(len(p) for _, p in corpus)
+    characters = sum(len(text) for _, p in corpus for _, text in p)
+    print(
+        f"[Corpus] {len(corpus)} documents, {pages} pages, {characters} characters "
+        f"(token counts: {'tiktoken cl100k_base' if tokenizer.get() else 'estimate'})"
+    )
+
+    rows = []
+    for strategy in args.strategies.split(","):
+        options = {}
+        if strategy != "chars":
+            options = {
+                "max_tokens": args.max_tokens,
+                "overlap_tokens": args.overlap_tokens,
+            }
+        rows.append(run_strategy(strategy, corpus, options, args.price))
+    print_table(rows)
@@ -0,0 +1,402 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from chunking import CHUNKERS, DEFAULT_STRATEGY
+from fake_services import (
+    FakeServices,
+    ServiceProfile,
+    add_profile_arguments,
+    profiles_from_args,
+)
+from ingest_pipeline import STAGES
+
+try:
+    import resource  # Peak memory (not available on Windows)
+except ImportError:
+    resource = None
+
+# ---------------------------
+# Offline end-to-end benchmark (no API keys, no network)
+# 1. Starts local stand-ins for OpenAI and Pinecone (fake_services.py)
+# 2. Writes a synthetic corpus (PDF / DOCX / TXT, corpus.py)
+# 3. Ingests it with upload_embeddings.process_directory → files/sec, chunks/sec
+# 4. Sends questions to Flask/app.py (in-process test client, concurrent threads)
+#    → queries/sec and p50/p95/p99 latency (time to first token with --stream)
+# 5. Reports peak memory (this process and the extraction workers)
+# --json saves the results; --baseline compares them with a saved run and exits
+# with status 1 when a figure is worse by more than --tolerance (regression check)
+# Usage (from the project root):
+#   python benchmarks/bench_pipeline.py
+#   python benchmarks/bench_pipeline.py --files 200 --pages 20 --store local
+#   python benchmarks/bench_pipeline.py --json base.json
+#   python benchmarks/bench_pipeline.py --baseline base.json --tolerance 0.2
+# ---------------------------
+NAMESPACE = "bench"
+DEFAULT_PROFILES = {
+    "embed": ServiceProfile(latency=0.1),
+    "chat": ServiceProfile(latency=0.8),
+    "upsert": ServiceProfile(latency=0.05),
+    "query": ServiceProfile(latency=0.03),
+}
+# Figures compared with --baseline: name → True when higher is better
+COMPARED = {
+    "files_per_sec": True,
+    "chunks_per_sec": True,
+    "queries_per_sec": True,
+    "query_p50": False,
+    "query_p95": False,
+    "query_p99": False,
+    "peak_rss_mb": False,
+    "context_tokens_per_answer": False,
+    "upsert_bytes_per_vector": False,
+    "search_bytes_per_query": False,
+}
+
+
+# ---------------------------
+# Point the project at the stand-ins (must run before upload_embeddings and
+# Flask/app.py are imported, as both read their settings at import time)
+# Caches are disabled so that every run measures the same work
+# chunk_store: keep chunk texts in a local store instead of the vector metadata
+# ---------------------------
+def configure_environment(services, store, work_dir, chunk_store=False):
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": services.openai_base_url,
+            "OPENAI_EMBEDDINGS_URL": services.embeddings_url,
+            "PINECONE_API_KEY": "bench",
+            "PINECONE_URL": services.pinecone_url,
+            "PINECONE_INDEX_NAME": NAMESPACE,
+            "VECTOR_STORE": store,
+            "LOCAL_INDEX_DIR": os.path.join(work_dir, "index"),
+            "LEXICAL_INDEX_DIR": os.path.join(work_dir, "lexical"),
+            "INGEST_JOB_DIR": os.path.join(work_dir, "jobs"),
+            "CHUNK_STORE_DIR": os.path.join(work_dir, "chunks") if chunk_store else "",
+            "EMBEDDING_CACHE_DIR": "",
+            "EXTRACT_CACHE_DIR": "",
+            "ANSWER_CACHE_DIR": "",
+            "TRACE_LOG": "",
+        }
+    )
+
+
+# ---------------------------
+# Ingestion: returns files, chunks, seconds, upsert request bytes per vector
+# (Pinecone only; the local store sends no requests) and the per-stage p95
+# from the run's metrics
+# ---------------------------
+def run_ingestion(corpus_dir, chunk_options, options, verbose):
+    import upload_embeddings
+
+    output = contextlib.nullcontext() if verbose else _quiet()
+    started = time.perf_counter()
+    with output:
+        metrics = upload_embeddings.process_directory(
+            corpus_dir,
+            NAMESPACE,
+            manifest_path=None,
+            chunk_options=chunk_options,
+            progress_interval=3600,
+            **options,
+        )
+    elapsed = time.perf_counter() - started
+    files = metrics.value("ingest_files_total")
+    chunks = metrics.value("ingest_chunks_total")
+    upserted = metrics.value("upserted_vectors_total")
+    stages = {}
+    for stage in STAGES:
+        histogram = metrics.histogram("ingest_stage_seconds", stage=stage)
+        if histogram is not None:
+            stages[stage] = histogram.quantile(0.95)
+    return {
+        "files": files,
+        "chunks": chunks,
+        "vectors_upserted": upserted,
+        "upsert_bytes_per_vector": (
+            metrics.value("upserted_bytes_total") / upserted if upserted else 0.0
+        ),
+        "ingest_seconds": elapsed,
+        "files_per_sec": files / elapsed if elapsed else 0.0,
+        "chunks_per_sec": chunks / elapsed if elapsed else 0.0,
+        "stage_p95": stages,
+    }
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# Import Flask/app.py serving NAMESPACE and warm it up (clients, caches, indexes)
+def load_app():
+    flask_dir = os.path.join(ROOT, "Flask")
+    sys.path.insert(0, flask_dir)
+    spec = importlib.util.spec_from_file_location(
+        "bench_app", os.path.join(flask_dir, "app.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.serve_namespaces([NAMESPACE])
+    with _quiet():
+        module.warm_up()
+    return module.app
+
+
+# ---------------------------
+# Queries: `concurrency` threads, one test client each
+# Latency is measured per request (until the whole answer, or the first token
+# of /query/stream with stream=True)
+# mode: search mode sent with each question ("vector" / "hybrid" / "lexical")
+# ---------------------------
+def run_queries(app, questions, concurrency, stream, mode="vector"):
+    from bench_chunking import percentile
+
+    clients = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def ask(question):
+        if not hasattr(clients, "client"):
+            clients.client = app.test_client()
+        started = time.perf_counter()
+        if stream:
+            response = clients.client.post(
+                "/query/stream", json={"query": question, "mode": mode}, buffered=False
+            )
+            latency = None
+            for part in response.response:
+                if latency is None and b"event: token" in part:
+                    latency = time.perf_counter() - started
+                if b"event: error" in part:
+                    response.status_code = 504
+            response.close()
+        else:
+            response = clients.client.post(
+                "/query", json={"query": question, "mode": mode}
+            )
+            latency = time.perf_counter() - started
+        with lock:
+            if response.status_code != 200 or latency is None:
+                errors.append(response.status_code)
+            else:
+                latencies.append(latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ask, questions))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    # Prompt context tokens per generated answer (context_builder.py)
+    context = app.test_client().get("/stats").json["context"]
+    answers = context["contexts"] or 1
+    # Size of the vector search results (JSON) per question
+    exposition = app.test_client().get("/metrics").get_data(as_text=True)
+    search_bytes = sum(
+        float(line.split()[-1])
+        for line in exposition.splitlines()
+        if line.startswith("rag_search_response_bytes_total")
+    )
+    return {
+        "search_bytes_per_query": search_bytes / len(questions),
+        "context_tokens_per_answer": context["tokens"] / answers,
+        "context_tokens_saved_per_answer": context["tokens_saved"] / answers,
+        "queries": len(questions),
+        "query_errors": len(errors),
+        "query_seconds": elapsed,
+        "queries_per_sec": len(questions) / elapsed if elapsed else 0.0,
+        "query_p50": percentile(latencies, 0.50),
+        "query_p95": percentile(latencies, 0.95),
+        "query_p99": percentile(latencies, 0.99),
+    }
+
+
+# Peak resident memory in MB: (this process, largest extraction worker)
+def peak_memory():
+    if resource is None:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss: bytes / kilobytes
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * unit / (1024 * 1024), children * unit / (1024 * 1024)
+
+
+def print_results(results):
+    print(
+        f"[Ingest] {results['files']} files, {results['chunks']} chunks "
+        f"({results['vectors_upserted']} upserted) in {results['ingest_seconds']:.1f}s "
+        f"→ {results['files_per_sec']:.1f} files/s, "
+        f"{results['chunks_per_sec']:.1f} chunks/s"
+    )
+    stages = ", ".join(
+        f"{stage} {seconds:.3f}s" for stage, seconds in results["stage_p95"].items()
+    )
+    print(f"[Ingest] p95 per stage: {stages}")
+    if results["queries"]:
+        label = "first token" if results["stream"] else "latency"
+        print(
+            f"[Query] {results['queries']} queries, concurrency "
+            f"{results['concurrency']} → {results['queries_per_sec']:.1f} q/s, "
+            f"{label} p50 {results['query_p50']:.3f}s, "
+            f"p95 {results['query_p95']:.3f}s, p99 {results['query_p99']:.3f}s, "
+            f"{results['query_errors']} errors"
+        )
+        print(
+            f"[Context] {results['context_tokens_per_answer']:.0f} prompt context "
+            f"tokens per answer, {results['context_tokens_saved_per_answer']:.0f} "
+            f"saved by merging / deduplication"
+        )
+        print(
+            f"[Payload] {results['upsert_bytes_per_vector']:.0f} upsert bytes per "
+            f"vector, {results['search_bytes_per_query']:.0f} search result bytes "
+            f"per query"
+        )
+    if results["peak_rss_mb"] is not None:
+        print(
+            f"[Memory] peak RSS {results['peak_rss_mb']:.1f} MB, "
+            f"extraction workers {results['peak_rss_children_mb']:.1f} MB"
+        )
+    for name, stats in results["upstream"].items():
+        print(
+            f"[Upstream] {name}: {stats['requests']} requests, "
+            f"{stats['throttled']} throttled (429), {stats['errors']} errors (500)"
+        )
+
+
+# ---------------------------
+# Compare with a saved run; returns the figures that regressed
+# ---------------------------
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'figure':<16}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, higher_is_better in COMPARED.items():
+        base, current = baseline.get(name), results.get(name)
+        if not base or current is None:
+            continue
+        change = current / base - 1
+        worse = -change if higher_is_better else change
+        flag = "  ← regression" if worse > tolerance else ""
+        print(f"{name:<16}{base:>12.3f}{current:>12.3f}{change:>+9.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingestion/query benchmark")
+    parser.add_argument("--files", type=int, default=30, help="Documents to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per document")
+    parser.add_argument(
+        "--formats", default="txt,docx,pdf", help="Comma-separated: txt,docx,pdf"
+    )
+    parser.add_argument("--lang", choices=["en", "ja", "mixed"], default="mixed")
+    parser.add_argument("--chunker", choices=sorted(CHUNKERS), default=DEFAULT_STRATEGY)
+    parser.add_argument("--store", choices=["pinecone", "local"], default="pinecone")
+    parser.add_argument("--extract-workers", type=int, default=None)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200, help="0 skips queries")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--mode", choices=["vector", "hybrid", "lexical"], default="vector"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Use /query/stream and measure the time to the first token",
+    )
+    add_profile_arguments(parser, DEFAULT_PROFILES)
+    parser.add_argument("--json", help="Save the results to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative change before a figure counts as a regression",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the corpus and index directories"
+    )
+    parser.add_argument(
+        "--chunk-store",
+        action="store_true",
+        help="Keep chunk texts in a local store instead of the vector metadata",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show ingestion logs")
+    args = parser.parse_args()
+
+    # Queries against the Pinecone store go through the SDK
+    if args.store == "pinecone" and args.queries:
+        if importlib.util.find_spec("pinecone") is None:
+            parser.error(
+                "--store pinecone needs the pinecone package (or --store local)"
+            )
+
+    services = FakeServices(profiles_from_args(args)).start()
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    configure_environment(services, args.store, work_dir, args.chunk_store)
+
+    from corpus import synthetic_questions, write_corpus
+
+    corpus_dir = os.path.join(work_dir, "corpus")
+    formats = tuple(args.formats.split(","))
+    paths = write_corpus(corpus_dir, args.files, args.pages, formats, args.lang)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(
+        f"[Corpus] {len(paths)} files ({', '.join(formats)}), {args.pages} pages each, "
+        f"{size / (1024 * 1024):.1f} MB in {corpus_dir}"
+    )
+
+    chunk_options = {"strategy": args.chunker}
+    results = run_ingestion(
+        corpus_dir,
+        chunk_options,
+        {
+            "backend": args.store,
+            "extract_workers": args.extract_workers,
+            "embed_workers": args.embed_workers,
+            "upsert_workers": args.upsert_workers,
+        },
+        args.verbose,
+    )
+    results["queries"] = 0
+    if args.queries:
+        app = load_app()
+        questions = synthetic_questions(args.queries, args.lang)
+        results.update(
+            run_queries(app, questions, args.concurrency, args.stream, args.mode)
+        )
+    results["stream"] = args.stream
+    results["concurrency"] = args.concurrency
+    results["peak_rss_mb"], results["peak_rss_children_mb"] = peak_memory()
+    results["upstream"] = services.stats()
+    services.stop()
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"[Regression] {', '.join(regressions)}")
+            sys.exit(1)
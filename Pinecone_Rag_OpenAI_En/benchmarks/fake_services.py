@@ -0,0 +1,450 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from embedding_batcher import estimate_tokens
+from rate_limiter import TokenBucket
+
+# ---------------------------
+# Local stand-ins for the OpenAI and Pinecone HTTP APIs (for benchmarks, no API keys)
+# One server answers every endpoint the project calls:
+#   POST /v1/embeddings        deterministic vectors (seeded by the text)
+#   POST /v1/chat/completions  short answer built from the prompt ("stream": true supported)
+#   POST /vectors/upsert, /vectors/delete, /query, /describe_index_stats
+#                              in-memory index per namespace (cosine, brute force)
+#   GET /v1/models/<id>        model description (connection warm-up)
+# Each service (embed / chat / upsert / query) has its own ServiceProfile:
+# latency, a rate limit (429 with Retry-After) and an error rate (500)
+# Usage:
+#   services = FakeServices({"chat": ServiceProfile(latency=0.5)}).start()
+#   services.openai_base_url / services.embeddings_url / services.pinecone_url
+# ---------------------------
+SERVICES = ("embed", "chat", "upsert", "query")
+DIMENSION = 1536
+MAX_INPUT_TOKENS = 8191  # text-embedding-3-small: larger inputs are rejected (400)
+
+
+# ---------------------------
+# Behaviour of one service
+# latency: seconds per request; jitter adds latency × jitter × Exp(1) on top
+#          (a long tail, like the real APIs)
+# requests_per_minute: token bucket; a request over the limit gets 429 + Retry-After
+# error_rate: fraction of requests answered with 500
+# ---------------------------
+class ServiceProfile:
+    def __init__(
+        self, latency=0.0, jitter=0.25, requests_per_minute=None, error_rate=0.0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+
+
+class _Service:
+    def __init__(self, profile, seed):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.bucket = (
+            TokenBucket(profile.requests_per_minute)
+            if profile.requests_per_minute
+            else None
+        )
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    # (status, retry_after, delay) for the next request
+    def admit(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.bucket is not None:
+                wait = self.bucket.take(1)
+                if wait > 0:
+                    self.stats["throttled"] += 1
+                    return 429, max(1, int(wait + 0.999)), 0.0
+            delay = self.profile.latency * (
+                1 + self.profile.jitter * self.rng.expovariate(1.0)
+            )
+            if self.rng.random() < self.profile.error_rate:
+                self.stats["errors"] += 1
+                return 500, None, delay
+        return 200, None, delay
+
+
+# Unit vector derived from the text (same text → same vector, in every run)
+def fake_embedding(text, dimension=DIMENSION):
+    seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# ---------------------------
+# In-memory Pinecone namespace: the matrix of vectors is rebuilt after writes
+# ---------------------------
+class _Namespace:
+    def __init__(self):
+        self.vectors = {}  # id → (unit vector, metadata)
+        self._matrix = None
+
+    def upsert(self, vectors):
+        for vector in vectors:
+            values = np.asarray(vector["values"], dtype=np.float32)
+            norm = np.linalg.norm(values)
+            values = values / norm if norm > 0 else values
+            self.vectors[vector["id"]] = (values, vector.get("metadata") or {})
+        self._matrix = None
+
+    def delete(self, ids):
+        for vector_id in ids:
+            self.vectors.pop(vector_id, None)
+        self._matrix = None
+
+    def query(self, vector, top_k):
+        if not self.vectors:
+            return []
+        if self._matrix is None:
+            ids = list(self.vectors)
+            self._matrix = (ids, np.stack([self.vectors[i][0] for i in ids]))
+        ids, matrix = self._matrix
+        scores = matrix @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        return [(ids[i], float(scores[i])) for i in top]
+
+
+class FakeServices:
+    def __init__(self, profiles=None, seed=0, host="127.0.0.1", port=0):
+        profiles = profiles or {}
+        self.services = {
+            name: _Service(profiles.get(name) or ServiceProfile(), seed + i)
+            for i, name in enumerate(SERVICES)
+        }
+        self.namespaces = {}  # namespace → _Namespace
+        self.index_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.url}/v1"
+
+    @property
+    def embeddings_url(self):
+        return f"{self.url}/v1/embeddings"
+
+    @property
+    def pinecone_url(self):
+        return self.url
+
+    def start(self):
+        threading.Thread(
+            target=self.server.serve_forever, name="fake-services", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Requests / throttled (429) / errors (500) per service
+    def stats(self):
+        return {name: dict(service.stats) for name, service in self.services.items()}
+
+    def vector_count(self, namespace=None):
+        with self.index_lock:
+            if namespace is not None:
+                space = self.namespaces.get(namespace)
+                return len(space.vectors) if space else 0
+            return sum(len(space.vectors) for space in self.namespaces.values())
+
+    # ---------------------------
+    # Endpoint bodies: return (status, JSON body); chat streaming is in the handler
+    # ---------------------------
+    def embeddings(self, body):
+        inputs = body["input"]
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        tokens = [estimate_tokens(text) for text in inputs]
+        if max(tokens, default=0) > MAX_INPUT_TOKENS:
+            message = (
+                f"This model's maximum context length is {MAX_INPUT_TOKENS} tokens"
+            )
+            return 400, {"error": {"message": message, "type": "invalid_request_error"}}
+        data = [
+            {
+                "object": "embedding",
+                "index": i,
+                "embedding": fake_embedding(text).tolist(),
+            }
+            for i, text in enumerate(inputs)
+        ]
+        usage = {"prompt_tokens": sum(tokens), "total_tokens": sum(tokens)}
+        return 200, {
+            "object": "list",
+            "model": body.get("model"),
+            "data": data,
+            "usage": usage,
+        }
+
+    def chat_answer(self, body):
+        prompt = body["messages"][-1]["content"]
+        question = prompt.split("\n")[0][:80]
+        answer = f"Based on {len(prompt)} characters of context: {question}"
+        usage = {
+            "prompt_tokens": sum(
+                estimate_tokens(m["content"]) for m in body["messages"]
+            ),
+            "completion_tokens": estimate_tokens(answer),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return answer, usage
+
+    def upsert(self, body):
+        with self.index_lock:
+            space = self.namespaces.setdefault(body.get("namespace", ""), _Namespace())
+            space.upsert(body["vectors"])
+        return 200, {"upsertedCount": len(body["vectors"])}
+
+    def delete(self, body):
+        with self.index_lock:
+            space = self.namespaces.get(body.get("namespace", ""))
+            if space is not None:
+                if body.get("deleteAll"):
+                    space.delete(list(space.vectors))
+                else:
+                    space.delete(body.get("ids", []))
+        return 200, {}
+
+    def query(self, body):
+        namespace = body.get("namespace", "")
+        with self.index_lock:
+            space = self.namespaces.get(namespace)
+            found = space.query(body["vector"], body.get("topK", 10)) if space else []
+            matches = [
+                {
+                    "id": vector_id,
+                    "score": score,
+                    "values": [],
+                    "metadata": (
+                        space.vectors[vector_id][1]
+                        if body.get("includeMetadata")
+                        else None
+                    ),
+                }
+                for vector_id, score in found
+            ]
+        return 200, {
+            "matches": matches,
+            "namespace": namespace,
+            "usage": {"readUnits": 5},
+        }
+
+    def describe_index_stats(self, body):
+        with self.index_lock:
+            namespaces = {
+                name: {"vectorCount": len(space.vectors)}
+                for name, space in self.namespaces.items()
+            }
+        total = sum(ns["vectorCount"] for ns in namespaces.values())
+        return 200, {
+            "namespaces": namespaces,
+            "dimension": DIMENSION,
+            "indexFullness": 0.0,
+            "totalVectorCount": total,
+        }
+
+
+# ---------------------------
+# Request handler bound to one FakeServices instance (HTTP/1.1, keep-alive)
+# ---------------------------
+def _handler(services):
+    routes = {
+        "/v1/embeddings": ("embed", services.embeddings),
+        "/v1/chat/completions": ("chat", None),
+        "/vectors/upsert": ("upsert", services.upsert),
+        "/vectors/delete": ("upsert", services.delete),
+        "/query": ("query", services.query),
+        "/describe_index_stats": ("query", services.describe_index_stats),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if path not in routes:
+                return self._json(404, {"error": {"message": f"Unknown path {path}"}})
+            service, endpoint = routes[path]
+            status, retry_after, delay = services.services[service].admit()
+            if status == 429:
+                return self._json(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                    {"Retry-After": str(retry_after)},
+                )
+            if endpoint is None:
+                return self._chat(body, status, delay)
+            time.sleep(delay)
+            if status != 200:
+                return self._json(status, {"error": {"message": "Injected error"}})
+            self._json(*endpoint(body))
+
+        def do_GET(self):
+            if self.path.split("?")[0] == "/describe_index_stats":
+                return self._json(*services.describe_index_stats({}))
+            if self.path.startswith("/v1/models/"):
+                model = self.path[len("/v1/models/") :]
+                return self._json(
+                    200,
+                    {"id": model, "object": "model", "created": 0, "owned_by": "bench"},
+                )
+            self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def _json(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        # ---------------------------
+        # Chat completion; streamed word by word (Server-Sent Events) when asked,
+        # with the latency spread over the words
+        # ---------------------------
+        def _chat(self, body, status, delay):
+            answer, usage = services.chat_answer(body)
+            if not body.get("stream"):
+                time.sleep(delay)
+                if status != 200:
+                    return self._json(status, {"error": {"message": "Injected error"}})
+                return self._json(
+                    200,
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": answer},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    },
+                )
+            words = answer.split(" ")
+            time.sleep(delay / 2)  # Time to the first token
+            if status != 200:
+                return self._json(status, {"error": {"message": "Injected error"}})
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            base = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model"),
+            }
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(delay / 2 / len(words))
+                delta = {"content": word if i == 0 else " " + word}
+                choice = {"index": 0, "delta": delta, "finish_reason": None}
+                self._event(dict(base, choices=[choice]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._event(dict(base, choices=[], usage=usage))
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+
+        def _event(self, data):
+            self._chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        def _chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return Handler
+
+
+# ---------------------------
+# Command-line options for the profiles: --embed-latency, --chat-rpm, --query-error-rate, ...
+# defaults: {service: ServiceProfile} used when an option is not given
+# ---------------------------
+def add_profile_arguments(parser, defaults=None):
+    defaults = defaults or {}
+    for name in SERVICES:
+        profile = defaults.get(name) or ServiceProfile()
+        parser.add_argument(
+            f"--{name}-latency",
+            type=float,
+            default=profile.latency,
+            help=f"Seconds per {name} request (default: {profile.latency})",
+        )
+        parser.add_argument(
+            f"--{name}-rpm",
+            type=int,
+            default=profile.requests_per_minute,
+            help=f"{name} requests per minute before 429 (default: unlimited)",
+        )
+        parser.add_argument(
+            f"--{name}-error-rate",
+            type=float,
+            default=profile.error_rate,
+            help=f"Fraction of {name} requests answered with 500",
+        )
+
+
+def profiles_from_args(args):
+    return {
+        name: ServiceProfile(
+            latency=getattr(args, f"{name}_latency"),
+            requests_per_minute=getattr(args, f"{name}_rpm"),
+            error_rate=getattr(args, f"{name}_error_rate"),
+        )
+        for name in SERVICES
+    }
+
+
+# ---------------------------
+# Run the stand-ins on their own (e.g. for the app or query_embeddings.py)
+#   python benchmarks/fake_services.py --port 8900 --chat-latency 0.8
+# ---------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI / Pinecone server")
+    parser.add_argument("--port", type=int, default=8900)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    services = FakeServices(profiles_from_args(args), port=args.port).start()
+    print(f"OPENAI_BASE_URL={services.openai_base_url}")
+    print(f"OPENAI_EMBEDDINGS_URL={services.embeddings_url}")
+    print(f"PINECONE_URL={services.pinecone_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
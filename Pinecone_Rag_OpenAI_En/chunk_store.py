@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+import zlib
+
+# ---------------------------
+# Local chunk-text store (slim vector metadata)
+# With a chunk store, vectors are written with their small attributes only
+# (source, page, section) and the chunk text is kept here, zlib-compressed in SQLite
+# → smaller upsert requests, vector index storage and query responses
+# Queries look up the texts of all their matches in one batched read (resolve)
+# Matches that already have metadata["text"] (vectors written without a chunk
+# store) are left as they are, so both kinds of vectors can be mixed
+#   chunks.sqlite3: (namespace, vector ID) → compressed text
+# ---------------------------
+DEFAULT_CHUNK_STORE_DIR = ""  # Disabled: the text stays in the vector metadata
+COMPRESSION_LEVEL = 6
+_SQL_BATCH = 400  # (namespace, id) pairs per "IN (...)" query
+_MMAP_BYTES = 256 * 1024 * 1024  # Reads go through a memory map of the file
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    id TEXT NOT NULL,
+    text BLOB NOT NULL,
+    PRIMARY KEY (namespace, id)
+) WITHOUT ROWID;
+"""
+
+
+class ChunkStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(directory, "chunks.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA mmap_size = {_MMAP_BYTES}")
+        self.lock = threading.Lock()
+
+    # Insert or replace chunk texts: [(vector_id, text), ...]
+    def put(self, namespace, chunks):
+        rows = [
+            (
+                namespace,
+                vector_id,
+                zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL),
+            )
+            for vector_id, text in chunks
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, id, text) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    # Texts of several chunks: [(namespace, vector_id), ...] → {(namespace, vector_id): text}
+    # Chunks that are not stored are missing from the result
+    def get(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start : start + _SQL_BATCH]
+                rows = self.conn.execute(
+                    "SELECT namespace, id, text FROM chunks WHERE (namespace, id) IN "
+                    f"(VALUES {', '.join(['(?, ?)'] * len(batch))})",
+                    [value for key in batch for value in key],
+                )
+                for namespace, vector_id, blob in rows:
+                    found[(namespace, vector_id)] = blob
+        return {
+            key: zlib.decompress(blob).decode("utf-8") for key, blob in found.items()
+        }
+
+    # ---------------------------
+    # Matches with metadata["text"] filled in from the store (same order)
+    # A match's namespace is match["namespace"] when present, otherwise `namespace`
+    # A match whose text is not stored (e.g. written moments ago by a running
+    # ingestion, or deleted since) is left out
+    # ---------------------------
+    def resolve(self, matches, namespace=""):
+        keys = [
+            (match.get("namespace", namespace), match["id"])
+            for match in matches
+            if "text" not in match["metadata"]
+        ]
+        if not keys:
+            return matches
+        texts = self.get(keys)
+        resolved = []
+        for match in matches:
+            if "text" in match["metadata"]:
+                resolved.append(match)
+                continue
+            text = texts.get((match.get("namespace", namespace), match["id"]))
+            if text is not None:
+                resolved.append(
+                    dict(match, metadata=dict(match["metadata"], text=text))
+                )
+        return resolved
+
+    def delete(self, namespace, ids):
+        ids = list(ids)
+        with self.lock, self.conn:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                self.conn.execute(
+                    "DELETE FROM chunks WHERE namespace = ? AND id IN "
+                    f"({', '.join('?' * len(batch))})",
+                    [namespace, *batch],
+                )
+
+    # Number of chunks and compressed bytes of a namespace
+    def describe(self, namespace):
+        with self.lock:
+            count, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM chunks "
+                "WHERE namespace = ?",
+                (namespace,),
+            ).fetchone()
+        return {"chunks": count, "bytes": size}
+
+    # Wrap a vector store writer so that chunk texts are stored here instead
+    def writer(self, writer):
+        return ChunkStoreWriter(self, writer)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------
+# Vector store writer that moves metadata["text"] into the chunk store
+# (same interface and reports as the wrapped writer; texts are stored in batches
+# of max_batch_chunks and at every flush, deletions are applied to both)
+# ---------------------------
+class ChunkStoreWriter:
+    def __init__(self, store, writer, max_batch_chunks=100):
+        self.store = store
+        self.writer = writer
+        self.max_batch_chunks = max_batch_chunks
+        self.buffers = {}  # namespace → [(vector_id, text), ...]
+        self.reports = writer.reports
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        metadata = dict(metadata or {})
+        text = metadata.pop("text", None)
+        if text is not None:
+            self.buffers.setdefault(namespace, []).append((vector_id, text))
+            if len(self.buffers[namespace]) >= self.max_batch_chunks:
+                self._store(namespace)
+        self.writer.add(namespace, vector_id, values, metadata)
+
+    def flush(self, namespace=None):
+        self._store(namespace)
+        self.writer.flush(namespace)
+
+    def _store(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            chunks = self.buffers.pop(ns, [])
+            if chunks:
+                self.store.put(ns, chunks)
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        self.store.delete(namespace, ids)
+        return self.writer.delete(namespace, ids, batch_size)
+
+    def close(self):
+        self._store()
+        return self.writer.close()
+
+    def summary(self):
+        return self.writer.summary()
+
+
+# ---------------------------
+# Create the chunk store (an empty directory disables it → None)
+# ---------------------------
+def open_chunk_store(directory=DEFAULT_CHUNK_STORE_DIR):
+    if not directory:
+        return None
+    return ChunkStore(directory)
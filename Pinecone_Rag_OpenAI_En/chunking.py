@@ -0,0 +1,296 @@
+import re
+from functools import partial
+
+from clients import Lazy
+from embedding_batcher import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Optional; token counts fall back to an estimate
+    tiktoken = None
+
+# ---------------------------
+# Chunking strategies (selected by name with get_chunker)
+# chars:    fixed character windows (same chunks as the original chunk_text)
+# tokens:   word-aligned windows of at most max_tokens tokens
+# sentence: sentences/paragraphs packed up to max_tokens (Japanese 。！？ aware)
+# heading:  like sentence, but chunks never cross a Markdown/DOCX heading;
+#           continuation chunks repeat the heading and carry the section path
+# Every chunker takes pages = iterable of (page number, text) and
+# yields (info, chunk); info holds "page" (when known) and "section" (heading only)
+# ---------------------------
+DEFAULT_STRATEGY = "chars"
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+
+# A run of text without any boundary longer than this is cut anyway
+_MAX_UNIT_CHARS = 20000
+
+_WORD_END = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"[。．！？]+[」』）)]*\s*|[.!?]+[\"')\]]*\s+|\n[ \t]*\n\s*")
+_HEADING = re.compile(r"(#{1,6})[ \t]+(.*)")
+
+
+# ---------------------------
+# Token count with the embedding model's tokenizer (cl100k_base)
+# The encoding is loaded by the first count_tokens call, not at import (tiktoken
+# downloads its BPE file); when tiktoken is not installed or the encoding cannot
+# be loaded (e.g. offline), estimate_tokens is used instead
+# ---------------------------
+def _load_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[Warning] Cannot load the tiktoken encoding; estimating token counts: {e}")
+        return None
+
+
+tokenizer = Lazy("tiktoken", _load_encoding)
+
+
+def count_tokens(text):
+    encoding = tokenizer.get()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# ---------------------------
+# Strategy: fixed character windows
+# Same chunks as chunk_text over the joined pages; the overlap carries over
+# page boundaries and only the unfinished tail is kept in memory
+# ---------------------------
+def chunk_chars(pages, chunk_size=1000, overlap=200):
+    step = chunk_size - overlap
+    buffer = ""
+    starts = []  # [(offset in buffer, page number)] where each page begins
+    for page, text in pages:
+        if not text:
+            continue
+        starts.append((len(buffer), page))
+        buffer += text
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            chunk = _chunk_with_page(buffer[start : start + chunk_size], start, starts)
+            if chunk:
+                yield chunk
+            start += step
+        if start:
+            buffer = buffer[start:]
+            starts = [(0, _page_at(starts, start))] + [
+                (offset - start, number) for offset, number in starts if offset > start
+            ]
+    start = 0
+    while start < len(buffer):
+        chunk = _chunk_with_page(buffer[start : start + chunk_size], start, starts)
+        if chunk:
+            yield chunk
+        start += step
+
+
+def _chunk_with_page(chunk, offset, starts):
+    stripped = chunk.strip()
+    if not stripped:
+        return None
+    offset += len(chunk) - len(chunk.lstrip())
+    return _info(_page_at(starts, offset)), stripped
+
+
+def _page_at(starts, offset):
+    page = starts[0][1]
+    for start, number in starts:
+        if start > offset:
+            break
+        page = number
+    return page
+
+
+# ---------------------------
+# Strategy: token budget, cut between words
+# (CJK runs without spaces are cut by token count)
+# ---------------------------
+def chunk_tokens(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    units = ((page, text, False) for page, text in _split_units(pages, _WORD_END))
+    return _pack(units, max_tokens, overlap_tokens)
+
+
+# ---------------------------
+# Strategy: whole sentences/paragraphs up to the token budget
+# ---------------------------
+def chunk_sentences(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    units = ((page, text, False) for page, text in _split_units(pages, _SENTENCE_END))
+    return _pack(units, max_tokens, overlap_tokens)
+
+
+# ---------------------------
+# Strategy: sentences within Markdown sections ("# Title" lines)
+# DOCX headings arrive as Markdown lines (see extract_pages(markdown_headings=True))
+# ---------------------------
+def chunk_headings(
+    pages, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS
+):
+    return _pack(_heading_units(pages), max_tokens, overlap_tokens)
+
+
+def _heading_units(pages):
+    for page, text in _split_units(pages, _SENTENCE_END):
+        # A heading line can sit in the middle of a unit (no sentence end before it)
+        for part in re.split(r"(?m)^(?=#{1,6}[ \t])", text):
+            if not part:
+                continue
+            if _HEADING.match(part):
+                line, newline, rest = part.partition("\n")
+                yield page, line + newline, True
+                if rest:
+                    yield page, rest, False
+            else:
+                yield page, part, False
+
+
+# ---------------------------
+# Split the page stream into units ending at pattern matches (words, sentences)
+# Yields (page number where the unit starts, text); units may span pages
+# ---------------------------
+def _split_units(pages, pattern):
+    carry = ""
+    carry_page = None
+    for page, text in pages:
+        if not text:
+            continue
+        if not carry:
+            carry_page = page
+        page_start = len(carry)
+        carry += text
+        start = 0
+        for match in pattern.finditer(carry):
+            # A boundary at the very end may continue on the next page
+            if match.end() >= len(carry):
+                break
+            yield (carry_page if start < page_start else page), carry[
+                start : match.end()
+            ]
+            start = match.end()
+        while len(carry) - start > _MAX_UNIT_CHARS:
+            yield (carry_page if start < page_start else page), carry[
+                start : start + _MAX_UNIT_CHARS
+            ]
+            start += _MAX_UNIT_CHARS
+        if start:
+            carry_page = carry_page if start < page_start else page
+            carry = carry[start:]
+    if carry:
+        yield carry_page, carry
+
+
+# ---------------------------
+# Pack units greedily into chunks of at most max_tokens
+# units: (page, text, is_heading)
+# After each chunk, trailing units of up to overlap_tokens start the next one
+# A heading starts a new chunk (no overlap) and is repeated on its continuation chunks
+# ---------------------------
+def _pack(units, max_tokens, overlap_tokens):
+    window = []  # [(page, text, tokens)], without the heading line
+    total = 0  # tokens in window
+    header = None  # (page, text, tokens) of the current heading line
+    headings = []  # [(level, title)] of the current section
+    for page, text, is_heading in units:
+        if is_heading:
+            if window:
+                yield from _emit(header, window, headings)
+            level, title = _HEADING.match(text).groups()
+            headings = [h for h in headings if h[0] < len(level)]
+            headings.append((len(level), title.strip()))
+            header = (page, text, count_tokens(text))
+            window = []
+            total = 0
+            continue
+        # Room left next to the repeated heading (at least half of max_tokens)
+        budget = max(max_tokens - (header[2] if header else 0), max_tokens // 2)
+        tokens = count_tokens(text)
+        pieces = [(text, tokens)] if tokens <= budget else _split_long(text, budget)
+        for piece, tokens in pieces:
+            if window and total + tokens > budget:
+                yield from _emit(header, window, headings)
+                window = _overlap(window, overlap_tokens)
+                total = sum(unit[2] for unit in window)
+                while window and total + tokens > budget:
+                    total -= window.pop(0)[2]
+            window.append((page, piece, tokens))
+            total += tokens
+    # A heading without any text under it is not emitted on its own
+    if window:
+        yield from _emit(header, window, headings)
+
+
+# Trailing units (never the whole window) that fit in overlap_tokens
+def _overlap(window, overlap_tokens):
+    tail = []
+    size = 0
+    for unit in reversed(window[1:]):
+        if size + unit[2] > overlap_tokens:
+            break
+        tail.insert(0, unit)
+        size += unit[2]
+    return tail
+
+
+# Yields (info, chunk) for a window, unless it holds only whitespace
+def _emit(header, window, headings):
+    text = "".join(unit[1] for unit in window)
+    if not text.strip():
+        return
+    info = _info(window[0][0])
+    if headings:
+        info["section"] = " > ".join(title for _, title in headings)
+    if header is not None:
+        text = header[1] + text
+    yield info, text.strip()
+
+
+def _info(page):
+    return {} if page is None else {"page": page}
+
+
+# ---------------------------
+# Cut an over-long unit into pieces of at most max_tokens (by character position)
+# ---------------------------
+def _split_long(text, max_tokens):
+    pieces = []
+    while text:
+        tokens = count_tokens(text)
+        if tokens <= max_tokens:
+            pieces.append((text, tokens))
+            break
+        size = max(1, len(text) * max_tokens // tokens)
+        while size > 1 and count_tokens(text[:size]) > max_tokens:
+            size = size * 9 // 10
+        pieces.append((text[:size], count_tokens(text[:size])))
+        text = text[size:]
+    return pieces
+
+
+CHUNKERS = {
+    "chars": chunk_chars,
+    "tokens": chunk_tokens,
+    "sentence": chunk_sentences,
+    "heading": chunk_headings,
+}
+
+
+# ---------------------------
+# Chunker by strategy name; options are passed to the strategy
+# (chars: chunk_size / overlap, others: max_tokens / overlap_tokens)
+# ---------------------------
+def get_chunker(strategy=DEFAULT_STRATEGY, **options):
+    if strategy not in CHUNKERS:
+        raise ValueError(
+            f"Unknown chunking strategy: {strategy} (choose from {', '.join(CHUNKERS)})"
+        )
+    options = {key: value for key, value in options.items() if value is not None}
+    return partial(CHUNKERS[strategy], **options)
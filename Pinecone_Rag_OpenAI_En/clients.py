@@ -0,0 +1,212 @@
+import importlib
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from functools import partial
+
+# ---------------------------
+# Lazy construction of the SDK clients and local resources, startup timing and
+# pre-forked workers
+# Importing Flask/app.py or query_embeddings.py only defines things: the OpenAI
+# and Pinecone SDKs are imported, and clients, caches and indexes opened, on
+# first use (or by an explicit warm-up before serving)
+# → a worker is ready in a fraction of a second, and tools and tests that
+#   import the modules do no network or disk setup
+# ---------------------------
+
+
+# ---------------------------
+# Startup timing of the process, measured from the first import of this module
+# Phases: "import" (modules), "init" (each resource built), "warm-up"
+# (connections opened before serving), each broken down by name
+# report(): one line, e.g. "import 0.62s (flask 0.18s, openai 0.41s), init ..."
+# ---------------------------
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marked = self.started
+        self.forked = None  # time.perf_counter() in a pre-forked worker
+        self.worker = None  # Index of the pre-forked worker (None: not forked)
+        self.ready_seconds = None
+        self.phases = {}  # kind → {name: seconds}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, kind, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(kind, name, time.perf_counter() - started)
+
+    # Time since the previous mark or phase (e.g. the imports at the top of a module)
+    def mark(self, kind, name):
+        self._add(kind, name, time.perf_counter() - self.marked)
+
+    def _add(self, kind, name, seconds):
+        with self.lock:
+            names = self.phases.setdefault(kind, {})
+            names[name] = names.get(name, 0.0) + seconds
+            self.marked = time.perf_counter()
+
+    # The process (or worker) starts serving
+    def ready(self):
+        self.ready_seconds = time.perf_counter() - (self.forked or self.started)
+
+    def snapshot(self):
+        with self.lock:
+            phases = {kind: dict(names) for kind, names in self.phases.items()}
+        return {
+            "phases": phases,
+            "ready_seconds": self.ready_seconds,
+            "worker": self.worker,
+        }
+
+    def report(self):
+        parts = []
+        for kind, names in self.snapshot()["phases"].items():
+            detail = ", ".join(
+                f"{name} {seconds:.2f}s"
+                for name, seconds in sorted(names.items(), key=lambda item: -item[1])
+            )
+            parts.append(f"{kind} {sum(names.values()):.2f}s ({detail})")
+        if self.ready_seconds is not None:
+            since = "after fork" if self.forked is not None else "after start"
+            parts.append(f"ready {self.ready_seconds:.2f}s {since}")
+        return ", ".join(parts)
+
+
+startup = StartupTimer()
+
+
+# ---------------------------
+# Import a module on first use, timed as an "import" phase
+# ---------------------------
+def import_module(name):
+    module = sys.modules.get(name)
+    if module is None:
+        with startup.phase("import", name):
+            module = importlib.import_module(name)
+    return module
+
+
+# Import modules ahead of time (e.g. before forking workers, so they share them)
+def preload(names):
+    for name in names:
+        import_module(name)
+
+
+_UNSET = object()
+
+
+# ---------------------------
+# A value built on first use: Lazy(name, factory, *args, **kwargs).get()
+# Built once even with concurrent callers; the factory may return None (a
+# disabled feature, like the open_xxx functions); the time to build it is
+# recorded as the "init" phase `name`
+# ---------------------------
+class Lazy:
+    def __init__(self, name, factory, *args, **kwargs):
+        self.name = name
+        self.factory = partial(factory, *args, **kwargs)
+        self.value = _UNSET
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.value is _UNSET:
+            with self.lock:
+                if self.value is _UNSET:
+                    with startup.phase("init", self.name):
+                        self.value = self.factory()
+        return self.value
+
+    @property
+    def built(self):
+        return self.value is not _UNSET
+
+
+# ---------------------------
+# SDK clients (the openai package is the slowest import of the project, so it is
+# only imported here, when the first client is created)
+# Retries are left to the scheduler (rate_limiter.py) by default
+# ---------------------------
+def openai_client(api_key=None, max_retries=0, **options):
+    openai = import_module("openai")
+    return openai.OpenAI(api_key=api_key, max_retries=max_retries, **options)
+
+
+def async_openai_client(api_key=None, max_retries=0, **options):
+    openai = import_module("openai")
+    return openai.AsyncOpenAI(api_key=api_key, max_retries=max_retries, **options)
+
+
+# Pinecone index client (host: index URL; without it the SDK looks the index up)
+def pinecone_index(api_key, index_name, host=None):
+    pinecone = import_module("pinecone")
+    client = pinecone.Pinecone(api_key=api_key)
+    if host:
+        return client.Index(name=index_name, host=host)
+    return client.Index(index_name)
+
+
+# Build (and drop) one client of each SDK: both import most of their modules
+# (HTTP stack, data-plane API) when a client is created, which opens no
+# connection → safe before forking, and the workers get the modules for free
+def preload_clients():
+    preload(["openai", "pinecone"])
+    with startup.phase("import", "sdk clients"):
+        openai_client(api_key="preload")
+        async_openai_client(api_key="preload")
+        pinecone_index("preload", "preload", host="http://127.0.0.1")
+
+
+# ---------------------------
+# Pre-forked workers
+# The parent imports what the workers share (preload), binds the listening
+# socket, then forks `workers` children; each child opens its own clients,
+# caches and connections (nothing is opened before the fork, so no SQLite
+# connection, memory map or socket is shared) and serves on the same socket
+# → the imports happen once and a new worker is ready without repeating them
+# serve(worker): runs in each child (worker = 0 … workers - 1)
+# The parent forwards SIGINT / SIGTERM to the children and waits for them
+# Without os.fork (Windows) or with one worker, serve(0) runs in this process
+# ---------------------------
+def prefork(workers, serve):
+    if workers <= 1 or not hasattr(os, "fork"):
+        serve(0)
+        return
+    children = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            startup.forked = time.perf_counter()
+            startup.worker = worker
+            status = 0
+            try:
+                serve(worker)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
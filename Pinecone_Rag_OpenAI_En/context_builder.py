@@ -0,0 +1,233 @@
+import re
+import threading
+
+import numpy as np
+
+from chunking import count_tokens
+
+# ---------------------------
+# Prompt context built from the matched chunks (used by the app and query_embeddings.py)
+# 1. Chunks of the same source that overlap (each chunk repeats the end of the
+#    previous one) or are adjacent are merged into one passage
+# 2. Near-duplicate passages are dropped, keeping the better ranked one
+#    (Jaccard similarity of character shingles estimated with MinHash)
+# 3. Passages are packed in rank order into max_tokens; the first one that does
+#    not fit is cut to the remaining budget
+# The report tells how many prompt tokens this saved compared with joining every match
+# ---------------------------
+DEFAULT_MAX_TOKENS = 3000  # Context token budget (0: no limit)
+DEFAULT_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity of near-duplicates
+SHINGLE_CHARS = 5  # Character shingles work for Japanese and English alike
+MINHASH_PERMUTATIONS = 64
+MIN_OVERLAP_CHARS = 20  # A shorter common suffix/prefix is not an overlap
+MIN_CUT_TOKENS = 50  # A passage would be cut shorter than this → left out instead
+
+# Vector IDs are "<path under the ingest root>-chunk-<n>" (see chunk_file in
+# upload_embeddings)
+_CHUNK_NUMBER = re.compile(r"-chunk-(\d+)$")
+
+# MinHash permutations: multiply-shift hashes of each shingle's hash
+_SHINGLE_BASE = np.uint64(1000003)
+_rng = np.random.default_rng(0)
+_MULTIPLIERS = _rng.integers(1, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64) | 1
+_OFFSETS = _rng.integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+# ---------------------------
+# Context text for matches in rank order ([{"id", "metadata": {"text", "source"}, ...}])
+# Returns (context, report):
+#   chunks / passages   matches given / passages in the context
+#   merged              chunks merged into a neighbouring chunk
+#   duplicates          passages dropped as near-duplicates
+#   over_budget         passages cut or left out for max_tokens
+#   tokens              tokens of the context
+#   tokens_saved        tokens of all matches joined as-is minus tokens
+# ---------------------------
+def build_context(
+    matches,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD,
+    separator="\n\n",
+):
+    passages = _merge_chunks(matches)
+    kept = _drop_duplicates(passages, duplicate_threshold)
+    packed, over_budget = _pack(kept, int(max_tokens or 0), separator)
+    context = separator.join(packed)
+    tokens = count_tokens(context) if packed else 0
+    report = {
+        "chunks": len(matches),
+        "passages": len(packed),
+        "merged": len(matches) - len(passages),
+        "duplicates": len(passages) - len(kept),
+        "over_budget": over_budget,
+        "tokens": tokens,
+        "tokens_saved": _joined_tokens(matches, separator) - tokens,
+    }
+    return context, report
+
+
+# Tokens of every match joined as-is (what the prompt held before this module)
+def _joined_tokens(matches, separator):
+    if not matches:
+        return 0
+    tokens = sum(count_tokens(match["metadata"]["text"]) for match in matches)
+    return tokens + count_tokens(separator) * (len(matches) - 1)
+
+
+def _chunk_number(vector_id):
+    found = _CHUNK_NUMBER.search(vector_id or "")
+    return int(found.group(1)) if found else None
+
+
+# ---------------------------
+# Merge chunks of the same (namespace, source) that overlap or are adjacent
+# Returns the passages ordered by the best rank among their chunks
+# ---------------------------
+def _merge_chunks(matches):
+    groups = {}
+    for rank, match in enumerate(matches):
+        metadata = match["metadata"]
+        number = _chunk_number(match.get("id"))
+        if number is None or not metadata.get("source"):
+            key = (None, rank)  # Position unknown: kept on its own
+        else:
+            key = (match.get("namespace"), metadata["source"])
+        groups.setdefault(key, []).append((number or 0, rank, metadata["text"]))
+
+    passages = []
+    for members in groups.values():
+        members.sort()
+        number, rank, text = members[0]
+        for next_number, next_rank, next_text in members[1:]:
+            joined = _join(text, next_text, adjacent=next_number == number + 1)
+            if joined is None:
+                passages.append((rank, text))
+                rank, text = next_rank, next_text
+            else:
+                rank, text = min(rank, next_rank), joined
+            number = next_number
+        passages.append((rank, text))
+    return [text for _, text in sorted(passages)]
+
+
+# Two chunks in document order as one passage (None: they are not neighbours)
+def _join(first, second, adjacent):
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = _overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    if adjacent:
+        return first + "\n" + second
+    return None
+
+
+# Length of the longest end of `first` that `second` starts with (0: none)
+def _overlap(first, second):
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    position = first.find(probe, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+# ---------------------------
+# Drop passages contained in, or near-duplicates of, a better ranked passage
+# ---------------------------
+def _drop_duplicates(passages, threshold):
+    kept = []
+    signatures = []
+    for text in passages:
+        if any(text in other for other in kept):
+            continue
+        signature = _minhash(text)
+        if signatures and _similarity(signatures, signature).max() >= threshold:
+            continue
+        kept.append(text)
+        signatures.append(signature)
+    return kept
+
+
+# MinHash signature of the character shingles (whitespace collapsed, lowercased)
+# Shingles are hashed as polynomials of their code points, all at once with numpy
+def _minhash(text):
+    text = " ".join(text.split()).lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < SHINGLE_CHARS:
+        codes = np.pad(codes, (0, SHINGLE_CHARS - len(codes)))
+    count = len(codes) - SHINGLE_CHARS + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(SHINGLE_CHARS):
+        hashes = hashes * _SHINGLE_BASE + codes[i : i + count]
+    hashes = np.unique(hashes)
+    return ((hashes[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).min(axis=0)
+
+
+# Estimated Jaccard similarity of a signature with each of `signatures`
+def _similarity(signatures, signature):
+    return (np.stack(signatures) == signature).mean(axis=1)
+
+
+# ---------------------------
+# Whole passages in rank order while they fit; the first one that does not fit
+# is cut to the rest of the budget (unless less than MIN_CUT_TOKENS remain)
+# Returns (passages, number of passages cut or left out)
+# ---------------------------
+def _pack(passages, max_tokens, separator):
+    if not max_tokens:
+        return list(passages), 0
+    packed = []
+    used = 0
+    gap = count_tokens(separator)
+    for i, text in enumerate(passages):
+        budget = max_tokens - used - (gap if packed else 0)
+        tokens = count_tokens(text)
+        if tokens <= budget:
+            packed.append(text)
+            used += tokens + (gap if len(packed) > 1 else 0)
+        elif budget >= MIN_CUT_TOKENS:
+            packed.append(_cut(text, tokens, budget))
+            return packed, len(passages) - i
+    return packed, len(passages) - len(packed)
+
+
+# Start of a text within max_tokens, ending at a sentence or line break when one is near
+def _cut(text, tokens, max_tokens):
+    size = max(1, len(text) * max_tokens // tokens)
+    while size > 1 and count_tokens(text[:size]) > max_tokens:
+        size = size * 9 // 10
+    head = text[:size]
+    end = max(head.rfind(mark) for mark in ("。", ". ", "\n"))
+    if end > size * 3 // 4:
+        head = head[: end + 1]
+    return head.rstrip()
+
+
+# ---------------------------
+# Totals over every context built (thread-safe; shown at /stats and /metrics)
+# ---------------------------
+class ContextStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        keys = ("contexts", "chunks", "merged", "duplicates", "over_budget")
+        self.totals = dict.fromkeys(keys + ("tokens", "tokens_saved"), 0)
+
+    def add(self, report):
+        with self.lock:
+            self.totals["contexts"] += 1
+            for key in report:
+                if key in self.totals:
+                    self.totals[key] += report[key]
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+        sent = totals["tokens"] + totals["tokens_saved"]
+        totals["saved_rate"] = totals["tokens_saved"] / sent if sent else 0.0
+        return totals
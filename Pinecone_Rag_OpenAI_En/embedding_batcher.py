@@ -0,0 +1,235 @@
+import threading
+import time
+import requests
+
+from rate_limiter import Scheduler
+
+# ---------------------------
+# Batched embedding generation (OpenAI embeddings endpoint)
+# The endpoint accepts an array "input", so many chunks are vectorized per request
+# → A 300-page PDF costs a handful of round trips instead of one per chunk
+# ---------------------------
+DEFAULT_EMBEDDING_URL = "https://api.openai.com/v1/embeddings"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# API limits: at most 2048 inputs and 300,000 tokens per request
+# The default token budget stays well below the limit because the estimate is approximate
+MAX_INPUTS_PER_REQUEST = 2048
+DEFAULT_MAX_BATCH_TOKENS = 100000
+
+
+# ---------------------------
+# Rough token estimate (no tokenizer dependency)
+# ASCII text: about 4 characters per token
+# Japanese and other non-ASCII text: about 1 token per character (conservative)
+# ---------------------------
+def estimate_tokens(text):
+    ascii_chars = len(text.encode("ascii", errors="ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+# ---------------------------
+# Error raised when a single input can never be embedded (too large on its own)
+# ---------------------------
+class BatchTooLargeError(Exception):
+    pass
+
+
+# ---------------------------
+# Embedding batcher
+# items: (chunk_id, text) pairs, may come from one or more files
+# Groups items into token-budgeted batches, sends one request per batch,
+# and maps the returned vectors back to chunk IDs by their "index" field
+# url: can point at a local stand-in server for testing
+# cache: EmbeddingCache; cached texts are served without a request
+# scheduler: Scheduler shared with the other OpenAI / Pinecone calls of the
+#   process (per-model rate limits, retries with backoff, circuit breaker)
+# ---------------------------
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        api_key,
+        url=DEFAULT_EMBEDDING_URL,
+        model=DEFAULT_EMBEDDING_MODEL,
+        max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+        max_batch_size=MAX_INPUTS_PER_REQUEST,
+        session=None,
+        timeout=60,
+        cache=None,
+        scheduler=None,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = min(max_batch_size, MAX_INPUTS_PER_REQUEST)
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler = scheduler or Scheduler()
+        self.lock = threading.Lock()
+        self.failed = {}  # chunk_id → error message
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "inputs": 0,
+            "tokens": 0,
+            "splits": 0,
+            "cached": 0,
+            "seconds": 0.0,
+        }
+
+    # ---------------------------
+    # Split items into batches within the token budget and input count limit
+    # ---------------------------
+    def iter_batches(self, items):
+        batch = []
+        batch_tokens = 0
+        for chunk_id, text in items:
+            tokens = estimate_tokens(text)
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append((chunk_id, text))
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    # ---------------------------
+    # Send one array request and return the vectors in input order
+    # limiter: RateLimiter shared by concurrent callers (waited on before sending,
+    #   in addition to the scheduler's limit for the model)
+    # 429 / 5xx responses are retried by the scheduler; "too large" is not
+    # ---------------------------
+    def _post(self, texts, limiter=None):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        data = {"input": texts, "model": self.model}
+
+        def send():
+            with self.lock:
+                self.stats["requests"] += 1
+            response = self.session.post(
+                self.url, headers=headers, json=data, timeout=self.timeout
+            )
+            if response.status_code in (400, 413) and _is_too_large(response):
+                raise BatchTooLargeError(response.text)
+            response.raise_for_status()
+            return response.json()
+
+        tokens = sum(estimate_tokens(text) for text in texts)
+        body = self.scheduler.call(self.model, send, tokens, limiter=limiter)
+        with self.lock:
+            self.stats["tokens"] += body.get("usage", {}).get("prompt_tokens", 0)
+        vectors = [None] * len(texts)
+        for item in body["data"]:
+            vectors[item["index"]] = item["embedding"]
+        return vectors
+
+    # ---------------------------
+    # Embed one batch; when the API rejects it as too large, split it in half and retry
+    # A single input that is still too large is recorded in self.failed
+    # ---------------------------
+    def _embed_batch(self, batch, limiter=None):
+        try:
+            vectors = self._post([text for _, text in batch], limiter)
+        except BatchTooLargeError as e:
+            with self.lock:
+                if len(batch) == 1:
+                    self.failed[batch[0][0]] = str(e)
+                    return []
+                self.stats["splits"] += 1
+            middle = len(batch) // 2
+            return self._embed_batch(batch[:middle], limiter) + self._embed_batch(
+                batch[middle:], limiter
+            )
+        return [(chunk_id, vector) for (chunk_id, _), vector in zip(batch, vectors)]
+
+    # ---------------------------
+    # Embed one batch and update the statistics (safe to call from several threads)
+    # A failed batch is recorded in self.failed and an empty list is returned
+    # Cache hits are taken out of the batch; only the misses are sent
+    # ---------------------------
+    def embed_batch(self, batch, limiter=None):
+        start = time.perf_counter()
+        cached = []
+        if self.cache:
+            vectors = self.cache.get_many([text for _, text in batch])
+            cached = [
+                (chunk_id, vector)
+                for (chunk_id, _), vector in zip(batch, vectors)
+                if vector is not None
+            ]
+            batch = [item for item, vector in zip(batch, vectors) if vector is None]
+        try:
+            results = self._embed_batch(batch, limiter) if batch else []
+        except Exception as e:
+            with self.lock:
+                for chunk_id, _ in batch:
+                    self.failed[chunk_id] = str(e)
+            results = []
+        if self.cache and results:
+            texts = dict(batch)
+            self.cache.put_many(
+                [(texts[chunk_id], vector) for chunk_id, vector in results]
+            )
+        with self.lock:
+            self.stats["seconds"] += time.perf_counter() - start
+            self.stats["batches"] += 1
+            self.stats["inputs"] += len(results) + len(cached)
+            self.stats["cached"] += len(cached)
+        return cached + results
+
+    # ---------------------------
+    # Embed all items and yield (chunk_id, embedding) as each batch completes
+    # ---------------------------
+    def embed(self, items):
+        for batch in self.iter_batches(items):
+            yield from self.embed_batch(batch)
+
+    # ---------------------------
+    # Embed all items and return {chunk_id: embedding}
+    # ---------------------------
+    def embed_all(self, items):
+        return dict(self.embed(items))
+
+    # ---------------------------
+    # Batch size and throughput report
+    # ---------------------------
+    def report(self):
+        batches = self.stats["batches"]
+        inputs = self.stats["inputs"]
+        seconds = self.stats["seconds"]
+        avg_size = inputs / batches if batches else 0.0
+        rate = inputs / seconds if seconds else 0.0
+        return (
+            f"{inputs} chunks in {batches} batches "
+            f"({self.stats['requests']} requests, {self.stats['splits']} splits, "
+            f"{self.stats['cached']} from cache), "
+            f"avg batch size {avg_size:.1f}, {rate:.1f} chunks/s, "
+            f"{self.stats['tokens']} tokens, {len(self.failed)} failed"
+        )
+
+
+# ---------------------------
+# Determine whether an error response means "request too large"
+# ---------------------------
+def _is_too_large(response):
+    if response.status_code == 413:
+        return True
+    message = response.text.lower()
+    return any(
+        phrase in message
+        for phrase in (
+            "maximum context length",
+            "too many tokens",
+            "max_tokens_per_request",
+            "too large",
+        )
+    )
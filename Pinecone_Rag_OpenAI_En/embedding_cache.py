@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ---------------------------
+# Persistent on-disk embedding cache keyed by (model, text hash)
+# vectors.f32: memory-mapped float32 array (capacity × dim), one slot per entry
+# slots.bin:   memory-mapped index (SHA-256 key + last-used counter per slot)
+# → Text embedded before (re-chunked overlaps, repeated questions, a second namespace)
+#   is served from disk without any network call
+# When full, the least recently used entry is evicted and its slot reused
+# A cache directory is meant to be written by one process at a time
+# (ingestion and query serving use separate directories by default)
+# ---------------------------
+DEFAULT_CACHE_DIR = ".embedding_cache"
+DEFAULT_DIMENSION = 1536  # text-embedding-3-small
+DEFAULT_CAPACITY = 50000  # ~300 MB of vectors at 1536 dimensions
+
+# tick 0 marks an unused slot; keys are raw 32-byte SHA-256 digests
+_SLOT_DTYPE = np.dtype([("key", "u1", (32,)), ("tick", "<u8")])
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIR,
+        model="text-embedding-3-small",
+        dim=DEFAULT_DIMENSION,
+        capacity=DEFAULT_CAPACITY,
+    ):
+        self.directory = directory
+        self.model = model
+        self.dim = dim
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+
+        mode = "r+" if os.path.exists(self._path("slots.bin")) else "w+"
+        self.slots = np.memmap(
+            self._path("slots.bin"), dtype=_SLOT_DTYPE, mode=mode, shape=(capacity,)
+        )
+        self.vectors = np.memmap(
+            self._path("vectors.f32"),
+            dtype=np.float32,
+            mode=mode,
+            shape=(capacity, dim),
+        )
+
+        # key → slot, ordered from least to most recently used
+        self.lru = OrderedDict()
+        used = np.nonzero(self.slots["tick"] > 0)[0]
+        for slot in used[np.argsort(self.slots["tick"][used], kind="stable")]:
+            self.lru[self.slots["key"][slot].tobytes()] = int(slot)
+        used_set = set(used.tolist())
+        self.free = [
+            slot for slot in range(capacity - 1, -1, -1) if slot not in used_set
+        ]
+        self.tick = int(self.slots["tick"].max()) if len(used) else 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # The dimension and capacity are fixed when the cache directory is created
+    def _check_meta(self):
+        meta_path = self._path("meta.json")
+        meta = {"dim": self.dim, "capacity": self.capacity}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(
+                    f"Embedding cache {self.directory} was created with {stored}, "
+                    f"not {meta}"
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).digest()
+
+    # ---------------------------
+    # Look up one text; returns the vector (list of float) or None
+    # ---------------------------
+    def get(self, text):
+        return self.get_many([text])[0]
+
+    # ---------------------------
+    # Look up several texts at once; misses are returned as None
+    # ---------------------------
+    def get_many(self, texts):
+        results = []
+        with self.lock:
+            for text in texts:
+                key = self.key(text)
+                slot = self.lru.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._touch(key, slot)
+                results.append(self.vectors[slot].tolist())
+        return results
+
+    # ---------------------------
+    # Store vectors (evicting the least recently used entries when full)
+    # ---------------------------
+    def put(self, text, vector):
+        self.put_many([(text, vector)])
+
+    def put_many(self, items):
+        with self.lock:
+            for text, vector in items:
+                if len(vector) != self.dim:
+                    continue
+                key = self.key(text)
+                slot = self.lru.get(key)
+                if slot is None:
+                    if self.free:
+                        slot = self.free.pop()
+                    else:
+                        _, slot = self.lru.popitem(last=False)
+                    self.slots["key"][slot] = np.frombuffer(key, dtype=np.uint8)
+                self.vectors[slot] = vector
+                self._touch(key, slot)
+
+    def _touch(self, key, slot):
+        self.tick += 1
+        self.slots["tick"][slot] = self.tick
+        self.lru[key] = slot
+        self.lru.move_to_end(key)
+
+    # ---------------------------
+    # Hit/miss counters
+    # ---------------------------
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.lru),
+                "capacity": self.capacity,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"{stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), "
+            f"{stats['entries']}/{stats['capacity']} entries"
+        )
+
+    def flush(self):
+        with self.lock:
+            self.slots.flush()
+            self.vectors.flush()
+
+    def close(self):
+        self.flush()
+
+
+# ---------------------------
+# Open the cache for one role (e.g. "ingest", "query")
+# base_dir: base directory; empty or None disables the cache
+# role: subdirectory, so ingestion and query serving do not share one writer
+# ---------------------------
+def open_cache(
+    role,
+    base_dir=DEFAULT_CACHE_DIR,
+    capacity=DEFAULT_CAPACITY,
+    model="text-embedding-3-small",
+):
+    if not base_dir:
+        return None
+    return EmbeddingCache(
+        os.path.join(base_dir, role), model=model, capacity=int(capacity)
+    )
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import zlib
+
+from ingest_manifest import file_sha256
+
+# ---------------------------
+# Cache of extracted text, keyed by the SHA-256 of the file's content (plus the
+# extractor and its options)
+# Re-chunking the same documents (another strategy or size) or ingesting them into
+# another namespace reads the pages from here instead of parsing the PDFs again
+# One zlib-compressed JSON file per document, written atomically (os.replace)
+# → safe to share between the extraction worker processes
+# Past max_mb the least recently used entries are removed (prune)
+#   <dir>/<first 2 hex digits>/<key>.json.z: [[page, text], ...]
+# ---------------------------
+DEFAULT_EXTRACT_CACHE_DIR = ".extract_cache"
+DEFAULT_MAX_MB = 1024
+EXTRACTION_VERSION = 1  # Bump when extracted text changes → older entries are unused
+COMPRESSION_LEVEL = 6
+
+
+class ExtractCache:
+    def __init__(self, directory, max_mb=DEFAULT_MAX_MB):
+        self.directory = directory
+        self.max_bytes = float(max_mb) * 1024 * 1024
+
+    # Key of a file's pages as extracted by `kind` with the given options
+    def key(self, file_path, kind, **options):
+        digest = hashlib.sha256(file_sha256(file_path).encode("ascii"))
+        digest.update(
+            f"{EXTRACTION_VERSION}\n{kind}\n{sorted(options.items())}".encode()
+        )
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.z")
+
+    # [(page, text), ...] or None when not cached (or unreadable)
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pages = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            os.utime(path)  # Most recently used (prune removes the oldest first)
+        except (OSError, ValueError, zlib.error):
+            return None
+        return [tuple(page) for page in pages]
+
+    def put(self, key, pages):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(list(pages), ensure_ascii=False).encode("utf-8")
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(zlib.compress(data, COMPRESSION_LEVEL))
+        os.replace(temp, path)
+
+    # ---------------------------
+    # Remove the least recently used entries while the cache exceeds max_mb
+    # Returns {"files", "bytes"} left and the number of files removed
+    # ---------------------------
+    def prune(self):
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return {"files": len(entries) - removed, "bytes": total, "removed": removed}
+
+
+# ---------------------------
+# Create the extraction cache (an empty directory disables it → None)
+# ---------------------------
+def open_extract_cache(directory=DEFAULT_EXTRACT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+    if not directory:
+        return None
+    return ExtractCache(directory, max_mb)
@@ -0,0 +1,381 @@
+import codecs
+import csv
+import os
+import re
+import zipfile
+from html.parser import HTMLParser
+
+import docx
+import pdfplumber
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+# ---------------------------
+# Text extraction by file type (registry of extractors, one page at a time)
+# The type is sniffed from the first bytes of the file; the extension only picks
+# between the text formats → images, archives and other binary files are skipped
+# instead of being decoded as garbage and embedded
+# Every extractor yields (page number or None, text), so the whole document is
+# never built as one string
+#   pdf       pdfplumber, page by page (page numbers)
+#   docx      paragraphs and tables in document order, page headers once at the top
+#   html      visible text (no scripts / styles), one line per block element
+#   csv       one "column: value; column: value" line per row (.csv / .tsv)
+#   markdown  as text, without the YAML front matter (.md / .markdown)
+#   text      everything else that is text, read in UTF-8 blocks (e.g. .txt, .py)
+# markdown_headings=True writes headings as "# Title" lines (docx / html)
+# ---------------------------
+TEXT_BLOCK_SIZE = 64 * 1024
+SNIFF_BYTES = 8192  # Bytes read to recognise the file type
+DEFAULT_MAX_FILE_MB = 200  # Larger files are skipped (0: no limit)
+MAX_INVALID_RATE = 0.01  # More undecodable bytes than this → not UTF-8 text
+
+EXTRACTORS = {}  # kind → extractor(file_path, markdown_headings)
+EXTENSIONS = {}  # extension → kind of the text formats
+_SNIFFERS = []  # (kind, sniff(file_path, head)) of the binary formats, checked first
+
+# Binary files without an extractor, recognised by their first bytes
+_BINARY_SIGNATURES = (
+    (b"\x89PNG", "PNG image"),
+    (b"\xff\xd8\xff", "JPEG image"),
+    (b"GIF8", "GIF image"),
+    (b"II*\x00", "TIFF image"),
+    (b"MM\x00*", "TIFF image"),
+    (b"RIFF", "audio / video / image (RIFF)"),
+    (b"PK\x03\x04", "ZIP archive"),
+    (b"\x1f\x8b", "gzip archive"),
+    (b"7z\xbc\xaf", "7z archive"),
+    (b"Rar!", "RAR archive"),
+    (b"\xd0\xcf\x11\xe0", "legacy Office document"),
+    (b"\x7fELF", "executable"),
+    (b"SQLite format 3", "SQLite database"),
+)
+_UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+
+# The file type cannot be extracted; the message is the reason
+class UnsupportedFile(Exception):
+    pass
+
+
+# ---------------------------
+# Register an extractor (decorator)
+# extensions: text formats handled by it (e.g. ".csv")
+# sniff: (file_path, first bytes) → True for binary formats recognised by content
+# ---------------------------
+def register(kind, *extensions, sniff=None):
+    def decorate(extractor):
+        EXTRACTORS[kind] = extractor
+        for extension in extensions:
+            EXTENSIONS[extension] = kind
+        if sniff is not None:
+            _SNIFFERS.append((kind, sniff))
+        return extractor
+
+    return decorate
+
+
+# ---------------------------
+# Kind of extractor for a file → (kind, None), or (None, reason) when it is skipped
+# Skip rules: hidden and Office lock files ("~$..."), empty files, files larger
+# than max_file_mb, binary files no extractor recognises, text that is not UTF-8
+# ---------------------------
+def detect_kind(file_path, max_file_mb=DEFAULT_MAX_FILE_MB):
+    if os.path.basename(file_path).startswith((".", "~$")):
+        return None, "hidden or temporary file"
+    size = os.path.getsize(file_path)
+    if not size:
+        return None, "empty file"
+    if max_file_mb and size > float(max_file_mb) * 1024 * 1024:
+        return None, f"larger than {max_file_mb} MB"
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    for kind, sniff in _SNIFFERS:
+        if sniff(file_path, head):
+            return kind, None
+    for signature, description in _BINARY_SIGNATURES:
+        if head.startswith(signature):
+            return None, description
+    if not head.startswith(_UTF16_BOMS):
+        if b"\x00" in head:
+            return None, "binary file"
+        text = head.decode("utf-8", errors="replace")
+        if text.count("\ufffd") > len(text) * MAX_INVALID_RATE:
+            return None, "not UTF-8 text"
+    extension = os.path.splitext(file_path)[1].lower()
+    return EXTENSIONS.get(extension, "text"), None
+
+
+# ---------------------------
+# (page number, text) of a file, one page (or block) at a time
+# kind: result of detect_kind (detected here when omitted)
+# Raises UnsupportedFile for files that are skipped
+# ---------------------------
+def extract_pages(
+    file_path, markdown_headings=False, kind=None, max_file_mb=DEFAULT_MAX_FILE_MB
+):
+    if kind is None:
+        kind, reason = detect_kind(file_path, max_file_mb)
+        if kind is None:
+            raise UnsupportedFile(reason)
+    return EXTRACTORS[kind](file_path, markdown_headings)
+
+
+# Text file opened in UTF-8 (BOM removed), or UTF-16 when it starts with its BOM
+def _open_text(file_path, newline=None):
+    with open(file_path, "rb") as f:
+        head = f.read(2)
+    encoding = "utf-16" if head in _UTF16_BOMS else "utf-8-sig"
+    return open(file_path, "r", encoding=encoding, errors="ignore", newline=newline)
+
+
+# ---------------------------
+# PDF: pdfplumber (yields (page number, text) for each page)
+# ---------------------------
+def _is_pdf(file_path, head):
+    return b"%PDF-" in head[:1024]
+
+
+@register("pdf", sniff=_is_pdf)
+def extract_pdf(file_path, markdown_headings=False):
+    with pdfplumber.open(file_path) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            # extract_text() returns None for pages without a text layer (scans, blank pages)
+            text = page.extract_text() or ""
+            # Drop the parsed layout objects so memory does not grow with the page count
+            page.flush_cache()
+            yield number, text + "\n"
+
+
+# ---------------------------
+# Word: python-docx (paragraph by paragraph; page number None as .docx has no fixed pages)
+# Page headers come first (each distinct text once), then paragraphs and tables
+# in document order; a table row becomes one "cell | cell | cell" line
+# ---------------------------
+def _is_docx(file_path, head):
+    if not head.startswith(b"PK\x03\x04"):
+        return False
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            return "word/document.xml" in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+@register("docx", sniff=_is_docx)
+def extract_docx(file_path, markdown_headings=False):
+    doc = docx.Document(file_path)
+    for idx, text in enumerate(_docx_lines(doc, markdown_headings)):
+        yield None, ("\n" if idx else "") + text
+
+
+def _docx_lines(doc, markdown_headings):
+    yield from _docx_headers(doc)
+    for child in doc.element.body.iterchildren():
+        if child.tag == qn("w:p"):
+            para = Paragraph(child, doc)
+            text = para.text
+            if markdown_headings:
+                text = _heading_prefix(para) + text
+            yield text
+        elif child.tag == qn("w:tbl"):
+            yield from _table_lines(Table(child, doc))
+
+
+# Header texts of every section (a header linked to the previous section is the same)
+def _docx_headers(doc):
+    seen = set()
+    for section in doc.sections:
+        for header in (section.first_page_header, section.header):
+            if header.is_linked_to_previous:
+                continue
+            for para in header.paragraphs:
+                text = para.text.strip()
+                if text and text not in seen:
+                    seen.add(text)
+                    yield text
+
+
+# One line per row; a merged cell is repeated by python-docx, so it is kept once
+def _table_lines(table):
+    for row in table.rows:
+        cells = []
+        previous = None
+        for cell in row.cells:
+            if cell._tc is previous:
+                continue
+            previous = cell._tc
+            cells.append(" ".join(cell.text.split()))
+        if any(cells):
+            yield " | ".join(cells)
+
+
+# "## " for a "Heading 2" paragraph ("Title" counts as level 1); "" otherwise
+def _heading_prefix(para):
+    style = para.style.name if para.style is not None else ""
+    if style == "Title":
+        return "# "
+    if style.startswith("Heading") or style.startswith("見出し"):
+        level = style.split()[-1]
+        return "#" * min(int(level), 6) + " " if level.isdigit() else "# "
+    return ""
+
+
+# ---------------------------
+# HTML: visible text, parsed block by block (html.parser from the standard library)
+# Block elements start new lines, list items become "- " lines, table cells are
+# separated by " | "; scripts, styles and templates are left out
+# ---------------------------
+_HTML_HIDDEN = {"script", "style", "noscript", "template", "svg"}
+_HTML_BLOCKS = {
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "br",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "figcaption",
+    "footer",
+    "form",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "hr",
+    "li",
+    "main",
+    "nav",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "title",
+    "tr",
+    "ul",
+}
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _HTMLText(HTMLParser):
+    def __init__(self, markdown_headings):
+        super().__init__(convert_charrefs=True)
+        self.markdown_headings = markdown_headings
+        self.hidden = 0  # Depth inside hidden elements
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_HIDDEN:
+            self.hidden += 1
+        elif tag in _HTML_BLOCKS:
+            self.parts.append("\n")
+            if tag == "li":
+                self.parts.append("- ")
+            elif self.markdown_headings and re.fullmatch(r"h[1-6]", tag):
+                self.parts.append("#" * int(tag[1]) + " ")
+        elif tag in ("td", "th"):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in _HTML_HIDDEN:
+            self.hidden = max(0, self.hidden - 1)
+        elif tag in _HTML_BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.parts.append(_WHITESPACE.sub(" ", data))
+
+    # Complete lines parsed so far (empty lines dropped); the last one may still grow
+    def take_lines(self, final=False):
+        text = "".join(self.parts)
+        end = len(text) if final else text.rfind("\n") + 1
+        self.parts = [text[end:]]
+        lines = [line.strip(" |") for line in text[:end].split("\n")]
+        return [line for line in lines if line]
+
+
+@register("html", ".html", ".htm", ".xhtml")
+def extract_html(file_path, markdown_headings=False):
+    parser = _HTMLText(markdown_headings)
+    with _open_text(file_path) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+            parser.feed(block)
+            lines = parser.take_lines()
+            if lines:
+                yield None, "\n".join(lines) + "\n"
+    parser.close()
+    lines = parser.take_lines(final=True)
+    if lines:
+        yield None, "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# CSV / TSV: the first row names the columns; every other row becomes one
+# "column: value; column: value" line (empty values left out), so each chunk
+# tells which column a value belongs to
+# The delimiter is sniffed from the start of the file (fallback: by extension)
+# ---------------------------
+@register("csv", ".csv", ".tsv")
+def extract_csv(file_path, markdown_headings=False):
+    with _open_text(file_path, newline="") as f:
+        sample = f.read(SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            tsv = file_path.lower().endswith(".tsv")
+            dialect = csv.excel_tab if tsv else csv.excel
+        rows = csv.reader(f, dialect)
+        header = [name.strip() for name in next(rows, [])]
+        lines = []
+        size = 0
+        for row in rows:
+            fields = [
+                f"{header[i]}: {value}" if i < len(header) and header[i] else value
+                for i, value in enumerate(value.strip() for value in row)
+                if value
+            ]
+            if not fields:
+                continue
+            line = "; ".join(fields)
+            lines.append(line)
+            size += len(line) + 1
+            if size >= TEXT_BLOCK_SIZE:
+                yield None, "\n".join(lines) + "\n"
+                lines = []
+                size = 0
+        if lines:
+            yield None, "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# Markdown: read as text (headings are already "#" lines), without the YAML
+# front matter ("---" ... "---" at the very start)
+# ---------------------------
+@register("markdown", ".md", ".markdown")
+def extract_markdown(file_path, markdown_headings=False):
+    with _open_text(file_path) as f:
+        for idx, block in enumerate(iter(lambda: f.read(TEXT_BLOCK_SIZE), "")):
+            if idx == 0 and block.startswith("---\n"):
+                end = block.find("\n---\n", 3)
+                if end != -1:
+                    block = block[end + 5 :]
+            yield None, block
+
+
+# ---------------------------
+# Other text: read in UTF-8 blocks (e.g., .txt, .py; page number None)
+# ---------------------------
+@register("text")
+def extract_plain_text(file_path, markdown_headings=False):
+    with _open_text(file_path) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+            yield None, block
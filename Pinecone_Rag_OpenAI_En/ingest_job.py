@@ -0,0 +1,318 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ingest_manifest import text_sha256
+
+# ---------------------------
+# Checkpointed ingestion job (SQLite), one per (vector store, namespace, directory)
+# files:        files whose chunks were all upserted (or dead-lettered), with the
+#               manifest record written for them at the end of the run
+#               (a file modified since is processed again when resuming)
+# chunks:       vectors upserted by the job (vector ID + content hash)
+# dead_letters: chunks whose embedding or upsert failed, kept with their text and
+#               metadata so that they can be replayed (--replay-dead-letters)
+# Every update is committed at once → the checkpoint survives the process dying,
+# and a resumed run (--resume) skips the finished files and the chunks already
+# upserted instead of repeating hours of embedding after an outage
+#   jobs.sqlite3 in the job directory (shared by all jobs)
+# ---------------------------
+DEFAULT_JOB_DIR = ".ingest_jobs"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    job TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    state TEXT,
+    hashes TEXT,
+    error TEXT,
+    PRIMARY KEY (job, path)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (job, vector_id)
+);
+CREATE INDEX IF NOT EXISTS chunks_by_path ON chunks (job, path);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    job TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    error TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (job, vector_id)
+);
+"""
+
+
+# ID of the job ingesting `directory` into `namespace` of a vector store
+def job_id(backend, namespace, directory):
+    return f"{backend}:{namespace}:{os.path.abspath(directory)}"
+
+
+class IngestJob:
+    def __init__(self, path, job):
+        self.id = job
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.resumed = False
+        self.previous_status = None  # Status of the job's last run (None: never ran)
+        self.options_changed = False
+        self.done = set()
+
+    # ---------------------------
+    # Start a run of the job
+    # resume=True continues the last run if it stopped before finishing with the
+    # same options (chunking and vector store); otherwise the job starts over
+    # and its previous checkpoint and dead letters are dropped
+    # ---------------------------
+    def start(self, options, resume=False):
+        options = json.dumps(options, sort_keys=True, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT options, status FROM jobs WHERE id = ?", (self.id,)
+            ).fetchone()
+            if row:
+                self.previous_status = row[1]
+                self.options_changed = row[0] != options
+            self.resumed = bool(
+                resume and row and row[1] == "running" and not self.options_changed
+            )
+            if self.resumed:
+                self.conn.execute(
+                    "UPDATE jobs SET updated = ? WHERE id = ?", (now, self.id)
+                )
+                rows = self.conn.execute(
+                    "SELECT path FROM files WHERE job = ? AND status = 'done'",
+                    (self.id,),
+                )
+                self.done = {path for (path,) in rows}
+                return
+            for table in ("files", "chunks", "dead_letters"):
+                self.conn.execute(f"DELETE FROM {table} WHERE job = ?", (self.id,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, 'running', ?, ?)",
+                (self.id, options, now, now),
+            )
+
+    # Manifest record of a file finished by the stopped run: (state, hashes), or
+    # None when the file is not finished or changed since (hashes is None without
+    # a manifest)
+    def finished_file(self, file_path):
+        if file_path not in self.done:
+            return None
+        with self.lock:
+            mtime, size, state, hashes = self.conn.execute(
+                "SELECT mtime, size, state, hashes FROM files WHERE job = ? AND path = ?",
+                (self.id, file_path),
+            ).fetchone()
+        stat = os.stat(file_path)
+        if (mtime, size) != (stat.st_mtime, stat.st_size):
+            return None
+        return (
+            json.loads(state) if state else None,
+            json.loads(hashes) if hashes else None,
+        )
+
+    # ---------------------------
+    # Chunks of a file still to be embedded: those this job already upserted with
+    # the same content are left out when resuming
+    # chunks: [(vector_id, chunk, metadata), ...]
+    # ---------------------------
+    def pending_chunks(self, file_path, chunks):
+        if not self.resumed:
+            return chunks
+        with self.lock:
+            upserted = dict(
+                self.conn.execute(
+                    "SELECT vector_id, content_hash FROM chunks WHERE job = ? AND path = ?",
+                    (self.id, file_path),
+                )
+            )
+        return [
+            (vector_id, chunk, metadata)
+            for vector_id, chunk, metadata in chunks
+            if upserted.get(vector_id) != text_sha256(chunk)
+        ]
+
+    # Vectors upserted: [(vector_id, path, content_hash), ...] (removed from the dead letters)
+    def record_chunks(self, items):
+        rows = [(self.id, vector_id, path, h) for vector_id, path, h in items]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows
+            )
+            self.conn.executemany(
+                "DELETE FROM dead_letters WHERE job = ? AND vector_id = ?",
+                [row[:2] for row in rows],
+            )
+
+    # ---------------------------
+    # Upsert reports of a writer: the vectors of successful requests are
+    # checkpointed, those of failed requests (after the writer's retries) become
+    # dead letters
+    # sent: {vector_id: (chunk, metadata)} of the vectors added to the writer
+    #       (reported vectors are removed from it)
+    # Returns [(vector_id, metadata, ok), ...]
+    # ---------------------------
+    def settle_reports(self, reports, sent):
+        settled = []
+        for report in reports:
+            items = [
+                (vector_id, *sent.pop(vector_id))
+                for vector_id in report["ids"]
+                if vector_id in sent
+            ]
+            if report["ok"]:
+                self.record_chunks(
+                    [
+                        (vector_id, metadata["source"], text_sha256(chunk))
+                        for vector_id, chunk, metadata in items
+                    ]
+                )
+            else:
+                for vector_id, chunk, metadata in items:
+                    self.dead_letter(
+                        vector_id,
+                        metadata["source"],
+                        chunk,
+                        metadata,
+                        "upsert",
+                        report["error"],
+                    )
+            settled.extend(
+                (vector_id, metadata, report["ok"]) for vector_id, _, metadata in items
+            )
+        return settled
+
+    # ---------------------------
+    # A file whose chunks were all upserted or dead-lettered
+    # state / hashes: what the manifest records for it (None without a manifest)
+    # ---------------------------
+    def complete_file(self, file_path, state=None, hashes=None):
+        stat = os.stat(file_path)
+        self._set_file(
+            file_path,
+            "done",
+            stat.st_mtime,
+            stat.st_size,
+            json.dumps(list(state)) if state else None,
+            json.dumps(hashes) if hashes is not None else None,
+            None,
+        )
+
+    # A file whose extraction failed (tried again when the job is resumed)
+    def fail_file(self, file_path, error):
+        self._set_file(file_path, "failed", None, None, None, None, str(error))
+
+    def _set_file(self, file_path, status, mtime, size, state, hashes, error):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.id, file_path, status, mtime, size, state, hashes, error),
+            )
+            self.conn.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), self.id)
+            )
+
+    # ---------------------------
+    # Dead-letter queue
+    # stage: "embed" / "upsert"; a chunk failing again counts one more attempt
+    # ---------------------------
+    def dead_letter(self, vector_id, path, text, metadata, stage, error):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (job, vector_id) DO UPDATE SET stage = excluded.stage, "
+                "error = excluded.error, attempts = attempts + 1",
+                (
+                    self.id,
+                    vector_id,
+                    path,
+                    text,
+                    json.dumps(metadata, ensure_ascii=False),
+                    stage,
+                    str(error),
+                    time.time(),
+                ),
+            )
+
+    # [{"vector_id", "path", "text", "metadata", "stage", "error", "attempts"}, ...]
+    def dead_letters(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT vector_id, path, text, metadata, stage, error, attempts "
+                "FROM dead_letters WHERE job = ? ORDER BY created",
+                (self.id,),
+            ).fetchall()
+        keys = ("vector_id", "path", "text", "metadata", "stage", "error", "attempts")
+        letters = [dict(zip(keys, row)) for row in rows]
+        for letter in letters:
+            letter["metadata"] = json.loads(letter["metadata"])
+        return letters
+
+    # The run went through every file (dead letters may remain)
+    def finish(self):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'finished', updated = ? WHERE id = ?",
+                (time.time(), self.id),
+            )
+
+    # Files done / failed, chunks upserted and dead letters of the job
+    def summary(self):
+        with self.lock:
+            files = dict(
+                self.conn.execute(
+                    "SELECT status, COUNT(*) FROM files WHERE job = ? GROUP BY status",
+                    (self.id,),
+                )
+            )
+            chunks, dead = (
+                self.conn.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE job = ?", (self.id,)
+                ).fetchone()[0]
+                for table in ("chunks", "dead_letters")
+            )
+        return {
+            "files_done": files.get("done", 0),
+            "files_failed": files.get("failed", 0),
+            "chunks": chunks,
+            "dead_letters": dead,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------
+# Open the job store (an empty directory disables checkpointing → None)
+# ---------------------------
+def open_ingest_job(directory, job):
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return IngestJob(os.path.join(directory, "jobs.sqlite3"), job)
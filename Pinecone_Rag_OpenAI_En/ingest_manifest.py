@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# ---------------------------
+# Local ingestion manifest (SQLite)
+# files:  per namespace, the mtime / size / SHA-256 of each ingested file and the
+#         chunking options (changing the options makes the file count as changed)
+# chunks: per namespace and file, the content hash of each vector ID
+# → A re-run only embeds new or changed chunks and deletes vectors that no longer exist
+# ---------------------------
+DEFAULT_MANIFEST_PATH = "ingest_manifest.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    namespace TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    options TEXT NOT NULL,
+    PRIMARY KEY (namespace, path)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (namespace, path, vector_id)
+);
+"""
+
+
+# ---------------------------
+# Hash helpers (file contents are read in blocks so large files use little memory)
+# ---------------------------
+def file_sha256(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    # ---------------------------
+    # Check whether a file changed since it was last recorded
+    # Same mtime and size → unchanged without opening the file
+    # Otherwise the SHA-256 decides (a touched but identical file is still unchanged)
+    # options: fingerprint of the chunking options (a different one means changed)
+    # Returns (unchanged, state); state = (mtime, size, sha256) is passed to record_file
+    # ---------------------------
+    def check_file(self, namespace, file_path, options=""):
+        stat = os.stat(file_path)
+        row = self.conn.execute(
+            "SELECT mtime, size, sha256 FROM files "
+            "WHERE namespace = ? AND path = ? AND options = ?",
+            (namespace, file_path, options),
+        ).fetchone()
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return True, None
+        sha256 = file_sha256(file_path)
+        if row and row[1] == stat.st_size and row[2] == sha256:
+            self.conn.execute(
+                "UPDATE files SET mtime = ? WHERE namespace = ? AND path = ?",
+                (stat.st_mtime, namespace, file_path),
+            )
+            return True, None
+        return False, (stat.st_mtime, stat.st_size, sha256)
+
+    # {vector_id: content_hash} recorded for a file
+    def chunk_hashes(self, namespace, file_path):
+        rows = self.conn.execute(
+            "SELECT vector_id, content_hash FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        return dict(rows)
+
+    # ---------------------------
+    # Record the chunk hashes of a file
+    # state: (mtime, size, sha256), or None to leave the file row untouched
+    # (used when some chunks failed, so the next run looks at the file again)
+    # options: fingerprint of the chunking options stored with the file row
+    # ---------------------------
+    def record_file(self, namespace, file_path, state, hashes, options=""):
+        self.conn.execute(
+            "DELETE FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+            [(namespace, vid, file_path, h) for vid, h in hashes.items()],
+        )
+        if state is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, file_path) + tuple(state) + (options,),
+            )
+        self.conn.commit()
+
+    # Remove a file and its chunks from the manifest
+    def forget_file(self, namespace, file_path):
+        self.conn.execute(
+            "DELETE FROM chunks WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.execute(
+            "DELETE FROM files WHERE namespace = ? AND path = ?",
+            (namespace, file_path),
+        )
+        self.conn.commit()
+
+    # Paths recorded for the namespace
+    def files(self, namespace):
+        rows = self.conn.execute(
+            "SELECT DISTINCT path FROM chunks WHERE namespace = ? "
+            "UNION SELECT path FROM files WHERE namespace = ?",
+            (namespace, namespace),
+        )
+        return [row[0] for row in rows]
+
+
+# ---------------------------
+# Incremental sync of one ingestion run (used by IngestPipeline)
+# should_skip(): skip unchanged files before extraction
+# select_chunks(): keep only new or changed chunks for embedding
+# restore(): take over a file finished by an interrupted run of an ingestion job
+# take_over(): take over the chunks of a file that such a run already upserted
+# finish(): record successful files, then delete orphaned vectors
+#           (chunks that disappeared from a file, and files removed from the directory)
+# full=True: embed every chunk again, but still update the manifest and delete orphans
+# options: chunking options; files recorded with other options are processed again
+# All calls happen on the pipeline's main thread (one SQLite connection), except
+# file_record(), which does not touch the manifest (called by the upsert workers)
+# ---------------------------
+class IncrementalSync:
+    def __init__(self, manifest, namespace, root, full=False, options=None):
+        self.manifest = manifest
+        self.namespace = namespace
+        self.root = root
+        self.full = full
+        self.options = options_fingerprint(options)
+        self.seen = set()
+        # file_path → (state, {vector_id: hash}, {changed vector_ids})
+        self.pending = {}
+        self.old_hashes = {}  # file_path → {vector_id: hash} before this run
+        self.stats = {
+            "files_skipped": 0,
+            "files_changed": 0,
+            "chunks_embedded": 0,
+            "chunks_unchanged": 0,
+            "chunks_resumed": 0,
+            "vectors_deleted": 0,
+        }
+
+    def should_skip(self, file_path):
+        self.seen.add(file_path)
+        if self.full:
+            return False
+        unchanged, state = self.manifest.check_file(
+            self.namespace, file_path, self.options
+        )
+        if unchanged:
+            self.stats["files_skipped"] += 1
+            return True
+        self.pending[file_path] = (state, {}, set())
+        return False
+
+    def select_chunks(self, file_path, chunks):
+        if file_path not in self.pending:
+            # full mode (or a file not checked beforehand): hash it now
+            stat = os.stat(file_path)
+            state = (stat.st_mtime, stat.st_size, file_sha256(file_path))
+            self.pending[file_path] = (state, {}, set())
+        state, hashes, changed = self.pending[file_path]
+        old = self.manifest.chunk_hashes(self.namespace, file_path)
+        self.old_hashes[file_path] = old
+        selected = []
+        for vector_id, chunk, metadata in chunks:
+            hashes[vector_id] = text_sha256(chunk)
+            if self.full or old.get(vector_id) != hashes[vector_id]:
+                changed.add(vector_id)
+                selected.append((vector_id, chunk, metadata))
+        self.stats["files_changed"] += 1
+        self.stats["chunks_unchanged"] += len(chunks) - len(selected)
+        return selected
+
+    # ---------------------------
+    # A file finished by an earlier, interrupted run of the same job (see
+    # ingest_job.py): not extracted again, but recorded by finish() like the
+    # files of this run, with the state and hashes that run settled on
+    # ---------------------------
+    def restore(self, file_path, state, hashes):
+        self.seen.add(file_path)
+        self.pending[file_path] = (state, hashes, set())
+        old = self.manifest.chunk_hashes(self.namespace, file_path)
+        self.old_hashes[file_path] = old
+        self.stats["files_changed"] += 1
+        self.stats["chunks_resumed"] += sum(
+            old.get(vid) != h for vid, h in hashes.items()
+        )
+
+    # ---------------------------
+    # Chunks of a file that an interrupted run of the same job already upserted
+    # (left out by IngestJob.pending_chunks): recorded with their new hash like
+    # the chunks upserted by this run, without being embedded again
+    # ---------------------------
+    def take_over(self, file_path, vector_ids):
+        self.pending[file_path][2].difference_update(vector_ids)
+        self.stats["chunks_resumed"] += len(vector_ids)
+
+    # (state, hashes) to record for a file once its chunks are embedded and upserted
+    # failed_ids: vector IDs whose embedding or upsert failed
+    def file_record(self, file_path, failed_ids):
+        state, hashes, changed = self.pending[file_path]
+        old = self.old_hashes[file_path]
+        failed = changed & failed_ids
+        if failed:
+            # Keep the previous hash for failed chunks so they are retried next run
+            hashes = {
+                vid: (old[vid] if vid in failed else h)
+                for vid, h in hashes.items()
+                if vid not in failed or vid in old
+            }
+            state = None
+        return state, hashes
+
+    # ---------------------------
+    # upserted_ids: vector IDs with a successful upsert report; embedded or upserted
+    #               chunks missing from it count as failed (the file is redone next run)
+    #               → stats["chunks_embedded"] counts the chunks of this run found in it
+    # writer: used to delete orphaned vectors
+    # ---------------------------
+    def finish(self, upserted_ids, writer):
+        for file_path in self.pending:
+            if file_path not in self.old_hashes:
+                continue  # Extraction never completed; look at it again next run
+            old = self.old_hashes[file_path]
+            changed = self.pending[file_path][2]
+            self.stats["chunks_embedded"] += len(changed & upserted_ids)
+            state, hashes = self.file_record(file_path, changed - upserted_ids)
+            orphans = set(old) - set(hashes)
+            if orphans:
+                if self._delete(writer, orphans):
+                    self.stats["vectors_deleted"] += len(orphans)
+                else:
+                    # Keep the orphans recorded so the deletion is retried next run
+                    hashes.update({vid: old[vid] for vid in orphans})
+                    state = None
+            self.manifest.record_file(
+                self.namespace, file_path, state, hashes, self.options
+            )
+
+        for file_path in self.manifest.files(self.namespace):
+            if file_path in self.seen or not _is_under(file_path, self.root):
+                continue
+            if os.path.exists(file_path):
+                continue
+            ids = set(self.manifest.chunk_hashes(self.namespace, file_path))
+            if not ids or self._delete(writer, ids):
+                self.manifest.forget_file(self.namespace, file_path)
+                self.stats["vectors_deleted"] += len(ids)
+        return self.stats
+
+    def _delete(self, writer, ids):
+        reports = writer.delete(self.namespace, sorted(ids))
+        for report in reports:
+            if not report["ok"]:
+                print(
+                    f"[Error] Delete failed: {len(report['ids'])} vectors → {report['error']}"
+                )
+        return all(report["ok"] for report in reports)
+
+
+# Chunking options as recorded in the manifest (unset values left out)
+def options_fingerprint(options):
+    options = {k: v for k, v in (options or {}).items() if v is not None}
+    return json.dumps(options, sort_keys=True)
+
+
+def _is_under(path, root):
+    path = os.path.abspath(path)
+    root = os.path.abspath(root)
+    return os.path.commonpath([path, root]) == root
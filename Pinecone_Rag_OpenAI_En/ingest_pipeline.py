@@ -0,0 +1,446 @@
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from metrics import Metrics
+from rate_limiter import RateLimiter
+
+# ---------------------------
+# Concurrent ingestion pipeline (extract → chunk → embed → upsert)
+# extract/chunk: process pool (CPU-bound PDF/DOCX parsing)
+# embed / upsert: worker threads (network-bound API calls)
+# Stages are connected by bounded queues → a slow downstream stage blocks upstream
+# (backpressure) instead of letting chunks pile up in memory
+# ---------------------------
+_STOP = object()  # Sentinel telling worker threads to finish
+
+# Stages timed in `metrics` (histogram "ingest_stage_seconds", label "stage")
+# extract / chunk: per file (in the worker process), embed: per batch (including
+# the rate-limit wait), upsert: per batch request (including retries)
+STAGES = ("extract", "chunk", "embed", "upsert")
+
+# Seconds one file may take to extract and chunk (None / 0: no limit)
+DEFAULT_EXTRACT_TIMEOUT = 300
+
+
+# A file was not extracted and chunked within the time limit
+class ExtractionTimeout(Exception):
+    pass
+
+
+# Raised by the alarm inside the task; a BaseException so that broad
+# "except Exception" handlers in the parsing libraries cannot swallow it
+class _Interrupted(BaseException):
+    pass
+
+
+def _interrupt(signum, frame):
+    raise _Interrupted()
+
+
+# ---------------------------
+# Runs in a worker process: chunk_fn records into its own Metrics, which is sent
+# back with the chunks and added to the pipeline's
+# timeout: the task is interrupted by SIGALRM after this many seconds, so one
+# pathological file cannot hold a worker for the rest of the run
+# (POSIX only; where setitimer is missing, e.g. Windows, there is no limit)
+# ---------------------------
+def _chunk_with_metrics(chunk_fn, file_path, timeout=None):
+    metrics = Metrics()
+    limited = bool(timeout) and hasattr(signal, "setitimer")
+    if limited:
+        signal.signal(signal.SIGALRM, _interrupt)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        chunks = chunk_fn(file_path, metrics=metrics)
+    except _Interrupted:
+        raise ExtractionTimeout(f"no result within {timeout} seconds") from None
+    finally:
+        if limited:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return chunks, metrics.snapshot()
+
+
+class IngestPipeline:
+    # ---------------------------
+    # chunk_fn: (file_path, metrics) → [(vector_id, chunk, metadata), ...]
+    #           (top-level function so that it can be sent to the process pool;
+    #           records its extract / chunk times in metrics)
+    # batcher: EmbeddingBatcher (shared by the embed workers)
+    # writer_factory: creates one PineconeUpsertWriter per upsert worker
+    # requests_per_minute / tokens_per_minute: global limit on embedding calls
+    # sync: IncrementalSync; skips unchanged files/chunks and deletes orphaned vectors
+    # extract_timeout: seconds one file may take in the process pool (None / 0: no limit)
+    # job: IngestJob; checkpoints finished files and upserted chunks as they complete,
+    #      keeps failed chunks as dead letters, and skips finished work when resuming
+    # metrics: Metrics receiving the stage times and counters (see STAGES)
+    # ---------------------------
+    def __init__(
+        self,
+        chunk_fn,
+        batcher,
+        writer_factory,
+        namespace,
+        extract_workers=None,
+        embed_workers=4,
+        upsert_workers=2,
+        queue_size=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        progress_interval=5.0,
+        sync=None,
+        metrics=None,
+        extract_timeout=DEFAULT_EXTRACT_TIMEOUT,
+        job=None,
+    ):
+        self.chunk_fn = chunk_fn
+        self.batcher = batcher
+        self.writer_factory = writer_factory
+        self.namespace = namespace
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # Batches waiting for embedding / vectors waiting for upsert
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.upsert_queue = queue.Queue(maxsize=queue_size * 64)
+        # IDs carry the path relative to the ingest root, so same-named files differ
+        self.sources = {}  # vector_id → (chunk, metadata) until the vector is upserted
+        self.writers = []
+        self.progress_interval = progress_interval
+        self.sync = sync
+        self.sync_stats = None
+        self.metrics = metrics or Metrics()
+        self.extract_timeout = extract_timeout
+        self.job = job
+        self.outstanding = {}  # file_path → vector IDs not settled yet (see _settle)
+        self.file_failures = {}  # file_path → vector IDs dead-lettered
+        self.counts = {
+            "files": 0,
+            "files_done": 0,
+            "chunks": 0,
+            "embedded": 0,
+            "files_resumed": 0,
+            "chunks_resumed": 0,
+            "dead_letters": 0,
+        }
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    # ---------------------------
+    # Run the pipeline over the given files and return the upsert writers
+    # (their per-batch reports are read by the caller)
+    # ---------------------------
+    def run(self, file_paths):
+        self.started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._embed_worker, daemon=True)
+            for _ in range(self.embed_workers)
+        ]
+        upsert_threads = []
+        for _ in range(self.upsert_workers):
+            writer = self.writer_factory()
+            self.writers.append(writer)
+            upsert_threads.append(
+                threading.Thread(
+                    target=self._upsert_worker, args=(writer,), daemon=True
+                )
+            )
+        progress = threading.Thread(target=self._progress_worker, daemon=True)
+        for thread in threads + upsert_threads + [progress]:
+            thread.start()
+
+        try:
+            for batch in self.batcher.iter_batches(self._extracted_items(file_paths)):
+                self.embed_queue.put(batch)  # Blocks while embed workers are behind
+        finally:
+            for _ in threads:
+                self.embed_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+            for _ in upsert_threads:
+                self.upsert_queue.put(_STOP)
+            for thread in upsert_threads:
+                thread.join()
+            self.done.set()
+            progress.join()
+        if self.sync and self.writers:
+            self.sync_stats = self.sync.finish(self._upserted_ids(), self.writers[0])
+        self._record_totals()
+        return self.writers
+
+    # Upsert request times and the run's counters (after all workers finished)
+    def _record_totals(self):
+        for writer in self.writers:
+            for report in writer.reports:
+                self.metrics.observe(
+                    "ingest_stage_seconds", report["seconds"], stage="upsert"
+                )
+                if report["ok"]:
+                    self.metrics.inc("upserted_vectors_total", len(report["ids"]))
+                    self.metrics.inc("upserted_bytes_total", report["bytes"])
+        self.metrics.inc("ingest_files_total", self.counts["files_done"])
+        self.metrics.inc("ingest_chunks_total", self.counts["chunks"])
+        self.metrics.inc("ingest_files_resumed_total", self.counts["files_resumed"])
+        self.metrics.inc("ingest_chunks_resumed_total", self.counts["chunks_resumed"])
+        self.metrics.inc("dead_letters_total", self.counts["dead_letters"])
+        stats = self.batcher.stats
+        self.metrics.inc("embedding_requests_total", stats["requests"])
+        self.metrics.inc("embedding_tokens_total", stats["tokens"])
+        self.metrics.inc("embedding_cache_hits_total", stats["cached"])
+        self.metrics.inc("embedding_inputs_total", stats["inputs"])
+        self.metrics.inc("rate_limit_wait_seconds_total", self.limiter.waited_seconds)
+
+    # Vector IDs with a successful upsert report in this run
+    def _upserted_ids(self):
+        return {
+            vector_id
+            for writer in self.writers
+            for report in writer.reports
+            if report["ok"]
+            for vector_id in report["ids"]
+        }
+
+    # ---------------------------
+    # Extract/chunk files in the process pool and yield (vector_id, chunk) in completion order
+    # At most 2 × extract_workers files are in flight so extraction cannot run far ahead
+    # ---------------------------
+    def _extracted_items(self, file_paths):
+        file_paths = iter(file_paths)
+        max_in_flight = self.extract_workers * 2
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+            in_flight = set()
+            submitted = {}  # future → file_path
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    file_path = next(file_paths, None)
+                    if file_path is None:
+                        exhausted = True
+                        break
+                    if self.job and self._resume_file(file_path):
+                        continue
+                    if self.sync and self.sync.should_skip(file_path):
+                        continue
+                    print(f"[Processing] {file_path}")
+                    future = pool.submit(
+                        _chunk_with_metrics,
+                        self.chunk_fn,
+                        file_path,
+                        self.extract_timeout,
+                    )
+                    submitted[future] = file_path
+                    in_flight.add(future)
+                    with self.lock:
+                        self.counts["files"] += 1
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    file_path = submitted.pop(future)
+                    try:
+                        chunks, snapshot = future.result()
+                    except ExtractionTimeout as e:
+                        # Not recorded in the manifest → tried again on the next run
+                        print(f"[Error] Extraction timed out: {file_path} → {e}")
+                        self.metrics.inc("extract_timeouts_total")
+                        self._fail_file(file_path, e)
+                        chunks = []
+                    except Exception as e:
+                        print(f"[Error] Extraction failed: {file_path} → {e}")
+                        self._fail_file(file_path, e)
+                        chunks = []
+                    else:
+                        self.metrics.merge(snapshot)
+                        if self.sync:
+                            chunks = self.sync.select_chunks(file_path, chunks)
+                        chunks = self._track_file(file_path, chunks)
+                    with self.lock:
+                        self.counts["files_done"] += 1
+                        self.counts["chunks"] += len(chunks)
+                    for vector_id, chunk, metadata in chunks:
+                        self.sources[vector_id] = (chunk, metadata)
+                        yield vector_id, chunk
+
+    # ---------------------------
+    # Embed worker: take a batch → embed (waiting for the rate limit) → queue for upsert
+    # ---------------------------
+    def _embed_worker(self):
+        while True:
+            batch = self.embed_queue.get()
+            if batch is _STOP:
+                return
+            try:
+                self._embed(batch)
+            except Exception as e:
+                # Keep the worker alive: a dead worker fills the queues and hangs the run
+                print(f"[Error] Failed while embedding a batch of {len(batch)}: {e}")
+                with self.batcher.lock:
+                    for vector_id, _ in batch:
+                        self.batcher.failed.setdefault(vector_id, str(e))
+                self._dead_letter_failed(batch)
+
+    # Vectors are queued for upsert last: if anything before fails, the whole
+    # batch is still unsent and is dead-lettered by the worker
+    def _embed(self, batch):
+        with self.metrics.timer("ingest_stage_seconds", stage="embed"):
+            results = self.batcher.embed_batch(batch, self.limiter)
+        with self.lock:
+            self.counts["embedded"] += len(results)
+        self._dead_letter_failed(batch)
+        for vector_id, embedding in results:
+            self.upsert_queue.put((vector_id, embedding))
+
+    # Chunks of a batch recorded in batcher.failed become dead letters
+    def _dead_letter_failed(self, batch):
+        for vector_id, _ in batch:
+            if vector_id in self.batcher.failed:
+                source = self.sources.pop(vector_id, None)
+                if source:
+                    self._dead_letter(
+                        vector_id, *source, "embed", self.batcher.failed[vector_id]
+                    )
+
+    # ---------------------------
+    # Upsert worker: buffer vectors in this worker's own writer (sent in batches)
+    # With a job, each batch report is settled as soon as the writer sends it
+    # ---------------------------
+    def _upsert_worker(self, writer):
+        inflight = {}  # vector_id → (chunk, metadata) until its batch is reported
+        reported = 0  # writer.reports already settled
+        while True:
+            item = self.upsert_queue.get()
+            if item is _STOP:
+                writer.close()
+                self._settle_reports(writer.reports[reported:], inflight)
+                return
+            vector_id, embedding = item
+            # Keep the worker alive: a dead worker fills the queues and hangs the run
+            source = None
+            try:
+                source = chunk, metadata = self.sources.pop(vector_id)
+                if self.job:
+                    inflight[vector_id] = source
+                writer.add(
+                    self.namespace, vector_id, embedding, dict(metadata, text=chunk)
+                )
+                if len(writer.reports) > reported:
+                    self._settle_reports(writer.reports[reported:], inflight)
+                    reported = len(writer.reports)
+            except Exception as e:
+                print(f"[Error] Failed while processing {vector_id}: {e}")
+                if source and inflight.pop(vector_id, None):
+                    self._dead_letter(vector_id, *source, "upsert", e)
+
+    # ---------------------------
+    # Job checkpoint
+    # Each file is tracked until every chunk of it is upserted or dead-lettered;
+    # the job then records it as finished (with the manifest record sync would
+    # write for it, so that a resumed run can hand it over to sync.restore())
+    # ---------------------------
+    def _resume_file(self, file_path):
+        record = self.job.finished_file(file_path)
+        if record is None or (self.sync and record[1] is None):
+            return False  # Not finished, changed since, or finished without a manifest
+        if self.sync:
+            self.sync.restore(file_path, *record)
+        with self.lock:
+            self.counts["files_resumed"] += 1
+        return True
+
+    # Chunks of an extracted file still to be embedded (a resumed job leaves out
+    # those it already upserted; sync records them as taken over)
+    def _track_file(self, file_path, chunks):
+        if self.job is None:
+            return chunks
+        selected = self.job.pending_chunks(file_path, chunks)
+        pending = {vector_id for vector_id, _, _ in selected}
+        if self.sync:
+            self.sync.take_over(
+                file_path,
+                {vector_id for vector_id, _, _ in chunks if vector_id not in pending},
+            )
+        with self.lock:
+            self.counts["chunks_resumed"] += len(chunks) - len(selected)
+            self.outstanding[file_path] = pending
+        if not selected:
+            self._complete_file(file_path)
+        return selected
+
+    def _fail_file(self, file_path, error):
+        if self.job:
+            self.job.fail_file(file_path, error)
+
+    def _settle(self, vector_id, file_path, failed=False):
+        with self.lock:
+            waiting = self.outstanding.get(file_path)
+            if waiting is None:
+                return
+            waiting.discard(vector_id)
+            if failed:
+                self.file_failures.setdefault(file_path, set()).add(vector_id)
+            if waiting:
+                return
+            del self.outstanding[file_path]
+            failures = self.file_failures.pop(file_path, set())
+        self._complete_file(file_path, failures)
+
+    def _complete_file(self, file_path, failures=frozenset()):
+        state = hashes = None
+        if self.sync:
+            state, hashes = self.sync.file_record(file_path, failures)
+        self.job.complete_file(file_path, state, hashes)
+
+    # Upsert reports of one writer: vectors sent are checkpointed, those of a
+    # failed request become dead letters (see IngestJob.settle_reports)
+    def _settle_reports(self, reports, inflight):
+        if self.job is None:
+            return
+        for vector_id, metadata, ok in self.job.settle_reports(reports, inflight):
+            if not ok:
+                with self.lock:
+                    self.counts["dead_letters"] += 1
+            self._settle(vector_id, metadata["source"], failed=not ok)
+
+    # A chunk whose embedding or upsert failed: kept in the job's dead-letter queue
+    def _dead_letter(self, vector_id, chunk, metadata, stage, error):
+        if self.job is None:
+            return
+        with self.lock:
+            self.counts["dead_letters"] += 1
+        self.job.dead_letter(
+            vector_id, metadata["source"], chunk, metadata, stage, error
+        )
+        self._settle(vector_id, metadata["source"], failed=True)
+
+    # ---------------------------
+    # Periodic progress line
+    # Queue depths at their maximum and rate-limit wait time show where backpressure is
+    # ---------------------------
+    def _progress_worker(self):
+        while not self.done.wait(self.progress_interval):
+            print(f"[Progress] {self.progress()}")
+        print(f"[Progress] {self.progress()}")
+
+    def progress(self):
+        with self.lock:
+            counts = dict(self.counts)
+        upserted = sum(
+            len(report["ids"])
+            for writer in self.writers
+            for report in list(writer.reports)
+            if report["ok"]
+        )
+        elapsed = time.perf_counter() - self.started
+        rate = counts["embedded"] / elapsed if elapsed else 0.0
+        return (
+            f"files {counts['files_done']}/{counts['files']}, "
+            f"chunks {counts['chunks']}, embedded {counts['embedded']} ({rate:.1f}/s), "
+            f"upserted {upserted}, "
+            f"embed queue {self.embed_queue.qsize()}/{self.embed_queue.maxsize}, "
+            f"upsert queue {self.upsert_queue.qsize()}/{self.upsert_queue.maxsize}, "
+            f"rate-limit wait {self.limiter.waited_seconds:.1f}s"
+        )
@@ -0,0 +1,486 @@
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from urllib.parse import quote
+
+import numpy as np
+
+# ---------------------------
+# Local BM25 inverted index (lexical search next to the vector store)
+# Built at ingestion time from the same chunks (and vector IDs) that are embedded,
+# so exact strings such as product codes, part numbers and error messages are found
+# even when dense similarity misses them; lexical queries need no embedding call
+# One SQLite file per namespace under `directory`:
+#   docs:     document number → vector ID, length in tokens, metadata (JSON, with text)
+#   postings: term → compact posting list per segment
+#             (document numbers delta-encoded in the smallest unsigned integer type
+#             that fits, term frequencies as uint8)
+# Each write adds a segment; replaced and deleted documents are dropped from
+# postings when the segments are merged (compact, run at the end of ingestion)
+# ---------------------------
+DEFAULT_LEXICAL_INDEX_DIR = ".lexical_index"
+DEFAULT_RRF_K = 60  # Reciprocal rank fusion constant
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    docs BLOB NOT NULL,
+    tfs BLOB NOT NULL,
+    PRIMARY KEY (term, segment)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+_SQL_BATCH = 500  # Parameters per "IN (...)" query
+
+# ---------------------------
+# Tokenizer (text is NFKC-normalized and lowercased first, so full-width
+# letters and digits match their ASCII form)
+# Words: runs of letters/digits; joined by "-", "_", ".", "/" or ":" they also
+#        form one compound token ("xj-200a" → "xj-200a", "xj", "200a"),
+#        so a code matches exactly and by its parts
+# Japanese / Chinese: character bigrams over runs of kana and kanji
+#        ("圧力センサー" → "圧力", "力セ", "セン", "ンサ", "サー"; one character alone stays)
+# ---------------------------
+_CJK = "\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN = re.compile(rf"([{_CJK}]+)|([^\W_{_CJK}]+(?:[-_./:][^\W_{_CJK}]+)*)")
+_JOINERS = re.compile(r"[-_./:]")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for cjk, word in _TOKEN.findall(text):
+        if word:
+            tokens.append(word)
+            if not word.isalnum():
+                tokens.extend(_JOINERS.split(word))
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i : i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+# ---------------------------
+# Posting list encoding: (first document, width, deltas, term frequencies)
+# ---------------------------
+def _encode(docs, tfs):
+    deltas = np.diff(docs)
+    top = int(deltas.max()) if len(deltas) else 0
+    width = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4
+    return (
+        int(docs[0]),
+        width,
+        deltas.astype(f"<u{width}").tobytes(),
+        np.minimum(tfs, 255).astype(np.uint8).tobytes(),
+    )
+
+
+def _decode(first, width, docs, tfs):
+    deltas = np.frombuffer(docs, dtype=f"<u{width}")
+    decoded = np.empty(len(deltas) + 1, dtype=np.int64)
+    decoded[0] = first
+    np.cumsum(deltas, out=decoded[1:])
+    decoded[1:] += first
+    return decoded, np.frombuffer(tfs, dtype=np.uint8)
+
+
+class LexicalIndex:
+    def __init__(self, directory=DEFAULT_LEXICAL_INDEX_DIR):
+        self.directory = directory
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def namespace(self, namespace):
+        with self.lock:
+            if namespace not in self.namespaces:
+                # The default namespace "" is stored as "_" (same as the local store)
+                path = os.path.join(self.directory, quote(namespace or "_", safe=""))
+                self.namespaces[namespace] = LexicalNamespace(path)
+            return self.namespaces[namespace]
+
+    def search(self, text, top_k=5, namespace="", include_metadata=True):
+        return self.namespace(namespace).search(text, top_k, include_metadata)
+
+    def upsert(self, namespace, docs):
+        self.namespace(namespace).upsert(docs)
+
+    def delete(self, namespace, ids):
+        self.namespace(namespace).delete(ids)
+
+    def compact(self, namespace):
+        return self.namespace(namespace).compact()
+
+    def clear(self, namespace):
+        self.namespace(namespace).clear()
+
+    def count(self, namespace):
+        return self.namespace(namespace).count()
+
+    # Wrap a vector store writer so that every vector written is also indexed
+    def writer(self, writer):
+        return LexicalIndexWriter(self, writer)
+
+    def close(self):
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.close()
+            self.namespaces.clear()
+
+
+class LexicalNamespace:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(path, "lexical.sqlite3"), timeout=30, check_same_thread=False
+        )
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.version = None
+        self.lengths = np.zeros(0, dtype=np.int32)  # document → tokens (-1: none)
+        self.live = 0
+        self.avgdl = 0.0
+        self._refresh()
+
+    # ---------------------------
+    # Reload the document lengths after another connection committed changes
+    # (e.g. an ingestion run while the app is serving; see LocalNamespace._refresh)
+    # ---------------------------
+    def _refresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return
+        self.version = version
+        row = self.conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'docs'"
+        ).fetchone()
+        lengths = np.full((row[0] if row else 0) + 1, -1, dtype=np.int32)
+        found = np.asarray(
+            self.conn.execute("SELECT doc, length FROM docs").fetchall(), dtype=np.int64
+        ).reshape(-1, 2)
+        lengths[found[:, 0]] = found[:, 1]
+        self.lengths = lengths
+        self.live = len(found)
+        self.avgdl = float(found[:, 1].mean()) if len(found) else 0.0
+
+    # Documents still present (numbers written after the last refresh count as absent)
+    def _live(self, docs):
+        live = docs < len(self.lengths)
+        live[live] = self.lengths[docs[live]] >= 0
+        return live
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return self.live
+
+    # ---------------------------
+    # Insert or replace documents: [(vector_id, metadata), ...]
+    # metadata["text"] is what gets indexed; the whole metadata is returned by search
+    # A replaced document gets a new number; its old postings are ignored from now on
+    # ---------------------------
+    def upsert(self, docs):
+        latest = dict(docs)  # The last occurrence of an ID in one batch wins
+        if not latest:
+            return
+        with self.lock:
+            self._delete(list(latest))
+            row = self.conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'docs'"
+            ).fetchone()
+            first = (row[0] if row else 0) + 1
+            rows = []
+            postings = {}  # term → ([doc, ...], [tf, ...])
+            for doc, (vector_id, metadata) in enumerate(latest.items(), start=first):
+                tokens = tokenize(metadata.get("text") or "")
+                rows.append(
+                    (
+                        doc,
+                        vector_id,
+                        len(tokens),
+                        json.dumps(metadata, ensure_ascii=False),
+                    )
+                )
+                for term, tf in Counter(tokens).items():
+                    entry = postings.setdefault(term, ([], []))
+                    entry[0].append(doc)
+                    entry[1].append(tf)
+            self.conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+            segment = self._next_segment()
+            self.conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (term, segment) + _encode(np.asarray(docs), np.asarray(tfs))
+                    for term, (docs, tfs) in postings.items()
+                ],
+            )
+            self.conn.commit()
+            self.version = None  # Own commits do not change data_version
+
+    def delete(self, ids):
+        with self.lock:
+            self._delete(list(ids))
+            self.conn.commit()
+            self.version = None
+
+    def _delete(self, ids):
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start : start + _SQL_BATCH]
+            self.conn.execute(
+                f"DELETE FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch
+            )
+
+    # Segments written since the last merge (the merged one is segment 0)
+    def _next_segment(self):
+        row = self.conn.execute(
+            "SELECT value FROM info WHERE key = 'segments'"
+        ).fetchone()
+        segment = (row[0] if row else 0) + 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO info VALUES ('segments', ?)", (segment,)
+        )
+        return segment
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM docs")
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM info")
+            self.conn.commit()
+            self.version = None
+
+    # ---------------------------
+    # Merge every term's segments into one, dropping replaced and deleted documents
+    # Returns the number of terms left
+    # ---------------------------
+    def compact(self):
+        with self.lock:
+            return self._compact()
+
+    def _compact(self):
+        self._refresh()
+        terms = [
+            term for (term,) in self.conn.execute("SELECT DISTINCT term FROM postings")
+        ]
+        kept = 0
+        for term in terms:
+            docs, tfs = self._postings(term)
+            live = self._live(docs)
+            self.conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+            if live.any():
+                self.conn.execute(
+                    "INSERT INTO postings VALUES (?, 0, ?, ?, ?, ?)",
+                    (term,) + _encode(docs[live], tfs[live]),
+                )
+                kept += 1
+        self.conn.execute("INSERT OR REPLACE INTO info VALUES ('segments', 0)")
+        self.conn.commit()
+        self.version = None
+        return kept
+
+    # Posting list of a term over all segments (documents in ascending order)
+    def _postings(self, term):
+        rows = self.conn.execute(
+            "SELECT first, width, docs, tfs FROM postings WHERE term = ? "
+            "ORDER BY segment",
+            (term,),
+        ).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        decoded = [_decode(*row) for row in rows]
+        return (
+            np.concatenate([docs for docs, _ in decoded]),
+            np.concatenate([tfs for _, tfs in decoded]),
+        )
+
+    # ---------------------------
+    # Top-k documents by BM25 → [{"id", "score", "metadata"}] (same as vector queries)
+    # Posting lists are decoded with numpy, so a query takes milliseconds
+    # ---------------------------
+    def search(self, text, top_k=5, include_metadata=True):
+        terms = Counter(tokenize(text))
+        with self.lock:
+            self._refresh()
+            if not terms or not self.live:
+                return []
+            found_docs = []
+            found_scores = []
+            for term, query_tf in terms.items():
+                docs, tfs = self._postings(term)
+                live = self._live(docs)
+                if not live.any():
+                    continue
+                docs, tfs = docs[live], tfs[live].astype(np.float32)
+                lengths = self.lengths[docs]
+                df = len(docs)
+                idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self.avgdl or 1))
+                found_docs.append(docs)
+                found_scores.append(query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+            if not found_docs:
+                return []
+            docs, inverse = np.unique(np.concatenate(found_docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(found_scores))
+            k = min(top_k, len(docs))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            found = {}
+            numbers = docs[top].tolist()
+            for start in range(0, len(numbers), _SQL_BATCH):
+                batch = numbers[start : start + _SQL_BATCH]
+                found.update(
+                    (doc, (vector_id, metadata))
+                    for doc, vector_id, metadata in self.conn.execute(
+                        "SELECT doc, id, metadata FROM docs "
+                        f"WHERE doc IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+        # A document deleted by another process since the refresh is left out
+        return [
+            {
+                "id": found[doc][0],
+                "score": float(score),
+                "metadata": json.loads(found[doc][1]) if include_metadata else {},
+            }
+            for doc, score in zip(numbers, scores[top].tolist())
+            if doc in found
+        ]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------
+# Vector store writer that also indexes each vector's metadata["text"]
+# (same interface and reports as the wrapped writer; documents are indexed in
+# batches of max_batch_docs, deletions are applied to both)
+# ---------------------------
+class LexicalIndexWriter:
+    def __init__(self, index, writer, max_batch_docs=1000):
+        self.index = index
+        self.writer = writer
+        self.max_batch_docs = max_batch_docs
+        self.buffers = {}  # namespace → [(vector_id, metadata), ...]
+        self.reports = writer.reports
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        self.writer.add(namespace, vector_id, values, metadata)
+        self.buffers.setdefault(namespace, []).append((vector_id, metadata or {}))
+        if len(self.buffers[namespace]) >= self.max_batch_docs:
+            self._index(namespace)
+
+    def flush(self, namespace=None):
+        self._index(namespace)
+        self.writer.flush(namespace)
+
+    def _index(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            docs = self.buffers.pop(ns, [])
+            if docs:
+                self.index.upsert(ns, docs)
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        self.index.delete(namespace, ids)
+        return self.writer.delete(namespace, ids, batch_size)
+
+    def close(self):
+        self._index()
+        return self.writer.close()
+
+    def summary(self):
+        return self.writer.summary()
+
+
+# ---------------------------
+# Reciprocal rank fusion of several result lists (e.g. vector and lexical)
+# score = Σ 1 / (k + rank) over the lists a match appears in (rank from 1)
+# Matches are identified by (namespace, id); the first list's fields are kept
+# ---------------------------
+def fuse(result_lists, top_k=5, k=DEFAULT_RRF_K):
+    fused = {}
+    for matches in result_lists:
+        for rank, match in enumerate(matches, start=1):
+            key = (match.get("namespace"), match["id"])
+            if key not in fused:
+                fused[key] = dict(match, score=0.0)
+            fused[key]["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda m: m["score"], reverse=True)[:top_k]
+
+
+# ---------------------------
+# Create the lexical index (an empty directory disables it → None)
+# ---------------------------
+def open_lexical_index(directory=DEFAULT_LEXICAL_INDEX_DIR):
+    if not directory:
+        return None
+    return LexicalIndex(directory)
+
+
+# ---------------------------
+# Exact-match search from the command line (no embedding call, no network)
+# Usage: python lexical_index.py <namespace> "<query>" [--top-k 5]
+#        python lexical_index.py <namespace> --compact
+# ---------------------------
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Search the local BM25 index")
+    parser.add_argument("namespace", help="Namespace to search")
+    parser.add_argument("query", nargs="?", help="Query text (e.g. a part number)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--compact", action="store_true", help="Merge the posting list segments"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR),
+        help="Lexical index directory (default: LEXICAL_INDEX_DIR)",
+    )
+    args = parser.parse_args()
+
+    index = LexicalIndex(args.index_dir)
+    if args.compact:
+        terms = index.compact(args.namespace)
+        print(f"[Lexical] {args.namespace}: {terms} terms after merging")
+    if args.query:
+        started = time.perf_counter()
+        matches = index.search(args.query, args.top_k, args.namespace)
+        elapsed = time.perf_counter() - started
+        for match in matches:
+            text = " ".join(match["metadata"].get("text", "").split())
+            print(f"{match['score']:.3f}  {match['id']}  {text[:100]}")
+        print(f"[Lexical] {len(matches)} matches in {elapsed * 1000:.1f} ms")
+    index.close()
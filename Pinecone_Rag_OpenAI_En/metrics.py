@@ -0,0 +1,256 @@
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# ---------------------------
+# Lightweight metrics: stage timers (histograms in seconds), counters and gauges
+# Web app: exposed at /metrics in the Prometheus text format
+# Ingestion: summary printed at the end of upload_embeddings.py
+# Names ending in "_total" are counters; other values are gauges
+# snapshot() / merge(): metrics recorded in a worker process are added to the parent's
+# ---------------------------
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+DEFAULT_PREFIX = "rag"
+
+
+# ---------------------------
+# Histogram with fixed bucket bounds (cumulative "le" buckets when rendered)
+# quantile(): estimated from the buckets (linear within a bucket, capped at the max)
+# ---------------------------
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last: above the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    # e.g. "12 × avg 0.153s, p50 0.120s, p95 0.410s, max 0.502s, total 1.8s"
+    def describe(self):
+        if not self.count:
+            return "0 ×"
+        return (
+            f"{self.count} × avg {self.sum / self.count:.3f}s, "
+            f"p50 {self.quantile(0.5):.3f}s, p95 {self.quantile(0.95):.3f}s, "
+            f"max {self.max:.3f}s, total {self.sum:.1f}s"
+        )
+
+    def state(self):
+        return list(self.counts), self.count, self.sum, self.max
+
+    def merge(self, state):
+        counts, count, total, maximum = state
+        for i, value in enumerate(counts):
+            self.counts[i] += value
+        self.count += count
+        self.sum += total
+        self.max = max(self.max, maximum)
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) → Histogram
+        self.values = {}  # (name, labels) → counter or gauge value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # Time the block and add it to the histogram `name`
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    # Set a value maintained elsewhere (e.g. cache hit counters, calls in flight)
+    def record(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, _label_key(labels))] = value
+
+    def histogram(self, name, **labels):
+        with self.lock:
+            histogram = self.histograms.get((name, _label_key(labels)))
+            if histogram is None:
+                return None
+            copy = Histogram(histogram.buckets)
+            copy.merge(histogram.state())
+            return copy
+
+    def value(self, name, default=0, **labels):
+        with self.lock:
+            return self.values.get((name, _label_key(labels)), default)
+
+    # ---------------------------
+    # Picklable copy (sent back from worker processes) and its addition to this one
+    # ---------------------------
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": {
+                    key: histogram.state() for key, histogram in self.histograms.items()
+                },
+                "values": dict(self.values),
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, state in snapshot["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.buckets)
+                histogram.merge(state)
+            for key, value in snapshot["values"].items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    # ---------------------------
+    # Prometheus text exposition format (version 0.0.4)
+    # ---------------------------
+    def render(self, prefix=DEFAULT_PREFIX):
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(snapshot["values"].items()):
+            full = f"{prefix}_{name}"
+            if full not in typed:
+                kind = "counter" if name.endswith("_total") else "gauge"
+                lines.append(f"# TYPE {full} {kind}")
+                typed.add(full)
+            lines.append(f"{full}{_format_labels(labels)} {_number(value)}")
+        for (name, labels), state in sorted(snapshot["histograms"].items()):
+            full = f"{prefix}_{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} histogram")
+                typed.add(full)
+            counts, count, total, _ = state
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = labels + (("le", _number(bound)),)
+                lines.append(f"{full}_bucket{_format_labels(le)} {cumulative}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {_number(total)}")
+            lines.append(f"{full}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+# ---------------------------
+# Per-request trace: an ID and the seconds spent in each stage
+# The ID comes from the client's X-Request-ID header when it looks like one
+# (letters, digits, "-", "_", ".", at most 64), otherwise a new one is generated
+# Stage times are also added to the metrics histogram `name` (label "stage")
+# ---------------------------
+_TRACE_ID = re.compile(r"^[\w.-]{1,64}$")
+
+
+def new_trace_id(requested=None):
+    if requested and _TRACE_ID.match(requested):
+        return requested
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    def __init__(self, metrics, name, trace_id=None):
+        self.metrics = metrics
+        self.name = name
+        self.trace_id = new_trace_id(trace_id)
+        self.started = time.perf_counter()
+        self.stages = {}  # stage → seconds (in the order they ran)
+        self.notes = {}  # Other per-request values shown in the summary
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.metrics.observe(self.name, seconds, stage=stage)
+
+    # Per-request value for the summary (e.g. prompt tokens saved)
+    def note(self, name, value):
+        self.notes[name] = value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # e.g. "embed=12ms search=3ms chat=905ms tokens_saved=410 total=921ms"
+    def summary(self):
+        parts = [
+            f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stages.items()
+        ]
+        parts += [f"{name}={value}" for name, value in self.notes.items()]
+        return " ".join(parts + [f"total={self.elapsed() * 1000:.0f}ms"])
@@ -0,0 +1,200 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import PINECONE, Scheduler
+
+# ---------------------------
+# Bulk upsert writer for Pinecone (REST /vectors/upsert)
+# Buffers vectors per namespace and sends them in batches over one pooled Session
+# → Keep-alive connections are reused instead of opening one connection per vector
+# ---------------------------
+DEFAULT_MAX_BATCH_VECTORS = 100  # Recommended upper limit of vectors per upsert
+DEFAULT_MAX_BATCH_BYTES = 2 * 1024 * 1024  # Pinecone request size limit (2 MB)
+
+# Fixed JSON overhead of the request body besides the vectors
+# ({"vectors": [...], "namespace": "..."})
+_REQUEST_OVERHEAD_BYTES = 64
+
+
+# ---------------------------
+# Create a Session with a connection pool (shared keep-alive connections)
+# ---------------------------
+def build_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ---------------------------
+# Upsert writer
+# add(): buffer one vector; flushed automatically when the count or byte limit is reached
+# close(): flush everything and return the per-batch report list
+# Each report: namespace / number of vectors / bytes / attempts / ok / error /
+# seconds (including retries)
+# scheduler: Scheduler shared with the other OpenAI / Pinecone calls of the process
+#   (rate limit, retries with backoff, circuit breaker); by default a scheduler
+#   of its own with max_retries / backoff
+# ---------------------------
+class PineconeUpsertWriter:
+    def __init__(
+        self,
+        api_key,
+        url,
+        max_batch_vectors=DEFAULT_MAX_BATCH_VECTORS,
+        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+        max_retries=5,
+        backoff=0.5,
+        timeout=30,
+        session=None,
+        scheduler=None,
+    ):
+        self.api_key = api_key
+        self.url = f"{url}/vectors/upsert"
+        self.delete_url = f"{url}/vectors/delete"
+        self.max_batch_vectors = max_batch_vectors
+        self.max_batch_bytes = max_batch_bytes
+        self.scheduler = scheduler or Scheduler(
+            max_retries=max_retries, backoff=backoff
+        )
+        self.timeout = timeout
+        self.session = session or build_session()
+        self.buffers = {}  # namespace → [(vector, encoded size), ...]
+        self.buffer_bytes = {}  # namespace → total bytes buffered
+        self.reports = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------------------
+    # Add one vector to the namespace buffer
+    # ---------------------------
+    def add(self, namespace, vector_id, values, metadata=None):
+        vector = {"id": vector_id, "values": values}
+        if metadata:
+            vector["metadata"] = metadata
+        size = len(json.dumps(vector, ensure_ascii=False).encode("utf-8")) + 1
+        limit = self.max_batch_bytes - _REQUEST_OVERHEAD_BYTES - len(namespace)
+        if self.buffer_bytes.get(namespace, 0) + size > limit:
+            self.flush(namespace)
+        self.buffers.setdefault(namespace, []).append((vector, size))
+        self.buffer_bytes[namespace] = self.buffer_bytes.get(namespace, 0) + size
+        if len(self.buffers[namespace]) >= self.max_batch_vectors:
+            self.flush(namespace)
+
+    # ---------------------------
+    # Send buffered vectors (all namespaces when namespace is omitted)
+    # ---------------------------
+    def flush(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            entries = self.buffers.pop(ns, [])
+            batch_bytes = self.buffer_bytes.pop(ns, 0)
+            if entries:
+                vectors = [vector for vector, _ in entries]
+                self.reports.append(self._send(ns, vectors, batch_bytes))
+
+    # ---------------------------
+    # Send one batch; 429/5xx and connection errors are retried with exponential backoff
+    # A Retry-After header from the server takes precedence over the computed delay
+    # ---------------------------
+    def _send(self, namespace, vectors, batch_bytes):
+        data = {"vectors": vectors, "namespace": namespace}
+        report = {
+            "namespace": namespace,
+            "ids": [vector["id"] for vector in vectors],
+            "bytes": batch_bytes,
+            "attempts": 0,
+            "ok": False,
+            "error": None,
+        }
+        return self._post(self.url, data, report)
+
+    # ---------------------------
+    # Delete vectors by ID (sent in batches of batch_size IDs)
+    # Returns reports in the same format as upserts; not included in self.reports
+    # ---------------------------
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        reports = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            report = {
+                "namespace": namespace,
+                "ids": batch,
+                "bytes": 0,
+                "attempts": 0,
+                "ok": False,
+                "error": None,
+            }
+            data = {"ids": batch, "namespace": namespace}
+            reports.append(self._post(self.delete_url, data, report))
+        return reports
+
+    # ---------------------------
+    # POST with retries, filling in the report (attempts / ok / error / seconds)
+    # A batch still failing after the retries (or rejected by an open circuit)
+    # is reported as failed instead of raising
+    # ---------------------------
+    def _post(self, url, data, report):
+        started = time.perf_counter()
+        try:
+            return self._post_attempts(url, data, report)
+        finally:
+            report["seconds"] = time.perf_counter() - started
+
+    def _post_attempts(self, url, data, report):
+        headers = {"Api-Key": self.api_key, "Content-Type": "application/json"}
+
+        def send():
+            report["attempts"] += 1
+            response = self.session.post(
+                url, headers=headers, json=data, timeout=self.timeout
+            )
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                raise requests.HTTPError(error, response=response)
+
+        try:
+            self.scheduler.call(PINECONE, send)
+        except Exception as e:
+            report["error"] = str(e)
+            return report
+        report["ok"] = True
+        report["error"] = None
+        return report
+
+    # ---------------------------
+    # Flush remaining vectors and return all batch reports
+    # ---------------------------
+    def close(self):
+        self.flush()
+        return self.reports
+
+    # ---------------------------
+    # Aggregate of the batch reports (number of vectors and batches succeeded/failed)
+    # ---------------------------
+    def summary(self):
+        return summarize_reports(self.reports)
+
+
+# ---------------------------
+# Aggregate a list of batch reports (shared with the local vector store writer)
+# ---------------------------
+def summarize_reports(reports):
+    ok = [r for r in reports if r["ok"]]
+    failed = [r for r in reports if not r["ok"]]
+    return {
+        "batches_ok": len(ok),
+        "batches_failed": len(failed),
+        "vectors_ok": sum(len(r["ids"]) for r in ok),
+        "vectors_failed": sum(len(r["ids"]) for r in failed),
+        "bytes": sum(r["bytes"] for r in reports),
+        "retries": sum(max(r["attempts"] - 1, 0) for r in reports),
+    }
@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from ann_index import MAX_SAMPLE, kmeans, nearest
+
+# ---------------------------
+# Vector quantization: compressed codes for stored embeddings
+# int8: one signed byte per dimension, scaled per dimension (4× smaller than float32)
+# pq:   product quantization; the vector is cut into `subspaces` parts and each part
+#       is replaced by the index of its nearest of 256 centroids (1 byte per part)
+#       → text-embedding-3-small (1536 dims) with 96 subspaces: 96 bytes instead of 6 KB
+# Scores from codes are approximate; the local store re-ranks the best
+# top_k × rerank candidates with the float vectors (see LocalNamespace.query)
+# ---------------------------
+KINDS = ("int8", "pq")
+DEFAULT_RERANK = 10  # Candidates re-ranked with float vectors, per result
+PQ_CENTROIDS = 256
+PQ_SAMPLE = 20000  # Training vectors for the codebooks (~80 per centroid)
+_BLOCK = 65536  # Rows encoded per block (bounds the temporaries)
+_SCORE_BLOCK = 2048  # Rows scored per block (the temporaries stay in the CPU cache)
+
+
+def _blocks(codes, score, size=_SCORE_BLOCK):
+    if not len(codes):
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(
+        [score(codes[start : start + size]) for start in range(0, len(codes), size)]
+    )
+
+
+# ---------------------------
+# int8: code = round(value / scale), scale = largest |value| of the dimension / 127
+# ---------------------------
+class Int8Quantizer:
+    kind = "int8"
+    dtype = np.int8
+
+    def __init__(self, scale=None):
+        self.scale = scale
+
+    def train(self, vectors):
+        high = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0)
+        self.scale = np.where(high > 0, high / 127, 1).astype(np.float32)
+        return self
+
+    @property
+    def code_size(self):
+        return len(self.scale)
+
+    def encode(self, vectors):
+        # Values beyond the trained range (vectors added later) are clipped
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    # Approximate dot products with the query: codes · (query × scale)
+    def score(self, codes, query):
+        weights = (np.asarray(query, dtype=np.float32) * self.scale).astype(np.float32)
+        return _blocks(codes, lambda block: block.astype(np.float32) @ weights)
+
+    def state(self):
+        return {"scale": self.scale}
+
+
+# ---------------------------
+# Product quantization
+# Scores are looked up per part: table[part, code] = centroid · query part
+# ---------------------------
+class PQQuantizer:
+    kind = "pq"
+    dtype = np.uint8
+
+    def __init__(self, subspaces=None, codebooks=None):
+        self.codebooks = codebooks  # (subspaces, 256, dim / subspaces)
+        self.subspaces = len(codebooks) if codebooks is not None else subspaces
+
+    def train(self, vectors, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        self.subspaces = self.subspaces or default_subspaces(dim)
+        if dim % self.subspaces:
+            raise ValueError(
+                f"Dimension {dim} is not divisible by {self.subspaces} subspaces"
+            )
+        k = min(PQ_CENTROIDS, len(vectors))
+        self.codebooks = np.stack(
+            [
+                kmeans(part, k, seed=seed, spherical=False)
+                for part in self._parts(vectors)
+            ]
+        )
+        return self
+
+    @property
+    def code_size(self):
+        return self.subspaces
+
+    def _parts(self, vectors):
+        return np.split(vectors, self.subspaces, axis=1)
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return np.stack(
+            [
+                nearest(part, book, spherical=False)
+                for part, book in zip(self._parts(vectors), self.codebooks)
+            ],
+            axis=1,
+        ).astype(np.uint8)
+
+    def score(self, codes, query):
+        query = np.asarray(query, dtype=np.float32)
+        table = np.einsum(
+            "pcd,pd->pc", self.codebooks, query.reshape(self.subspaces, -1)
+        )
+        return _blocks(codes, lambda block: _lookup(table, block))
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+
+# Sum of table[part, code] over the parts of each row
+# (one contiguous column per part is much faster than 2-D fancy indexing)
+def _lookup(table, codes):
+    scores = np.zeros(len(codes), dtype=np.float32)
+    for part, column in zip(table, np.ascontiguousarray(codes.T)):
+        scores += part.take(column)
+    return scores
+
+
+# Subspaces for a dimension: 16 dimensions per part where possible (1536 → 96)
+def default_subspaces(dim):
+    return next(m for m in range(max(1, dim // 16), 0, -1) if dim % m == 0)
+
+
+def make_quantizer(kind, subspaces=None):
+    if kind == "int8":
+        return Int8Quantizer()
+    if kind == "pq":
+        return PQQuantizer(subspaces)
+    raise ValueError(f"Unknown quantization: {kind} (choose from {', '.join(KINDS)})")
+
+
+# Train on (a sample of) the vectors
+def train_quantizer(kind, vectors, rows=None, subspaces=None, seed=0):
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    sample = PQ_SAMPLE if kind == "pq" else MAX_SAMPLE
+    if len(rows) > sample:
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(rows, sample, replace=False))
+    return make_quantizer(kind, subspaces).train(np.asarray(vectors[rows]))
+
+
+# Encode rows in blocks (vectors may be a memmap larger than memory)
+def encode_rows(quantizer, vectors, rows):
+    codes = np.empty((len(rows), quantizer.code_size), dtype=quantizer.dtype)
+    for start in range(0, len(rows), _BLOCK):
+        block = rows[start : start + _BLOCK]
+        codes[start : start + len(block)] = quantizer.encode(vectors[block])
+    return codes
+
+
+# ---------------------------
+# Save / load a quantizer (.npz; written atomically)
+# ---------------------------
+def save_quantizer(quantizer, path, **arrays):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, kind=quantizer.kind, **quantizer.state(), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_quantizer(data):
+    if isinstance(data, str):
+        data = np.load(data)
+    kind = str(data["kind"])
+    if kind == "int8":
+        return Int8Quantizer(data["scale"])
+    if kind == "pq":
+        return PQQuantizer(codebooks=data["codebooks"])
+    raise ValueError(f"Unknown quantization: {kind} (choose from {', '.join(KINDS)})")
+
+
+# ---------------------------
+# Codes of a local namespace, next to its float vectors
+#   quantizer.npz: trained quantizer
+#   codes.q:       memory-mapped codes (capacity × code size)
+# Queries scan the codes instead of the float vectors (4× to 64× less data)
+# ---------------------------
+class QuantizedVectors:
+    def __init__(self, directory):
+        self.quantizer_path = os.path.join(directory, "quantizer.npz")
+        self.codes_path = os.path.join(directory, "codes.q")
+        self.quantizer = None
+        self.codes = None
+
+    @property
+    def kind(self):
+        return self.quantizer.kind if self.quantizer is not None else None
+
+    # (Re)load for a store with `capacity` rows
+    def load(self, capacity):
+        self.quantizer = None
+        self.codes = None
+        if os.path.exists(self.quantizer_path):
+            self.quantizer = load_quantizer(self.quantizer_path)
+            self.resize(capacity)
+
+    # Grow the codes file with the vectors file
+    def resize(self, capacity):
+        if self.quantizer is None or not capacity:
+            return
+        self.codes = None
+        size = self.quantizer.code_size * np.dtype(self.quantizer.dtype).itemsize
+        with open(self.codes_path, "ab") as f:
+            if f.tell() < capacity * size:
+                f.truncate(capacity * size)
+        self.codes = np.memmap(
+            self.codes_path,
+            dtype=self.quantizer.dtype,
+            mode="r+",
+            shape=(capacity, self.quantizer.code_size),
+        )
+
+    # ---------------------------
+    # Train a quantizer of `kind` on the live rows and encode all of them
+    # The codes are written to a new file that replaces the old one, so a reader
+    # keeps a consistent (old) mapping until it reloads after the next commit
+    # ---------------------------
+    def train(self, kind, vectors, rows, subspaces=None):
+        quantizer = train_quantizer(kind, vectors, rows, subspaces)
+        tmp_path = self.codes_path + ".tmp"
+        codes = np.memmap(
+            tmp_path,
+            dtype=quantizer.dtype,
+            mode="w+",
+            shape=(len(vectors), quantizer.code_size),
+        )
+        for start in range(0, len(rows), _BLOCK):
+            block = rows[start : start + _BLOCK]
+            codes[block] = quantizer.encode(vectors[block])
+        codes.flush()
+        del codes
+        os.replace(tmp_path, self.codes_path)
+        save_quantizer(quantizer, self.quantizer_path)
+        self.quantizer = quantizer
+        self.resize(len(vectors))
+
+    # Encode new or replaced rows (no-op until a quantizer is trained)
+    def assign(self, rows, values):
+        if self.quantizer is not None:
+            self.codes[rows] = self.quantizer.encode(values)
+
+    def flush(self):
+        if self.codes is not None:
+            self.codes.flush()
+
+    # Approximate scores of the given rows
+    def score(self, query, rows):
+        if len(rows) > len(self.codes) // 2:
+            return self.quantizer.score(self.codes, query)[rows]
+        return self.quantizer.score(self.codes[rows], query)
+
+
+# ---------------------------
+# Compact export of a namespace: quantizer, codes, IDs and metadata in one .npz
+# Searchable on its own (approximate scores, no float vectors needed)
+# ---------------------------
+def write_compact(path, quantizer, codes, ids, metadata):
+    save_quantizer(
+        quantizer,
+        path,
+        codes=codes,
+        ids=_json_bytes(ids),
+        metadata=_json_bytes(metadata),
+    )
+
+
+def _json_bytes(value):
+    return np.frombuffer(
+        json.dumps(value, ensure_ascii=False).encode("utf-8"), np.uint8
+    )
+
+
+class CompactIndex:
+    def __init__(self, path):
+        data = np.load(path)
+        self.quantizer = load_quantizer(data)
+        self.codes = data["codes"]
+        self.ids = json.loads(data["ids"].tobytes().decode("utf-8"))
+        self.metadata = json.loads(data["metadata"].tobytes().decode("utf-8"))
+
+    def query(self, vector, top_k=5, include_metadata=True):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.quantizer.score(self.codes, query)
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "id": self.ids[row],
+                "score": float(scores[row]),
+                "metadata": self.metadata[row] if include_metadata else {},
+            }
+            for row in top.tolist()
+        ]
+
+
+# ---------------------------
+# Export a namespace of the local index (LOCAL_INDEX_DIR) to a compact file
+# Usage: python quantization.py <namespace> <output.npz> [--kind pq|int8]
+# ---------------------------
+if __name__ == "__main__":
+    from vector_store import DEFAULT_LOCAL_INDEX_DIR, LocalVectorStore
+
+    parser = argparse.ArgumentParser(description="Export a compact namespace index")
+    parser.add_argument("namespace", help="Namespace of the local index")
+    parser.add_argument("output", help="Output file (.npz)")
+    parser.add_argument("--kind", choices=KINDS, default="pq")
+    parser.add_argument(
+        "--subspaces", type=int, default=None, help="PQ bytes per vector"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR),
+        help="Local index directory (default: LOCAL_INDEX_DIR)",
+    )
+    args = parser.parse_args()
+
+    store = LocalVectorStore(args.index_dir)
+    count = store.namespace(args.namespace).export(
+        args.output, args.kind, args.subspaces
+    )
+    store.close()
+    print(
+        f"[Export] {count} vectors → {args.output} "
+        f"({os.path.getsize(args.output) / (1024 * 1024):.1f} MB)"
+    )
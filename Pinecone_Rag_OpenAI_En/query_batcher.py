@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# ---------------------------
+# Micro-batching of question embeddings
+# Questions arriving within max_wait seconds of each other are embedded in one
+# request (the embeddings endpoint accepts an array "input"), and each caller
+# gets its own vector back
+# → Under load: a few requests per second instead of one per question,
+#   so fewer rate-limit errors; a lone question waits at most max_wait
+# max_batch_size: a full batch is sent at once, without waiting
+# embed_many: texts → vectors in the same order (one API request)
+# MicroBatcher: for threads (query_embeddings.py)
+# AsyncMicroBatcher: for an asyncio event loop (Flask/answer_service.py)
+# ---------------------------
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT = 0.005  # Seconds the first question of a batch waits for others
+
+
+# ---------------------------
+# Batch counters: batch sizes and time spent queued before the request is sent
+# ---------------------------
+class BatchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.inputs = 0
+        self.queued_seconds = 0.0
+        self.max_queued_seconds = 0.0
+
+    def record(self, enqueued, sent):
+        with self.lock:
+            self.batches += 1
+            self.inputs += len(enqueued)
+            for started in enqueued:
+                self.queued_seconds += sent - started
+                self.max_queued_seconds = max(self.max_queued_seconds, sent - started)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "inputs": self.inputs,
+                "avg_batch_size": self.inputs / self.batches if self.batches else 0.0,
+                "avg_queue_ms": (
+                    1000 * self.queued_seconds / self.inputs if self.inputs else 0.0
+                ),
+                "max_queue_ms": 1000 * self.max_queued_seconds,
+            }
+
+
+# Embed the distinct texts of a batch once (the same question asked twice at once)
+def _unique(texts):
+    order = list(dict.fromkeys(texts))
+    position = {text: i for i, text in enumerate(order)}
+    return order, [position[text] for text in texts]
+
+
+# ---------------------------
+# Thread version: callers block in embed(); a background thread collects the
+# queue into batches and sends them from a small pool (batches can overlap)
+# ---------------------------
+class MicroBatcher:
+    def __init__(
+        self,
+        embed_many,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_wait=DEFAULT_MAX_WAIT,
+        workers=4,
+    ):
+        self.embed_many = embed_many
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = float(max_wait)
+        self.stats = BatchStats()
+        self.condition = threading.Condition()
+        self.pending = []  # (text, Future, enqueued)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="query-embed"
+        )
+        threading.Thread(
+            target=self._collect, name="query-embed-batcher", daemon=True
+        ).start()
+
+    def embed(self, text):
+        future = Future()
+        with self.condition:
+            self.pending.append((text, future, time.perf_counter()))
+            self.condition.notify()
+        return future.result()
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                deadline = self.pending[0][2] + self.max_wait
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.max_batch_size,
+                    timeout=max(0.0, deadline - time.perf_counter()),
+                )
+                batch = self.pending[: self.max_batch_size]
+                del self.pending[: self.max_batch_size]
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        self.stats.record([enqueued for _, _, enqueued in batch], time.perf_counter())
+        texts, positions = _unique([text for text, _, _ in batch])
+        try:
+            vectors = self.embed_many(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), i in zip(batch, positions):
+            future.set_result(vectors[i])
+
+
+# ---------------------------
+# asyncio version: must be used from one event loop
+# The first question of a batch schedules the send after max_wait; a full batch
+# is sent immediately. A caller that gives up (timeout) simply stops waiting
+# ---------------------------
+class AsyncMicroBatcher:
+    def __init__(
+        self,
+        embed_many,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.embed_many = embed_many  # async: texts → vectors
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = float(max_wait)
+        self.stats = BatchStats()
+        self.pending = []  # (text, asyncio.Future, enqueued)
+        self._timer = None
+        self._tasks = set()  # batch tasks in flight (the loop keeps only weak refs)
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self.pending
+        self.pending = []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        self.stats.record([enqueued for _, _, enqueued in batch], time.perf_counter())
+        texts, positions = _unique([text for text, _, _ in batch])
+        try:
+            vectors = await self.embed_many(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), i in zip(batch, positions):
+            if not future.done():
+                future.set_result(vectors[i])
@@ -1,6 +1,35 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from clients import Lazy, openai_client, startup
 from dotenv import dotenv_values
-import openai
-from pinecone import Pinecone
+from answer_cache import (
+    DEFAULT_ANSWER_CACHE_DIR,
+    DEFAULT_CAPACITY as DEFAULT_ANSWER_CAPACITY,
+    DEFAULT_THRESHOLD,
+    DEFAULT_TTL,
+    open_answer_cache,
+)
+from embedding_batcher import estimate_tokens
+from embedding_cache import DEFAULT_CACHE_DIR, DEFAULT_CAPACITY, open_cache
+from chunk_store import DEFAULT_CHUNK_STORE_DIR, open_chunk_store
+from context_builder import (
+    DEFAULT_DUPLICATE_THRESHOLD as DEFAULT_CONTEXT_THRESHOLD,
+    DEFAULT_MAX_TOKENS as DEFAULT_CONTEXT_TOKENS,
+    ContextStats,
+    build_context,
+)
+from query_batcher import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT, MicroBatcher
+from ann_index import DEFAULT_NPROBE
+from lexical_index import (
+    DEFAULT_LEXICAL_INDEX_DIR,
+    DEFAULT_RRF_K,
+    fuse,
+    open_lexical_index,
+)
+from rate_limiter import INTERACTIVE, Scheduler, parse_limits
+from vector_store import DEFAULT_BACKEND, DEFAULT_LOCAL_INDEX_DIR, open_vector_store
+
+startup.mark("import", "project modules")
 
 # ---------------------------
 # Load environment variables (directly from config.env.template)
@@ -9,54 +38,235 @@ from pinecone import Pinecone
 # ---------------------------
 config = dotenv_values("config.env.template")
 
-# Set OpenAI API key directly (not via environment variable)
-openai.api_key = config.get("OPENAI_API_KEY")
+# ---------------------------
+# Clients, indexes and caches below are opened on first use (Lazy; .get() returns
+# them) → importing this module does no network or disk setup; warm_up() opens
+# them ahead of the first question
+# ---------------------------
 
-# Initialize Pinecone with direct API key
-pc = Pinecone(api_key=config.get("PINECONE_API_KEY"))
+# OpenAI client with the API key set directly (not via environment variable)
+# Retries are left to the scheduler below (backoff honouring Retry-After)
+openai_api = Lazy("openai", openai_client, config.get("OPENAI_API_KEY"))
 
-# Retrieve Pinecone index name from external config
+# Scheduler of the OpenAI and Pinecone calls (interactive priority): per-model
+# rate limits (RATE_LIMITS, same format as the app), retries, circuit breaker
+scheduler = Scheduler(
+    parse_limits(config.get("RATE_LIMITS")),
+    priority=INTERACTIVE,
+    failure_threshold=int(config.get("CIRCUIT_BREAKER_FAILURES", 5)),
+    reset_seconds=float(config.get("CIRCUIT_BREAKER_RESET", 30)),
+)
+
+# Vector store: Pinecone (default) or the local index (VECTOR_STORE=local)
+# Pinecone index name is retrieved from external config
 # → Flexible structure for handling multiple projects/datasets
-index = pc.Index(config.get("PINECONE_INDEX_NAME"))
+vector_store = Lazy(
+    "vector_store",
+    open_vector_store,
+    config.get("VECTOR_STORE", DEFAULT_BACKEND),
+    local_dir=config.get("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR),
+    nprobe=config.get("LOCAL_ANN_NPROBE", DEFAULT_NPROBE),
+    api_key=config.get("PINECONE_API_KEY"),
+    index_name=config.get("PINECONE_INDEX_NAME"),
+    scheduler=scheduler,
+)
+
+# Local BM25 index built at ingestion (an empty LEXICAL_INDEX_DIR disables it)
+# SEARCH_MODE: "vector" (default), "hybrid" (vector + BM25, fused by rank) or
+# "lexical" (BM25 only: exact product codes / error strings, no embedding call)
+lexical_index = Lazy(
+    "lexical_index",
+    open_lexical_index,
+    config.get("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR),
+)
+SEARCH_MODE = config.get("SEARCH_MODE", "vector")
+
+# Chunk texts kept locally by upload_embeddings.py (CHUNK_STORE_DIR; empty: off)
+# → Vectors written with it carry no text; their texts are looked up here
+chunk_store = Lazy(
+    "chunk_store",
+    open_chunk_store,
+    config.get("CHUNK_STORE_DIR", DEFAULT_CHUNK_STORE_DIR),
+)
+RRF_K = int(config.get("HYBRID_RRF_K", DEFAULT_RRF_K))
+
+# Prompt context of ask_direct_answer: overlapping chunks merged, near-duplicates
+# dropped, at most CONTEXT_MAX_TOKENS tokens (see context_builder.py)
+# → context_stats.stats(): prompt tokens used and saved so far
+CONTEXT_MAX_TOKENS = int(config.get("CONTEXT_MAX_TOKENS", DEFAULT_CONTEXT_TOKENS))
+CONTEXT_DUPLICATE_THRESHOLD = float(
+    config.get("CONTEXT_DUPLICATE_THRESHOLD", DEFAULT_CONTEXT_THRESHOLD)
+)
+context_stats = ContextStats()
+
+# Local embedding cache for questions (an empty EMBEDDING_CACHE_DIR disables it)
+# → Repeated questions are vectorized without calling the OpenAI API
+embedding_cache = Lazy(
+    "embedding_cache",
+    open_cache,
+    "query",
+    config.get("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR),
+    config.get("EMBEDDING_CACHE_CAPACITY", DEFAULT_CAPACITY),
+)
+
+# Answer cache (an empty ANSWER_CACHE_DIR disables it)
+# → A question close to one answered before (same namespace) skips search and gpt-4o
+answer_cache = Lazy(
+    "answer_cache",
+    open_answer_cache,
+    "cli",
+    config.get("ANSWER_CACHE_DIR", DEFAULT_ANSWER_CACHE_DIR),
+    threshold=config.get("ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD),
+    ttl=config.get("ANSWER_CACHE_TTL", DEFAULT_TTL),
+    capacity=config.get("ANSWER_CACHE_CAPACITY", DEFAULT_ANSWER_CAPACITY),
+)
 
 
 # ---------------------------
-# Similar document search (Pinecone + OpenAI embedding)
-# Input: Question (natural language), namespace (dataset identifier)
-# Output: List of matched metadata["text"]
+# One embeddings request for several questions (vectors in input order)
 # ---------------------------
-def get_similar_chunks(question, ns):
-    # Vectorize question using OpenAI API (embedding model)
-    embedding = (
-        openai.embeddings.create(
-            input=question,
-            model="text-embedding-3-small",  # Lightweight and high-accuracy embedding model
-        )
-        .data[0]
-        .embedding
+def embed_questions(questions):
+    model = "text-embedding-3-small"  # Lightweight and high-accuracy embedding model
+    response = scheduler.call(
+        model,
+        lambda: openai_api.get().embeddings.create(input=questions, model=model),
+        sum(estimate_tokens(question) for question in questions),
     )
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+# Questions asked concurrently (from several threads) share one request
+# → QUERY_EMBED_BATCH_WAIT_MS: how long the first question waits for others
+batch_wait_ms = config.get("QUERY_EMBED_BATCH_WAIT_MS", DEFAULT_MAX_WAIT * 1000)
+# (its worker thread starts with the first question)
+embedding_batcher = Lazy(
+    "embedding_batcher",
+    MicroBatcher,
+    embed_questions,
+    max_batch_size=config.get("QUERY_EMBED_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE),
+    max_wait=float(batch_wait_ms) / 1000,
+)
+
+
+# ---------------------------
+# Vectorize a question (OpenAI embedding, served from the local cache when possible)
+# ---------------------------
+def embed_question(question):
+    cache = embedding_cache.get()
+    if cache is not None:
+        embedding = cache.get(question)
+        if embedding is not None:
+            return embedding
 
-    # Execute similarity search in Pinecone vector DB
-    results = index.query(
-        vector=embedding,
+    embedding = embedding_batcher.get().embed(question)
+    if cache is not None:
+        cache.put(question, embedding)
+    return embedding
+
+
+# ---------------------------
+# Similarity search for an embedded question (Pinecone or local)
+# ---------------------------
+def search_similar(embedding, ns):
+    return vector_store.get().query(
+        embedding,
         top_k=5,  # Retrieve top 5 similar documents
         include_metadata=True,  # Include metadata with original text
         namespace=ns,  # Identifier for logical separation by project or use case
     )
 
+
+# ---------------------------
+# Keyword search in the local BM25 index (no embedding call)
+# ---------------------------
+def search_lexical(question, ns, top_k=5):
+    index = lexical_index.get()
+    if index is None:
+        raise RuntimeError("The lexical index is disabled (LEXICAL_INDEX_DIR is empty)")
+    return index.search(question, top_k=top_k, namespace=ns)
+
+
+# ---------------------------
+# Hybrid search: the BM25 search runs alongside the vector search,
+# then both rankings are merged by reciprocal rank fusion
+# ---------------------------
+def search_hybrid(question, embedding, ns, top_k=5):
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        lexical = pool.submit(search_lexical, question, ns, top_k)
+        vector = search_similar(embedding, ns)
+        return fuse([vector, lexical.result()], top_k=top_k, k=RRF_K)
+
+
+# Search in the given mode (embedding: None in lexical mode)
+# Texts missing from the matches' metadata come from the chunk store (one lookup)
+def search_chunks(question, embedding, ns, mode):
+    if mode == "lexical":
+        matches = search_lexical(question, ns)
+    elif mode == "hybrid":
+        matches = search_hybrid(question, embedding, ns)
+    else:
+        matches = search_similar(embedding, ns)
+    store = chunk_store.get()
+    if store is not None:
+        matches = store.resolve(matches, ns)
+    return matches
+
+
+# ---------------------------
+# Similar document search (vector store + OpenAI embedding)
+# Input: Question (natural language), namespace (dataset identifier)
+#        mode: "vector" / "hybrid" / "lexical" (default: SEARCH_MODE)
+# Output: List of matched metadata["text"]
+# ---------------------------
+def get_similar_chunks(question, ns, mode=None):
+    mode = mode or SEARCH_MODE
+    # Vectorize question using OpenAI API (embedding model; not needed for lexical)
+    embedding = None if mode == "lexical" else embed_question(question)
+
+    # Execute the search (vector store: Pinecone or local; BM25: local index)
+    matches = search_chunks(question, embedding, ns, mode)
+
     # Extract and return only the text content from metadata
-    return [match["metadata"]["text"] for match in results["matches"]]
+    return [match["metadata"]["text"] for match in matches]
 
 
 # ---------------------------
 # Response generation (OpenAI Chat model)
 # Input: User question, namespace (target dataset)
 # Output: Answer string in natural language generated by gpt-4o
+# A near-duplicate of a question answered before is served from the answer cache
+# (not in lexical mode, which does not embed the question)
 # ---------------------------
-def ask_direct_answer(question, ns):
+def ask_direct_answer(question, ns, mode=None):
+    mode = mode or SEARCH_MODE
+    embedding = None if mode == "lexical" else embed_question(question)
+    cache = answer_cache.get()
+    if cache is not None and embedding is not None:
+        cached = cache.get(ns, embedding)
+        if cached is not None:
+            return cached["answer"]
+
     # Retrieve similar documents and use as context for the answer
-    chunks = get_similar_chunks(question, ns)
-    context = "\n".join(chunks)
+    started = time.perf_counter()
+    matches = search_chunks(question, embedding, ns, mode)
+    answer = generate_answer(question, matches)
+    if cache is not None and embedding is not None:
+        cache.put(ns, question, embedding, answer, cost=time.perf_counter() - started)
+    return answer
+
+
+# ---------------------------
+# Answer a question from its matches (prompt context packed from the chunk texts)
+# Output: Answer string generated by gpt-4o
+# ---------------------------
+def generate_answer(question, matches):
+    context, report = build_context(
+        matches,
+        max_tokens=CONTEXT_MAX_TOKENS,
+        duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+        separator="\n",
+    )
+    context_stats.add(report)
 
     # Prompt design: Instruct to generate answer based on FAQ-style documents
     prompt = (
@@ -64,9 +274,163 @@ def ask_direct_answer(question, ns):
     )
 
     # Generate response using gpt-4o (latest as of 2024)
-    response = openai.chat.completions.create(
-        model="gpt-4o", messages=[{"role": "user", "content": prompt}]
+    messages = [{"role": "user", "content": prompt}]
+    response = scheduler.call(
+        "gpt-4o",
+        lambda: openai_api.get().chat.completions.create(
+            model="gpt-4o", messages=messages
+        ),
+        estimate_tokens(prompt),
     )
 
     # Extract and return only the generated answer text
     return response.choices[0].message.content.strip()
+
+
+# ---------------------------
+# Batched questions (evaluation sets, bulk question answering; see batch_questions.py)
+# ---------------------------
+BATCH_SIZE = 256  # Questions embedded and searched together
+BATCH_WORKERS = 8  # Embedding requests / vector queries / BM25 searches in flight
+ANSWER_WORKERS = 4  # gpt-4o calls in flight
+
+
+# ---------------------------
+# Vectorize many questions: cached ones come from the local cache, the others
+# are embedded batch_size per request, up to `workers` requests at a time
+# Output: vectors in input order
+# ---------------------------
+def embed_question_batch(questions, batch_size=BATCH_SIZE, workers=BATCH_WORKERS):
+    cache = embedding_cache.get()
+    vectors = (
+        cache.get_many(questions) if cache is not None else [None] * len(questions)
+    )
+    missing = list(dict.fromkeys(q for q, v in zip(questions, vectors) if v is None))
+    batches = [
+        missing[start : start + batch_size]
+        for start in range(0, len(missing), batch_size)
+    ]
+    embedded = {}
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            for batch, batch_vectors in zip(
+                batches, pool.map(embed_questions, batches)
+            ):
+                embedded.update(zip(batch, batch_vectors))
+        if cache is not None:
+            cache.put_many(list(embedded.items()))
+    return [
+        vector if vector is not None else embedded[question]
+        for question, vector in zip(questions, vectors)
+    ]
+
+
+# ---------------------------
+# Search for many questions at once (embeddings: None in lexical mode)
+# The vector queries go to the store together (query_many: concurrent Pinecone
+# queries, or one matrix product on the local index); BM25 searches run in
+# `workers` threads; hybrid fuses both rankings per question
+# Output: matches per question, texts filled in from the chunk store
+# ---------------------------
+def search_chunks_batch(
+    questions, embeddings, ns, mode, top_k=5, workers=BATCH_WORKERS
+):
+    if mode != "lexical":
+        vector = vector_store.get().query_many(
+            embeddings, top_k=top_k, namespace=ns, workers=workers
+        )
+    if mode != "vector":
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            lexical = list(
+                pool.map(
+                    lambda question: search_lexical(question, ns, top_k), questions
+                )
+            )
+    if mode == "hybrid":
+        results = [fuse(pair, top_k=top_k, k=RRF_K) for pair in zip(vector, lexical)]
+    else:
+        results = lexical if mode == "lexical" else vector
+    store = chunk_store.get()
+    if store is not None:
+        results = [store.resolve(matches, ns) for matches in results]
+    return results
+
+
+# Answer of one question of a batch (answer cache as in ask_direct_answer)
+def _batch_answer(question, ns, embedding, matches):
+    cache = answer_cache.get() if embedding is not None else None
+    if cache is not None:
+        cached = cache.get(ns, embedding)
+        if cached is not None:
+            return cached["answer"]
+    started = time.perf_counter()
+    answer = generate_answer(question, matches)
+    if cache is not None:
+        cache.put(ns, question, embedding, answer, cost=time.perf_counter() - started)
+    return answer
+
+
+# ---------------------------
+# Retrieval (and optionally answers) for many questions
+# Input: questions (list of str), namespace, mode (default: SEARCH_MODE), top_k
+#        answer: also generate answers, up to answer_workers gpt-4o calls at a time
+#        batch_size: questions embedded and searched together; each batch is
+#        yielded before the next one starts, so results can be streamed
+# Output: yields {"question", "matches", "answer"} in input order
+#         (answer is None without answer=True)
+# ---------------------------
+def answer_question_batch(
+    questions,
+    ns,
+    mode=None,
+    top_k=5,
+    answer=False,
+    batch_size=BATCH_SIZE,
+    workers=BATCH_WORKERS,
+    answer_workers=ANSWER_WORKERS,
+):
+    mode = mode or SEARCH_MODE
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start : start + batch_size]
+        if mode == "lexical":
+            embeddings = [None] * len(batch)
+        else:
+            embeddings = embed_question_batch(batch, batch_size, workers)
+        results = search_chunks_batch(batch, embeddings, ns, mode, top_k, workers)
+        if not answer:
+            for question, matches in zip(batch, results):
+                yield {"question": question, "matches": matches, "answer": None}
+            continue
+        with ThreadPoolExecutor(max_workers=answer_workers) as pool:
+            answers = pool.map(
+                lambda item: _batch_answer(item[0], ns, item[1], item[2]),
+                zip(batch, embeddings, results),
+            )
+            for question, matches, text in zip(batch, results, answers):
+                yield {"question": question, "matches": matches, "answer": text}
+
+
+# ---------------------------
+# Open the clients, caches and indexes ahead of the first question (optional:
+# everything is otherwise opened on first use), including the OpenAI and Pinecone
+# connections and the vector store / BM25 index of the namespace `ns`
+# Output: {part: error} of the parts that failed (they are retried on first use)
+# ---------------------------
+def warm_up(ns=""):
+    for resource in (embedding_cache, answer_cache, chunk_store, embedding_batcher):
+        resource.get()
+    parts = {
+        "openai": lambda: openai_api.get().models.retrieve("text-embedding-3-small"),
+        "vector store": lambda: vector_store.get().warm_up(ns),
+    }
+    if lexical_index.get() is not None:
+        parts["lexical index"] = lambda: lexical_index.get().namespace(ns)
+    errors = {}
+    for name, call in parts.items():
+        try:
+            with startup.phase("warm-up", name):
+                call()
+        except Exception as e:
+            errors[name] = str(e)
+    startup.ready()
+    return errors
@@ -0,0 +1,482 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+
+import requests
+
+# HTTP statuses worth retrying: rate limited (429) and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Errors without a status that are retried (connection reset, timeout, ...)
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Priorities: interactive calls (questions from /query) go before background
+# calls (ingestion) that wait on the same limiter
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Adaptive rate: a 429 halves the rate of the limiter (down to MIN_RATE_SCALE of
+# its configured limits); each successful call gives back RATE_RECOVERY_STEP
+MIN_RATE_SCALE = 0.1
+RATE_RECOVERY_STEP = 0.05
+# Seconds a background caller waits while interactive callers are waiting
+BACKGROUND_YIELD_SECONDS = 0.05
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # Seconds before the first retry (doubled for each retry)
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_FAILURE_THRESHOLD = 5  # Consecutive failures that open a circuit
+DEFAULT_RESET_SECONDS = 30.0  # Seconds an open circuit rejects calls
+
+
+# ---------------------------
+# Token bucket (capacity = amount allowed per minute, refilled continuously)
+# take(): returns 0 when the amount is available, otherwise the seconds to wait
+# wait() / consume(): the same in two steps, to take from several buckets at once
+# scale: fraction of the rate currently allowed (lowered after 429 responses)
+# ---------------------------
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount):
+        wait = self.wait(amount)
+        if wait == 0.0:
+            self.consume(amount)
+        return wait
+
+    def wait(self, amount):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # Requests larger than the whole bucket are allowed once it is full
+        amount = min(float(amount), self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(float(amount), self.capacity)
+
+    def set_scale(self, scale):
+        self.wait(0)  # Refill at the old rate up to now
+        self.rate = self.capacity / 60.0 * scale
+
+
+def _bucket(per_minute, share=1.0):
+    return TokenBucket(per_minute * share) if per_minute else None
+
+
+# ---------------------------
+# Rate limit shared by worker threads (and the coroutines of one event loop)
+# requests_per_minute / tokens_per_minute: None means unlimited
+# background_share: fraction of the limits background callers may use; the rest
+#   is left to interactive traffic, also when it comes from another process
+#   (ingestion and the web app share the same API quota)
+# acquire(tokens): blocks until both one request and the tokens are available
+# acquire_async(tokens): the same without blocking the event loop
+# throttled(retry_after) / succeeded(): adapt the rate to 429 responses
+# waited_seconds: total time spent waiting (shown as backpressure in progress output)
+# ---------------------------
+class RateLimiter:
+    def __init__(
+        self, requests_per_minute=None, tokens_per_minute=None, background_share=1.0
+    ):
+        self.request_bucket = _bucket(requests_per_minute)
+        self.token_bucket = _bucket(tokens_per_minute)
+        # Background callers also take from these smaller buckets
+        self.background_buckets = (None, None)
+        if background_share < 1.0:
+            self.background_buckets = (
+                _bucket(requests_per_minute, background_share),
+                _bucket(tokens_per_minute, background_share),
+            )
+        self.lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.scale = 1.0
+        self.paused_until = 0.0  # Retry-After of the last 429 (time.monotonic)
+        self.interactive_waiting = 0
+
+    def acquire(self, tokens=0, priority=BACKGROUND):
+        for wait in self._waits(tokens, priority):
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0, priority=BACKGROUND):
+        for wait in self._waits(tokens, priority):
+            await asyncio.sleep(wait)
+
+    # Waits before the request can be sent (interactive callers count as waiting
+    # meanwhile, so that background callers let them go first)
+    def _waits(self, tokens, priority):
+        waiting = False
+        try:
+            while True:
+                with self.lock:
+                    wait = self._try_take(tokens, priority)
+                    if wait == 0.0:
+                        return
+                    if priority == INTERACTIVE and not waiting:
+                        self.interactive_waiting += 1
+                        waiting = True
+                    self.waited_seconds += wait
+                yield wait
+        finally:
+            if waiting:
+                with self.lock:
+                    self.interactive_waiting -= 1
+
+    # Take from all the buckets only when all of them can serve the request
+    def _try_take(self, tokens, priority):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if priority != INTERACTIVE and self.interactive_waiting:
+            return BACKGROUND_YIELD_SECONDS
+        demands = [(self.request_bucket, 1), (self.token_bucket, tokens)]
+        if priority != INTERACTIVE:
+            request_bucket, token_bucket = self.background_buckets
+            demands += [(request_bucket, 1), (token_bucket, tokens)]
+        demands = [(bucket, amount) for bucket, amount in demands if bucket and amount]
+        wait = max((bucket.wait(amount) for bucket, amount in demands), default=0.0)
+        if wait == 0.0:
+            for bucket, amount in demands:
+                bucket.consume(amount)
+        return wait
+
+    # ---------------------------
+    # Adaptive rate (AIMD): a 429 halves the rate and pauses every caller for
+    # retry_after seconds; each success raises the rate again by a small step
+    # → steady throughput just below the quota instead of bursts and 429s
+    # ---------------------------
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self._set_scale(max(MIN_RATE_SCALE, self.scale / 2))
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+    def succeeded(self):
+        if self.scale < 1.0:
+            with self.lock:
+                self._set_scale(min(1.0, self.scale + RATE_RECOVERY_STEP))
+
+    def _set_scale(self, scale):
+        self.scale = scale
+        buckets = (self.request_bucket, self.token_bucket) + self.background_buckets
+        for bucket in buckets:
+            if bucket:
+                bucket.set_scale(scale)
+
+
+# ---------------------------
+# Circuit breaker: after `threshold` consecutive failures the circuit opens and
+# calls fail at once (CircuitOpenError) for reset_seconds; then one trial call
+# is let through (half-open), which closes the circuit again when it succeeds
+# → an upstream outage costs one quick error per call instead of every caller
+# going through all its retries
+# Failures are 5xx responses, connection errors and timeouts; a 429 means the
+# upstream is up, so throttling never opens the circuit
+# ---------------------------
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self, threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS
+    ):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened = None  # time.monotonic() when the circuit opened
+        self.trial = False  # A half-open trial call is in flight
+        self.lock = threading.Lock()
+
+    # Returns True when the caller is the half-open trial call
+    def check(self, name):
+        with self.lock:
+            if self.opened is None:
+                return False
+            remaining = self.opened + self.reset_seconds - time.monotonic()
+            if remaining <= 0 and not self.trial:
+                self.trial = True
+                return True
+            raise CircuitOpenError(
+                f"{name}: circuit open after {self.failures} consecutive failures "
+                f"(next trial in {max(remaining, 0.0):.1f} seconds)"
+            )
+
+    # Returns whether the circuit is open (after a failure)
+    def record(self, ok):
+        with self.lock:
+            self.trial = False
+            if ok:
+                self.failures = 0
+                self.opened = None
+                return False
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            return self.opened is not None
+
+    # The trial call ended without an outcome (e.g. cancelled): the next call is
+    # let through as the trial instead
+    def cancel_trial(self):
+        with self.lock:
+            self.trial = False
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        return "half-open" if self.trial else "open"
+
+
+# ---------------------------
+# Whether an error is worth retrying: (retryable, status, retry_after seconds)
+# Works with requests, the OpenAI SDK (status_code / response) and the Pinecone
+# SDK (status / headers) without depending on their exception classes
+# ---------------------------
+def retry_info(error):
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+        return status in RETRY_STATUS_CODES, status, parse_retry_after(headers)
+    return isinstance(error, RETRY_ERRORS + _sdk_retry_errors()), None, None
+
+
+# openai.APIConnectionError (also covers APITimeoutError) once the SDK is loaded
+# (not imported here: it is the slowest import of the project, see clients.py)
+def _sdk_retry_errors():
+    openai = sys.modules.get("openai")
+    error = getattr(openai, "APIConnectionError", None)
+    return (error,) if isinstance(error, type) else ()
+
+
+# ---------------------------
+# Retry-After header (seconds, or OpenAI's retry-after-ms) → float; None when
+# absent or not a number
+# ---------------------------
+def parse_retry_after(headers):
+    if not headers:
+        return None
+    try:
+        milliseconds = headers.get("retry-after-ms")
+        if milliseconds is not None:
+            return max(0.0, float(milliseconds) / 1000)
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+# Full-jitter exponential backoff; a Retry-After from the server takes precedence
+def retry_delay(
+    attempt, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, retry_after=None
+):
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(max_backoff, backoff * (2**attempt)))
+
+
+# ---------------------------
+# Per-upstream limits from a setting such as
+#   "text-embedding-3-small=3000:1000000,gpt-4o=500:30000,pinecone=6000"
+# → {name: (requests_per_minute, tokens_per_minute)}; a missing or 0 tokens
+#   part means no token limit
+# ---------------------------
+def parse_limits(spec):
+    limits = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, values = item.partition("=")
+        requests_per_minute, _, tokens_per_minute = values.partition(":")
+        limits[name.strip()] = (
+            float(requests_per_minute) or None,
+            float(tokens_per_minute or 0) or None,
+        )
+    return limits
+
+
+# ---------------------------
+# Client-side scheduler shared by every OpenAI and Pinecone call of a process
+# One rate limiter and one circuit breaker per upstream: the model name for
+# OpenAI (limits are per model), PINECONE for the vector store
+# call(name, send, tokens): waits for the rate limit, calls send() and retries
+#   429 / 5xx / connection errors with backoff; other errors are raised at once,
+#   and so is the last error once the retries are used up or the circuit opens
+# acall(name, send, tokens): the same for coroutines (send() returns an awaitable)
+# limits: {name: (requests_per_minute, tokens_per_minute)} (see parse_limits)
+# priority: default priority of the calls (INTERACTIVE for the web app and the
+#   query CLI, BACKGROUND for ingestion)
+# background_share: fraction of each limit left to background calls
+# ---------------------------
+PINECONE = "pinecone"
+
+
+class Scheduler:
+    def __init__(
+        self,
+        limits=None,
+        priority=BACKGROUND,
+        background_share=1.0,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_seconds=DEFAULT_RESET_SECONDS,
+    ):
+        self.limits = limits or {}
+        self.priority = priority
+        self.background_share = background_share
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.limiters = {}
+        self.breakers = {}
+        self.counters = {}  # name → {"calls", "retries", "throttled", "rejected"}
+        self.lock = threading.Lock()
+
+    def limiter(self, name):
+        with self.lock:
+            if name not in self.limiters:
+                self.limiters[name] = RateLimiter(
+                    *self.limits.get(name, (None, None)),
+                    background_share=self.background_share,
+                )
+                self.breakers[name] = CircuitBreaker(
+                    self.failure_threshold, self.reset_seconds
+                )
+                self.counters[name] = dict.fromkeys(
+                    ("calls", "retries", "throttled", "rejected"), 0
+                )
+            return self.limiters[name]
+
+    # ---------------------------
+    # limiter: an extra RateLimiter to wait on (e.g. --rpm / --tpm of one run)
+    # ---------------------------
+    def call(self, name, send, tokens=0, priority=None, limiter=None):
+        priority = self.priority if priority is None else priority
+        limiters = [self.limiter(name)] + ([limiter] if limiter else [])
+        trial = self._admit(name)
+        attempt = 0
+        try:
+            while True:
+                for each in limiters:
+                    each.acquire(tokens, priority)
+                try:
+                    result = send()
+                except Exception as e:
+                    delay = self._failed(name, e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(name)
+                return result
+        except BaseException:
+            if trial:
+                self.breakers[name].cancel_trial()
+            raise
+
+    async def acall(self, name, send, tokens=0, priority=None):
+        priority = self.priority if priority is None else priority
+        limiter = self.limiter(name)
+        trial = self._admit(name)
+        attempt = 0
+        try:
+            while True:
+                await limiter.acquire_async(tokens, priority)
+                try:
+                    result = await send()
+                except Exception as e:
+                    delay = self._failed(name, e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(name)
+                return result
+        except BaseException:
+            # e.g. cancelled by a stage timeout: let the next call be the trial
+            if trial:
+                self.breakers[name].cancel_trial()
+            raise
+
+    # Returns whether the call is the half-open trial
+    def _admit(self, name):
+        try:
+            trial = self.breakers[name].check(name)
+        except CircuitOpenError:
+            self._count(name, "rejected")
+            raise
+        self._count(name, "calls")
+        return trial
+
+    def _count(self, name, counter):
+        with self.lock:
+            self.counters[name][counter] += 1
+
+    def _succeeded(self, name):
+        self.breakers[name].record(True)
+        self.limiters[name].succeeded()
+
+    # Seconds to wait before retrying, or None when the error is to be raised
+    def _failed(self, name, error, attempt):
+        retryable, status, retry_after = retry_info(error)
+        if not retryable:
+            # The upstream answered (e.g. 400): the error is the caller's, not an outage
+            self.breakers[name].record(True)
+            return None
+        if status == 429:
+            # Throttling is not an outage: left to the adaptive limiter and Retry-After
+            self._count(name, "throttled")
+            self.limiters[name].throttled(retry_after)
+            opened = self.breakers[name].record(True)
+        else:
+            opened = self.breakers[name].record(False)
+        if attempt >= self.max_retries or opened:
+            return None  # Calls after this one are rejected until the circuit resets
+        self._count(name, "retries")
+        return retry_delay(attempt, self.backoff, self.max_backoff, retry_after)
+
+    # {name: {"calls", "retries", "throttled", "rejected", "rate_scale", "circuit",
+    #         "waited_seconds"}}
+    def stats(self):
+        with self.lock:
+            names = list(self.limiters)
+            counters = {name: dict(self.counters[name]) for name in names}
+        return {
+            name: dict(
+                counters[name],
+                rate_scale=self.limiters[name].scale,
+                circuit=self.breakers[name].state,
+                waited_seconds=self.limiters[name].waited_seconds,
+            )
+            for name in names
+        }
+
+    def report(self):
+        return ", ".join(
+            f"{name}: {stats['calls']} calls, {stats['retries']} retries, "
+            f"{stats['throttled']} throttled (429), {stats['rejected']} rejected "
+            f"by the circuit breaker, rate-limit wait {stats['waited_seconds']:.1f}s"
+            for name, stats in self.stats().items()
+        )
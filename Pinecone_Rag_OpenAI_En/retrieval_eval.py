@@ -0,0 +1,77 @@
+import os
+import threading
+
+# ---------------------------
+# Retrieval quality against labelled sources (evaluation sets)
+# A question is labelled with the documents that answer it: "sources", file
+# paths or file names as stored in metadata["source"] at ingestion
+# recall@k: share of the question's labelled sources found in its top k matches
+# MRR:      1 / rank of the first match from a labelled source (0: none in the top k)
+# Both are averaged over the labelled questions; unlabelled questions are skipped
+# ---------------------------
+
+
+# A source as a label may name it: its path or its file name
+def _source_keys(source):
+    source = os.path.normpath(source)
+    return {source, os.path.basename(source)}
+
+
+# ---------------------------
+# Scores of one question: {"recall", "reciprocal_rank", "found": [labels found]}
+# matches: ranked matches (best first) with metadata["source"]
+# ---------------------------
+def score_matches(matches, sources, k):
+    labels = {os.path.normpath(source) for source in sources}
+    found = set()
+    rank = None
+    for position, match in enumerate(matches[:k], 1):
+        source = match["metadata"].get("source")
+        hits = _source_keys(source) & labels if source else set()
+        if hits:
+            found |= hits
+            rank = rank or position
+    return {
+        "recall": len(found) / len(labels) if labels else 0.0,
+        "reciprocal_rank": 1 / rank if rank else 0.0,
+        "found": sorted(found),
+    }
+
+
+# ---------------------------
+# Averages over every scored question (thread-safe)
+# ---------------------------
+class RetrievalScores:
+    def __init__(self, k):
+        self.k = k
+        self.lock = threading.Lock()
+        self.totals = {"questions": 0, "recall": 0.0, "reciprocal_rank": 0.0}
+
+    # Score one question and add it to the averages (None when it has no labels)
+    def add(self, matches, sources):
+        if not sources:
+            return None
+        scores = score_matches(matches, sources, self.k)
+        with self.lock:
+            self.totals["questions"] += 1
+            self.totals["recall"] += scores["recall"]
+            self.totals["reciprocal_rank"] += scores["reciprocal_rank"]
+        return scores
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+        questions = totals["questions"]
+        return {
+            "questions": questions,
+            "k": self.k,
+            f"recall@{self.k}": totals["recall"] / questions if questions else 0.0,
+            "mrr": totals["reciprocal_rank"] / questions if questions else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"recall@{self.k} {stats[f'recall@{self.k}']:.3f}, "
+            f"MRR {stats['mrr']:.3f} over {stats['questions']} labelled questions"
+        )
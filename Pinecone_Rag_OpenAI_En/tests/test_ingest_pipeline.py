@@ -0,0 +1,115 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from embedding_batcher import EmbeddingBatcher
+from ingest_job import IngestJob
+from ingest_manifest import IncrementalSync, IngestManifest, text_sha256
+from ingest_pipeline import IngestPipeline
+
+OPTIONS = {"chunk_options": {}}
+
+
+# One chunk per line (top-level so that the process pool can run it)
+def _chunk_lines(file_path, metrics=None):
+    with open(file_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    return [
+        (f"doc-chunk-{i}", line, {"source": file_path}) for i, line in enumerate(lines)
+    ]
+
+
+# Records the chunks it embeds instead of calling the API
+class FakeBatcher(EmbeddingBatcher):
+    def __init__(self):
+        super().__init__(api_key="test")
+        self.embedded = []
+
+    def embed_batch(self, batch, limiter=None):
+        self.embedded.extend(vector_id for vector_id, _ in batch)
+        return [(vector_id, [0.0]) for vector_id, _ in batch]
+
+
+# Fails every batch with an unexpected error
+class BrokenBatcher(FakeBatcher):
+    def embed_batch(self, batch, limiter=None):
+        raise RuntimeError("broken")
+
+
+# Reports every vector as upserted on its own
+class FakeWriter:
+    def __init__(self):
+        self.reports = []
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        report = {"ids": [vector_id], "ok": True, "seconds": 0.0, "bytes": 0}
+        self.reports.append(report)
+
+    def close(self):
+        return self.reports
+
+    def delete(self, namespace, ids):
+        return []
+
+
+def _run(tmp_path, file_path, resume, batcher=None):
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    job = IngestJob(str(tmp_path / "jobs.sqlite3"), "job")
+    job.start(OPTIONS, resume)
+    sync = IncrementalSync(manifest, "ns", str(tmp_path))
+    batcher = batcher or FakeBatcher()
+    pipeline = IngestPipeline(
+        _chunk_lines,
+        batcher,
+        FakeWriter,
+        "ns",
+        extract_workers=1,
+        embed_workers=1,
+        upsert_workers=1,
+        progress_interval=3600,
+        sync=sync,
+        job=job,
+    )
+    pipeline.run([file_path])
+    job.finish()
+    summary = job.summary()
+    job.close()
+    manifest.close()
+    return batcher.embedded, pipeline.sync_stats, summary
+
+
+def test_resumed_chunks_are_recorded_and_not_embedded_again(tmp_path):
+    lines = [f"line {i}" for i in range(4)]
+    file_path = str(tmp_path / "doc.txt")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+    # A run that stopped after upserting the first two chunks
+    job = IngestJob(str(tmp_path / "jobs.sqlite3"), "job")
+    job.start(OPTIONS)
+    job.record_chunks(
+        [(f"doc-chunk-{i}", file_path, text_sha256(lines[i])) for i in range(2)]
+    )
+    job.close()
+
+    embedded, stats, _ = _run(tmp_path, file_path, resume=True)
+    assert embedded == ["doc-chunk-2", "doc-chunk-3"]
+    assert stats["chunks_embedded"] == 2
+    assert stats["chunks_resumed"] == 2
+
+    embedded, stats, _ = _run(tmp_path, file_path, resume=False)
+    assert embedded == []
+    assert stats["files_skipped"] == 1
+    assert stats["chunks_embedded"] == 0
+
+
+def test_failed_embed_batch_is_dead_lettered_and_the_file_completed(tmp_path):
+    file_path = str(tmp_path / "doc.txt")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(f"line {i}" for i in range(3)))
+
+    _, stats, summary = _run(tmp_path, file_path, False, BrokenBatcher())
+    assert summary["files_done"] == 1
+    assert summary["dead_letters"] == 3
+    assert stats["chunks_embedded"] == 0
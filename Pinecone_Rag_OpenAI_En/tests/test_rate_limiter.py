@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rate_limiter import CircuitOpenError, Scheduler
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def _fail():
+    raise ServerError("unavailable")
+
+
+def _throttle():
+    raise Throttled("rate limited")
+
+
+# A scheduler whose "embed" circuit is open and ready for its half-open trial
+def _half_open_scheduler():
+    scheduler = Scheduler(max_retries=0, failure_threshold=1, reset_seconds=0.0)
+    with pytest.raises(ServerError):
+        scheduler.call("embed", _fail)
+    return scheduler
+
+
+def test_cancelled_trial_lets_the_next_call_through():
+    scheduler = _half_open_scheduler()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.acall("embed", hang), 0.01)
+        return await scheduler.acall("embed", ok)
+
+    assert asyncio.run(run()) == "ok"
+    assert scheduler.stats()["embed"]["circuit"] == "closed"
+
+
+def test_interrupted_trial_lets_the_next_call_through():
+    scheduler = _half_open_scheduler()
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call("embed", interrupt)
+    assert scheduler.call("embed", lambda: "ok") == "ok"
+
+
+def test_other_calls_are_rejected_while_the_trial_runs():
+    scheduler = _half_open_scheduler()
+
+    def nested():
+        with pytest.raises(CircuitOpenError):
+            scheduler.call("embed", lambda: "rejected")
+        return "trial"
+
+    assert scheduler.call("embed", nested) == "trial"
+
+
+def test_throttling_does_not_open_the_circuit():
+    scheduler = Scheduler(max_retries=0, failure_threshold=2)
+    for _ in range(5):
+        with pytest.raises(Throttled):
+            scheduler.call("embed", _throttle)
+    stats = scheduler.stats()["embed"]
+    assert stats["circuit"] == "closed"
+    assert stats["throttled"] == 5
+    assert scheduler.call("embed", lambda: "ok") == "ok"
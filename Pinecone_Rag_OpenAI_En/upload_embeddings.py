@@ -1,9 +1,34 @@
 import os
+import time
 import requests
-import pdfplumber
-import docx
 import argparse
+from functools import partial
 from dotenv import load_dotenv
+from ann_index import DEFAULT_MIN_ROWS
+from answer_cache import DEFAULT_ANSWER_CACHE_DIR, invalidate_answers
+from chunk_store import DEFAULT_CHUNK_STORE_DIR, open_chunk_store
+from chunking import CHUNKERS, DEFAULT_STRATEGY, get_chunker
+from embedding_batcher import DEFAULT_EMBEDDING_URL, EmbeddingBatcher, estimate_tokens
+from embedding_cache import DEFAULT_CACHE_DIR, DEFAULT_CAPACITY, open_cache
+from extract_cache import DEFAULT_EXTRACT_CACHE_DIR, DEFAULT_MAX_MB, open_extract_cache
+from extractors import DEFAULT_MAX_FILE_MB, detect_kind, extract_pages
+from ingest_job import DEFAULT_JOB_DIR, job_id, open_ingest_job
+from ingest_manifest import (
+    DEFAULT_MANIFEST_PATH,
+    IncrementalSync,
+    IngestManifest,
+    text_sha256,
+)
+from ingest_pipeline import DEFAULT_EXTRACT_TIMEOUT, STAGES, IngestPipeline
+from lexical_index import DEFAULT_LEXICAL_INDEX_DIR, open_lexical_index
+from metrics import Metrics
+from rate_limiter import Scheduler, parse_limits
+from vector_store import (
+    BACKENDS,
+    DEFAULT_BACKEND,
+    DEFAULT_LOCAL_INDEX_DIR,
+    open_vector_store,
+)
 
 # ---------------------------
 # Load environment variables (safely retrieve API keys and endpoint URLs from external file)
@@ -12,29 +37,63 @@ load_dotenv("config.env.template")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_URL = os.getenv("PINECONE_URL")  # Must not include /query at the end
+# Embeddings endpoint (can be switched to a local stand-in server for testing)
+OPENAI_EMBEDDINGS_URL = os.getenv("OPENAI_EMBEDDINGS_URL", DEFAULT_EMBEDDING_URL)
+# Local embedding cache (an empty EMBEDDING_CACHE_DIR disables it)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR)
+EMBEDDING_CACHE_CAPACITY = os.getenv("EMBEDDING_CACHE_CAPACITY", DEFAULT_CAPACITY)
+# Answer cache of the app and query_embeddings.py (dropped for a re-ingested namespace)
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", DEFAULT_ANSWER_CACHE_DIR)
+# Where vectors are written: "pinecone" or "local" (index files under LOCAL_INDEX_DIR)
+VECTOR_STORE = os.getenv("VECTOR_STORE", DEFAULT_BACKEND)
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR)
+# Local index: vectors per namespace before an IVF index is trained after ingestion
+LOCAL_ANN_MIN_ROWS = os.getenv("LOCAL_ANN_MIN_ROWS", DEFAULT_MIN_ROWS)
+# Local index: compress the vectors along with the IVF index ("int8" / "pq"; empty: off)
+LOCAL_QUANTIZATION = os.getenv("LOCAL_QUANTIZATION")
+# BM25 index of the ingested chunks for lexical / hybrid search (empty: not built)
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR)
+# Local store of the chunk texts; vectors then carry only small attributes (empty: off)
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", DEFAULT_CHUNK_STORE_DIR)
+# Extracted text cached by file content, so re-chunking does not parse again (empty: off)
+EXTRACT_CACHE_DIR = os.getenv("EXTRACT_CACHE_DIR", DEFAULT_EXTRACT_CACHE_DIR)
+EXTRACT_CACHE_MAX_MB = os.getenv("EXTRACT_CACHE_MAX_MB", DEFAULT_MAX_MB)
+# Larger files are skipped without being read (0: no limit)
+EXTRACT_MAX_FILE_MB = os.getenv("EXTRACT_MAX_FILE_MB", DEFAULT_MAX_FILE_MB)
+# Checkpoints of ingestion jobs and their dead-letter queues, for --resume (empty: off)
+INGEST_JOB_DIR = os.getenv("INGEST_JOB_DIR", DEFAULT_JOB_DIR)
+# Client-side rate limits per model / "pinecone" (same format as the app's RATE_LIMITS,
+# e.g. "text-embedding-3-small=3000:1000000,pinecone=6000"; unset: no limit)
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Fraction of each limit ingestion may use; the rest is left to the app's questions
+INGEST_RATE_SHARE = float(os.getenv("INGEST_RATE_SHARE", "0.8"))
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", "30"))
+
+# ---------------------------
+# Scheduler of every OpenAI and Pinecone call of ingestion (background priority):
+# per-model rate limits, retries with jittered backoff honouring Retry-After,
+# and a circuit breaker per upstream
+# ---------------------------
+scheduler = Scheduler(
+    parse_limits(RATE_LIMITS),
+    background_share=INGEST_RATE_SHARE,
+    failure_threshold=CIRCUIT_BREAKER_FAILURES,
+    reset_seconds=CIRCUIT_BREAKER_RESET,
+)
+
+# Shared by the extraction worker processes (entries are written atomically)
+extract_cache = open_extract_cache(EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_MB)
 
 
 # ---------------------------
-# Text extraction process according to file type
-# PDF → pdfplumber
-# Word → python-docx
-# Others → Read directly in UTF-8 (e.g., .txt, .md, .py)
+# Whole text of a file (for small files; ingestion uses extract_pages directly)
+# Extraction by file type: see extractors.py (registry of extractors for PDF,
+# Word, HTML, CSV, Markdown and text; binary files are skipped)
 # ---------------------------
 def extract_text(file_path):
-    ext = os.path.splitext(file_path)[1].lower()
     try:
-        if ext == ".pdf":
-            text = ""
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() + "\n"
-            return text
-        elif ext == ".docx":
-            doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
-        else:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+        return "".join(text for _, text in extract_pages(file_path))
     except Exception as e:
         print(f"[Warning] Text extraction failed: {file_path} → {e}")
         return ""
@@ -60,6 +119,7 @@ def chunk_text(text, chunk_size=1000, overlap=200):
 # Generate embeddings via OpenAI API
 # Model: text-embedding-3-small (high-accuracy version from 2024 onward)
 # Vectorize each chunk for semantic search with Pinecone
+# 429 / 5xx responses are retried by the scheduler
 # ---------------------------
 def get_embedding(text):
     headers = {
@@ -67,63 +127,587 @@ def get_embedding(text):
         "Content-Type": "application/json",
     }
     data = {"input": text, "model": "text-embedding-3-small"}
-    response = requests.post(
-        "https://api.openai.com/v1/embeddings", headers=headers, json=data
+
+    def send():
+        response = requests.post(OPENAI_EMBEDDINGS_URL, headers=headers, json=data)
+        response.raise_for_status()
+        return response.json()
+
+    body = scheduler.call(data["model"], send, estimate_tokens(text))
+    return body["data"][0]["embedding"]
+
+
+# ---------------------------
+# Create the batcher used for bulk embedding during ingestion
+# Chunks are sent as an array input in token-budgeted batches
+# Chunks embedded before are read from the local cache instead of the API
+# ---------------------------
+def build_embedding_batcher():
+    cache = open_cache("ingest", EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_CAPACITY)
+    return EmbeddingBatcher(
+        OPENAI_API_KEY, url=OPENAI_EMBEDDINGS_URL, cache=cache, scheduler=scheduler
     )
-    response.raise_for_status()
-    return response.json()["data"][0]["embedding"]
+
+
+# ---------------------------
+# Print the embedding report (and cache hit/miss counters) and flush the cache
+# Also the retries / 429s per upstream (model / pinecone) of the scheduler
+# ---------------------------
+def print_embedding_report(batcher):
+    print(f"[Embedding] {batcher.report()}")
+    if scheduler.stats():
+        print(f"[Upstream] {scheduler.report()}")
+    if batcher.cache:
+        print(f"[Embedding cache] {batcher.cache.report()}")
+        batcher.cache.close()
+
+
+# ---------------------------
+# Create the vector store vectors are written to (Pinecone or the local index)
+# backend: "pinecone" / "local"; VECTOR_STORE when omitted
+# ---------------------------
+def build_vector_store(backend=None):
+    return open_vector_store(
+        backend or VECTOR_STORE,
+        local_dir=LOCAL_INDEX_DIR,
+        api_key=PINECONE_API_KEY,
+        url=PINECONE_URL,
+        ann_min_rows=LOCAL_ANN_MIN_ROWS,
+        quantization=LOCAL_QUANTIZATION,
+        scheduler=scheduler,
+    )
+
+
+# Manifest of the backend: the local index keeps its own next to its files
+def default_manifest_path(backend=None):
+    if (backend or VECTOR_STORE) == "local":
+        return os.path.join(LOCAL_INDEX_DIR, DEFAULT_MANIFEST_PATH)
+    return DEFAULT_MANIFEST_PATH
+
+
+# ---------------------------
+# Create the writer used for bulk upserts
+# Pinecone: vectors are buffered per namespace and sent in batches over a pooled Session
+# Local: vectors are written to the memory-mapped index in batches
+# lexical: LexicalIndex that also indexes the text of every vector written (optional)
+# chunks: ChunkStore keeping the texts, so that vectors are written without them (optional)
+# ---------------------------
+def build_upsert_writer(store=None, lexical=None, chunks=None):
+    writer = (store or build_vector_store()).writer()
+    if chunks:
+        writer = chunks.writer(writer)
+    return lexical.writer(writer) if lexical else writer
 
 
 # ---------------------------
 # Upload process to Pinecone
-# ID: Uniquely generated by filename + chunk number
+# ID: Uniquely generated by path relative to the ingest root + chunk number
+#     (vector_id_base)
 # namespace: Logical group specified by user (switchable by purpose)
 # metadata: Stores original text and file info to return during search
+#           (the text goes to the chunk store instead when CHUNK_STORE_DIR is set)
+# → Only buffered here; the writer sends it with the next batch
 # ---------------------------
-def upload_to_pinecone(vector_id, embedding, metadata, namespace):
-    headers = {"Api-Key": PINECONE_API_KEY, "Content-Type": "application/json"}
-    url = f"{PINECONE_URL}/vectors/upsert"
-    data = {
-        "vectors": [{"id": vector_id, "values": embedding, "metadata": metadata}],
-        "namespace": namespace,
-    }
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code != 200:
-        print(f"[Error] Upload failed: {vector_id} → {response.text}")
-    else:
-        print(f"[Success] Uploaded: {vector_id}")
+def upload_to_pinecone(vector_id, embedding, metadata, namespace, writer):
+    writer.add(namespace, vector_id, embedding, metadata)
 
 
 # ---------------------------
-# Split full text of a single file → vectorize → register in Pinecone
-# Upload and log each chunk
+# Print the per-batch upload report (combined over one or more writers)
+# Only failed batches are listed individually, followed by a summary line
 # ---------------------------
-def process_file(file_path, namespace):
-    text = extract_text(file_path)
-    if not text.strip():
+def print_upload_report(*writers):
+    summary = {}
+    for writer in writers:
+        for report in writer.reports:
+            if not report["ok"]:
+                print(
+                    f"[Error] Upload failed: {len(report['ids'])} vectors "
+                    f"({report['ids'][0]} … {report['ids'][-1]}) → {report['error']}"
+                )
+        for key, value in writer.summary().items():
+            summary[key] = summary.get(key, 0) + value
+    print(
+        f"[Upload] {summary['vectors_ok']} vectors in {summary['batches_ok']} batches succeeded, "
+        f"{summary['vectors_failed']} vectors in {summary['batches_failed']} batches failed "
+        f"({summary['retries']} retries, {summary['bytes']} bytes)"
+    )
+
+
+# ---------------------------
+# Print where the run spent its time (per stage) and its token / byte counters
+# ---------------------------
+def print_metrics_report(metrics):
+    for stage in STAGES:
+        histogram = metrics.histogram("ingest_stage_seconds", stage=stage)
+        if histogram is not None:
+            print(f"[Metrics] {stage}: {histogram.describe()}")
+    inputs = metrics.value("embedding_inputs_total")
+    cached = metrics.value("embedding_cache_hits_total")
+    print(
+        f"[Metrics] {metrics.value('extracted_bytes_total')} bytes extracted, "
+        f"{metrics.value('embedding_tokens_total')} embedding tokens in "
+        f"{metrics.value('embedding_requests_total')} requests, "
+        f"embedding cache hit rate {cached / inputs if inputs else 0.0:.1%}, "
+        f"{metrics.value('upserted_bytes_total')} bytes upserted, "
+        f"rate-limit wait {metrics.value('rate_limit_wait_seconds_total'):.1f}s"
+    )
+    print(
+        f"[Metrics] {metrics.value('extract_cache_hits_total')} files read from the "
+        f"extraction cache, {metrics.value('extract_skipped_files_total')} skipped, "
+        f"{metrics.value('extract_timeouts_total')} timed out"
+    )
+
+
+# ---------------------------
+# Split a single file into chunks page by page
+# Yields (vector_id, chunk, metadata); metadata has the source path and,
+# for PDFs, the page number where the chunk starts (plus "section" for heading)
+# strategy / options: chunking strategy (see chunking.get_chunker)
+# root: ingest root; vector IDs use the path relative to it (default: the file
+#       name), so same-named files in different subfolders get distinct IDs
+# Extraction errors are raised (the pipeline retries the file on the next run)
+# Files the extractors do not handle (binary, too large, ...) are skipped with a message
+# timing: dict receiving the seconds spent extracting pages ("extract"), the
+#         size of the extracted text ("bytes"), whether the pages came from the
+#         extraction cache ("cached") or the file was skipped ("skipped");
+#         the rest of the time is chunking
+# ---------------------------
+def chunk_file(file_path, strategy=DEFAULT_STRATEGY, timing=None, root=None, **options):
+    kind, reason = detect_kind(file_path, EXTRACT_MAX_FILE_MB)
+    if kind is None:
+        print(f"[Skip] {file_path} → {reason}")
+        if timing is not None:
+            timing["skipped"] = True
+        return
+    chunker = get_chunker(strategy, **options)
+    pages = load_pages(file_path, kind, strategy == "heading", timing)
+    if timing is not None:
+        pages = timed_pages(pages, timing)
+    base = vector_id_base(file_path, root)
+    count = 0
+    for info, chunk in chunker(pages):
+        count += 1
+        vector_id = f"{base}-chunk-{count}"
+        metadata = dict(info, source=file_path)
+        yield vector_id, chunk, metadata
+    if not count:
         print(f"[Skip] Empty or unextractable: {file_path}")
+
+
+# First part of a vector ID ("<path relative to root>-chunk-<n>", "/"-separated
+# on every OS)
+def vector_id_base(file_path, root=None):
+    if root is None:
+        return os.path.basename(file_path)
+    return os.path.relpath(file_path, root).replace(os.sep, "/")
+
+
+# ---------------------------
+# Pages of a file: from the extraction cache when the same content was extracted
+# before, otherwise extracted (and cached once the whole file has been read)
+# kind: extractor from extractors.detect_kind
+# ---------------------------
+def load_pages(file_path, kind, markdown_headings=False, timing=None):
+    if extract_cache is None:
+        yield from extract_pages(file_path, markdown_headings, kind)
         return
-    chunks = chunk_text(text)
-    for idx, chunk in enumerate(chunks):
-        vector_id = f"{os.path.basename(file_path)}-chunk-{idx+1}"
+    key = extract_cache.key(file_path, kind, markdown_headings=markdown_headings)
+    pages = extract_cache.get(key)
+    if timing is not None:
+        timing["cached"] = pages is not None
+    if pages is not None:
+        yield from pages
+        return
+    pages = []
+    for page in extract_pages(file_path, markdown_headings, kind):
+        pages.append(page)
+        yield page
+    extract_cache.put(key, pages)
+
+
+# Page iterator adding the time spent in extraction and the text size to timing
+def timed_pages(pages, timing):
+    timing.setdefault("extract", 0.0)
+    timing.setdefault("bytes", 0)
+    while True:
+        started = time.perf_counter()
+        page = next(pages, None)
+        timing["extract"] += time.perf_counter() - started
+        if page is None:
+            return
+        timing["bytes"] += len(page[1].encode("utf-8"))
+        yield page
+
+
+# Same as chunk_file, but an extraction error only prints a warning
+def iter_file_chunks(file_path, **chunk_options):
+    try:
+        yield from chunk_file(file_path, **chunk_options)
+    except Exception as e:
+        print(f"[Warning] Text extraction failed: {file_path} → {e}")
+
+
+# ---------------------------
+# Extraction + chunking task run in the pipeline's process pool
+# Returns a list because generators cannot be sent back from a worker process
+# metrics: receives the extract / chunk time of the file and its text size
+# ---------------------------
+def extract_and_chunk(file_path, metrics=None, **chunk_options):
+    if metrics is None:
+        return list(chunk_file(file_path, **chunk_options))
+    timing = {}
+    started = time.perf_counter()
+    chunks = list(chunk_file(file_path, timing=timing, **chunk_options))
+    total = time.perf_counter() - started
+    if timing.get("skipped"):
+        metrics.inc("extract_skipped_files_total")
+        return chunks
+    if timing.get("cached"):
+        metrics.inc("extract_cache_hits_total")
+    metrics.observe("ingest_stage_seconds", timing["extract"], stage="extract")
+    metrics.observe("ingest_stage_seconds", total - timing["extract"], stage="chunk")
+    metrics.inc("extracted_bytes_total", timing["bytes"])
+    return chunks
+
+
+# ---------------------------
+# Vectorize chunks in batches → register in Pinecone
+# Chunks from several files can share a batch; results are matched back by
+# (source path, vector_id), so equal vector IDs from different files never mix
+# job: IngestJob checkpointing the upserted chunks and keeping the failed ones as
+#      dead letters (None: failures are only printed)
+# ---------------------------
+def embed_and_upload(chunk_iter, namespace, batcher, writer, job=None):
+    pending = {}  # (source, vector_id) → (chunk, metadata)
+    sent = {}  # vector_id → (chunk, metadata) until the writer reports it
+    reported = len(writer.reports)
+
+    def items():
+        for vector_id, chunk, metadata in chunk_iter:
+            key = (metadata["source"], vector_id)
+            pending[key] = (chunk, metadata)
+            yield key, chunk
+
+    for key, embedding in batcher.embed(items()):
+        vector_id = key[1]
+        chunk, metadata = pending.pop(key)
         try:
-            embedding = get_embedding(chunk)
-            metadata = {"source": file_path, "text": chunk}
-            upload_to_pinecone(vector_id, embedding, metadata, namespace)
+            upload_to_pinecone(
+                vector_id, embedding, dict(metadata, text=chunk), namespace, writer
+            )
+            sent[vector_id] = (chunk, metadata)
         except Exception as e:
             print(f"[Error] Failed while processing {vector_id}: {e}")
+            if job:
+                job.dead_letter(
+                    vector_id, metadata["source"], chunk, metadata, "upsert", e
+                )
+
+    for key, error in batcher.failed.items():
+        vector_id = key[1]
+        print(f"[Error] Embedding failed: {vector_id} → {error}")
+        if job and key in pending:
+            chunk, metadata = pending.pop(key)
+            job.dead_letter(
+                vector_id, metadata["source"], chunk, metadata, "embed", error
+            )
+    batcher.failed.clear()
+    writer.flush()
+    if job:
+        job.settle_reports(writer.reports[reported:], sent)
 
 
 # ---------------------------
-# Traverse all files in directory and process sequentially
-# Recursively includes subdirectories
+# Split full text of a single file → vectorize → register in Pinecone
+# job: IngestJob receiving the failed chunks as dead letters (see embed_and_upload)
 # ---------------------------
-def process_directory(directory_path, namespace):
+def process_file(
+    file_path, namespace, batcher=None, writer=None, chunk_options=None, job=None
+):
+    if batcher is None:
+        batcher = build_embedding_batcher()
+        process_file(file_path, namespace, batcher, writer, chunk_options, job)
+        print_embedding_report(batcher)
+    elif writer is None:
+        chunk_store = open_chunk_store(CHUNK_STORE_DIR)
+        try:
+            with build_upsert_writer(chunks=chunk_store) as writer:
+                process_file(file_path, namespace, batcher, writer, chunk_options, job)
+        finally:
+            if chunk_store:
+                chunk_store.close()
+        print_upload_report(writer)
+    else:
+        chunks = iter_file_chunks(file_path, **(chunk_options or {}))
+        embed_and_upload(chunks, namespace, batcher, writer, job)
+
+
+# Paths of all files in a directory, subdirectories included
+def iter_directory_files(directory_path):
     for root, _, files in os.walk(directory_path):
         for file in files:
-            file_path = os.path.join(root, file)
+            yield os.path.join(root, file)
+
+
+# ---------------------------
+# Traverse all files in directory and process them in a concurrent pipeline
+# Recursively includes subdirectories
+# Extraction (process pool) overlaps with embedding and upserting (worker threads)
+# options: worker counts per stage, queue size, rate limits (see IngestPipeline)
+# manifest_path: local manifest for incremental runs (None processes everything)
+# full: re-embed every chunk even if unchanged (the manifest is still updated)
+# chunk_options: chunking strategy and sizes, e.g. {"strategy": "sentence", "max_tokens": 512}
+# backend: vector store to write to ("pinecone" / "local"; VECTOR_STORE when omitted)
+# resume: continue the directory's ingestion job where its last run stopped
+#         (finished files and upserted chunks are not processed again)
+# Returns the run's Metrics (stage times and counters)
+# ---------------------------
+def process_directory(
+    directory_path,
+    namespace,
+    manifest_path=DEFAULT_MANIFEST_PATH,
+    full=False,
+    chunk_options=None,
+    backend=None,
+    resume=False,
+    **options,
+):
+    job = open_ingest_job(
+        INGEST_JOB_DIR, job_id(backend or VECTOR_STORE, namespace, directory_path)
+    )
+    if job:
+        start_job(job, chunk_options or {}, resume)
+    batcher = build_embedding_batcher()
+    store = build_vector_store(backend)
+    manifest = IngestManifest(manifest_path) if manifest_path else None
+    sync = (
+        IncrementalSync(
+            manifest, namespace, directory_path, full=full, options=chunk_options
+        )
+        if manifest
+        else None
+    )
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    chunks = open_chunk_store(CHUNK_STORE_DIR)
+    metrics = Metrics()
+    pipeline = IngestPipeline(
+        partial(extract_and_chunk, root=directory_path, **(chunk_options or {})),
+        batcher,
+        partial(build_upsert_writer, store, lexical, chunks),
+        namespace,
+        sync=sync,
+        metrics=metrics,
+        job=job,
+        **options,
+    )
+    try:
+        writers = pipeline.run(iter_directory_files(directory_path))
+        if job:
+            job.finish()
+            job_summary = job.summary()
+        # Local index: (re)train the ANN index once the namespace is large enough
+        index = store.build_index(namespace)
+        if lexical:
+            # Merge the BM25 posting lists written by this run
+            lexical.compact(namespace)
+            print(f"[Lexical] {lexical.count(namespace)} chunks indexed in {namespace}")
+        if extract_cache:
+            cached = extract_cache.prune()
+            print(
+                f"[Extraction cache] {cached['files']} files, "
+                f"{cached['bytes'] / (1024 * 1024):.1f} MB "
+                f"({cached['removed']} least recently used removed)"
+            )
+        if chunks:
+            stored = chunks.describe(namespace)
+            print(
+                f"[Chunk store] {stored['chunks']} chunk texts in {namespace}, "
+                f"{stored['bytes'] / (1024 * 1024):.1f} MB compressed"
+            )
+    finally:
+        if manifest:
+            manifest.close()
+        if lexical:
+            lexical.close()
+        if chunks:
+            chunks.close()
+        if job:
+            job.close()
+        store.close()
+
+    for vector_id, error in batcher.failed.items():
+        print(f"[Error] Embedding failed: {vector_id} → {error}")
+    print_embedding_report(batcher)
+    print_upload_report(*writers)
+    print_metrics_report(metrics)
+    if pipeline.sync_stats:
+        stats = pipeline.sync_stats
+        print(
+            f"[Sync] {stats['files_skipped']} files unchanged, "
+            f"{stats['files_changed']} files processed, "
+            f"{stats['chunks_embedded']} chunks embedded, "
+            f"{stats['chunks_unchanged']} chunks unchanged, "
+            f"{stats['vectors_deleted']} orphaned vectors deleted"
+        )
+    if job:
+        print(
+            f"[Job] {job_summary['files_done']} files finished "
+            f"({metrics.value('ingest_files_resumed_total')} and "
+            f"{metrics.value('ingest_chunks_resumed_total')} chunks taken over from "
+            f"the stopped run), {job_summary['files_failed']} files failed, "
+            f"{job_summary['dead_letters']} chunks in the dead-letter queue"
+        )
+        if job_summary["dead_letters"]:
+            print("[Job] Embed and upsert them again with --replay-dead-letters")
+    if index:
+        print(
+            f"[Index] IVF index trained: {index['rows']} vectors, "
+            f"{index['nlist']} lists, quantization: {index['quantization'] or 'none'}"
+        )
+
+    # Cached answers may quote chunks that changed or were deleted
+    stats = pipeline.sync_stats
+    if (
+        not stats
+        or stats["chunks_embedded"]
+        or stats["chunks_resumed"]
+        or stats["vectors_deleted"]
+    ):
+        removed = invalidate_answers(namespace, ANSWER_CACHE_DIR)
+        print(f"[Cache] Answer cache of {namespace} invalidated ({removed} answers)")
+    return metrics
+
+
+# ---------------------------
+# Start a run of an ingestion job (see ingest_job.py) and say what it continues
+# ---------------------------
+def start_job(job, chunk_options, resume):
+    job.start({"chunk_options": chunk_options}, resume)
+    stopped = job.previous_status == "running"
+    if job.resumed:
+        print(f"[Job] Resuming: {len(job.done)} files finished by the stopped run")
+    elif resume and stopped:
+        print("[Job] Chunking options changed since the stopped run; starting over")
+    elif resume:
+        print("[Job] No stopped run to resume; starting a new job")
+    elif stopped:
+        print(
+            "[Job] The previous run stopped before finishing; starting over "
+            "(--resume continues it)"
+        )
+
+
+# ---------------------------
+# Embed and upsert again the dead letters of a directory's ingestion job (chunks
+# whose embedding or upsert failed, e.g. during an outage)
+# Replayed chunks leave the queue and are recorded in the manifest, so the next
+# run does not embed them again; chunks failing again stay (attempts + 1)
+# ---------------------------
+def replay_dead_letters(
+    directory_path, namespace, manifest_path=DEFAULT_MANIFEST_PATH, backend=None
+):
+    job = open_ingest_job(
+        INGEST_JOB_DIR, job_id(backend or VECTOR_STORE, namespace, directory_path)
+    )
+    if job is None:
+        print("[Error] INGEST_JOB_DIR is empty; ingestion jobs are disabled")
+        return
+    letters = job.dead_letters()
+    if not letters:
+        print(f"[Job] No dead letters for {directory_path} in {namespace}")
+        job.close()
+        return
+    print(f"[Job] Replaying {len(letters)} dead letters")
+    batcher = build_embedding_batcher()
+    store = build_vector_store(backend)
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    chunks = open_chunk_store(CHUNK_STORE_DIR)
+    try:
+        with build_upsert_writer(store, lexical, chunks) as writer:
+            embed_and_upload(
+                (
+                    (letter["vector_id"], letter["text"], letter["metadata"])
+                    for letter in letters
+                ),
+                namespace,
+                batcher,
+                writer,
+                job,
+            )
+        remaining = {letter["vector_id"] for letter in job.dead_letters()}
+        replayed = [
+            letter for letter in letters if letter["vector_id"] not in remaining
+        ]
+        if manifest_path and replayed:
+            record_replayed(manifest_path, namespace, replayed)
+        store.build_index(namespace)
+        if lexical:
+            lexical.compact(namespace)
+    finally:
+        if lexical:
+            lexical.close()
+        if chunks:
+            chunks.close()
+        job.close()
+        store.close()
+
+    print_embedding_report(batcher)
+    print_upload_report(writer)
+    print(
+        f"[Job] {len(replayed)} dead letters replayed, {len(remaining)} still failing"
+    )
+    if replayed:
+        removed = invalidate_answers(namespace, ANSWER_CACHE_DIR)
+        print(f"[Cache] Answer cache of {namespace} invalidated ({removed} answers)")
+
+
+# Record the replayed chunks' hashes; the file rows stay as they are, so the next
+# run still looks at these files, but finds the replayed chunks unchanged
+def record_replayed(manifest_path, namespace, replayed):
+    manifest = IngestManifest(manifest_path)
+    try:
+        for path in {letter["path"] for letter in replayed}:
+            hashes = manifest.chunk_hashes(namespace, path)
+            hashes.update(
+                {
+                    letter["vector_id"]: text_sha256(letter["text"])
+                    for letter in replayed
+                    if letter["path"] == path
+                }
+            )
+            manifest.record_file(namespace, path, None, hashes)
+    finally:
+        manifest.close()
+
+
+# ---------------------------
+# (Re)build only the BM25 index of a namespace from the documents (no embedding,
+# no vector store writes), e.g. for a namespace ingested before the index existed
+# Uses the same chunking and vector IDs as ingestion, so the IDs match the vectors
+# ---------------------------
+def build_lexical_index(directory_path, namespace, chunk_options=None):
+    lexical = open_lexical_index(LEXICAL_INDEX_DIR)
+    if lexical is None:
+        print("[Error] LEXICAL_INDEX_DIR is empty; the lexical index is disabled")
+        return
+    try:
+        lexical.clear(namespace)
+        for file_path in iter_directory_files(directory_path):
             print(f"[Processing] {file_path}")
-            process_file(file_path, namespace)
+            lexical.upsert(
+                namespace,
+                [
+                    (vector_id, dict(metadata, text=chunk))
+                    for vector_id, chunk, metadata in iter_file_chunks(
+                        file_path, root=directory_path, **(chunk_options or {})
+                    )
+                ],
+            )
+        lexical.compact(namespace)
+        print(f"[Lexical] {lexical.count(namespace)} chunks indexed in {namespace}")
+    finally:
+        lexical.close()
 
 
 # ---------------------------
@@ -137,6 +721,102 @@ if __name__ == "__main__":
     parser.add_argument(
         "namespace", help="Pinecone namespace (e.g., our-project-specs)"
     )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=None,
+        help="Processes for text extraction/chunking (default: CPU count)",
+    )
+    parser.add_argument(
+        "--embed-workers", type=int, default=4, help="Threads for embedding calls"
+    )
+    parser.add_argument(
+        "--upsert-workers", type=int, default=2, help="Threads for Pinecone upserts"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Embedding batches buffered between stages (backpressure limit)",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=None, help="Embedding requests per minute limit"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=None, help="Embedding tokens per minute limit"
+    )
+    parser.add_argument(
+        "--extract-timeout",
+        type=float,
+        default=DEFAULT_EXTRACT_TIMEOUT,
+        help="Seconds one file may take to extract and chunk (0: no limit)",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between progress lines",
+    )
+    parser.add_argument(
+        "--store",
+        choices=BACKENDS,
+        default=None,
+        help="Vector store to write to (default: VECTOR_STORE or pinecone)",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help=(
+            "Local manifest used to skip unchanged files and chunks "
+            f"(default: {DEFAULT_MANIFEST_PATH}, inside LOCAL_INDEX_DIR for --store local)"
+        ),
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Process every file without reading or updating the manifest",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-embed every chunk even if unchanged (the manifest is still updated)",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=sorted(CHUNKERS),
+        default=DEFAULT_STRATEGY,
+        help="Chunking strategy (chars: fixed 1000-character windows as before)",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=None,
+        help="Maximum tokens per chunk (tokens/sentence/heading strategies)",
+    )
+    parser.add_argument(
+        "--chunk-overlap-tokens",
+        type=int,
+        default=None,
+        help="Tokens carried over between chunks (tokens/sentence/heading strategies)",
+    )
+    parser.add_argument(
+        "--lexical-only",
+        action="store_true",
+        help="Only rebuild the BM25 index (LEXICAL_INDEX_DIR); no embeddings or upserts",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue this directory's ingestion job where its last run stopped "
+            f"(checkpoints in INGEST_JOB_DIR, default: {DEFAULT_JOB_DIR})"
+        ),
+    )
+    parser.add_argument(
+        "--replay-dead-letters",
+        action="store_true",
+        help="Only embed and upsert again the chunks that failed in this directory's job",
+    )
     args = parser.parse_args()
 
     # Check folder existence
@@ -149,5 +829,40 @@ if __name__ == "__main__":
         print(f"[Error] Directory is empty: {args.directory}")
         exit(1)
 
+    chunk_options = {"strategy": args.chunker}
+    if args.chunker != "chars":
+        chunk_options.update(
+            max_tokens=args.chunk_tokens, overlap_tokens=args.chunk_overlap_tokens
+        )
+
+    if args.lexical_only:
+        build_lexical_index(args.directory, args.namespace, chunk_options)
+        exit(0)
+
+    manifest_path = (
+        None if args.no_manifest else args.manifest or default_manifest_path(args.store)
+    )
+    if args.replay_dead_letters:
+        replay_dead_letters(
+            args.directory, args.namespace, manifest_path, backend=args.store
+        )
+        exit(0)
+
     # Start batch processing
-    process_directory(args.directory, args.namespace)
+    process_directory(
+        args.directory,
+        args.namespace,
+        extract_workers=args.extract_workers,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        progress_interval=args.progress_interval,
+        extract_timeout=args.extract_timeout,
+        manifest_path=manifest_path,
+        full=args.full,
+        chunk_options=chunk_options,
+        backend=args.store,
+        resume=args.resume,
+    )
@@ -0,0 +1,703 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from ann_index import DEFAULT_MIN_ROWS, DEFAULT_NPROBE, IVFIndex
+from clients import pinecone_index
+from pinecone_writer import PineconeUpsertWriter, summarize_reports
+from rate_limiter import PINECONE, Scheduler
+from quantization import (
+    DEFAULT_RERANK,
+    QuantizedVectors,
+    encode_rows,
+    train_quantizer,
+    write_compact,
+)
+
+# ---------------------------
+# Vector store abstraction (selected by name with open_vector_store)
+# pinecone: Pinecone index (queries via the SDK, writes via the REST bulk writer)
+# local:    vectors on local disk; no network hop, works offline
+# Both backends provide:
+#   query(vector, top_k, namespace, include_metadata, filter) → [{"id", "score", "metadata"}]
+#   query_many(vectors, top_k, namespace, include_metadata, workers) → one match list
+#              per vector (pinecone: concurrent queries; local: one matrix product)
+#   writer() → writer with add / flush / delete / close / summary / reports
+#              (same interface as PineconeUpsertWriter, so ingestion works with either)
+#   build_index(namespace) → called after ingestion (local: trains the ANN index)
+#   warm_up(namespace) → opens what the first query needs (client / connection, files)
+# ---------------------------
+DEFAULT_BACKEND = "pinecone"
+DEFAULT_LOCAL_INDEX_DIR = ".vector_index"
+BACKENDS = ("pinecone", "local")
+
+
+# ---------------------------
+# Pinecone backend
+# The SDK client is created on the first query (ingestion only needs the REST writer)
+# Queries and writes go through the scheduler (rate limit, retries, circuit breaker)
+# ---------------------------
+class PineconeStore:
+    def __init__(self, api_key, url=None, index_name=None, scheduler=None):
+        self.api_key = api_key
+        self.url = url
+        self.index_name = index_name
+        self.scheduler = scheduler or Scheduler()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = pinecone_index(self.api_key, self.index_name, self.url)
+        return self._index
+
+    # Create the SDK client and open its connection (one index stats request)
+    def warm_up(self, namespace=""):
+        self.scheduler.call(PINECONE, self.index.describe_index_stats)
+
+    def query(self, vector, top_k=5, namespace="", include_metadata=True, filter=None):
+        options = {"filter": filter} if filter else {}
+        result = self.scheduler.call(
+            PINECONE,
+            lambda: self.index.query(
+                vector=vector,
+                top_k=top_k,
+                include_metadata=include_metadata,
+                namespace=namespace,
+                **options,
+            ),
+        )
+        # Handle both dict and object formats from Pinecone
+        matches = result["matches"] if isinstance(result, dict) else result.matches
+        return [
+            {
+                "id": _field(match, "id"),
+                "score": _field(match, "score"),
+                "metadata": _field(match, "metadata") or {},
+            }
+            for match in matches
+        ]
+
+    # Several queries at once: up to `workers` requests in flight (same scheduler)
+    def query_many(
+        self, vectors, top_k=5, namespace="", include_metadata=True, workers=8
+    ):
+        vectors = list(vectors)
+        if not vectors:
+            return []
+        with ThreadPoolExecutor(max_workers=min(workers, len(vectors))) as pool:
+            return list(
+                pool.map(
+                    lambda vector: self.query(
+                        vector, top_k, namespace, include_metadata
+                    ),
+                    vectors,
+                )
+            )
+
+    def writer(self):
+        return PineconeUpsertWriter(self.api_key, self.url, scheduler=self.scheduler)
+
+    # Pinecone maintains its own index
+    def build_index(self, namespace, force=False, nlist=None):
+        return None
+
+    def close(self):
+        pass
+
+
+def _field(match, key):
+    return match[key] if isinstance(match, dict) else getattr(match, key, None)
+
+
+# ---------------------------
+# Local backend: one directory per namespace under `directory`
+# vectors.f32:  memory-mapped float32 array (rows × dim), normalized to unit length
+# rows.sqlite3: row number → vector ID and metadata (JSON)
+# Queries score every row at once (matrix-vector product) and pick the top k with
+# argpartition, so cosine scores match a Pinecone index with the cosine metric
+# Once a namespace has ann_min_rows vectors, build_index trains an IVF index
+# (ann_index.py) and queries only score the rows in the nprobe closest lists
+# With quantization ("int8" / "pq", see quantization.py) it also encodes the vectors;
+# queries then scan the codes and re-rank the best candidates with the float vectors
+# Only the metadata of the returned rows is read, so memory stays at the vectors' size
+# ---------------------------
+class LocalVectorStore:
+    def __init__(
+        self,
+        directory=DEFAULT_LOCAL_INDEX_DIR,
+        nprobe=DEFAULT_NPROBE,
+        ann_min_rows=DEFAULT_MIN_ROWS,
+        quantization=None,
+    ):
+        self.directory = directory
+        self.nprobe = nprobe
+        self.ann_min_rows = ann_min_rows
+        self.quantization = quantization
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def namespace(self, namespace):
+        with self.lock:
+            if namespace not in self.namespaces:
+                # The default namespace "" is stored as "_"
+                path = os.path.join(self.directory, quote(namespace or "_", safe=""))
+                self.namespaces[namespace] = LocalNamespace(
+                    path, self.nprobe, self.quantization
+                )
+            return self.namespaces[namespace]
+
+    def query(self, vector, top_k=5, namespace="", include_metadata=True, filter=None):
+        return self.namespace(namespace).query(vector, top_k, include_metadata, filter)
+
+    # Several queries at once (workers: unused, the queries share one matrix product)
+    def query_many(
+        self, vectors, top_k=5, namespace="", include_metadata=True, workers=None
+    ):
+        return self.namespace(namespace).query_many(vectors, top_k, include_metadata)
+
+    # Open the namespace's files (memory maps, ANN index) before the first query
+    def warm_up(self, namespace=""):
+        self.namespace(namespace)
+
+    def upsert(self, namespace, vectors):
+        self.namespace(namespace).upsert(vectors)
+
+    def delete(self, namespace, ids):
+        self.namespace(namespace).delete(ids)
+
+    def writer(self):
+        return LocalStoreWriter(self)
+
+    def build_index(self, namespace, force=False, nlist=None):
+        return self.namespace(namespace).build_index(self.ann_min_rows, force, nlist)
+
+    # Number of vectors per namespace
+    def describe(self):
+        names = os.listdir(self.directory)
+        stats = {}
+        for name in sorted(names):
+            if os.path.isdir(os.path.join(self.directory, name)):
+                namespace = _unquote_namespace(name)
+                stats[namespace] = self.namespace(namespace).count()
+        return stats
+
+    def close(self):
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.close()
+            self.namespaces.clear()
+
+
+def _unquote_namespace(name):
+    return "" if name == "_" else unquote(name)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+_INITIAL_ROWS = 1024
+_SQL_BATCH = 500  # Parameters per "IN (...)" query
+# Scores (queries × rows) computed at once by query_many
+_SCORE_BLOCK = 16 * 1024 * 1024
+
+
+class LocalNamespace:
+    def __init__(
+        self, path, nprobe=DEFAULT_NPROBE, quantization=None, rerank=DEFAULT_RERANK
+    ):
+        self.path = path
+        self.nprobe = nprobe
+        self.quantization = quantization  # Kind trained by build_index (None: none)
+        self.rerank = rerank
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.conn = sqlite3.connect(
+            os.path.join(path, "rows.sqlite3"), check_same_thread=False
+        )
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.version = None
+        self.dim = None
+        self.vectors = None  # memmap (capacity × dim), None while empty
+        self.live = np.zeros(0, dtype=bool)  # rows holding a vector
+        self.ann = IVFIndex(path)
+        self.quantized = QuantizedVectors(path)
+        self._refresh()
+
+    # ---------------------------
+    # Reload after another process (e.g. an ingestion run) committed changes
+    # PRAGMA data_version only changes on commits from other connections
+    # ---------------------------
+    def _refresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return
+        self.version = version
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        if row is None:
+            return
+        self.dim = int(row[0])
+        self._open_vectors()
+        capacity = len(self.vectors) if self.vectors is not None else 0
+        self.ann.load(capacity)
+        self.quantized.load(capacity)
+        self.live = np.zeros(capacity, bool)
+        rows = [r for (r,) in self.conn.execute("SELECT row FROM rows")]
+        self.live[rows] = True
+
+    def _open_vectors(self):
+        size = (
+            os.path.getsize(self.vectors_path)
+            if os.path.exists(self.vectors_path)
+            else 0
+        )
+        capacity = size // (self.dim * 4)
+        self.vectors = (
+            np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dim),
+            )
+            if capacity
+            else None
+        )
+
+    # Grow the vectors file so that at least `capacity` rows fit
+    def _grow(self, capacity):
+        old = len(self.live)
+        capacity = max(capacity, old * 2, _INITIAL_ROWS)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._open_vectors()
+        self.ann.resize(capacity)
+        self.quantized.resize(capacity)
+        live = np.zeros(capacity, dtype=bool)
+        live[:old] = self.live
+        self.live = live
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return int(self.live.sum())
+
+    # ---------------------------
+    # Insert or replace vectors: [{"id", "values", "metadata"}, ...]
+    # Vector data is flushed to disk before the rows are committed,
+    # so a reader never sees a row whose vector is not written yet
+    # ---------------------------
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        # The last occurrence of an ID in one batch wins
+        latest = {vector["id"]: vector for vector in vectors}
+        ids = list(latest)
+        values = np.asarray([latest[i]["values"] for i in ids], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms > 0, norms, 1)
+
+        with self.lock:
+            self._refresh()
+            if self.dim is None:
+                self.dim = values.shape[1]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO info VALUES ('dim', ?)", (self.dim,)
+                )
+            elif values.shape[1] != self.dim:
+                raise ValueError(
+                    f"Vector dimension {values.shape[1]} does not match "
+                    f"{self.dim} of {self.path}"
+                )
+            existing = dict(self._select("SELECT id, row FROM rows WHERE id IN", ids))
+            new_count = sum(1 for i in ids if i not in existing)
+            free = np.flatnonzero(~self.live)
+            if len(free) < new_count:
+                self._grow(len(self.live) + new_count - len(free))
+                free = np.flatnonzero(~self.live)
+            free = iter(free.tolist())
+            rows = [existing[i] if i in existing else next(free) for i in ids]
+
+            self.vectors[rows] = values
+            self.vectors.flush()
+            # New rows join their nearest IVF list (no-op until the index is trained)
+            self.ann.assign(rows, values)
+            self.ann.flush()
+            self.quantized.assign(rows, values)
+            self.quantized.flush()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                [
+                    (
+                        row,
+                        i,
+                        json.dumps(latest[i].get("metadata") or {}, ensure_ascii=False),
+                    )
+                    for row, i in zip(rows, ids)
+                ],
+            )
+            self.conn.commit()
+            self.live[rows] = True
+
+    def delete(self, ids):
+        with self.lock:
+            self._refresh()
+            rows = [
+                r for _, r in self._select("SELECT id, row FROM rows WHERE id IN", ids)
+            ]
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                self.conn.execute(
+                    f"DELETE FROM rows WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            self.conn.commit()
+            self.live[rows] = False
+
+    # ---------------------------
+    # Top-k by cosine similarity
+    # With a trained IVF index only the rows in the nprobe closest lists are scored;
+    # nprobe=0 or a filter scores every row
+    # rerank: see _score (None: the namespace's setting)
+    # filter: {"key": value} or {"key": {"$eq": value}} on metadata fields
+    # ---------------------------
+    def query(
+        self,
+        vector,
+        top_k=5,
+        include_metadata=True,
+        filter=None,
+        nprobe=None,
+        rerank=None,
+    ):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        nprobe = self.nprobe if nprobe is None else nprobe
+        rerank = self.rerank if rerank is None else rerank
+        with self.lock:
+            self._refresh()
+            if self.vectors is None or not self.live.any():
+                return []
+            if self.ann.trained and nprobe and not filter:
+                rows = np.sort(self.ann.candidates(query, nprobe))
+                rows = rows[self.live[rows]]
+            else:
+                mask = self._filter_mask(filter) if filter else self.live
+                rows = np.flatnonzero(mask)
+            rows, scores = self._score(rows, query, top_k, rerank)
+            k = min(top_k, len(rows))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            scores = scores[top].tolist()
+            top = rows[top].tolist()
+            found = self._rows(top)
+        return _matches(top, scores, found, include_metadata)
+
+    # ---------------------------
+    # Top-k of several queries (one list of matches per vector)
+    # Exact search scores a block of queries against every row with one matrix
+    # product (blocks are sized so that the score matrix stays ~64 MB); with a
+    # trained IVF index or quantized codes each query goes through query()
+    # ---------------------------
+    def query_many(self, vectors, top_k=5, include_metadata=True):
+        if not len(vectors):
+            return []
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+        with self.lock:
+            self._refresh()
+            if self.vectors is None or not self.live.any() or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            exact = self.quantized.quantizer is None and not (
+                self.ann.trained and self.nprobe
+            )
+            if exact:
+                rows = np.flatnonzero(self.live)
+                k = min(top_k, len(rows))
+                # Like _score: all rows (then the live ones) when most are live
+                whole = len(rows) > len(self.live) // 2
+                matrix = self.vectors if whole else self.vectors[rows]
+                block = max(1, _SCORE_BLOCK // len(matrix))
+                tops, top_scores = [], []
+                for start in range(0, len(queries), block):
+                    scores = queries[start : start + block] @ matrix.T
+                    if whole:
+                        scores = scores[:, rows]
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    best = np.take_along_axis(scores, top, axis=1)
+                    order = np.argsort(-best, axis=1, kind="stable")
+                    tops += rows[np.take_along_axis(top, order, axis=1)].tolist()
+                    top_scores += np.take_along_axis(best, order, axis=1).tolist()
+                found = self._rows(sorted({row for top in tops for row in top}))
+        if not exact:
+            return [self.query(query, top_k, include_metadata) for query in queries]
+        return [
+            _matches(top, scores, found, include_metadata)
+            for top, scores in zip(tops, top_scores)
+        ]
+
+    # row → (vector ID, metadata JSON) of the given rows
+    def _rows(self, rows):
+        return {
+            row: (vector_id, metadata)
+            for vector_id, row, metadata in self._select(
+                "SELECT id, row, metadata FROM rows WHERE row IN", rows
+            )
+        }
+
+    # ---------------------------
+    # Scores of the candidate rows
+    # With quantized codes, the codes are scored first and only the best
+    # top_k × rerank rows are scored again with the float vectors
+    # (rerank=0 returns the approximate scores of the codes)
+    # ---------------------------
+    def _score(self, rows, query, top_k, rerank):
+        if self.quantized.quantizer is not None:
+            scores = self.quantized.score(query, rows)
+            if not rerank:
+                return rows, scores
+            keep = min(len(rows), top_k * rerank)
+            if keep < len(rows):
+                rows = np.sort(rows[np.argpartition(-scores, keep - 1)[:keep]])
+        elif len(rows) > len(self.live) // 2:
+            return rows, (self.vectors @ query)[rows]
+        return rows, self.vectors[rows] @ query
+
+    # ---------------------------
+    # Train (or retrain) the IVF index once the namespace has min_rows vectors
+    # It is retrained when the namespace has doubled since the last training,
+    # as the lists grow unevenly with incremental inserts
+    # The quantizer (if configured) is trained along with it
+    # Returns {"rows", "nlist", "quantization"} when trained, otherwise None
+    # ---------------------------
+    def build_index(self, min_rows=DEFAULT_MIN_ROWS, force=False, nlist=None):
+        with self.lock:
+            self._refresh()
+            rows = np.flatnonzero(self.live)
+            if not len(rows):
+                return None
+            trained = self.conn.execute(
+                "SELECT value FROM info WHERE key = 'ann_rows'"
+            ).fetchone()
+            stale = (
+                force
+                or not self.ann.trained
+                or not trained
+                or len(rows) >= int(trained[0]) * 2
+            )
+            quantize = self.quantization and (
+                stale or self.quantized.kind != self.quantization
+            )
+            if not force and (len(rows) < min_rows or not (stale or quantize)):
+                return None
+            if stale:
+                self.ann.train(self.vectors, rows, nlist)
+            if quantize:
+                self.quantized.train(self.quantization, self.vectors, rows)
+            # The commit makes other processes reload the index (see _refresh)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO info VALUES ('ann_rows', ?)", (len(rows),)
+            )
+            self.conn.commit()
+            return {
+                "rows": len(rows),
+                "nlist": len(self.ann.centroids),
+                "quantization": self.quantized.kind,
+            }
+
+    # ---------------------------
+    # Write a compact, searchable copy of the namespace (see quantization.CompactIndex)
+    # The namespace's own quantizer is reused when it is of the same kind
+    # Returns the number of vectors written
+    # ---------------------------
+    def export(self, path, kind="pq", subspaces=None):
+        with self.lock:
+            self._refresh()
+            found = self.conn.execute(
+                "SELECT row, id, metadata FROM rows ORDER BY row"
+            ).fetchall()
+            if not found:
+                raise ValueError(f"No vectors in {self.path}")
+            rows = np.asarray([row for row, _, _ in found])
+            quantizer = self.quantized.quantizer
+            if quantizer is not None and quantizer.kind == kind and not subspaces:
+                codes = np.asarray(self.quantized.codes[rows])
+            else:
+                quantizer = train_quantizer(kind, self.vectors, rows, subspaces)
+                codes = encode_rows(quantizer, self.vectors, rows)
+        write_compact(
+            path,
+            quantizer,
+            codes,
+            [vector_id for _, vector_id, _ in found],
+            [json.loads(metadata) for _, _, metadata in found],
+        )
+        return len(found)
+
+    def _filter_mask(self, filter):
+        conditions = []
+        params = []
+        for key, value in filter.items():
+            if isinstance(value, dict):
+                if set(value) != {"$eq"}:
+                    raise ValueError(f"Unsupported filter for the local store: {value}")
+                value = value["$eq"]
+            conditions.append("json_extract(metadata, ?) = ?")
+            params += [f"$.{key}", value]
+        mask = np.zeros(len(self.live), dtype=bool)
+        rows = [
+            r
+            for (r,) in self.conn.execute(
+                f"SELECT row FROM rows WHERE {' AND '.join(conditions)}", params
+            )
+        ]
+        mask[rows] = True
+        return mask & self.live
+
+    # Run "... IN (?, ...)" in batches and return all rows
+    def _select(self, sql, values):
+        results = []
+        for start in range(0, len(values), _SQL_BATCH):
+            batch = values[start : start + _SQL_BATCH]
+            results += self.conn.execute(
+                f"{sql} ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+        return results
+
+    def close(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+            self.conn.close()
+
+
+# Matches of the given rows and scores (best first)
+def _matches(rows, scores, found, include_metadata):
+    matches = []
+    for row, score in zip(rows, scores):
+        vector_id, metadata = found[row]
+        matches.append(
+            {
+                "id": vector_id,
+                "score": score,
+                "metadata": json.loads(metadata) if include_metadata else {},
+            }
+        )
+    return matches
+
+
+# ---------------------------
+# Writer for the local store (same interface and reports as PineconeUpsertWriter)
+# Vectors are buffered and written in batches of max_batch_vectors
+# ---------------------------
+class LocalStoreWriter:
+    def __init__(self, store, max_batch_vectors=1000):
+        self.store = store
+        self.max_batch_vectors = max_batch_vectors
+        self.buffers = {}  # namespace → [vector, ...]
+        self.reports = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, namespace, vector_id, values, metadata=None):
+        vector = {"id": vector_id, "values": values, "metadata": metadata}
+        self.buffers.setdefault(namespace, []).append(vector)
+        if len(self.buffers[namespace]) >= self.max_batch_vectors:
+            self.flush(namespace)
+
+    def flush(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else list(self.buffers)
+        for ns in namespaces:
+            vectors = self.buffers.pop(ns, [])
+            if vectors:
+                ids = [vector["id"] for vector in vectors]
+                self.reports.append(
+                    self._run(ns, ids, lambda: self.store.upsert(ns, vectors))
+                )
+
+    def delete(self, namespace, ids, batch_size=1000):
+        ids = list(ids)
+        return [self._run(namespace, ids, lambda: self.store.delete(namespace, ids))]
+
+    def _run(self, namespace, ids, operation):
+        report = {
+            "namespace": namespace,
+            "ids": ids,
+            "bytes": 0,
+            "attempts": 1,
+            "ok": False,
+            "error": None,
+        }
+        started = time.perf_counter()
+        try:
+            operation()
+            report["ok"] = True
+        except Exception as e:
+            report["error"] = str(e)
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    def close(self):
+        self.flush()
+        return self.reports
+
+    def summary(self):
+        return summarize_reports(self.reports)
+
+
+# ---------------------------
+# Create the configured backend
+# backend: "pinecone" or "local"
+# local_dir: directory of the local backend
+# nprobe / ann_min_rows: IVF search width and training threshold of the local backend
+# quantization: codes built along with the IVF index ("int8" / "pq"; None: none)
+# api_key / url / index_name: Pinecone settings
+# scheduler: Scheduler of the Pinecone calls (shared with the OpenAI calls)
+# ---------------------------
+def open_vector_store(
+    backend=DEFAULT_BACKEND,
+    local_dir=DEFAULT_LOCAL_INDEX_DIR,
+    api_key=None,
+    url=None,
+    index_name=None,
+    nprobe=DEFAULT_NPROBE,
+    ann_min_rows=DEFAULT_MIN_ROWS,
+    quantization=None,
+    scheduler=None,
+):
+    if backend == "local":
+        return LocalVectorStore(
+            local_dir, int(nprobe), int(ann_min_rows), quantization or None
+        )
+    if backend == "pinecone":
+        return PineconeStore(api_key, url, index_name, scheduler)
+    raise ValueError(
+        f"Unknown vector store: {backend} (choose from {', '.join(BACKENDS)})"
+    )